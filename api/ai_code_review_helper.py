@@ -1,22 +1,40 @@
+"""
+AI Code Review Helper 的 Web 入口。
+
+- create_app(): 返回注册了全部路由的 Flask 应用，只做可以在 fork 之前共享的工作 (导入模块、注册路由、加载模板)，
+  不建立任何连接。生产环境由 api/wsgi.py 调用，配合 gunicorn 的 preload_app 在主进程中加载一次，worker 以写时复制共享。
+- init_process_resources(): 每个进程各自初始化 Redis 客户端、LLM 客户端和后台线程 (连接与线程不能跨 fork 共享)，
+  由 gunicorn.conf.py 的 post_fork 钩子调用；未调用钩子的服务器在该进程的第一个请求之前自动补做。
+- 直接运行本模块 (python -m api.ai_code_review_helper) 时使用 Flask 开发服务器，仅用于本地开发。
+- 进程退出前调用 job_queue_service.drain_local_jobs() 排空进程内的审查任务 (gunicorn 在 worker_exit 钩子中调用)。
+"""
 from flask import render_template
 import os
 import sys # 新增导入
 import logging
-import atexit
+import threading
 import redis # 新增导入
 
-from api.app_factory import app, executor # 导入 executor
+from api.app_factory import app
 from api.core_config import (
     SERVER_HOST, SERVER_PORT, app_configs, ADMIN_API_KEY,
     init_redis_client, load_configs_from_redis
 )
 import api.core_config as core_config_module
 from api.services.unified_review_service import initialize_llm_client
+from api.services.job_queue_service import drain_local_jobs, start_job_poller
+from api.services.dead_letter_service import start_dead_letter_retrier
 import api.services.llm_service as llm_service_module
 import api.routes.config_routes
 import api.routes.webhook_routes_detailed # Changed
 import api.routes.webhook_routes_general # Changed
 
+logger = logging.getLogger(__name__)
+
+# 已完成进程级初始化的进程 ID (fork 出的子进程 PID 不同，会重新初始化)
+_initialized_pid = None
+_process_init_lock = threading.Lock()
+
 
 # --- Admin Page ---
 @app.route('/admin')
@@ -25,35 +43,45 @@ def admin_page():
     return render_template('admin.html')
 
 
-# --- 主程序入口 ---
-if __name__ == '__main__':
-    # 配置日志记录
-    logging.basicConfig(level=logging.INFO,
-                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                        handlers=[logging.StreamHandler()])  # 输出到控制台
-    logger = logging.getLogger(__name__)
+def create_app():
+    """返回已注册全部路由的 Flask 应用 (路由在导入各 routes 模块时注册)。"""
+    return app
 
-    logger.info(f"启动统一代码审查 Webhook 服务于 {SERVER_HOST}:{SERVER_PORT}")
 
+def init_process_resources():
+    """
+    初始化当前进程的 LLM 客户端、Redis 客户端 (并从 Redis 加载仓库/项目配置) 和后台轮询线程。
+    Redis 初始化失败时抛出 ValueError 或 redis.exceptions.ConnectionError。
+    """
     # Initial call to set up the client based on initial configs
     initialize_llm_client()
 
-    # 初始化 Redis 客户端并加载配置
-    logger.info("--- 持久化配置 ---")
-    try:
-        init_redis_client()
-        # 如果 init_redis_client 成功，redis_client 应该已经设置好
-        if not core_config_module.redis_client:
-            # 这是一个后备检查，理论上 init_redis_client 应该在失败时抛出异常
-            logger.critical("Redis 客户端未能成功初始化，即使没有引发预期错误。服务无法启动。")
-            sys.exit(1)
-        logger.info(f"Redis 连接: 成功连接到 {app_configs.get('REDIS_HOST')}:{app_configs.get('REDIS_PORT')}")
-        load_configs_from_redis()  # 这会填充 github_repo_configs 和 gitlab_project_configs
-    except (ValueError, redis.exceptions.ConnectionError) as e:
-        logger.critical(f"关键错误: Redis 初始化失败 - {e}")
-        logger.critical("服务无法启动。请确保 Redis 相关环境变量 (如 REDIS_HOST, REDIS_PORT) 已正确设置，并且 Redis 服务可用。")
-        sys.exit(1)
-
+    init_redis_client()
+    # 如果 init_redis_client 成功，redis_client 应该已经设置好
+    if not core_config_module.redis_client:
+        # 这是一个后备检查，理论上 init_redis_client 应该在失败时抛出异常
+        raise redis.exceptions.ConnectionError("Redis 客户端未能成功初始化，即使没有引发预期错误。")
+    logger.info(f"Redis 连接: 成功连接到 {app_configs.get('REDIS_HOST')}:{app_configs.get('REDIS_PORT')} (进程 {os.getpid()})")
+    load_configs_from_redis()  # 这会填充 github_repo_configs 和 gitlab_project_configs
+    start_job_poller()
+    start_dead_letter_retrier()
+
+
+@app.before_request
+def ensure_process_initialized():
+    """确保当前进程已完成初始化 (幂等；fork 之后的子进程会重新初始化)。"""
+    global _initialized_pid
+    if _initialized_pid == os.getpid():
+        return
+    with _process_init_lock:
+        if _initialized_pid == os.getpid():
+            return
+        init_process_resources()
+        _initialized_pid = os.getpid()
+
+
+def log_startup_summary():
+    """输出当前配置与端点说明。"""
     logger.info("--- 当前应用配置 ---")
     for key, value in app_configs.items():
         if "KEY" in key.upper() or "TOKEN" in key.upper() or "PASSWORD" in key.upper() or "SECRET" in key.upper():  # Basic redaction for logs
@@ -99,6 +127,11 @@ if __name__ == '__main__':
     # Redis 状态的日志记录已在初始化部分处理，如果程序运行到此处，说明 Redis 已成功连接。
     # 此处不再需要重复的 Redis 状态日志。
 
+    if app_configs.get("JOB_QUEUE_MODE") == "redis_stream":
+        logger.info("审查任务队列: redis_stream。Webhook 只负责入队，请另外启动 worker 进程: python -m api.worker")
+    else:
+        logger.info("审查任务队列: local (进程内线程池)。")
+
     logger.info("--- 配置管理 API ---")
     logger.info("使用 /config/* 端点管理密钥和令牌。")
     logger.info("需要带有从环境加载的 ADMIN_API_KEY 的 'X-Admin-API-Key' 请求头。")
@@ -141,8 +174,29 @@ if __name__ == '__main__':
     logger.info(f"GitLab Webhook URL (通用审查): http://localhost:{SERVER_PORT}/gitlab_webhook_general")
     logger.info("--- ---")
 
-    # 注册 atexit 处理函数以关闭 ThreadPoolExecutor
-    atexit.register(lambda: executor.shutdown(wait=True))
-    logger.info("ThreadPoolExecutor shutdown hook registered.")
+# --- 主程序入口 (开发服务器) ---
+if __name__ == '__main__':
+    # 配置日志记录
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        handlers=[logging.StreamHandler()])  # 输出到控制台
 
-    app.run(host=SERVER_HOST, port=SERVER_PORT, debug=False)
+    logger.info(f"启动统一代码审查 Webhook 服务于 {SERVER_HOST}:{SERVER_PORT}")
+    logger.warning("当前使用 Flask 开发服务器，仅适用于本地开发。生产环境请使用: gunicorn -c gunicorn.conf.py api.wsgi:app")
+
+    # 初始化 Redis 客户端并加载配置
+    logger.info("--- 持久化配置 ---")
+    try:
+        ensure_process_initialized()
+    except (ValueError, redis.exceptions.ConnectionError) as e:
+        logger.critical(f"关键错误: Redis 初始化失败 - {e}")
+        logger.critical("服务无法启动。请确保 Redis 相关环境变量 (如 REDIS_HOST, REDIS_PORT) 已正确设置，并且 Redis 服务可用。")
+        sys.exit(1)
+
+    log_startup_summary()
+
+    try:
+        app.run(host=SERVER_HOST, port=SERVER_PORT, debug=False)
+    finally:
+        # 在解释器退出 (并等待线程池中的全部任务) 之前排空审查任务: 超过期限的任务保存进度后交由下次启动继续
+        drain_local_jobs()
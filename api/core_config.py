@@ -41,6 +41,99 @@ app_configs = {
     "REDIS_SSL_ENABLED": os.environ.get("REDIS_SSL_ENABLED", "true").lower() == "true",
     "REDIS_DB": int(os.environ.get("REDIS_DB", "0")),
     "CUSTOM_WEBHOOK_URL": os.environ.get("CUSTOM_WEBHOOK_URL", ""), # 自定义通知 Webhook URL
+
+    # 详细审查: 通过 application/vnd.github.v3.diff 一次获取整个 PR 的 diff (失败或 diff 过大时回退到 PR 文件 API)
+    "GITHUB_PR_DIFF_MEDIA_TYPE_ENABLED": os.environ.get("GITHUB_PR_DIFF_MEDIA_TYPE_ENABLED", "true").lower() == "true",
+
+    # 审查任务队列: local (进程内线程池，默认) 或 redis_stream (写入 Redis Stream，由 `python -m api.worker` 进程消费)
+    "JOB_QUEUE_MODE": os.environ.get("JOB_QUEUE_MODE", "local").lower(),
+    # 每个 worker 进程同时执行的审查任务数
+    "WORKER_CONCURRENCY": int(os.environ.get("WORKER_CONCURRENCY", "4")),
+    # 任务在消费组中空闲 (未收到所属 worker 心跳) 超过该秒数后，视为 worker 已退出，由其他 worker 接管
+    "JOB_RECLAIM_IDLE_SECONDS": int(os.environ.get("JOB_RECLAIM_IDLE_SECONDS", "120")),
+    # 单个任务最多投递 (执行) 次数: 执行失败的任务会重试，已完成文件的审查结果从检查点读取；超过后放弃
+    # (避免反复失败或导致 worker 崩溃的任务无限重试)
+    "JOB_MAX_DELIVERIES": int(os.environ.get("JOB_MAX_DELIVERIES", "3")),
+    # local 模式下失败任务的重试间隔秒数 (第 n 次重试等待 n 倍；redis_stream 模式在 JOB_RECLAIM_IDLE_SECONDS 后由 worker 接管重试)
+    "JOB_RETRY_DELAY_SECONDS": int(os.environ.get("JOB_RETRY_DELAY_SECONDS", "30")),
+
+    # 调度: 变更行数不超过该值的 PR 视为小任务
+    "SCHEDULER_SMALL_JOB_MAX_LINES": int(os.environ.get("SCHEDULER_SMALL_JOB_MAX_LINES", "300")),
+    # 调度: 为小任务预留的执行槽位数 (大任务最多占用其余槽位)
+    "SCHEDULER_RESERVED_SMALL_SLOTS": int(os.environ.get("SCHEDULER_RESERVED_SMALL_SLOTS", "2")),
+    # 调度: webhook 未提供 PR 大小时 (如 GitLab) 按该变更行数估算任务成本
+    "SCHEDULER_DEFAULT_JOB_LINES": int(os.environ.get("SCHEDULER_DEFAULT_JOB_LINES", "200")),
+    # 每个 worker 进程在执行槽位之外额外预取的任务数，供调度器在其中挑选
+    "WORKER_PREFETCH": int(os.environ.get("WORKER_PREFETCH", "4")),
+    # 因仓库并发上限在 worker 中等待超过该秒数的任务交还给消费组，由其他 worker 接管
+    "WORKER_HELD_JOB_HANDBACK_SECONDS": int(os.environ.get("WORKER_HELD_JOB_HANDBACK_SECONDS", "60")),
+
+    # 并发上限 (跨进程，通过 Redis 计数；0 表示不限制)，可通过 /config/concurrency_limits 按名称覆盖
+    # 单个仓库/项目同时执行的审查任务数
+    "REPO_CONCURRENCY_LIMIT": int(os.environ.get("REPO_CONCURRENCY_LIMIT", "0")),
+    # 单个 VCS 主机 (如 api.github.com) 同时进行的请求数
+    "VCS_HOST_CONCURRENCY_LIMIT": int(os.environ.get("VCS_HOST_CONCURRENCY_LIMIT", "0")),
+    # 单个 LLM 提供方 (openai / qianwen) 同时进行的请求数
+    "LLM_PROVIDER_CONCURRENCY_LIMIT": int(os.environ.get("LLM_PROVIDER_CONCURRENCY_LIMIT", "0")),
+    # 等待 VCS 主机 / LLM 提供方并发槽位的最长秒数，超时后不再等待直接执行 (避免请求无限期阻塞)；
+    # 仓库的任务上限由调度器在开始任务前检查，达到上限的任务留在队列中，不受此超时影响
+    "CONCURRENCY_ACQUIRE_TIMEOUT_SECONDS": int(os.environ.get("CONCURRENCY_ACQUIRE_TIMEOUT_SECONDS", "600")),
+
+    # 推送防抖: PR/MR 收到推送后等待该秒数的静默期，期间的新推送会重新计时，只审查窗口内最新的 head (0 表示不防抖)
+    "PUSH_DEBOUNCE_SECONDS": int(os.environ.get("PUSH_DEBOUNCE_SECONDS", "0")),
+
+    # 审查认领租约秒数: 提交任务时原子地认领 (vcs, 仓库, PR, SHA)，执行期间定期续约，完成后释放
+    "REVIEW_CLAIM_LEASE_SECONDS": int(os.environ.get("REVIEW_CLAIM_LEASE_SECONDS", "900")),
+
+    # 关闭进程时等待执行中任务完成的秒数，超时后任务在下一个文件边界保存检查点并中断，交由重启后的进程/其他 worker 继续
+    "SHUTDOWN_DRAIN_SECONDS": int(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "60")),
+    # 审查检查点 (逐文件的审查结果与已发布评论) 的保留秒数
+    "REVIEW_CHECKPOINT_TTL_SECONDS": int(os.environ.get("REVIEW_CHECKPOINT_TTL_SECONDS", "86400")),
+    # 审查素材 (PR diff、文件列表、MR 版本、文件内容) 按提交共享的缓存秒数，详细审查与通用审查只获取一次 (0 表示不缓存)
+    "REVIEW_ARTIFACT_TTL_SECONDS": int(os.environ.get("REVIEW_ARTIFACT_TTL_SECONDS", "600")),
+    # 审查素材进程内缓存的最大总大小 (MB)
+    "REVIEW_ARTIFACT_MEMORY_MAX_MB": int(os.environ.get("REVIEW_ARTIFACT_MEMORY_MAX_MB", "64")),
+
+    # Webhook 准入控制: 未完成的审查任务数 (local 模式为当前进程，redis_stream 模式为任务流) 达到高水位时视为过载 (0 表示不检查)，
+    # 回落到低水位以下时恢复 (低水位为 0 时取高水位的一半)
+    "ADMISSION_QUEUE_HIGH_WATERMARK": int(os.environ.get("ADMISSION_QUEUE_HIGH_WATERMARK", "500")),
+    "ADMISSION_QUEUE_LOW_WATERMARK": int(os.environ.get("ADMISSION_QUEUE_LOW_WATERMARK", "250")),
+    # Webhook 准入控制: 当前进程常驻内存 (MB) 的高/低水位 (高水位为 0 表示不检查，低水位为 0 时取高水位的 80%)
+    "ADMISSION_MEMORY_HIGH_MB": int(os.environ.get("ADMISSION_MEMORY_HIGH_MB", "0")),
+    "ADMISSION_MEMORY_LOW_MB": int(os.environ.get("ADMISSION_MEMORY_LOW_MB", "0")),
+    # 过载时对新审查请求的处理: defer (延后写入 Redis 延迟队列，负载回落后执行) 或 reject (返回 503)
+    "ADMISSION_OVERLOAD_ACTION": os.environ.get("ADMISSION_OVERLOAD_ACTION", "defer"),
+    # 过载时任务延后的秒数 / 拒绝时 Retry-After 响应头的秒数
+    "ADMISSION_DEFER_SECONDS": int(os.environ.get("ADMISSION_DEFER_SECONDS", "60")),
+    "ADMISSION_RETRY_AFTER_SECONDS": int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "60")),
+
+    # 审查任务状态 (/config/jobs) 的保留秒数
+    "JOB_STATUS_TTL_SECONDS": int(os.environ.get("JOB_STATUS_TTL_SECONDS", "259200")),
+    # 审查任务状态最多保留的任务数 (超出时删除最早提交的任务)
+    "JOB_STATUS_MAX_ENTRIES": int(os.environ.get("JOB_STATUS_MAX_ENTRIES", "1000")),
+    # 未结束的任务超过该秒数没有任何进展时标记为 stalled (0 表示不标记)
+    "JOB_STALLED_SECONDS": int(os.environ.get("JOB_STALLED_SECONDS", "600")),
+
+    # 死信队列: 失败的文件审查/评论/通知最多自动执行的次数 (含首次执行)
+    "DEAD_LETTER_MAX_ATTEMPTS": int(os.environ.get("DEAD_LETTER_MAX_ATTEMPTS", "5")),
+    # 死信队列: 首次重试前等待的秒数，之后每次失败翻倍，最多等待 DEAD_LETTER_RETRY_MAX_SECONDS 秒
+    "DEAD_LETTER_RETRY_BASE_SECONDS": int(os.environ.get("DEAD_LETTER_RETRY_BASE_SECONDS", "60")),
+    "DEAD_LETTER_RETRY_MAX_SECONDS": int(os.environ.get("DEAD_LETTER_RETRY_MAX_SECONDS", "3600")),
+    # 死信队列: 重放一个条目的最长秒数，进程在重放期间退出时，超过该时间后由其他进程重试
+    "DEAD_LETTER_REPLAY_LEASE_SECONDS": int(os.environ.get("DEAD_LETTER_REPLAY_LEASE_SECONDS", "900")),
+    # 死信队列最多保留的条目数 (超出时删除最早的条目)
+    "DEAD_LETTER_MAX_ENTRIES": int(os.environ.get("DEAD_LETTER_MAX_ENTRIES", "10000")),
+
+    # 增量审查: PR/MR 更新时只审查自上次审查的 commit 以来变更的文件
+    "INCREMENTAL_REVIEW_ENABLED": os.environ.get("INCREMENTAL_REVIEW_ENABLED", "true").lower() == "true",
+
+    # VCS 请求速率限制: 预算耗尽时单个请求最多排队等待的秒数
+    "VCS_RATE_LIMIT_MAX_WAIT_SECONDS": int(os.environ.get("VCS_RATE_LIMIT_MAX_WAIT_SECONDS", "900")),
+
+    # 粗粒度审查: 每个文件 prompt (diff + 变更所在代码块上下文) 的 token 预算 (按 4 字符约 1 token 估算)
+    "GENERAL_REVIEW_CONTEXT_TOKEN_BUDGET": int(os.environ.get("GENERAL_REVIEW_CONTEXT_TOKEN_BUDGET", "6000")),
+    # 详细审查: 每个文件附带的变更所在函数/类作用域上下文的 token 预算
+    "DETAILED_REVIEW_CONTEXT_TOKEN_BUDGET": int(os.environ.get("DETAILED_REVIEW_CONTEXT_TOKEN_BUDGET", "4000")),
 }
 # --- ---
 
@@ -50,7 +143,25 @@ REDIS_KEY_PREFIX = "ai_code_review_helper:"
 REDIS_GITHUB_CONFIGS_KEY = f"{REDIS_KEY_PREFIX}github_repo_configs"
 REDIS_GITLAB_CONFIGS_KEY = f"{REDIS_KEY_PREFIX}gitlab_project_configs"
 REDIS_PROCESSED_COMMITS_SET_KEY = f"{REDIS_KEY_PREFIX}processed_commits_set"
+REDIS_REVIEW_CLAIM_KEY_PREFIX = f"{REDIS_KEY_PREFIX}review_claims:"  # 正在审查的 commit -> 认领者 (job_id)
 REDIS_REVIEW_RESULTS_KEY_PREFIX = f"{REDIS_KEY_PREFIX}review_results:"
+REVIEW_RESULTS_LAST_SHA_FIELD = "_last_reviewed_sha"
+REDIS_COMMENT_FINGERPRINTS_KEY_PREFIX = f"{REDIS_KEY_PREFIX}comment_fingerprints:"
+COMMENT_FINGERPRINTS_SEEDED_MEMBER = "_seeded"  # 指纹集合中的哨兵成员，表示已从 VCS 现有评论初始化
+REDIS_JOB_STREAM_KEY = f"{REDIS_KEY_PREFIX}review_jobs"
+REDIS_JOB_CONSUMER_GROUP = "review_workers"
+REDIS_DEBOUNCE_SCHEDULE_KEY = f"{REDIS_KEY_PREFIX}debounced_jobs:schedule"  # ZSET: PR/MR -> 到期时间
+REDIS_DEBOUNCE_PAYLOADS_KEY = f"{REDIS_KEY_PREFIX}debounced_jobs:payloads"  # HASH: PR/MR -> 最新的任务
+REDIS_CONCURRENCY_LIMITS_KEY = f"{REDIS_KEY_PREFIX}concurrency_limits"  # HASH: "scope:name" -> 上限
+REDIS_CONCURRENCY_SLOTS_KEY_PREFIX = f"{REDIS_KEY_PREFIX}concurrency_slots:"  # ZSET: 持有者 -> 最近续约时间
+REDIS_LATEST_HEAD_KEY_PREFIX = f"{REDIS_KEY_PREFIX}latest_head:"  # 每个 PR/MR 最新提交的 head SHA，用于取消过期任务
+REDIS_REVIEW_CHECKPOINT_KEY_PREFIX = f"{REDIS_KEY_PREFIX}review_checkpoints:"  # HASH: 逐文件的审查进度 (vcs, 仓库, PR, SHA)
+REDIS_INTERRUPTED_JOBS_KEY = f"{REDIS_KEY_PREFIX}interrupted_jobs"  # LIST: 进程关闭时未完成、等待恢复的任务 (local 模式)
+REDIS_JOB_STATUS_KEY_PREFIX = f"{REDIS_KEY_PREFIX}job_status:"  # HASH: 单个审查任务的状态、进度和阶段时间
+REDIS_JOB_STATUS_INDEX_KEY = f"{REDIS_KEY_PREFIX}job_status_index"  # ZSET: job_id -> 提交时间
+REDIS_REVIEW_ARTIFACT_KEY_PREFIX = f"{REDIS_KEY_PREFIX}review_artifacts:"  # STRING: 按 (vcs, 仓库, PR, SHA) 共享的 VCS 原始响应
+REDIS_DEAD_LETTER_STREAM_KEY = f"{REDIS_KEY_PREFIX}dead_letters"  # STREAM: 失败的文件审查、评论发布和通知
+REDIS_DEAD_LETTER_SCHEDULE_KEY = f"{REDIS_KEY_PREFIX}dead_letters:schedule"  # ZSET: 条目 ID -> 下次重试时间
 
 
 def init_redis_client():
@@ -123,6 +234,25 @@ def load_configs_from_redis():
         logger.info("Redis 客户端不可用。跳过从 Redis 加载配置。")
 
 
+def resolve_access_token(platform: str, identifier: str):
+    """
+    读取仓库/项目的访问令牌。优先从 Redis 读取最新配置 (管理面板可能在任务排队期间更新了令牌)，
+    Redis 不可用时使用内存中的配置。
+    """
+    if platform == "github":
+        configs, redis_key = github_repo_configs, REDIS_GITHUB_CONFIGS_KEY
+    else:
+        configs, redis_key = gitlab_project_configs, REDIS_GITLAB_CONFIGS_KEY
+    if redis_client:
+        try:
+            raw_config = redis_client.hget(redis_key, identifier)
+            if raw_config:
+                configs[identifier] = json.loads(raw_config)
+        except (redis.exceptions.RedisError, UnicodeDecodeError, json.JSONDecodeError) as e:
+            logger.warning(f"从 Redis 读取 {platform} {identifier} 的配置时出错，使用内存中的配置: {e}")
+    return (configs.get(identifier) or {}).get("token")
+
+
 def _get_processed_commit_key(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str) -> str:
     """生成用于存储已处理 commit 的唯一键。"""
     return f"{vcs_type}:{identifier}:{pr_mr_id}:{commit_sha}"
@@ -164,6 +294,85 @@ def mark_commit_as_processed(vcs_type: str, identifier: str, pr_mr_id: str, comm
         logger.error(f"标记提交 {key} 为已处理时 Redis 出错: {e}")
 
 
+# KEYS[1]: 已处理 commit 集合，KEYS[2]: 认领键；ARGV[1]: commit 键，ARGV[2]: 认领者，ARGV[3]: 租约秒数
+_CLAIM_COMMIT_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    return 0
+end
+if redis.call('SET', KEYS[2], ARGV[2], 'NX', 'EX', tonumber(ARGV[3])) then
+    return 1
+end
+return 0
+"""
+# 认领者一致时续约；认领已过期且 commit 尚未处理时重新认领
+_RENEW_COMMIT_CLAIM_SCRIPT = """
+local holder = redis.call('GET', KEYS[2])
+if holder == ARGV[2] then
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+    return 1
+end
+if holder or redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', tonumber(ARGV[3]))
+return 1
+"""
+# KEYS[1]: 认领键；ARGV[1]: 认领者。只释放自己持有的认领
+_RELEASE_COMMIT_CLAIM_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _get_commit_claim_redis_key(processed_key: str) -> str:
+    return f"{REDIS_REVIEW_CLAIM_KEY_PREFIX}{processed_key}"
+
+
+def _run_commit_claim_script(script: str, vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str, owner: str) -> bool:
+    processed_key = _get_processed_commit_key(vcs_type, identifier, str(pr_mr_id), commit_sha)
+    lease_seconds = int(app_configs.get("REVIEW_CLAIM_LEASE_SECONDS", 900))
+    return bool(redis_client.eval(script, 2, REDIS_PROCESSED_COMMITS_SET_KEY, _get_commit_claim_redis_key(processed_key),
+                                  processed_key, owner, lease_seconds))
+
+
+def claim_commit_for_review(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str, owner: str) -> bool:
+    """
+    原子地认领一个 commit 的审查 (替代 is_commit_processed 检查之后再提交的做法)。
+    commit 已处理或已被其他任务认领时返回 False；Redis 不可用或出错时返回 True (与 is_commit_processed 一致，假定未处理)。
+    """
+    if not redis_client or not commit_sha:
+        return True
+    try:
+        return _run_commit_claim_script(_CLAIM_COMMIT_SCRIPT, vcs_type, identifier, pr_mr_id, commit_sha, owner)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"认领提交 {vcs_type}:{identifier}:{pr_mr_id}:{commit_sha} 时 Redis 出错: {e}。假定未被认领。")
+        return True
+
+
+def renew_commit_claim(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str, owner: str) -> bool:
+    """续约认领。认领已被其他任务持有或 commit 已处理时返回 False；Redis 不可用或出错时返回 True。"""
+    if not redis_client or not commit_sha:
+        return True
+    try:
+        return _run_commit_claim_script(_RENEW_COMMIT_CLAIM_SCRIPT, vcs_type, identifier, pr_mr_id, commit_sha, owner)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"续约提交 {vcs_type}:{identifier}:{pr_mr_id}:{commit_sha} 的认领时 Redis 出错: {e}")
+        return True
+
+
+def release_commit_claim(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str, owner: str):
+    """释放自己持有的认领。审查成功时 commit 已标记为已处理，失败时释放后重新投递的 webhook 可以重试。"""
+    if not redis_client or not commit_sha:
+        return
+    processed_key = _get_processed_commit_key(vcs_type, identifier, str(pr_mr_id), commit_sha)
+    try:
+        redis_client.eval(_RELEASE_COMMIT_CLAIM_SCRIPT, 1, _get_commit_claim_redis_key(processed_key), owner)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"释放提交 {processed_key} 的认领时 Redis 出错 (租约过期后自动释放): {e}")
+
+
 def remove_processed_commit_entries_for_pr_mr(vcs_type: str, identifier: str, pr_mr_id: str):
     """当 PR/MR 关闭或合并时，移除其所有相关的已处理 commit 条目。"""
     # global redis_client # redis_client is already global
@@ -211,8 +420,9 @@ def remove_processed_commit_entries_for_pr_mr(vcs_type: str, identifier: str, pr
         logger.error(
             f"为 {vcs_type} {identifier} #{pr_mr_id} 移除已处理的 commit 条目时发生意外错误: {e}")
 
-    # 同时删除关联的审查结果
+    # 同时删除关联的审查结果和已发布评论的指纹索引
     delete_review_results_for_pr_mr(vcs_type, identifier, pr_mr_id)
+    delete_comment_fingerprints(vcs_type, identifier, pr_mr_id)
 
 
 def _get_review_results_redis_key(vcs_type: str, identifier: str, pr_mr_id: str) -> str:
@@ -235,6 +445,7 @@ def save_review_results(vcs_type: str, identifier: str, pr_mr_id: str, commit_sh
         # 使用 pipeline 保证原子性
         pipe = redis_client.pipeline()
         pipe.hset(redis_key, commit_sha, review_json_string)
+        pipe.hset(redis_key, REVIEW_RESULTS_LAST_SHA_FIELD, commit_sha) # 记录最近一次审查的 commit，用于增量审查
         if vcs_type.startswith('gitlab') and project_name: # 确保 'gitlab' 和 'gitlab_general' 都能保存项目名
             # 仅在首次或需要更新时设置项目名称
             # 如果 _project_name 已存在且不同，可以选择是否覆盖，这里简单覆盖
@@ -275,6 +486,8 @@ def get_review_results(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha
                 try:
                     if field_str == "_project_name":
                         project_name_for_pr_mr = value_bytes.decode('utf-8')
+                    elif field_str == REVIEW_RESULTS_LAST_SHA_FIELD:
+                        continue
                     else: # 这是一个 commit sha
                         decoded_results[field_str] = json.loads(value_bytes.decode('utf-8'))
                 except (UnicodeDecodeError, json.JSONDecodeError) as e:
@@ -294,6 +507,125 @@ def get_review_results(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha
         return None if commit_sha else {}
 
 
+def get_last_reviewed_commit(vcs_type: str, identifier: str, pr_mr_id: str):
+    """获取 PR/MR 最近一次完成审查的 commit SHA。没有记录或 Redis 不可用时返回 None。"""
+    if not redis_client:
+        logger.warning("Redis 客户端不可用，无法获取最近一次审查的 commit。")
+        return None
+
+    redis_key = _get_review_results_redis_key(vcs_type, identifier, pr_mr_id)
+    try:
+        sha_bytes = redis_client.hget(redis_key, REVIEW_RESULTS_LAST_SHA_FIELD)
+        return sha_bytes.decode('utf-8') if sha_bytes else None
+    except redis.exceptions.RedisError as e:
+        logger.error(f"从 Redis 获取最近一次审查的 commit 时出错 (Key: {redis_key}): {e}")
+        return None
+
+
+def _get_comment_fingerprints_redis_key(vcs_type: str, identifier: str, pr_mr_id: str) -> str:
+    """生成用于存储特定 PR/MR 已发布评论指纹的 Redis Key。"""
+    return f"{REDIS_COMMENT_FINGERPRINTS_KEY_PREFIX}{vcs_type}:{identifier}:{str(pr_mr_id)}"
+
+
+def get_comment_fingerprints(vcs_type: str, identifier: str, pr_mr_id: str):
+    """
+    获取 PR/MR 已发布评论的指纹集合。
+    尚未初始化 (从未从 VCS 现有评论中加载) 或 Redis 不可用时返回 None。
+    """
+    if not redis_client:
+        return None
+
+    redis_key = _get_comment_fingerprints_redis_key(vcs_type, identifier, pr_mr_id)
+    try:
+        members = {m.decode('utf-8') for m in redis_client.smembers(redis_key)}
+    except redis.exceptions.RedisError as e:
+        logger.error(f"从 Redis 获取评论指纹时出错 (Key: {redis_key}): {e}")
+        return None
+    if COMMENT_FINGERPRINTS_SEEDED_MEMBER not in members:
+        return None
+    members.discard(COMMENT_FINGERPRINTS_SEEDED_MEMBER)
+    return members
+
+
+def add_comment_fingerprints(vcs_type: str, identifier: str, pr_mr_id: str, fingerprints, mark_seeded: bool = False):
+    """将已发布评论的指纹加入 PR/MR 的指纹集合。mark_seeded 为 True 时同时写入初始化标记。"""
+    if not redis_client:
+        return
+    members = list(fingerprints)
+    if mark_seeded:
+        members.append(COMMENT_FINGERPRINTS_SEEDED_MEMBER)
+    if not members:
+        return
+
+    redis_key = _get_comment_fingerprints_redis_key(vcs_type, identifier, pr_mr_id)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.sadd(redis_key, *members)
+        pipe.expire(redis_key, 60 * 60 * 24 * 7)  # 与审查结果保持一致，7 天
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"保存评论指纹到 Redis 时出错 (Key: {redis_key}): {e}")
+
+
+def delete_comment_fingerprints(vcs_type: str, identifier: str, pr_mr_id: str):
+    """删除特定 PR/MR 的评论指纹索引。"""
+    if not redis_client:
+        return
+
+    redis_key = _get_comment_fingerprints_redis_key(vcs_type, identifier, pr_mr_id)
+    try:
+        if redis_client.delete(redis_key) > 0:
+            logger.info(f"成功从 Redis 删除 {vcs_type} {identifier} #{pr_mr_id} 的评论指纹索引。")
+    except redis.exceptions.RedisError as e:
+        logger.error(f"从 Redis 删除评论指纹时出错 (Key: {redis_key}): {e}")
+
+
+def _get_review_checkpoint_redis_key(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str) -> str:
+    """生成用于存储特定提交审查进度 (检查点) 的 Redis Key。"""
+    return f"{REDIS_REVIEW_CHECKPOINT_KEY_PREFIX}{vcs_type}:{identifier}:{str(pr_mr_id)}:{commit_sha}"
+
+
+def get_review_checkpoint(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str) -> dict:
+    """获取提交的审查检查点 {字段: JSON 字符串}。没有检查点或 Redis 不可用时返回空字典。"""
+    if not redis_client or not commit_sha:
+        return {}
+
+    redis_key = _get_review_checkpoint_redis_key(vcs_type, identifier, pr_mr_id, commit_sha)
+    try:
+        return {field.decode('utf-8'): value.decode('utf-8')
+                for field, value in redis_client.hgetall(redis_key).items()}
+    except (redis.exceptions.RedisError, UnicodeDecodeError) as e:
+        logger.error(f"从 Redis 获取审查检查点时出错 (Key: {redis_key}): {e}")
+        return {}
+
+
+def save_review_checkpoint_field(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str, field: str, value: str):
+    """写入审查检查点的一个字段 (每次写入都会刷新过期时间)。"""
+    if not redis_client or not commit_sha:
+        return
+
+    redis_key = _get_review_checkpoint_redis_key(vcs_type, identifier, pr_mr_id, commit_sha)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(redis_key, field, value)
+        pipe.expire(redis_key, int(app_configs.get("REVIEW_CHECKPOINT_TTL_SECONDS", 86400)))
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"保存审查检查点到 Redis 时出错 (Key: {redis_key}, 字段: {field}): {e}")
+
+
+def delete_review_checkpoint(vcs_type: str, identifier: str, pr_mr_id: str, commit_sha: str):
+    """删除提交的审查检查点 (审查完成后调用)。"""
+    if not redis_client or not commit_sha:
+        return
+
+    redis_key = _get_review_checkpoint_redis_key(vcs_type, identifier, pr_mr_id, commit_sha)
+    try:
+        redis_client.delete(redis_key)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"从 Redis 删除审查检查点时出错 (Key: {redis_key}): {e}")
+
+
 def get_all_reviewed_prs_mrs_keys():
     """获取所有已存储 AI 审查结果的 PR/MR 的 Redis Key 列表。"""
     # global redis_client # redis_client is already global
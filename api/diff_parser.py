@@ -0,0 +1,385 @@
+"""
+流式 unified diff 解析器。
+
+逐行读取补丁文本 (不会对整个补丁调用 splitlines)，使用预编译的 hunk 标头正则，
+变更记录使用元组，结果对象使用 __slots__，增删行数在同一次遍历中统计。
+api.utils.parse_single_file_diff 返回的字典是 FileDiff.as_dict() 的视图。
+"""
+import bisect
+import io
+import logging
+import re
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+HUNK_HEADER_PATTERN = re.compile(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+# 与历史行为保持一致: 只保留整个文件最后若干行 diff 上下文
+DEFAULT_CONTEXT_LIMIT = 20
+
+CHANGE_ADD = "add"
+CHANGE_DELETE = "delete"
+CHANGE_CONTEXT = "context"
+
+# 变更记录是 (type, old_line, new_line, content) 元组，下标常量便于阅读
+TYPE, OLD_LINE, NEW_LINE, CONTENT = range(4)
+
+
+def change_as_dict(change: tuple) -> dict:
+    return {"type": change[TYPE], "old_line": change[OLD_LINE], "new_line": change[NEW_LINE], "content": change[CONTENT]}
+
+
+def as_line_number(value):
+    """将审查意见中的行号 (可能是字符串) 转为正整数，无效时返回 None。"""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        line_number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return line_number if line_number > 0 else None
+
+
+def _nearest(sorted_lines: list, target: int):
+    position = bisect.bisect_left(sorted_lines, target)
+    candidates = sorted_lines[max(position - 1, 0):position + 1]
+    return min(candidates, key=lambda line: (abs(line - target), line)) if candidates else None
+
+
+class LineAnchorIndex:
+    """
+    单个文件 diff 中可评论的行位置索引，在解析 diff 时构建。
+    new_to_old: 新文件行号 -> 对应旧行号 (新增行为 None)；old_to_new: 旧文件行号 -> 对应新行号 (删除行为 None)。
+    只有出现在 hunk 中的行 (新增、删除和上下文行) 才能作为行评论的位置。
+    """
+
+    __slots__ = ("new_to_old", "old_to_new", "added_lines", "deleted_lines")
+
+    def __init__(self):
+        self.new_to_old = {}
+        self.old_to_new = {}
+        self.added_lines = []  # 按解析顺序 (即行号升序) 追加
+        self.deleted_lines = []
+
+    def add(self, change_type, old_line, new_line):
+        if change_type is CHANGE_ADD:
+            self.new_to_old[new_line] = None
+            self.added_lines.append(new_line)
+        elif change_type is CHANGE_DELETE:
+            self.old_to_new[old_line] = None
+            self.deleted_lines.append(old_line)
+        else:
+            self.new_to_old[new_line] = old_line
+            self.old_to_new[old_line] = new_line
+
+    def __bool__(self):
+        return bool(self.new_to_old or self.old_to_new)
+
+    def resolve(self, new_line=None, old_line=None):
+        """
+        返回可评论的 (new_line, old_line) 位置：上下文行两者都有，新增行 old_line 为 None，删除行 new_line 为 None。
+        给定的行号不在 diff 中时吸附到最近的变更行 (优先按同一侧查找)；文件没有任何变更行时返回 None。
+        """
+        new_line, old_line = as_line_number(new_line), as_line_number(old_line)
+        if new_line is not None and new_line in self.new_to_old:
+            return new_line, self.new_to_old[new_line]
+        if old_line is not None and old_line in self.old_to_new:
+            return self.old_to_new[old_line], old_line
+        if new_line is None and old_line is None:
+            return None
+        if new_line is not None:
+            sides = ((self.added_lines, new_line, True), (self.deleted_lines, new_line, False))
+        else:
+            sides = ((self.deleted_lines, old_line, False), (self.added_lines, old_line, True))
+        for sorted_lines, target, is_new_side in sides:
+            nearest = _nearest(sorted_lines, target)
+            if nearest is not None:
+                return (nearest, None) if is_new_side else (None, nearest)
+        return None
+
+
+class FileDiff:
+    """单个文件的解析结果。changes 只包含新增/删除行；context_lines 只保留最后 context_limit 个上下文行。"""
+
+    __slots__ = ("path", "old_path", "changes", "context_lines", "additions", "deletions",
+                 "status", "is_binary", "old_mode", "new_mode", "new_blob", "patch", "anchors")
+
+    def __init__(self, path, old_path=None, context_limit=DEFAULT_CONTEXT_LIMIT):
+        self.path = path
+        self.old_path = old_path
+        self.changes = []
+        self.context_lines = deque(maxlen=context_limit)
+        self.additions = 0
+        self.deletions = 0
+        # 以下字段只有多文件 diff (parse_unified_diff) 才会填充
+        self.status = None  # added / removed / modified / renamed / copied
+        self.is_binary = False
+        self.old_mode = None
+        self.new_mode = None
+        self.new_blob = None  # "index" 行中的新 blob ID (可能是缩写)
+        self.patch = None  # 该文件从第一个 hunk 开始的 diff 文本
+        self.anchors = None  # LineAnchorIndex，仅在 build_anchors=True 时构建
+
+    @property
+    def lines_changed(self) -> int:
+        return self.additions + self.deletions
+
+    def context_text(self) -> str:
+        return "\n".join(f"{old_line} -> {new_line}: {content}" for _, old_line, new_line, content in self.context_lines)
+
+    def as_dict(self, include_anchors: bool = False) -> dict:
+        """parse_single_file_diff 的历史字典格式；include_anchors=True 时额外包含 "line_anchors" (LineAnchorIndex)。"""
+        context_text = self.context_text()
+        file_changes = {
+            "path": self.path,
+            "old_path": self.old_path,
+            "changes": [change_as_dict(change) for change in self.changes],
+            "context": {"old": context_text, "new": context_text},
+            "lines_changed": self.lines_changed,
+        }
+        if include_anchors:
+            file_changes["line_anchors"] = self.anchors
+        return file_changes
+
+
+def iter_patch_lines(diff_source):
+    """逐行产出补丁内容 (去掉行尾换行符)。diff_source 可以是字符串或任意按行迭代的对象 (如文件)。"""
+    if isinstance(diff_source, str):
+        diff_source = io.StringIO(diff_source)
+    for line in diff_source:
+        yield line.rstrip("\r\n")
+
+
+def iter_file_diff_events(lines, file_path=""):
+    """
+    解析单个文件的 diff 行，逐个产出 (type, old_line, new_line, content) 元组，type 为 add / delete / context。
+    hunk 标头中的行数用完之后，以 '--- ' 或 '+++ ' 开头的行才会被当作文件标头跳过，
+    因此内容本身以 '-- ' 或 '++ ' 开头的增删行不会丢失。
+    """
+    old_line = new_line = 0
+    old_remaining = new_remaining = 0
+    in_hunk = False
+    for line in lines:
+        marker = line[:1]
+        if marker == "@" and line.startswith("@@ "):
+            match = HUNK_HEADER_PATTERN.match(line)
+            if match:
+                old_start, old_count, new_start, new_count = match.groups()
+                old_line, new_line = int(old_start), int(new_start)
+                old_remaining = int(old_count) if old_count is not None else 1
+                new_remaining = int(new_count) if new_count is not None else 1
+                in_hunk = True
+            else:
+                logger.warning(f"警告: 无法解析 {file_path} 中的 hunk 标头: {line}")
+                old_line = new_line = 0
+                old_remaining = new_remaining = 0
+                in_hunk = False
+            continue
+        if not in_hunk:
+            continue
+        if marker == "+":
+            if new_remaining <= 0 and old_remaining <= 0 and line.startswith("+++ "):
+                continue
+            yield CHANGE_ADD, None, new_line, line[1:]
+            new_line += 1
+            new_remaining -= 1
+        elif marker == "-":
+            if new_remaining <= 0 and old_remaining <= 0 and line.startswith("--- "):
+                continue
+            yield CHANGE_DELETE, old_line, None, line[1:]
+            old_line += 1
+            old_remaining -= 1
+        elif marker == " " or (not line and old_remaining > 0 and new_remaining > 0):
+            # 部分工具会去掉空上下文行的前导空格
+            yield CHANGE_CONTEXT, old_line, new_line, line[1:]
+            old_line += 1
+            new_line += 1
+            old_remaining -= 1
+            new_remaining -= 1
+
+
+def _fill_file_diff(file_diff: FileDiff, lines, build_anchors: bool = False) -> FileDiff:
+    changes_append = file_diff.changes.append
+    context_append = file_diff.context_lines.append
+    anchor_add = None
+    if build_anchors:
+        file_diff.anchors = LineAnchorIndex()
+        anchor_add = file_diff.anchors.add
+    additions = deletions = 0
+    for event in iter_file_diff_events(lines, file_diff.path):
+        change_type = event[0]
+        if change_type is CHANGE_ADD:
+            changes_append(event)
+            additions += 1
+        elif change_type is CHANGE_DELETE:
+            changes_append(event)
+            deletions += 1
+        else:
+            context_append(event)
+        if anchor_add is not None:
+            anchor_add(change_type, event[OLD_LINE], event[NEW_LINE])
+    file_diff.additions = additions
+    file_diff.deletions = deletions
+    return file_diff
+
+
+def parse_file_diff(diff_source, file_path, old_file_path=None, context_limit=DEFAULT_CONTEXT_LIMIT,
+                    build_anchors: bool = False) -> FileDiff:
+    """单次遍历解析单个文件的 unified diff，返回 FileDiff。build_anchors=True 时同时构建 LineAnchorIndex。"""
+    return _fill_file_diff(FileDiff(file_path, old_file_path, context_limit), iter_patch_lines(diff_source or ""),
+                           build_anchors)
+
+
+_GIT_QUOTE_ESCAPES = {"a": "\a", "b": "\b", "t": "\t", "n": "\n", "v": "\v", "f": "\f", "r": "\r", '"': '"', "\\": "\\"}
+_DEV_NULL = "/dev/null"
+
+
+def unquote_git_path(path: str) -> str:
+    """还原 git 对特殊字符路径的 C 风格引号转义 (例如 "a/\\346\\226\\207.txt")。"""
+    if len(path) < 2 or path[0] != '"' or path[-1] != '"':
+        return path
+    decoded = bytearray()
+    index, end = 1, len(path) - 1
+    while index < end:
+        char = path[index]
+        if char == "\\" and index + 1 < end:
+            escaped = path[index + 1]
+            if escaped in "01234567":
+                decoded.append(int(path[index + 1:index + 4], 8) & 0xFF)
+                index += 4
+                continue
+            decoded += _GIT_QUOTE_ESCAPES.get(escaped, escaped).encode("utf-8")
+            index += 2
+            continue
+        decoded += char.encode("utf-8")
+        index += 1
+    return decoded.decode("utf-8", errors="replace")
+
+
+def _strip_side_prefix(path: str, prefix: str):
+    path = unquote_git_path(path.strip())
+    if path == _DEV_NULL:
+        return None
+    return path[len(prefix):] if path.startswith(prefix) else path
+
+
+def _paths_from_git_header(header: str):
+    """从 "diff --git a/X b/Y" 中解析新旧路径；路径含空格时依赖 a/X 与 b/Y 相同 (非重命名) 的对称性。"""
+    rest = header[len("diff --git "):]
+    if rest.startswith('"'):
+        closing = rest.find('"', 1)
+        while closing != -1 and rest[closing - 1] == "\\":
+            closing = rest.find('"', closing + 1)
+        if closing != -1:
+            return _strip_side_prefix(rest[:closing + 1], "a/"), _strip_side_prefix(rest[closing + 2:], "b/")
+    if len(rest) % 2 == 1:
+        middle = len(rest) // 2
+        old_part, new_part = rest[:middle], rest[middle + 1:]
+        if old_part[2:] == new_part[2:]:
+            return _strip_side_prefix(old_part, "a/"), _strip_side_prefix(new_part, "b/")
+    separator = rest.find(" b/")
+    if separator == -1:
+        separator = rest.find(" ")
+    if separator == -1:
+        return _strip_side_prefix(rest, "a/"), None
+    return _strip_side_prefix(rest[:separator], "a/"), _strip_side_prefix(rest[separator + 1:], "b/")
+
+
+class _FileSection:
+    """多文件 diff 中单个文件的标头信息与 hunk 行。"""
+
+    __slots__ = ("old_path", "new_path", "status", "is_binary", "old_mode", "new_mode", "new_blob", "hunk_lines",
+                 "old_is_dev_null", "new_is_dev_null")
+
+    def __init__(self, git_header: str):
+        self.old_path, self.new_path = _paths_from_git_header(git_header)
+        self.status = None
+        self.is_binary = False
+        self.old_mode = self.new_mode = self.new_blob = None
+        self.hunk_lines = []
+        self.old_is_dev_null = self.new_is_dev_null = False
+
+    def handle_header_line(self, line: str):
+        if line.startswith("--- "):
+            self.old_is_dev_null = line[4:].strip() == _DEV_NULL
+            if not self.old_is_dev_null:
+                self.old_path = _strip_side_prefix(line[4:], "a/")
+        elif line.startswith("+++ "):
+            self.new_is_dev_null = line[4:].strip() == _DEV_NULL
+            if not self.new_is_dev_null:
+                self.new_path = _strip_side_prefix(line[4:], "b/")
+        elif line.startswith("new file mode "):
+            self.status = "added"
+            self.new_mode = line[len("new file mode "):].strip()
+        elif line.startswith("deleted file mode "):
+            self.status = "removed"
+            self.old_mode = line[len("deleted file mode "):].strip()
+        elif line.startswith("old mode "):
+            self.old_mode = line[len("old mode "):].strip()
+        elif line.startswith("new mode "):
+            self.new_mode = line[len("new mode "):].strip()
+        elif line.startswith(("rename from ", "copy from ")):
+            self.old_path = unquote_git_path(line.split(" from ", 1)[1].strip())
+            self.status = self.status or ("renamed" if line.startswith("rename") else "copied")
+        elif line.startswith(("rename to ", "copy to ")):
+            self.new_path = unquote_git_path(line.split(" to ", 1)[1].strip())
+        elif line.startswith("index "):
+            blob_range = line[len("index "):].split(" ", 1)
+            if ".." in blob_range[0]:
+                self.new_blob = blob_range[0].split("..", 1)[1]
+            if len(blob_range) > 1:
+                self.new_mode = self.new_mode or blob_range[1].strip()
+                self.old_mode = self.old_mode or blob_range[1].strip()
+        elif line.startswith("Binary files ") or line == "GIT binary patch":
+            self.is_binary = True
+
+    def to_file_diff(self, context_limit: int, build_anchors: bool) -> FileDiff:
+        if self.status is None:
+            if self.old_is_dev_null:
+                self.status = "added"
+            elif self.new_is_dev_null:
+                self.status = "removed"
+            else:
+                self.status = "modified"
+        if self.status == "removed":
+            path, old_path = self.old_path, None
+        elif self.status in ("renamed", "copied"):
+            path, old_path = self.new_path, self.old_path
+        else:
+            path, old_path = self.new_path or self.old_path, None
+        file_diff = FileDiff(path, old_path, context_limit)
+        file_diff.status = self.status
+        file_diff.is_binary = self.is_binary
+        file_diff.old_mode = self.old_mode
+        file_diff.new_mode = self.new_mode
+        file_diff.new_blob = self.new_blob if self.new_blob and set(self.new_blob) != {"0"} else None
+        if self.hunk_lines:
+            file_diff.patch = "\n".join(self.hunk_lines)
+            _fill_file_diff(file_diff, self.hunk_lines, build_anchors)
+        return file_diff
+
+
+def parse_unified_diff(diff_source, context_limit=DEFAULT_CONTEXT_LIMIT, build_anchors: bool = False):
+    """
+    逐个产出完整多文件 diff (git diff 输出或 GitHub 的 application/vnd.github.v3.diff) 中每个文件的 FileDiff。
+    支持 "diff --git" 标头、重命名/复制、新增/删除、模式变更和二进制文件标记；
+    同一时刻只缓存当前文件的 hunk 行。
+    """
+    section = None
+    in_hunks = False
+    for line in iter_patch_lines(diff_source or ""):
+        if line.startswith("diff --git "):
+            if section is not None:
+                yield section.to_file_diff(context_limit, build_anchors)
+            section = _FileSection(line)
+            in_hunks = False
+            continue
+        if section is None:
+            continue  # 第一个文件之前的内容 (例如 format-patch 的邮件头)
+        if in_hunks or line.startswith("@@ "):
+            in_hunks = True
+            section.hunk_lines.append(line)
+        else:
+            section.handle_header_line(line)
+    if section is not None:
+        yield section.to_file_diff(context_limit, build_anchors)
@@ -14,6 +14,13 @@ from api.core_config import (
 import api.core_config as core_config_module  # 访问 redis_client 的推荐方式
 from api.utils import require_admin_key
 from api.services.unified_review_service import initialize_llm_client
+from api.services.path_filter_service import normalize_path_filter_config
+from api.services.review_scheduler import TIER_WEIGHTS
+from api.services.concurrency_limit_service import SCOPE_DEFAULT_CONFIG_KEYS, describe_limits, set_limit
+from api.services.job_status_service import JOB_STATES, get_job, list_jobs
+from api.services.dead_letter_service import (
+    DEAD_LETTER_KINDS, list_dead_letters, purge_dead_letters, replay_dead_letters
+)
 
 logger = logging.getLogger(__name__)
 
@@ -29,8 +36,18 @@ def add_or_update_github_repo_config():
     token = data.get('token')
     if not repo_full_name or not secret or not token:
         return jsonify({"error": "Missing required fields: repo_full_name, secret, token"}), 400
+    if "priority_tier" in data and data["priority_tier"] not in TIER_WEIGHTS:
+        return jsonify({"error": f"priority_tier must be one of: {', '.join(TIER_WEIGHTS)}"}), 400
 
     config_data = {"secret": secret, "token": token}
+    # 路径过滤规则未在请求中提供时沿用已有配置
+    existing_config = github_repo_configs.get(repo_full_name) or {}
+    for key in ("include_paths", "exclude_paths", "use_default_excludes", "priority_tier"):
+        if key in existing_config:
+            config_data[key] = existing_config[key]
+    config_data.update(normalize_path_filter_config(data))
+    if "priority_tier" in data:
+        config_data["priority_tier"] = data["priority_tier"]
     github_repo_configs[repo_full_name] = config_data
 
     if core_config_module.redis_client:
@@ -81,11 +98,21 @@ def add_or_update_gitlab_project_config():
 
     if not project_id or not secret or not token:  # instance_url 是可选的
         return jsonify({"error": "Missing required fields: project_id, secret, token"}), 400
+    if "priority_tier" in data and data["priority_tier"] not in TIER_WEIGHTS:
+        return jsonify({"error": f"priority_tier must be one of: {', '.join(TIER_WEIGHTS)}"}), 400
 
     project_id_str = str(project_id)
     config_data = {"secret": secret, "token": token}
     if instance_url:  # 只有当用户提供时才存储
         config_data["instance_url"] = instance_url
+    # 路径过滤规则未在请求中提供时沿用已有配置
+    existing_config = gitlab_project_configs.get(project_id_str) or {}
+    for key in ("include_paths", "exclude_paths", "use_default_excludes", "priority_tier"):
+        if key in existing_config:
+            config_data[key] = existing_config[key]
+    config_data.update(normalize_path_filter_config(data))
+    if "priority_tier" in data:
+        config_data["priority_tier"] = data["priority_tier"]
 
     gitlab_project_configs[project_id_str] = config_data
     if core_config_module.redis_client:
@@ -168,6 +195,157 @@ def update_global_settings():
         return jsonify({"message": "No settings were updated or values provided matched existing configuration."}), 200
 
 
+# --- Concurrency Limits ---
+@app.route('/config/concurrency_limits', methods=['GET'])
+@require_admin_key
+def get_concurrency_limits():
+    """返回各类并发上限的默认值、按名称的覆盖配置以及当前占用的槽位数。"""
+    return jsonify(describe_limits()), 200
+
+
+@app.route('/config/concurrency_limits', methods=['POST'])
+@require_admin_key
+def update_concurrency_limit():
+    """
+    设置或删除单个并发上限覆盖。请求体: {"scope": "repo" | "vcs_host" | "llm_provider", "name": "...", "limit": N}。
+    name 为 "*" 时覆盖该类型的默认上限；limit 为 null 时删除覆盖；limit 为 0 表示不限制。
+    """
+    if not request.is_json: return jsonify({"error": "Request must be JSON"}), 400
+    data = request.get_json()
+    scope = data.get('scope')
+    name = str(data.get('name') or '').strip()
+    limit = data.get('limit')
+    if scope not in SCOPE_DEFAULT_CONFIG_KEYS or not name:
+        return jsonify({"error": f"Fields required: scope (one of {', '.join(SCOPE_DEFAULT_CONFIG_KEYS)}), name"}), 400
+    if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 0):
+        return jsonify({"error": "limit must be a non-negative integer or null"}), 400
+    if not core_config_module.redis_client:
+        return jsonify({"error": "Redis 不可用，无法保存并发上限。"}), 503
+    try:
+        set_limit(scope, name, limit)
+    except Exception as e:
+        logger.error(f"保存并发上限 {scope}:{name} 时出错: {e}")
+        return jsonify({"error": "保存并发上限失败。"}), 500
+    logger.info(f"并发上限已更新: {scope}:{name} = {limit if limit is not None else '默认'}")
+    return jsonify({"message": f"Concurrency limit for {scope} {name} updated.", **describe_limits()}), 200
+
+
+# --- Review Job Status Endpoints ---
+@app.route('/config/jobs', methods=['GET'])
+@require_admin_key
+def list_review_jobs():
+    """
+    按提交时间倒序列出最近的审查任务及其状态、进度和阶段耗时。
+    查询参数: state (按状态过滤)，limit (默认 50，最大 500)。
+    """
+    state = request.args.get('state') or None
+    if state is not None and state not in JOB_STATES:
+        return jsonify({"error": f"state must be one of: {', '.join(JOB_STATES)}"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not core_config_module.redis_client:
+        return jsonify({"error": "Redis 不可用，无法查询审查任务。"}), 503
+    try:
+        return jsonify(list_jobs(limit=limit, state=state)), 200
+    except Exception as e:
+        logger.error(f"查询审查任务列表时出错: {e}")
+        return jsonify({"error": "查询审查任务列表失败。"}), 500
+
+
+@app.route('/config/jobs/<job_id>', methods=['GET'])
+@require_admin_key
+def get_review_job(job_id):
+    """返回单个审查任务的状态、进度、错误和各阶段耗时。"""
+    if not core_config_module.redis_client:
+        return jsonify({"error": "Redis 不可用，无法查询审查任务。"}), 503
+    try:
+        job = get_job(job_id)
+    except Exception as e:
+        logger.error(f"查询审查任务 {job_id} 时出错: {e}")
+        return jsonify({"error": "查询审查任务失败。"}), 500
+    if job is None:
+        return jsonify({"error": f"审查任务 {job_id} 不存在或已过期。"}), 404
+    return jsonify(job), 200
+
+
+# --- Dead Letter Queue Endpoints ---
+@app.route('/config/dead_letters', methods=['GET'])
+@require_admin_key
+def list_dead_letter_entries():
+    """
+    按失败时间倒序列出死信队列中的条目 (失败的文件审查、评论发布和通知)，以及各类型的条目数。
+    查询参数: kind (按类型过滤)，limit (默认 100，最大 1000)。
+    """
+    kind = request.args.get('kind') or None
+    if kind is not None and kind not in DEAD_LETTER_KINDS:
+        return jsonify({"error": f"kind must be one of: {', '.join(DEAD_LETTER_KINDS)}"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not core_config_module.redis_client:
+        return jsonify({"error": "Redis 不可用，无法查询死信队列。"}), 503
+    try:
+        return jsonify(list_dead_letters(kind=kind, limit=limit)), 200
+    except Exception as e:
+        logger.error(f"查询死信队列时出错: {e}")
+        return jsonify({"error": "查询死信队列失败。"}), 500
+
+
+def _parse_dead_letter_selection():
+    """
+    解析批量操作的请求体: {"ids": ["<条目 ID>", ...]} 或 {"all": true, "kind": "<可选类型>"}。
+    返回 ((ids, kind), None) 或 (None, 错误响应)。
+    """
+    if not request.is_json: return None, (jsonify({"error": "Request must be JSON"}), 400)
+    data = request.get_json() or {}
+    ids = data.get('ids')
+    kind = data.get('kind') or None
+    if kind is not None and kind not in DEAD_LETTER_KINDS:
+        return None, (jsonify({"error": f"kind must be one of: {', '.join(DEAD_LETTER_KINDS)}"}), 400)
+    if ids:
+        if not isinstance(ids, list) or not all(isinstance(entry_id, str) for entry_id in ids):
+            return None, (jsonify({"error": "ids must be a list of entry IDs"}), 400)
+        return (ids, None), None
+    if data.get('all') is True:
+        return (None, kind), None
+    return None, (jsonify({"error": "Provide a non-empty 'ids' list or 'all': true (optionally with 'kind')"}), 400)
+
+
+@app.route('/config/dead_letters/replay', methods=['POST'])
+@require_admin_key
+def replay_dead_letter_entries():
+    """将选中的条目 (包括已不再自动重试的) 标记为立即重放，由重试线程在几秒内执行。"""
+    selection, error_response = _parse_dead_letter_selection()
+    if error_response: return error_response
+    if not core_config_module.redis_client:
+        return jsonify({"error": "Redis 不可用，无法重放死信队列条目。"}), 503
+    try:
+        replayed = replay_dead_letters(*selection)
+    except Exception as e:
+        logger.error(f"重放死信队列条目时出错: {e}")
+        return jsonify({"error": "重放死信队列条目失败。"}), 500
+    return jsonify({"message": f"{replayed} dead letter entries scheduled for replay.", "replayed": replayed}), 200
+
+
+@app.route('/config/dead_letters/purge', methods=['POST'])
+@require_admin_key
+def purge_dead_letter_entries():
+    """删除选中的条目，不再重试。"""
+    selection, error_response = _parse_dead_letter_selection()
+    if error_response: return error_response
+    if not core_config_module.redis_client:
+        return jsonify({"error": "Redis 不可用，无法清除死信队列条目。"}), 503
+    try:
+        purged = purge_dead_letters(*selection)
+    except Exception as e:
+        logger.error(f"清除死信队列条目时出错: {e}")
+        return jsonify({"error": "清除死信队列条目失败。"}), 500
+    return jsonify({"message": f"{purged} dead letter entries purged.", "purged": purged}), 200
+
+
 # --- AI Code Review Results Endpoints ---
 @app.route('/config/review_results/list', methods=['GET'])
 @require_admin_key
@@ -1,5 +1,7 @@
 import logging
+from flask import jsonify
 from api.core_config import save_review_results
+from api.services.admission_control_service import retry_after_seconds
 
 logger = logging.getLogger(__name__)
 
@@ -27,3 +29,13 @@ def _save_review_results_and_log(vcs_type: str, identifier: str, pr_mr_id: str,
     except Exception as e:
         # save_review_results 内部已经有错误日志，这里可以捕获更通用的错误或决定是否需要额外日志
         logger.error(f"调用 save_review_results 时发生意外错误 ({vcs_type} {identifier}#{pr_mr_id}, Commit: {commit_sha}): {e}")
+
+
+def _overloaded_response(vcs_label: str, identifier: str, pr_mr_id):
+    """服务过载时拒绝审查请求: 返回 503 和 Retry-After，由调用方稍后重新投递。"""
+    retry_after = retry_after_seconds()
+    logger.warning(f"{vcs_label}: 服务过载，拒绝 {identifier}#{pr_mr_id} 的审查请求 (Retry-After: {retry_after} 秒)。")
+    response = jsonify({"error": "审查服务过载，请稍后重试。", "retry_after_seconds": retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
@@ -1,17 +1,24 @@
 from flask import request, abort, jsonify
 import json
 import logging
-from api.app_factory import app, executor, handle_async_task_exception # 导入 executor 和回调
+from api.app_factory import app
 from api.core_config import (
     github_repo_configs, gitlab_project_configs, app_configs,
-    is_commit_processed, mark_commit_as_processed, remove_processed_commit_entries_for_pr_mr
+    is_commit_processed, mark_commit_as_processed, remove_processed_commit_entries_for_pr_mr, resolve_access_token
 )
 from api.utils import verify_github_signature, verify_gitlab_signature
 from api.services.vcs_service import (
-    get_github_pr_changes, add_github_pr_comment, 
-    get_gitlab_mr_changes, add_gitlab_mr_comment,
+    get_github_pr_changes, add_github_pr_comment, post_github_pr_review_batch,
+    get_gitlab_mr_changes, add_gitlab_mr_comment, post_gitlab_mr_review_batch,
     add_github_pr_general_comment, # Used for final summary
-    add_gitlab_mr_general_comment  # Used for final summary
+    add_gitlab_mr_general_comment,  # Used for final summary
+    get_github_changed_files_between_commits,
+    get_gitlab_changed_files_between_commits,
+    list_github_pr_review_comment_bodies,
+    list_gitlab_mr_note_bodies,
+    make_github_head_blob_resolver,
+    make_gitlab_head_blob_resolver,
+    collect_line_anchors
 )
 # 从统一服务导入
 from api.services.unified_review_service import (
@@ -20,9 +27,23 @@ from api.services.unified_review_service import (
     get_general_review_service,
     get_llm_client
 )
+from api.services.incremental_review_service import plan_incremental_review
+from api.services.comment_dedup_service import CommentFingerprintIndex, build_line_content_map
+from api.services.review_checkpoint_service import ReviewCheckpoint
+from api.services.job_status_service import (
+    JOB_STATE_POSTING, JOB_STATE_REVIEWING, report_job_progress, report_job_state
+)
+from api.services.job_queue_service import (
+    get_latest_head, github_pr_size_hint, register_job_handler, submit_review_job
+)
+from api.services.dead_letter_service import (
+    DEAD_LETTER_FILE_REVIEW, register_dead_letter_handler
+)
+from api.services.scope_context_service import attach_scope_context
 from api.services.notification_service import send_notifications
 from api.services.common_service import get_final_summary_comment_text
-from .webhook_helpers import _save_review_results_and_log
+from api.services.admission_control_service import ADMISSION_DEFER, ADMISSION_REJECT, defer_seconds, evaluate_admission
+from .webhook_helpers import _overloaded_response, _save_review_results_and_log
 
 logger = logging.getLogger(__name__)
 
@@ -54,10 +75,14 @@ def _get_wecom_summary_line(num_reviews, vcs_type):
 # --- End Helper Functions ---
 
 
-def _process_github_detailed_payload(access_token, owner, repo_name, pull_number, head_sha, repo_full_name, pr_title, pr_html_url, repo_web_url, pr_source_branch, pr_target_branch):
-    """实际处理 GitHub 详细审查的核心逻辑 (逐文件审查和评论)。"""
+def _process_github_detailed_payload(access_token, owner, repo_name, pull_number, head_sha, repo_full_name, pr_title, pr_html_url, repo_web_url, pr_source_branch, pr_target_branch, cancel_token=None):
+    """
+    实际处理 GitHub 详细审查的核心逻辑 (逐文件审查和评论)。
+    cancel_token 已取消 (PR 推送了新的提交或进程正在关闭) 时在文件之间或发布评论之前提前结束，不保存也不发布任何结果。
+    每个文件的审查结果写入检查点，任务失败重试或中断后重新执行时跳过已审查的文件，已批量发布的评论不再发布。
+    """
     logger.info("GitHub (详细审查): 正在获取并解析 PR 变更...")
-    structured_changes = get_github_pr_changes(owner, repo_name, pull_number, access_token)
+    structured_changes = get_github_pr_changes(owner, repo_name, pull_number, access_token, head_sha)
 
     if structured_changes is None:
         logger.warning("GitHub (详细审查): 获取或解析 diff 内容失败。中止审查。")
@@ -71,48 +96,94 @@ def _process_github_detailed_payload(access_token, owner, repo_name, pull_number
         mark_commit_as_processed('github', repo_full_name, str(pull_number), head_sha)
         return
 
+    paths_to_review, carried_reviews = plan_incremental_review(
+        'github', repo_full_name, str(pull_number), head_sha,
+        {path: data.get("old_path") for path, data in structured_changes.items()},
+        lambda last_sha, new_sha: get_github_changed_files_between_commits(owner, repo_name, last_sha, new_sha, access_token)
+    )
+    if paths_to_review is not None:
+        structured_changes = {path: data for path, data in structured_changes.items() if path in paths_to_review}
+        if not structured_changes:
+            logger.info("GitHub (详细审查): 本次推送未触及 PR 中的任何文件，沿用上次的审查结果。")
+            _save_review_results_and_log(
+                vcs_type='github', identifier=repo_full_name, pr_mr_id=str(pull_number),
+                commit_sha=head_sha, review_json_string=json.dumps(carried_reviews, ensure_ascii=False)
+            )
+            mark_commit_as_processed('github', repo_full_name, str(pull_number), head_sha)
+            return
+
+    # 用变更所在的函数/类作用域替换 diff 中有限的上下文行
+    attach_scope_context(structured_changes,
+                         make_github_head_blob_resolver(owner, repo_name, access_token, head_sha, pull_number))
+
     all_reviews_for_redis = []
-    total_comments_posted_successfully = 0
-    
+
     # 获取 LLM 客户端和模型配置一次
-    get_llm_client()  # 初始化客户端
+    llm_client = get_llm_client()()  # 初始化客户端
     current_model = app_configs.get("OPENAI_MODEL", "gpt-4o") if not app_configs.get("USE_QIANWEN", False) else app_configs.get("QIANWEN_MODEL", "qwen-plus")
 
     logger.info(f'GitHub (详细审查): 将对 {len(structured_changes)} 个文件逐一发送给 {current_model} 进行审查...')
-
-    for file_path, file_data in structured_changes.items():
-        logger.info(f"GitHub (详细审查): 正在处理文件: {file_path}")
-        get_detailed_review_service()(file_path, file_data, None, current_model)
+    checkpoint = ReviewCheckpoint('github', repo_full_name, str(pull_number), head_sha)
+    report_job_state(cancel_token, JOB_STATE_REVIEWING, files_total=len(structured_changes))
+
+    for files_done, (file_path, file_data) in enumerate(structured_changes.items(), start=1):
+        if cancel_token and cancel_token.is_cancelled():
+            logger.info(f"GitHub (详细审查): PR {repo_full_name}#{pull_number} 的审查已取消 (有更新的提交或进程正在关闭)，中止对 {head_sha} 的审查。")
+            return
+        reviews_for_file_list = checkpoint.get_file_reviews(file_path)
+        if reviews_for_file_list is not None:
+            logger.info(f"GitHub (详细审查): 文件 {file_path} 已在检查点中完成审查，跳过。")
+        else:
+            logger.info(f"GitHub (详细审查): 正在处理文件: {file_path}")
+            reviews_for_file_list = get_detailed_review_service()(file_path, file_data, llm_client, current_model)
+            if reviews_for_file_list is not None:  # 审查失败 (None) 的文件不写入检查点，重试时重新审查
+                checkpoint.save_file_reviews(file_path, reviews_for_file_list)
+            else:  # 审查完成时仍失败的文件写入死信队列，由后台单独重新审查并发布该文件的意见
+                checkpoint.mark_file_failed(file_path, "LLM 审查失败或输出无法解析 (详见日志)")
 
         if reviews_for_file_list: # reviews_for_file_list 是一个 Python 列表
-            all_reviews_for_redis.extend(reviews_for_file_list)
-            logger.info(f"GitHub (详细审查): 文件 {file_path} 发现 {len(reviews_for_file_list)} 个问题。正在尝试添加评论...")
-            
-            file_comments_added, file_comments_failed = 0, 0
             for review_item in reviews_for_file_list:
                 # 确保 review_item 中包含 old_path (如果适用)
                 if "old_path" not in review_item and file_data.get("old_path"):
                     review_item["old_path"] = file_data["old_path"]
-                
-                success = add_github_pr_comment(owner, repo_name, pull_number, access_token, review_item, head_sha)
-                if success:
-                    file_comments_added += 1
-                    total_comments_posted_successfully +=1
-                else:
-                    file_comments_failed += 1
-            logger.info(f"GitHub (详细审查): 文件 {file_path} 评论添加完成: {file_comments_added} 成功, {file_comments_failed} 失败。")
+            all_reviews_for_redis.extend(reviews_for_file_list)
+            logger.info(f"GitHub (详细审查): 文件 {file_path} 发现 {len(reviews_for_file_list)} 个问题。")
         else:
             logger.info(f"GitHub (详细审查): 文件 {file_path} 未发现问题或审查时出错。")
+        report_job_progress(cancel_token, files_done)
+
+    if cancel_token and cancel_token.is_cancelled():
+        logger.info(f"GitHub (详细审查): PR {repo_full_name}#{pull_number} 的审查已取消 (有更新的提交或进程正在关闭)，丢弃对 {head_sha} 的审查结果。")
+        return
+    report_job_state(cancel_token, JOB_STATE_POSTING)
+
+    if all_reviews_for_redis and checkpoint.is_posted():
+        logger.info("GitHub (详细审查): 检查点显示审查意见已批量发布，不再重复发布。")
+    elif all_reviews_for_redis:
+        logger.info(f"GitHub (详细审查): 正在以单个 Review 批量发布 {len(all_reviews_for_redis)} 条审查意见...")
+        fingerprint_index = CommentFingerprintIndex(
+            'github', repo_full_name, str(pull_number),
+            seed_loader=lambda: list_github_pr_review_comment_bodies(owner, repo_name, pull_number, access_token)
+        )
+        comments_added, comments_failed = post_github_pr_review_batch(
+            owner, repo_name, pull_number, access_token, all_reviews_for_redis, head_sha,
+            summary_text=f"**AI Code Review**: 共发现 {len(all_reviews_for_redis)} 条审查意见。",
+            fingerprint_index=fingerprint_index,
+            line_content_map=build_line_content_map(structured_changes),
+            line_anchors=collect_line_anchors(structured_changes)
+        )
+        logger.info(f"GitHub (详细审查): 批量评论发布完成: {comments_added} 成功, {comments_failed} 失败。")
+        checkpoint.mark_posted()
 
     # 所有文件处理完毕后
     logger.info("--- GitHub (详细审查): 所有文件处理完毕 ---")
-    logger.info(f"总共收集到 {len(all_reviews_for_redis)} 条审查意见用于存储。")
+    logger.info(f"总共收集到 {len(all_reviews_for_redis)} 条新审查意见，沿用 {len(carried_reviews)} 条先前的审查意见用于存储。")
 
-    # 保存所有收集到的审查结果到 Redis
+    # 保存所有收集到的审查结果到 Redis (包含增量审查沿用的意见)
     final_review_json_for_redis = "[]"
-    if all_reviews_for_redis:
+    if all_reviews_for_redis or carried_reviews:
         try:
-            final_review_json_for_redis = json.dumps(all_reviews_for_redis, ensure_ascii=False, indent=2)
+            final_review_json_for_redis = json.dumps(all_reviews_for_redis + carried_reviews, ensure_ascii=False, indent=2)
         except TypeError as e:
             logger.error(f"GitHub (详细审查): 序列化最终审查列表到 JSON 时出错: {e}")
             # 保留 final_review_json_for_redis 为 "[]"
@@ -125,8 +196,8 @@ def _process_github_detailed_payload(access_token, owner, repo_name, pull_number
         review_json_string=final_review_json_for_redis
     )
 
-    # 如果没有任何评论被成功发布 (或 all_reviews_for_redis 为空)
-    if not all_reviews_for_redis: # 或者 total_comments_posted_successfully == 0
+    # 如果没有任何新的或沿用的审查意见
+    if not all_reviews_for_redis and not carried_reviews:
         _post_no_issues_comment(
             vcs_type='github',
             comment_function=add_github_pr_comment,
@@ -159,6 +230,11 @@ def _process_github_detailed_payload(access_token, owner, repo_name, pull_number
 
     final_comment_text = get_final_summary_comment_text()
     add_github_pr_general_comment(owner, repo_name, pull_number, access_token, final_comment_text)
+    checkpoint.flush_failed_files()
+    checkpoint.clear()
+
+
+register_job_handler("github_detailed", _process_github_detailed_payload)
 
 
 @app.route('/github_webhook', methods=['POST'])
@@ -231,10 +307,16 @@ def github_webhook():
         logger.info(f"GitHub (详细审查): PR {repo_full_name}#{pull_number} 的提交 {head_sha} 已处理。跳过。")
         return "提交已处理", 200
 
-    # 调用提取出来的核心处理逻辑函数 (异步执行)
-    future = executor.submit(
-        _process_github_detailed_payload,
-        access_token=access_token,
+    admission = evaluate_admission()
+    if admission == ADMISSION_REJECT:
+        return _overloaded_response("GitHub (详细审查)", repo_full_name, pull_number)
+
+    # 提交审查任务 (异步执行)，任务中不包含访问令牌
+    job_id = submit_review_job(
+        "github_detailed", "github", repo_full_name, pull_number, head_sha,
+        claim_vcs_type='github',
+        defer_seconds=defer_seconds() if admission == ADMISSION_DEFER else 0,
+        size_hint=github_pr_size_hint(pr_data),
         owner=owner,
         repo_name=repo_name,
         pull_number=pull_number,
@@ -246,16 +328,21 @@ def github_webhook():
         pr_source_branch=pr_source_branch,
         pr_target_branch=pr_target_branch
     )
-    future.add_done_callback(handle_async_task_exception)
-    
+    if job_id is None:
+        logger.info(f"GitHub (详细审查): PR {repo_full_name}#{pull_number} 的提交 {head_sha} 已处理或正在审查。跳过。")
+        return "提交已处理或正在审查", 200
+
     logger.info(f"GitHub (详细审查): PR {repo_full_name}#{pull_number} 的处理任务已提交到后台执行。")
     return jsonify({"message": "GitHub Detailed Webhook processing task accepted."}), 202
 
 
-def _process_gitlab_detailed_payload(access_token, project_id_str, mr_iid, head_sha_payload, project_data, mr_attrs, project_web_url, mr_title, mr_url, project_name_from_payload):
-    """实际处理 GitLab 详细审查的核心逻辑。"""
+def _process_gitlab_detailed_payload(access_token, project_id_str, mr_iid, head_sha_payload, project_data, mr_attrs, project_web_url, mr_title, mr_url, project_name_from_payload, cancel_token=None):
+    """
+    实际处理 GitLab 详细审查的核心逻辑。
+    每个文件的审查结果写入检查点，任务失败重试或中断后重新执行时只审查剩余的文件，已批量发布的评论不再发布。
+    """
     logger.info("GitLab (详细审查): 正在获取并解析 MR 变更...")
-    structured_changes, position_info = get_gitlab_mr_changes(project_id_str, mr_iid, access_token)
+    structured_changes, position_info = get_gitlab_mr_changes(project_id_str, mr_iid, access_token, head_sha_payload)
 
     if position_info is None: position_info = {}
     if head_sha_payload and not position_info.get("head_sha"):
@@ -277,9 +364,37 @@ def _process_gitlab_detailed_payload(access_token, project_id_str, mr_iid, head_
         mark_commit_as_processed('gitlab', project_id_str, str(mr_iid), head_sha_payload)
         return
 
+    paths_to_review, carried_reviews = plan_incremental_review(
+        'gitlab', project_id_str, str(mr_iid), head_sha_payload or position_info.get("head_sha"),
+        {path: data.get("old_path") for path, data in structured_changes.items()},
+        lambda last_sha, new_sha: get_gitlab_changed_files_between_commits(project_id_str, last_sha, new_sha, access_token)
+    )
+    if paths_to_review is not None:
+        structured_changes = {path: data for path, data in structured_changes.items() if path in paths_to_review}
+        if not structured_changes:
+            logger.info("GitLab (详细审查): 本次推送未触及 MR 中的任何文件，沿用上次的审查结果。")
+            _save_review_results_and_log(
+                vcs_type='gitlab', identifier=project_id_str, pr_mr_id=str(mr_iid),
+                commit_sha=head_sha_payload or position_info.get("head_sha"),
+                review_json_string=json.dumps(carried_reviews, ensure_ascii=False),
+                project_name_for_gitlab=project_name_from_payload
+            )
+            mark_commit_as_processed('gitlab', project_id_str, str(mr_iid), head_sha_payload or position_info.get("head_sha"))
+            return
+
+    # 用变更所在的函数/类作用域替换 diff 中有限的上下文行
+    attach_scope_context(structured_changes, make_gitlab_head_blob_resolver(
+        project_id_str, access_token, position_info.get("head_sha") or head_sha_payload))
+
     current_model = app_configs.get("OPENAI_MODEL", "gpt-4o") if not app_configs.get("USE_QIANWEN", False) else app_configs.get("QIANWEN_MODEL", "qwen-plus")
     logger.info(f'GitLab (详细审查): 正在发送变更给 {current_model} 进行审查...')
-    review_result_json = get_code_review_service()(structured_changes)
+    checkpoint = ReviewCheckpoint('gitlab', project_id_str, str(mr_iid), head_sha_payload or position_info.get("head_sha"))
+    report_job_state(cancel_token, JOB_STATE_REVIEWING, files_total=len(structured_changes))
+    review_result_json = get_code_review_service()(structured_changes, cancel_token=cancel_token, checkpoint=checkpoint)
+    if cancel_token and cancel_token.is_cancelled():
+        logger.info(f"GitLab (详细审查): MR {project_id_str}#{mr_iid} 的审查已取消 (有更新的提交或进程正在关闭)，丢弃对 {head_sha_payload} 的审查结果。")
+        return
+    report_job_state(cancel_token, JOB_STATE_POSTING)
 
     logger.info("--- GitLab (详细审查): AI 代码审查结果 (JSON) ---")
     logger.info(f"{review_result_json}")
@@ -290,15 +405,6 @@ def _process_gitlab_detailed_payload(access_token, project_id_str, mr_iid, head_
         current_commit_sha_for_saving = position_info.get("head_sha")
         logger.info(f"GitLab (详细审查): 使用来自 position_info 的 head_sha ({current_commit_sha_for_saving}) 进行后续操作。")
     
-    _save_review_results_and_log(
-        vcs_type='gitlab',
-        identifier=project_id_str,
-        pr_mr_id=str(mr_iid),
-        commit_sha=current_commit_sha_for_saving,
-        review_json_string=review_result_json,
-        project_name_for_gitlab=project_name_from_payload
-    )
-
     reviews = []
     try:
         parsed_data = json.loads(review_result_json)
@@ -307,25 +413,46 @@ def _process_gitlab_detailed_payload(access_token, project_id_str, mr_iid, head_
     except json.JSONDecodeError as e:
         logger.error(f"GitLab (详细审查): 解析审查结果 JSON 时出错: {e}。原始数据: {review_result_json[:500]}")
 
-    if reviews:
-        logger.info(f"GitLab (详细审查): 尝试向 MR 添加 {len(reviews)} 条审查评论...")
-        comments_added, comments_failed = 0, 0
+    review_json_for_saving = review_result_json
+    if carried_reviews:
+        review_json_for_saving = json.dumps(reviews + carried_reviews, ensure_ascii=False, indent=2)
+    _save_review_results_and_log(
+        vcs_type='gitlab',
+        identifier=project_id_str,
+        pr_mr_id=str(mr_iid),
+        commit_sha=current_commit_sha_for_saving,
+        review_json_string=review_json_for_saving,
+        project_name_for_gitlab=project_name_from_payload
+    )
+
+    if reviews and checkpoint.is_posted():
+        logger.info("GitLab (详细审查): 检查点显示审查意见已批量发布，不再重复发布。")
+    elif reviews:
+        valid_reviews = []
         for review in reviews:
-            if isinstance(review, dict) and "file" in review:
-                file_path = review["file"]
-                if file_path in structured_changes:
-                    review["old_path"] = structured_changes[file_path].get("old_path")
-            if isinstance(review, dict):
-                success = add_gitlab_mr_comment(project_id_str, mr_iid, access_token, review, position_info)
-                if success:
-                    comments_added += 1
-                else:
-                    comments_failed += 1
-            else:
-                logger.warning(f"GitLab (详细审查): 跳过无效的审查项: {review}");
-                comments_failed += 1
-        logger.info(f"GitLab (详细审查): 添加评论完成: {comments_added} 成功, {comments_failed} 失败。")
-    else:
+            if not isinstance(review, dict):
+                logger.warning(f"GitLab (详细审查): 跳过无效的审查项: {review}")
+                continue
+            file_path = review.get("file")
+            if file_path in structured_changes:
+                review["old_path"] = structured_changes[file_path].get("old_path")
+            valid_reviews.append(review)
+        logger.info(f"GitLab (详细审查): 正在以草稿评论批量发布 {len(valid_reviews)} 条审查意见...")
+        fingerprint_index = CommentFingerprintIndex(
+            'gitlab', project_id_str, str(mr_iid),
+            seed_loader=lambda: list_gitlab_mr_note_bodies(project_id_str, mr_iid, access_token)
+        )
+        comments_added, comments_failed = post_gitlab_mr_review_batch(
+            project_id_str, mr_iid, access_token, valid_reviews, position_info,
+            summary_text=f"**AI Code Review**: 共发现 {len(valid_reviews)} 条审查意见。",
+            fingerprint_index=fingerprint_index,
+            line_content_map=build_line_content_map(structured_changes),
+            line_anchors=collect_line_anchors(structured_changes)
+        )
+        comments_failed += len(reviews) - len(valid_reviews)
+        logger.info(f"GitLab (详细审查): 批量评论发布完成: {comments_added} 成功, {comments_failed} 失败。")
+        checkpoint.mark_posted()
+    elif not carried_reviews:
         _post_no_issues_comment(
             vcs_type='gitlab',
             comment_function=add_gitlab_mr_comment,
@@ -362,6 +489,83 @@ def _process_gitlab_detailed_payload(access_token, project_id_str, mr_iid, head_
 
     final_comment_text = get_final_summary_comment_text()
     add_gitlab_mr_general_comment(project_id_str, mr_iid, access_token, final_comment_text)
+    checkpoint.flush_failed_files()
+    checkpoint.clear()
+
+
+register_job_handler("gitlab_detailed", _process_gitlab_detailed_payload)
+
+
+def _replay_file_review(vcs_type, identifier, pr_mr_id, head_sha, file_path):
+    """
+    死信队列的重放函数：重新审查详细审查中失败的单个文件，并发布该文件的审查意见。
+    PR/MR 已有更新的提交 (新的提交会触发完整审查) 或文件已不在变更中时不再审查。
+    """
+    latest_head = get_latest_head(f"{vcs_type}_detailed", identifier, pr_mr_id)
+    if latest_head and latest_head != head_sha:
+        logger.info(f"{vcs_type} {identifier}#{pr_mr_id} 已有更新的提交 {latest_head}，跳过对 {head_sha} 中文件 {file_path} 的重新审查。")
+        return True
+    access_token = resolve_access_token(vcs_type, identifier)
+    if not access_token:
+        logger.error(f"错误: 无法重新审查 {vcs_type} {identifier}#{pr_mr_id} 的文件 {file_path}，缺少访问令牌。")
+        return False
+
+    if vcs_type == 'github':
+        owner, repo_name = identifier.split('/', 1)
+        structured_changes = get_github_pr_changes(owner, repo_name, pr_mr_id, access_token, head_sha)
+        position_info = None
+        blob_resolver = make_github_head_blob_resolver(owner, repo_name, access_token, head_sha, pr_mr_id)
+    else:
+        structured_changes, position_info = get_gitlab_mr_changes(identifier, pr_mr_id, access_token, head_sha)
+        position_info = position_info or {}
+        if not position_info.get("head_sha"):
+            position_info["head_sha"] = head_sha
+        blob_resolver = make_gitlab_head_blob_resolver(identifier, access_token, head_sha)
+    if structured_changes is None:
+        return False
+    if file_path not in structured_changes:
+        logger.info(f"文件 {file_path} 已不在 {vcs_type} {identifier}#{pr_mr_id} 的变更中，无需重新审查。")
+        return True
+
+    file_changes = {file_path: structured_changes[file_path]}
+    attach_scope_context(file_changes, blob_resolver)
+    current_model = app_configs.get("OPENAI_MODEL", "gpt-4o") if not app_configs.get("USE_QIANWEN", False) else app_configs.get("QIANWEN_MODEL", "qwen-plus")
+    reviews = get_detailed_review_service()(file_path, file_changes[file_path], get_llm_client()(), current_model)
+    if reviews is None:
+        return False
+    if not reviews:
+        logger.info(f"重新审查 {vcs_type} {identifier}#{pr_mr_id} 的文件 {file_path} 未发现问题。")
+        return True
+    for review in reviews:
+        if "old_path" not in review and file_changes[file_path].get("old_path"):
+            review["old_path"] = file_changes[file_path]["old_path"]
+
+    summary_text = f"**AI Code Review**: 重新审查文件 `{file_path}` 发现 {len(reviews)} 条审查意见。"
+    if vcs_type == 'github':
+        fingerprint_index = CommentFingerprintIndex(
+            'github', identifier, str(pr_mr_id),
+            seed_loader=lambda: list_github_pr_review_comment_bodies(owner, repo_name, pr_mr_id, access_token)
+        )
+        _, comments_failed = post_github_pr_review_batch(
+            owner, repo_name, pr_mr_id, access_token, reviews, head_sha, summary_text=summary_text,
+            fingerprint_index=fingerprint_index, line_content_map=build_line_content_map(file_changes),
+            line_anchors=collect_line_anchors(file_changes)
+        )
+    else:
+        fingerprint_index = CommentFingerprintIndex(
+            'gitlab', identifier, str(pr_mr_id),
+            seed_loader=lambda: list_gitlab_mr_note_bodies(identifier, pr_mr_id, access_token)
+        )
+        _, comments_failed = post_gitlab_mr_review_batch(
+            identifier, pr_mr_id, access_token, reviews, position_info, summary_text=summary_text,
+            fingerprint_index=fingerprint_index, line_content_map=build_line_content_map(file_changes),
+            line_anchors=collect_line_anchors(file_changes)
+        )
+    # 部分意见发布失败时整体视为失败，下次重试时已发布的意见通过指纹跳过
+    return comments_failed == 0
+
+
+register_dead_letter_handler(DEAD_LETTER_FILE_REVIEW, _replay_file_review)
 
 
 @app.route('/gitlab_webhook', methods=['POST'])
@@ -427,21 +631,28 @@ def gitlab_webhook():
         logger.info(f"GitLab (详细审查): MR {project_id_str}#{mr_iid} 的提交 {head_sha_payload} 已处理。跳过。")
         return "提交已处理", 200
 
-    # 调用提取出来的核心处理逻辑函数 (异步执行)
-    future = executor.submit(
-        _process_gitlab_detailed_payload,
-        access_token=access_token,
+    admission = evaluate_admission()
+    if admission == ADMISSION_REJECT:
+        return _overloaded_response("GitLab (详细审查)", project_id_str, mr_iid)
+
+    # 提交审查任务 (异步执行)，任务中只保留处理所需的负载字段，不包含访问令牌
+    job_id = submit_review_job(
+        "gitlab_detailed", "gitlab", project_id_str, mr_iid, head_sha_payload,
+        claim_vcs_type='gitlab',
+        defer_seconds=defer_seconds() if admission == ADMISSION_DEFER else 0,
         project_id_str=project_id_str,
         mr_iid=mr_iid,
         head_sha_payload=head_sha_payload,
-        project_data=project_data,
-        mr_attrs=mr_attrs,
+        project_data={"name": project_data.get("name")},
+        mr_attrs={"source_branch": mr_attrs.get("source_branch"), "target_branch": mr_attrs.get("target_branch")},
         project_web_url=project_web_url,
         mr_title=mr_title,
         mr_url=mr_url,
         project_name_from_payload=project_name_from_payload
     )
-    future.add_done_callback(handle_async_task_exception)
+    if job_id is None:
+        logger.info(f"GitLab (详细审查): MR {project_id_str}#{mr_iid} 的提交 {head_sha_payload} 已处理或正在审查。跳过。")
+        return "提交已处理或正在审查", 200
 
     logger.info(f"GitLab (详细审查): MR {project_id_str}#{mr_iid} 的处理任务已提交到后台执行。")
     return jsonify({"message": "GitLab Detailed Webhook processing task accepted."}), 202
@@ -1,7 +1,7 @@
 from flask import request, abort, jsonify
 import json
 import logging
-from api.app_factory import app, executor, handle_async_task_exception # 导入 executor 和回调
+from api.app_factory import app
 from api.core_config import (
     github_repo_configs, gitlab_project_configs, app_configs,
     is_commit_processed, mark_commit_as_processed, remove_processed_commit_entries_for_pr_mr
@@ -10,7 +10,7 @@ from api.utils import verify_github_signature, verify_gitlab_signature
 from api.services.vcs_service import (
     get_github_pr_data_for_general_review, add_github_pr_general_comment,
     get_gitlab_mr_data_for_general_review, add_gitlab_mr_general_comment,
-    get_gitlab_mr_changes # 新增导入
+    get_github_changed_files_between_commits, get_gitlab_changed_files_between_commits
 )
 # 从统一服务导入
 from api.services.unified_review_service import (
@@ -19,15 +19,25 @@ from api.services.unified_review_service import (
     get_general_review_service,
     get_llm_client
 )
+from api.services.incremental_review_service import plan_incremental_review
 from api.services.notification_service import send_notifications
 from api.services.common_service import get_final_summary_comment_text
-from .webhook_helpers import _save_review_results_and_log
+from api.services.job_queue_service import github_pr_size_hint, register_job_handler, submit_review_job
+from api.services.review_checkpoint_service import ReviewCheckpoint
+from api.services.job_status_service import (
+    JOB_STATE_POSTING, JOB_STATE_REVIEWING, report_job_progress, report_job_state
+)
+from api.services.admission_control_service import ADMISSION_DEFER, ADMISSION_REJECT, defer_seconds, evaluate_admission
+from .webhook_helpers import _overloaded_response, _save_review_results_and_log
 
 logger = logging.getLogger(__name__)
 
 
-def _process_github_general_payload(access_token, owner, repo_name, pull_number, pr_data, head_sha, repo_full_name, pr_title, pr_html_url, repo_web_url, pr_source_branch, pr_target_branch):
-    """实际处理 GitHub 通用审查的核心逻辑。"""
+def _process_github_general_payload(access_token, owner, repo_name, pull_number, pr_data, head_sha, repo_full_name, pr_title, pr_html_url, repo_web_url, pr_source_branch, pr_target_branch, cancel_token=None):
+    """
+    实际处理 GitHub 通用审查的核心逻辑。cancel_token 已取消时在文件之间提前结束。
+    每个文件的审查意见在评论发布后写入检查点，任务中断后重新执行时不再审查这些文件，也不重复发布评论。
+    """
     logger.info("GitHub (通用审查): 正在获取 PR 数据 (diffs 和文件内容)...")
     file_data_list = get_github_pr_data_for_general_review(owner, repo_name, pull_number, access_token, pr_data)
 
@@ -43,14 +53,43 @@ def _process_github_general_payload(access_token, owner, repo_name, pull_number,
         )
         return
 
+    paths_to_review, carried_reviews = plan_incremental_review(
+        'github_general', repo_full_name, str(pull_number), head_sha,
+        {item.get("file_path"): None for item in file_data_list},
+        lambda last_sha, new_sha: get_github_changed_files_between_commits(owner, repo_name, last_sha, new_sha, access_token)
+    )
+    if paths_to_review is not None:
+        file_data_list = [item for item in file_data_list if item.get("file_path") in paths_to_review]
+        if not file_data_list:
+            logger.info("GitHub (通用审查): 本次推送未触及 PR 中的任何文件，沿用上次的审查结果。")
+            _save_review_results_and_log(
+                vcs_type='github_general', identifier=repo_full_name, pr_mr_id=str(pull_number),
+                commit_sha=head_sha, review_json_string=json.dumps(carried_reviews)
+            )
+            mark_commit_as_processed('github_general', repo_full_name, str(pull_number), head_sha)
+            return
+
     aggregated_general_reviews_for_storage = []
     files_with_issues_details = [] # {file_path: str, issues_text: str}
 
     current_model = app_configs.get("OPENAI_MODEL", "gpt-4o") if not app_configs.get("USE_QIANWEN", False) else app_configs.get("QIANWEN_MODEL", "qwen-plus")
     logger.info(f'GitHub (通用审查): 将对 {len(file_data_list)} 个文件逐一发送给 {current_model} 进行审查...')
-
-    for file_item in file_data_list:
+    checkpoint = ReviewCheckpoint('github_general', repo_full_name, str(pull_number), head_sha)
+    report_job_state(cancel_token, JOB_STATE_REVIEWING, files_total=len(file_data_list))
+
+    for files_done, file_item in enumerate(file_data_list):
+        report_job_progress(cancel_token, files_done)
+        if cancel_token and cancel_token.is_cancelled():
+            logger.info(f"GitHub (通用审查): PR {repo_full_name}#{pull_number} 的审查已取消 (有更新的提交或进程正在关闭)，中止对 {head_sha} 的审查。")
+            return
         current_file_path = file_item.get("file_path", "Unknown File")
+        checkpointed_reviews = checkpoint.get_file_reviews(current_file_path)
+        if checkpointed_reviews is not None:
+            logger.info(f"GitHub (通用审查): 文件 {current_file_path} 已在检查点中完成审查 (评论已发布)，跳过。")
+            for review_wrapper_for_file in checkpointed_reviews:
+                files_with_issues_details.append({"file": current_file_path, "issues": review_wrapper_for_file.get("analysis")})
+                aggregated_general_reviews_for_storage.append(review_wrapper_for_file)
+            continue
         logger.info(f"GitHub (通用审查): 正在对文件 {current_file_path} 进行 LLM 审查...")
         review_text_for_file = get_general_review_service()(file_item) # Pass single file_item
 
@@ -77,12 +116,19 @@ def _process_github_general_payload(access_token, owner, repo_name, pull_number,
                 "suggestion": "请参考上述分析。"
             }
             aggregated_general_reviews_for_storage.append(review_wrapper_for_file)
+            checkpoint.save_file_reviews(current_file_path, [review_wrapper_for_file])
         else:
             logger.info(f"GitHub (通用审查): 文件 {current_file_path} 未发现问题、审查意见为空或指示无问题。")
+            checkpoint.save_file_reviews(current_file_path, [])
 
     # After processing all files
-    if aggregated_general_reviews_for_storage:
-        review_json_string_for_storage = json.dumps(aggregated_general_reviews_for_storage)
+    if cancel_token and cancel_token.is_cancelled():
+        logger.info(f"GitHub (通用审查): PR {repo_full_name}#{pull_number} 的审查已取消 (有更新的提交或进程正在关闭)，不再保存对 {head_sha} 的审查结果。")
+        return
+    report_job_progress(cancel_token, len(file_data_list))
+    report_job_state(cancel_token, JOB_STATE_POSTING)
+    if aggregated_general_reviews_for_storage or carried_reviews:
+        review_json_string_for_storage = json.dumps(aggregated_general_reviews_for_storage + carried_reviews)
         _save_review_results_and_log(
             vcs_type='github_general',
             identifier=repo_full_name,
@@ -128,6 +174,10 @@ def _process_github_general_payload(access_token, owner, repo_name, pull_number,
     # 添加最终总结评论
     final_comment_text = get_final_summary_comment_text()
     add_github_pr_general_comment(owner, repo_name, pull_number, access_token, final_comment_text)
+    checkpoint.clear()
+
+
+register_job_handler("github_general", _process_github_general_payload)
 
 
 @app.route('/github_webhook_general', methods=['POST'])
@@ -199,14 +249,20 @@ def github_webhook_general():
         logger.info(f"GitHub (通用审查): PR {repo_full_name}#{pull_number} 的提交 {head_sha} 已处理。跳过。")
         return "提交已处理", 200
 
-    # 调用提取出来的核心处理逻辑函数 (异步执行)
-    future = executor.submit(
-        _process_github_general_payload,
-        access_token=access_token,
+    admission = evaluate_admission()
+    if admission == ADMISSION_REJECT:
+        return _overloaded_response("GitHub (通用审查)", repo_full_name, pull_number)
+
+    # 提交审查任务 (异步执行)，任务中只保留处理所需的负载字段，不包含访问令牌
+    job_id = submit_review_job(
+        "github_general", "github", repo_full_name, pull_number, head_sha,
+        claim_vcs_type='github_general',
+        defer_seconds=defer_seconds() if admission == ADMISSION_DEFER else 0,
+        size_hint=github_pr_size_hint(pr_data),
         owner=owner,
         repo_name=repo_name,
         pull_number=pull_number,
-        pr_data=pr_data,
+        pr_data={"base": {"sha": pr_data.get('base', {}).get('sha')}, "head": {"sha": head_sha}},
         head_sha=head_sha,
         repo_full_name=repo_full_name,
         pr_title=pr_title,
@@ -215,19 +271,26 @@ def github_webhook_general():
         pr_source_branch=pr_source_branch,
         pr_target_branch=pr_target_branch
     )
-    future.add_done_callback(handle_async_task_exception)
-    
+    if job_id is None:
+        logger.info(f"GitHub (通用审查): PR {repo_full_name}#{pull_number} 的提交 {head_sha} 已处理或正在审查。跳过。")
+        return "提交已处理或正在审查", 200
+
     logger.info(f"GitHub (通用审查): PR {repo_full_name}#{pull_number} 的处理任务已提交到后台执行。")
     return jsonify({"message": "GitHub General Webhook processing task accepted."}), 202
 
 
-def _process_gitlab_general_payload(access_token, project_id_str, mr_iid, mr_attrs, final_position_info, head_sha_payload, current_commit_sha_for_ops, project_name_from_payload, project_web_url, mr_title, mr_url):
-    """实际处理 GitLab 通用审查的核心逻辑。"""
-    logger.info("GitLab (通用审查): 正在获取 MR 数据 (diffs 和文件内容)...")
-    file_data_list = get_gitlab_mr_data_for_general_review(project_id_str, mr_iid, access_token, mr_attrs, final_position_info)
+def _process_gitlab_general_payload(access_token, project_id_str, mr_iid, mr_attrs, position_info, head_sha_payload, project_name_from_payload, project_web_url, mr_title, mr_url, cancel_token=None):
+    """
+    实际处理 GitLab 通用审查的核心逻辑。cancel_token 已取消时在文件之间提前结束。
+    每个文件的审查意见在评论发布后写入检查点，任务中断后重新执行时不再审查这些文件，也不重复发布评论。
+    """
+    logger.info("GitLab (通用审查): 正在获取 MR 数据 (版本、diffs 和文件内容)...")
+    # 版本信息与 diff 在后台一次性获取，position_info 会被原地更新为最新版本的 SHA
+    file_data_list = get_gitlab_mr_data_for_general_review(project_id_str, mr_iid, access_token, mr_attrs, position_info)
+    current_commit_sha_for_ops = position_info.get("head_commit_sha") or head_sha_payload
 
     if file_data_list is None:
-        logger.warning("GitLab (通用审查): 获取 MR 数据失败。中止审查。")
+        logger.warning(f"GitLab (通用审查) MR {project_id_str}#{mr_iid}: 获取 MR 数据失败 (或无法确定 base_sha/head_sha)。中止审查。")
         return
     if not file_data_list:
         logger.info("GitLab (通用审查): 未检测到文件变更或数据。无需审查。")
@@ -238,14 +301,44 @@ def _process_gitlab_general_payload(access_token, project_id_str, mr_iid, mr_att
         )
         return
 
+    paths_to_review, carried_reviews = plan_incremental_review(
+        'gitlab_general', project_id_str, str(mr_iid), current_commit_sha_for_ops,
+        {item.get("file_path"): None for item in file_data_list},
+        lambda last_sha, new_sha: get_gitlab_changed_files_between_commits(project_id_str, last_sha, new_sha, access_token)
+    )
+    if paths_to_review is not None:
+        file_data_list = [item for item in file_data_list if item.get("file_path") in paths_to_review]
+        if not file_data_list:
+            logger.info("GitLab (通用审查): 本次推送未触及 MR 中的任何文件，沿用上次的审查结果。")
+            _save_review_results_and_log(
+                vcs_type='gitlab_general', identifier=project_id_str, pr_mr_id=str(mr_iid),
+                commit_sha=current_commit_sha_for_ops, review_json_string=json.dumps(carried_reviews),
+                project_name_for_gitlab=project_name_from_payload
+            )
+            mark_commit_as_processed('gitlab_general', project_id_str, str(mr_iid), current_commit_sha_for_ops)
+            return
+
     aggregated_general_reviews_for_storage = []
     files_with_issues_details = [] # {file_path: str, issues_text: str}
 
     current_model = app_configs.get("OPENAI_MODEL", "gpt-4o") if not app_configs.get("USE_QIANWEN", False) else app_configs.get("QIANWEN_MODEL", "qwen-plus")
     logger.info(f'GitLab (通用审查): 将对 {len(file_data_list)} 个文件逐一发送给 {current_model} 进行审查...')
-
-    for file_item in file_data_list:
+    checkpoint = ReviewCheckpoint('gitlab_general', project_id_str, str(mr_iid), current_commit_sha_for_ops)
+    report_job_state(cancel_token, JOB_STATE_REVIEWING, files_total=len(file_data_list))
+
+    for files_done, file_item in enumerate(file_data_list):
+        report_job_progress(cancel_token, files_done)
+        if cancel_token and cancel_token.is_cancelled():
+            logger.info(f"GitLab (通用审查): MR {project_id_str}#{mr_iid} 的审查已取消 (有更新的提交或进程正在关闭)，中止对 {current_commit_sha_for_ops} 的审查。")
+            return
         current_file_path = file_item.get("file_path", "Unknown File")
+        checkpointed_reviews = checkpoint.get_file_reviews(current_file_path)
+        if checkpointed_reviews is not None:
+            logger.info(f"GitLab (通用审查): 文件 {current_file_path} 已在检查点中完成审查 (评论已发布)，跳过。")
+            for review_wrapper_for_file in checkpointed_reviews:
+                files_with_issues_details.append({"file": current_file_path, "issues": review_wrapper_for_file.get("analysis")})
+                aggregated_general_reviews_for_storage.append(review_wrapper_for_file)
+            continue
         logger.info(f"GitLab (通用审查): 正在对文件 {current_file_path} 进行 LLM 审查...")
         review_text_for_file = get_general_review_service()(file_item)
 
@@ -272,12 +365,19 @@ def _process_gitlab_general_payload(access_token, project_id_str, mr_iid, mr_att
                 "suggestion": "请参考上述分析。"
             }
             aggregated_general_reviews_for_storage.append(review_wrapper_for_file)
+            checkpoint.save_file_reviews(current_file_path, [review_wrapper_for_file])
         else:
             logger.info(f"GitLab (通用审查): 文件 {current_file_path} 未发现问题、审查意见为空或指示无问题。")
+            checkpoint.save_file_reviews(current_file_path, [])
 
     # After processing all files
-    if aggregated_general_reviews_for_storage:
-        review_json_string_for_storage = json.dumps(aggregated_general_reviews_for_storage)
+    if cancel_token and cancel_token.is_cancelled():
+        logger.info(f"GitLab (通用审查): MR {project_id_str}#{mr_iid} 的审查已取消 (有更新的提交或进程正在关闭)，不再保存对 {current_commit_sha_for_ops} 的审查结果。")
+        return
+    report_job_progress(cancel_token, len(file_data_list))
+    report_job_state(cancel_token, JOB_STATE_POSTING)
+    if aggregated_general_reviews_for_storage or carried_reviews:
+        review_json_string_for_storage = json.dumps(aggregated_general_reviews_for_storage + carried_reviews)
         _save_review_results_and_log(
             vcs_type='gitlab_general',
             identifier=project_id_str,
@@ -326,6 +426,10 @@ def _process_gitlab_general_payload(access_token, project_id_str, mr_iid, mr_att
     # 添加最终总结评论
     final_comment_text = get_final_summary_comment_text()
     add_gitlab_mr_general_comment(project_id_str, mr_iid, access_token, final_comment_text)
+    checkpoint.clear()
+
+
+register_job_handler("gitlab_general", _process_gitlab_general_payload)
 
 
 @app.route('/gitlab_webhook_general', methods=['POST'])
@@ -390,41 +494,36 @@ def gitlab_webhook_general():
         logger.info(f"GitLab (通用审查): MR {project_id_str}#{mr_iid} 的提交 {head_sha_payload} 已处理。跳过。")
         return "提交已处理", 200
 
-    temp_position_info = {
+    # 版本信息 (base/start/head SHA) 在后台任务中与 diff 一起获取，这里只使用负载中的值作为初始值
+    position_info = {
         "base_commit_sha": mr_attrs.get("diff_base_sha") or mr_attrs.get("base_commit_sha"),
         "head_commit_sha": head_sha_payload,
         "start_commit_sha": mr_attrs.get("start_commit_sha")
     }
-    _, version_derived_position_info = get_gitlab_mr_changes(project_id_str, mr_iid, access_token)
-    
-    final_position_info = temp_position_info
-    if version_derived_position_info:
-        final_position_info["base_commit_sha"] = version_derived_position_info.get("base_sha", temp_position_info["base_commit_sha"])
-        final_position_info["head_commit_sha"] = version_derived_position_info.get("head_sha", temp_position_info["head_commit_sha"])
-        final_position_info["latest_version_id"] = version_derived_position_info.get("id")
-
-    if not final_position_info.get("base_commit_sha") or not final_position_info.get("head_commit_sha"):
-         logger.error(f"GitLab (通用审查) MR {project_id_str}#{mr_iid}: 无法确定 base_sha 或 head_sha。中止。")
-         return "无法确定提交SHA", 500
-    
-    current_commit_sha_for_ops = final_position_info.get("head_commit_sha", head_sha_payload)
-
-    # 调用提取出来的核心处理逻辑函数 (异步执行)
-    future = executor.submit(
-        _process_gitlab_general_payload,
-        access_token=access_token,
+
+    admission = evaluate_admission()
+    if admission == ADMISSION_REJECT:
+        return _overloaded_response("GitLab (通用审查)", project_id_str, mr_iid)
+
+    # 提交审查任务 (异步执行)，任务中只保留处理所需的负载字段，不包含访问令牌
+    job_id = submit_review_job(
+        "gitlab_general", "gitlab", project_id_str, mr_iid, head_sha_payload,
+        claim_vcs_type='gitlab_general',
+        defer_seconds=defer_seconds() if admission == ADMISSION_DEFER else 0,
         project_id_str=project_id_str,
         mr_iid=mr_iid,
-        mr_attrs=mr_attrs,
-        final_position_info=final_position_info,
+        mr_attrs={"source_branch": mr_attrs.get("source_branch"), "target_branch": mr_attrs.get("target_branch"),
+                  "last_commit": {"id": head_sha_payload}},
+        position_info=position_info,
         head_sha_payload=head_sha_payload,
-        current_commit_sha_for_ops=current_commit_sha_for_ops,
         project_name_from_payload=project_name_from_payload,
         project_web_url=project_web_url,
         mr_title=mr_title,
         mr_url=mr_url
     )
-    future.add_done_callback(handle_async_task_exception)
+    if job_id is None:
+        logger.info(f"GitLab (通用审查): MR {project_id_str}#{mr_iid} 的提交 {head_sha_payload} 已处理或正在审查。跳过。")
+        return "提交已处理或正在审查", 200
 
     logger.info(f"GitLab (通用审查): MR {project_id_str}#{mr_iid} 的处理任务已提交到后台执行。")
     return jsonify({"message": "GitLab General Webhook processing task accepted."}), 202
@@ -0,0 +1,101 @@
+"""
+Webhook 准入控制：根据未完成的审查任务数和当前进程的内存占用 (RSS) 判断服务是否过载，
+避免大规模 rebase 等突发推送使任务队列和内存无限增长。
+
+任一指标达到高水位 (ADMISSION_QUEUE_HIGH_WATERMARK / ADMISSION_MEMORY_HIGH_MB) 时进入过载状态，
+所有指标回落到低水位以下才恢复 (滞回，避免在阈值附近反复切换)。过载期间新的审查请求按 ADMISSION_OVERLOAD_ACTION 处理:
+- defer (默认): 任务延后 ADMISSION_DEFER_SECONDS 秒写入 Redis 延迟队列，不占用进程内存，同一 PR/MR 的后续推送合并为一个任务；
+  过载期间轮询线程不提交延迟队列中的到期任务 (见 job_queue_service.register_dispatch_gate)。Redis 不可用时改为拒绝。
+- reject: 返回 503 和 Retry-After，由调用方稍后重新投递。
+"""
+import logging
+import os
+import threading
+
+import api.core_config as core_config
+from api.core_config import app_configs
+from api.services.job_queue_service import queue_depth, register_dispatch_gate
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ACCEPT = "accept"
+ADMISSION_DEFER = "defer"
+ADMISSION_REJECT = "reject"
+
+_overloaded = False
+_overloaded_lock = threading.Lock()
+
+
+def current_rss_mb():
+    """当前进程的常驻内存 (MB)，无法读取 (非 Linux) 时返回 None。"""
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _watermarks(high_key: str, low_key: str, default_low_ratio: float):
+    """返回 (高水位, 低水位)；高水位为 0 表示不检查，低水位为 0 时按高水位的比例计算。"""
+    high = float(app_configs.get(high_key, 0) or 0)
+    low = float(app_configs.get(low_key, 0) or 0)
+    if high > 0 and (low <= 0 or low > high):
+        low = high * default_low_ratio
+    return high, low
+
+
+def is_overloaded() -> bool:
+    """重新采样队列深度和内存并返回是否处于过载状态。"""
+    global _overloaded
+    queue_high, queue_low = _watermarks("ADMISSION_QUEUE_HIGH_WATERMARK", "ADMISSION_QUEUE_LOW_WATERMARK", 0.5)
+    memory_high, memory_low = _watermarks("ADMISSION_MEMORY_HIGH_MB", "ADMISSION_MEMORY_LOW_MB", 0.8)
+    depth = queue_depth() if queue_high > 0 else None
+    rss_mb = current_rss_mb() if memory_high > 0 else None
+
+    with _overloaded_lock:
+        was_overloaded = _overloaded
+        if not was_overloaded:
+            _overloaded = ((depth is not None and depth >= queue_high) or
+                           (rss_mb is not None and rss_mb >= memory_high))
+        else:
+            _overloaded = not ((depth is None or depth <= queue_low) and
+                               (rss_mb is None or rss_mb <= memory_low))
+        overloaded = _overloaded
+
+    if overloaded != was_overloaded:
+        rss_text = f"{rss_mb:.0f} MB" if rss_mb is not None else "未检查"
+        if overloaded:
+            logger.warning(f"审查服务过载 (未完成任务 {depth if depth is not None else '未检查'}，内存 {rss_text})，"
+                           f"新的审查请求将{'延后执行' if _overload_action() == ADMISSION_DEFER else '被拒绝'}。")
+        else:
+            logger.info(f"审查服务负载已回落 (未完成任务 {depth if depth is not None else '未检查'}，内存 {rss_text})，恢复正常接收。")
+    return overloaded
+
+
+def _overload_action() -> str:
+    action = str(app_configs.get("ADMISSION_OVERLOAD_ACTION", ADMISSION_DEFER)).lower()
+    return ADMISSION_REJECT if action == ADMISSION_REJECT else ADMISSION_DEFER
+
+
+def evaluate_admission() -> str:
+    """
+    webhook 提交审查任务前调用，返回 ADMISSION_ACCEPT (正常提交)、ADMISSION_DEFER (延后提交) 或 ADMISSION_REJECT (返回 503)。
+    """
+    if not is_overloaded():
+        return ADMISSION_ACCEPT
+    if _overload_action() == ADMISSION_DEFER and core_config.redis_client:
+        return ADMISSION_DEFER
+    return ADMISSION_REJECT
+
+
+def defer_seconds() -> int:
+    return max(int(app_configs.get("ADMISSION_DEFER_SECONDS", 60)), 1)
+
+
+def retry_after_seconds() -> int:
+    return max(int(app_configs.get("ADMISSION_RETRY_AFTER_SECONDS", 60)), 1)
+
+
+# 过载期间延迟队列中到期的任务暂不提交
+register_dispatch_gate(lambda: not is_overloaded())
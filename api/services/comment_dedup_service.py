@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import re
+
+from api.core_config import add_comment_fingerprints, get_comment_fingerprints
+
+logger = logging.getLogger(__name__)
+
+# 嵌入在评论正文中的隐藏指纹标记，用于从 VCS 上已有的评论重建索引
+_FINGERPRINT_MARKER_TEMPLATE = "<!-- ai-review-fp:{} -->"
+_FINGERPRINT_MARKER_PATTERN = re.compile(r"<!-- ai-review-fp:([0-9a-f]{8,40}) -->")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def format_fingerprint_marker(fingerprint: str) -> str:
+    return _FINGERPRINT_MARKER_TEMPLATE.format(fingerprint)
+
+
+def extract_fingerprints(text: str) -> set:
+    """从评论正文中提取所有指纹标记 (合并到评审正文中的意见可能有多个)。"""
+    if not text:
+        return set()
+    return set(_FINGERPRINT_MARKER_PATTERN.findall(text))
+
+
+def _normalize_text(text) -> str:
+    return _WHITESPACE_PATTERN.sub(" ", str(text or "")).strip().lower()
+
+
+def _hash_text(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def build_line_content_map(structured_changes: dict) -> dict:
+    """
+    从结构化变更中构建 (path, 'new'|'old', 行号) -> 行内容 的映射，
+    使指纹锚定在行内容上，而不是会随推送漂移的行号上。
+    """
+    line_content_map = {}
+    for path, file_data in (structured_changes or {}).items():
+        for change in file_data.get("changes", []):
+            content = change.get("content")
+            if content is None:
+                continue
+            if change.get("new_line") is not None:
+                line_content_map[(path, "new", change["new_line"])] = content
+            if change.get("old_line") is not None:
+                line_content_map[(path, "old", change["old_line"])] = content
+    return line_content_map
+
+
+def compute_review_fingerprint(review: dict, line_content_map: dict = None) -> str:
+    """按 (文件路径, 锚定行内容哈希, 问题分类, 规范化分析文本哈希) 计算审查意见的指纹。"""
+    file_path = review.get("file") or ""
+    lines_info = review.get("lines") or {}
+    line_content_map = line_content_map or {}
+
+    anchor = "file"
+    for side in ("new", "old"):
+        line_number = lines_info.get(side)
+        if line_number is None:
+            continue
+        content = line_content_map.get((file_path, side, line_number))
+        # 找不到行内容时退化为行号锚定
+        anchor = _hash_text(_normalize_text(content)) if content is not None else f"{side}:{line_number}"
+        break
+
+    parts = [file_path, anchor, _normalize_text(review.get("category")), _hash_text(_normalize_text(review.get("analysis")))]
+    return _hash_text("\x1f".join(parts))[:20]
+
+
+class CommentFingerprintIndex:
+    """
+    单个 PR/MR 已发布的机器人评论指纹索引。
+    指纹集合保存在 Redis 中；首次使用时通过 seed_loader (返回已有评论正文列表的分页列表请求) 初始化一次。
+    """
+
+    def __init__(self, vcs_type: str, identifier: str, pr_mr_id: str, seed_loader=None):
+        self.vcs_type = vcs_type
+        self.identifier = identifier
+        self.pr_mr_id = str(pr_mr_id)
+        self._seed_loader = seed_loader
+        self._fingerprints = None
+
+    def _load(self) -> set:
+        if self._fingerprints is not None:
+            return self._fingerprints
+        fingerprints = get_comment_fingerprints(self.vcs_type, self.identifier, self.pr_mr_id)
+        if fingerprints is None:
+            fingerprints = set()
+            comment_bodies = self._seed_loader() if self._seed_loader else None
+            if comment_bodies is not None:
+                for body in comment_bodies:
+                    fingerprints.update(extract_fingerprints(body))
+                add_comment_fingerprints(self.vcs_type, self.identifier, self.pr_mr_id, fingerprints, mark_seeded=True)
+                logger.info(f"{self.vcs_type} {self.identifier}#{self.pr_mr_id}: 从已有评论中初始化了 {len(fingerprints)} 个评论指纹。")
+        self._fingerprints = fingerprints
+        return fingerprints
+
+    def __contains__(self, fingerprint: str) -> bool:
+        return fingerprint in self._load()
+
+    def filter_new(self, reviews: list, line_content_map: dict = None):
+        """
+        过滤掉已发布过的审查意见 (以及同一批次内的重复意见)。
+        :return: (新的审查意见列表, {id(review): fingerprint}, 跳过的重复数量)
+        """
+        known = self._load()
+        new_reviews = []
+        fingerprints = {}
+        seen = set()
+        duplicate_count = 0
+        for review in reviews:
+            if not isinstance(review, dict):
+                new_reviews.append(review)
+                continue
+            fingerprint = compute_review_fingerprint(review, line_content_map)
+            if fingerprint in known or fingerprint in seen:
+                duplicate_count += 1
+                continue
+            seen.add(fingerprint)
+            fingerprints[id(review)] = fingerprint
+            new_reviews.append(review)
+        if duplicate_count:
+            logger.info(f"{self.vcs_type} {self.identifier}#{self.pr_mr_id}: 跳过 {duplicate_count} 条已发布过的重复审查意见。")
+        return new_reviews, fingerprints, duplicate_count
+
+    def add(self, fingerprints):
+        """记录已成功发布的评论指纹。"""
+        fingerprints = [fp for fp in fingerprints if fp]
+        if not fingerprints:
+            return
+        self._load().update(fingerprints)
+        add_comment_fingerprints(self.vcs_type, self.identifier, self.pr_mr_id, fingerprints)
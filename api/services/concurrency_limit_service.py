@@ -0,0 +1,309 @@
+"""
+跨进程并发上限：按仓库/项目、VCS 主机和 LLM 提供方限制同时进行的审查任务或请求数。
+
+每个 (scope, name) 对应 Redis 中的一个 ZSET 信号量，成员为持有者令牌，分值为最近续约时间 (Redis 服务器时间)。
+获取槽位时先清除租约过期的持有者 (进程崩溃未释放)，再判断数量是否低于上限；持有期间由后台线程定期续约。
+上限默认取 app_configs 中的 *_CONCURRENCY_LIMIT，可通过 /config/concurrency_limits 按名称覆盖 (保存在 Redis 中，
+所有进程在 _LIMITS_CACHE_SECONDS 秒内生效)。Redis 不可用时退化为进程内计数；Redis 出错或等待超时时不再限制，
+以免审查被阻塞。
+
+请求级的上限 (VCS 主机、LLM 提供方) 通过 concurrency_slot 在调用处等待；仓库级的任务上限由审查调度器
+(review_scheduler) 在开始任务之前通过 try_acquire_slot 获取，槽位已满的任务留在队列中，不占用执行线程，也不会超时后直接执行。
+"""
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+
+import api.core_config as core_config
+from api.core_config import app_configs, REDIS_CONCURRENCY_LIMITS_KEY, REDIS_CONCURRENCY_SLOTS_KEY_PREFIX
+
+logger = logging.getLogger(__name__)
+
+SCOPE_REPO = "repo"
+SCOPE_VCS_HOST = "vcs_host"
+SCOPE_LLM_PROVIDER = "llm_provider"
+# scope -> app_configs 中的默认上限
+SCOPE_DEFAULT_CONFIG_KEYS = {
+    SCOPE_REPO: "REPO_CONCURRENCY_LIMIT",
+    SCOPE_VCS_HOST: "VCS_HOST_CONCURRENCY_LIMIT",
+    SCOPE_LLM_PROVIDER: "LLM_PROVIDER_CONCURRENCY_LIMIT",
+}
+# 覆盖整个 scope 默认上限时使用的名称
+DEFAULT_NAME = "*"
+
+# 持有者租约时长；持有期间每 1/3 租约续约一次
+_LEASE_SECONDS = 60
+# 从 Redis 读取的上限覆盖配置的缓存时长
+_LIMITS_CACHE_SECONDS = 5
+_POLL_INTERVAL_MIN_SECONDS = 0.1
+_POLL_INTERVAL_MAX_SECONDS = 1.0
+
+# KEYS[1]: 信号量 ZSET；ARGV[1]: 租约秒数，ARGV[2]: 上限，ARGV[3]: 持有者令牌
+_ACQUIRE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local lease = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - lease)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], now, ARGV[3])
+    redis.call('EXPIRE', KEYS[1], math.ceil(lease * 2))
+    return 1
+end
+return 0
+"""
+
+# KEYS[i] / ARGV[i]: 信号量 ZSET 与其中的持有者令牌；ARGV[#ARGV]: 租约秒数
+_RENEW_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local lease = tonumber(ARGV[#ARGV])
+for i = 1, #KEYS do
+    redis.call('ZADD', KEYS[i], 'XX', now, ARGV[i])
+    redis.call('EXPIRE', KEYS[i], math.ceil(lease * 2))
+end
+return #KEYS
+"""
+
+_limits_cache = {"loaded_at": 0.0, "overrides": {}}
+_limits_cache_lock = threading.Lock()
+
+# 当前进程持有的 Redis 槽位: (key, token)，由续约线程定期续约
+_held_slots = set()
+_held_slots_lock = threading.Lock()
+_renewer_thread = None
+
+# Redis 不可用时的进程内计数
+_local_counts = {}
+_local_condition = threading.Condition()
+
+
+def _slot_key(scope: str, name: str) -> str:
+    return f"{REDIS_CONCURRENCY_SLOTS_KEY_PREFIX}{scope}:{name}"
+
+
+def _load_overrides(force: bool = False) -> dict:
+    """读取 Redis 中的上限覆盖配置 {(scope, name): limit}，带短时缓存。"""
+    with _limits_cache_lock:
+        if not force and time.monotonic() - _limits_cache["loaded_at"] < _LIMITS_CACHE_SECONDS:
+            return _limits_cache["overrides"]
+        overrides = dict(_limits_cache["overrides"])
+        if core_config.redis_client:
+            try:
+                overrides = {}
+                for field_raw, value_raw in core_config.redis_client.hgetall(REDIS_CONCURRENCY_LIMITS_KEY).items():
+                    field = field_raw.decode('utf-8') if isinstance(field_raw, bytes) else field_raw
+                    scope, _, name = field.partition(":")
+                    try:
+                        overrides[(scope, name)] = int(value_raw)
+                    except (TypeError, ValueError):
+                        logger.error(f"并发上限配置 {field} 的值无效: {value_raw!r}")
+            except redis.exceptions.RedisError as e:
+                logger.error(f"从 Redis 读取并发上限配置时出错，沿用缓存: {e}")
+        _limits_cache["overrides"] = overrides
+        _limits_cache["loaded_at"] = time.monotonic()
+        return overrides
+
+
+def get_limit(scope: str, name: str) -> int:
+    """返回 (scope, name) 的并发上限，0 表示不限制。"""
+    overrides = _load_overrides()
+    for key in ((scope, name), (scope, DEFAULT_NAME)):
+        if key in overrides:
+            return max(overrides[key], 0)
+    return max(int(app_configs.get(SCOPE_DEFAULT_CONFIG_KEYS[scope], 0) or 0), 0)
+
+
+def set_limit(scope: str, name: str, limit):
+    """设置 (scope, name) 的上限覆盖；limit 为 None 时删除覆盖，恢复默认值。"""
+    if scope not in SCOPE_DEFAULT_CONFIG_KEYS:
+        raise ValueError(f"未知的并发上限类型: {scope}")
+    field = f"{scope}:{name}"
+    if limit is None:
+        core_config.redis_client.hdel(REDIS_CONCURRENCY_LIMITS_KEY, field)
+    else:
+        core_config.redis_client.hset(REDIS_CONCURRENCY_LIMITS_KEY, field, int(limit))
+    _load_overrides(force=True)
+
+
+def describe_limits() -> dict:
+    """返回默认上限、覆盖配置和当前占用的槽位数，供管理 API 展示。"""
+    overrides = {scope: {} for scope in SCOPE_DEFAULT_CONFIG_KEYS}
+    for (scope, name), limit in _load_overrides(force=True).items():
+        overrides.setdefault(scope, {})[name] = limit
+    in_use = {scope: {} for scope in SCOPE_DEFAULT_CONFIG_KEYS}
+    if core_config.redis_client:
+        try:
+            expired_before = time.time() - _LEASE_SECONDS
+            for key_raw in core_config.redis_client.scan_iter(match=f"{REDIS_CONCURRENCY_SLOTS_KEY_PREFIX}*", count=100):
+                key = key_raw.decode('utf-8') if isinstance(key_raw, bytes) else key_raw
+                scope, _, name = key[len(REDIS_CONCURRENCY_SLOTS_KEY_PREFIX):].partition(":")
+                count = core_config.redis_client.zcount(key, expired_before, "+inf")
+                if count:
+                    in_use.setdefault(scope, {})[name] = count
+        except redis.exceptions.RedisError as e:
+            logger.error(f"读取并发槽位占用时出错: {e}")
+    else:
+        with _local_condition:
+            for (scope, name), count in _local_counts.items():
+                if count:
+                    in_use.setdefault(scope, {})[name] = count
+    return {
+        "defaults": {scope: max(int(app_configs.get(config_key, 0) or 0), 0)
+                     for scope, config_key in SCOPE_DEFAULT_CONFIG_KEYS.items()},
+        "overrides": overrides,
+        "in_use": in_use,
+    }
+
+
+def _renew_held_slots():
+    with _held_slots_lock:
+        held = list(_held_slots)
+    if not held or not core_config.redis_client:
+        return
+    keys = [key for key, _ in held]
+    tokens = [token for _, token in held]
+    core_config.redis_client.eval(_RENEW_SCRIPT, len(keys), *keys, *tokens, _LEASE_SECONDS)
+
+
+def _renewer_loop():
+    while True:
+        time.sleep(_LEASE_SECONDS / 3)
+        try:
+            _renew_held_slots()
+        except redis.exceptions.RedisError as e:
+            logger.error(f"续约并发槽位时 Redis 出错: {e}")
+
+
+def _ensure_renewer():
+    global _renewer_thread
+    with _held_slots_lock:
+        if _renewer_thread is None or not _renewer_thread.is_alive():
+            _renewer_thread = threading.Thread(target=_renewer_loop, name="concurrency-slot-renewer", daemon=True)
+            _renewer_thread.start()
+
+
+def _try_acquire_redis(key: str, limit: int):
+    """尝试获取一次 Redis 槽位，返回持有者令牌，槽位已满时返回 None；Redis 出错时抛出 RedisError。"""
+    token = uuid.uuid4().hex
+    if not core_config.redis_client.eval(_ACQUIRE_SCRIPT, 1, key, _LEASE_SECONDS, limit, token):
+        return None
+    with _held_slots_lock:
+        _held_slots.add((key, token))
+    _ensure_renewer()
+    return token
+
+
+def _acquire_redis(key: str, limit: int, deadline: float):
+    """获取 Redis 槽位，返回持有者令牌；超时或 Redis 出错时返回 None (不限制)。"""
+    interval = _POLL_INTERVAL_MIN_SECONDS
+    while True:
+        try:
+            token = _try_acquire_redis(key, limit)
+            if token is not None:
+                return token
+        except redis.exceptions.RedisError as e:
+            logger.error(f"获取并发槽位 {key} 时 Redis 出错，本次不限制并发: {e}")
+            return None
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+        interval = min(interval * 2, _POLL_INTERVAL_MAX_SECONDS)
+
+
+def _release_redis(key: str, token: str):
+    with _held_slots_lock:
+        _held_slots.discard((key, token))
+    try:
+        core_config.redis_client.zrem(key, token)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"释放并发槽位 {key} 时 Redis 出错 (租约过期后自动释放): {e}")
+
+
+def _try_acquire_local(slot: tuple, limit: int) -> bool:
+    with _local_condition:
+        if _local_counts.get(slot, 0) >= limit:
+            return False
+        _local_counts[slot] = _local_counts.get(slot, 0) + 1
+        return True
+
+
+def _acquire_local(slot: tuple, limit: int, deadline: float) -> bool:
+    with _local_condition:
+        while _local_counts.get(slot, 0) >= limit:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _local_condition.wait(remaining)
+        _local_counts[slot] = _local_counts.get(slot, 0) + 1
+        return True
+
+
+def _release_local(slot: tuple):
+    with _local_condition:
+        _local_counts[slot] = max(_local_counts.get(slot, 0) - 1, 0)
+        _local_condition.notify_all()
+
+
+@contextmanager
+def concurrency_slot(scope: str, name: str):
+    """
+    在 (scope, name) 的并发上限内执行代码块；槽位已满时等待，最多等待 CONCURRENCY_ACQUIRE_TIMEOUT_SECONDS 秒。
+    上限为 0 时不做任何限制。
+    """
+    limit = get_limit(scope, name)
+    if limit <= 0:
+        yield
+        return
+
+    started_at = time.monotonic()
+    deadline = started_at + int(app_configs.get("CONCURRENCY_ACQUIRE_TIMEOUT_SECONDS", 600))
+    if core_config.redis_client:
+        key = _slot_key(scope, name)
+        token = _acquire_redis(key, limit, deadline)
+        acquired = token is not None
+    else:
+        key, token = None, None
+        acquired = _acquire_local((scope, name), limit, deadline)
+
+    waited = time.monotonic() - started_at
+    if not acquired and time.monotonic() >= deadline:
+        logger.warning(f"等待 {scope} {name} 的并发槽位 (上限 {limit}) 超过 {waited:.0f} 秒，不再等待直接执行。")
+    elif waited >= 1:
+        logger.info(f"等待 {scope} {name} 的并发槽位 (上限 {limit}) {waited:.1f} 秒。")
+    try:
+        yield
+    finally:
+        if acquired:
+            if token is not None:
+                _release_redis(key, token)
+            else:
+                _release_local((scope, name))
+
+
+def _release_nothing():
+    pass
+
+
+def try_acquire_slot(scope: str, name: str):
+    """
+    不等待地获取 (scope, name) 的一个槽位：成功时返回释放函数 (调用一次以释放槽位)，槽位已满时返回 None。
+    上限为 0 或 Redis 出错时不限制，返回不占用槽位的释放函数。
+    """
+    limit = get_limit(scope, name)
+    if limit <= 0:
+        return _release_nothing
+    if core_config.redis_client:
+        key = _slot_key(scope, name)
+        try:
+            token = _try_acquire_redis(key, limit)
+        except redis.exceptions.RedisError as e:
+            logger.error(f"获取并发槽位 {key} 时 Redis 出错，本次不限制并发: {e}")
+            return _release_nothing
+        return None if token is None else lambda: _release_redis(key, token)
+    if not _try_acquire_local((scope, name), limit):
+        return None
+    return lambda: _release_local((scope, name))
@@ -0,0 +1,293 @@
+"""
+死信队列：审查流程中失败的单元 (单个文件的 LLM 审查、单条评论的发布、摘要通知) 不再只记录日志后丢弃，
+而是连同错误信息和已失败次数写入 Redis Stream，由后台重试线程按指数退避重新执行
+(第 n 次失败后等待 DEAD_LETTER_RETRY_BASE_SECONDS * 2^(n-1) 秒，最多 DEAD_LETTER_RETRY_MAX_SECONDS 秒)。
+失败 DEAD_LETTER_MAX_ATTEMPTS 次后不再自动重试，条目保留在队列中，可通过 /config/dead_letters 查看、手动重放或清除。
+
+条目只保存重新执行所需的参数，不包含访问令牌和通知 URL，重放时从当前的仓库/项目配置和全局设置中读取。
+各类条目的重放函数由产生失败的模块通过 register_dead_letter_handler 注册，返回 True 表示成功 (或已无需执行)。
+重放过程中再次失败时不会由被调用的函数重复写入，而是由重试线程以新的失败次数重新写入。
+
+待重试的条目按下次重试时间记录在 ZSET 中；重试线程取出到期条目时把时间推后 DEAD_LETTER_REPLAY_LEASE_SECONDS 秒作为租约，
+多个进程同时运行时每个条目只会被一个进程重放，进程在重放期间退出时租约到期后由其他进程重试。
+"""
+import json
+import logging
+import threading
+import time
+
+import redis
+
+import api.core_config as core_config
+from api.core_config import app_configs, REDIS_DEAD_LETTER_STREAM_KEY, REDIS_DEAD_LETTER_SCHEDULE_KEY
+
+logger = logging.getLogger(__name__)
+
+# 条目类型
+DEAD_LETTER_FILE_REVIEW = "file_review"  # 详细审查中单个文件的 LLM 审查
+DEAD_LETTER_GITHUB_COMMENT = "github_comment"  # GitHub PR 行评论
+DEAD_LETTER_GITLAB_COMMENT = "gitlab_comment"  # GitLab MR 行评论
+DEAD_LETTER_GITHUB_REVIEW_BATCH = "github_review_batch"  # GitHub PR 批量评审 (详细审查的全部行评论)
+DEAD_LETTER_GITLAB_DRAFT_PUBLISH = "gitlab_draft_publish"  # GitLab MR 草稿评论的批量发布
+DEAD_LETTER_GITHUB_GENERAL_COMMENT = "github_general_comment"  # GitHub PR 通用评论
+DEAD_LETTER_GITLAB_GENERAL_COMMENT = "gitlab_general_comment"  # GitLab MR 通用评论
+DEAD_LETTER_NOTIFICATION = "notification"  # 企业微信 / 自定义 Webhook 摘要通知
+
+DEAD_LETTER_KINDS = (
+    DEAD_LETTER_FILE_REVIEW, DEAD_LETTER_GITHUB_COMMENT, DEAD_LETTER_GITLAB_COMMENT,
+    DEAD_LETTER_GITHUB_REVIEW_BATCH, DEAD_LETTER_GITLAB_DRAFT_PUBLISH,
+    DEAD_LETTER_GITHUB_GENERAL_COMMENT, DEAD_LETTER_GITLAB_GENERAL_COMMENT, DEAD_LETTER_NOTIFICATION,
+)
+
+# 重试线程的轮询间隔 (秒) 与每次最多重放的条目数
+_RETRY_POLL_INTERVAL_SECONDS = 5.0
+_RETRY_BATCH_SIZE = 10
+# 错误信息的最大保存长度
+_MAX_ERROR_LENGTH = 2000
+
+# 原子地取出一个已到期的条目，并把下次重试时间推后作为租约
+# KEYS[1]: 重试时间 ZSET；ARGV[1]: 条目 ID，ARGV[2]: 当前时间，ARGV[3]: 租约到期时间
+_CLAIM_DUE_ENTRY_SCRIPT = """
+local due_at = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not due_at or tonumber(due_at) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+"""
+
+# 条目类型 -> 重放函数 (以关键字参数接收条目的 params)
+_dead_letter_handlers = {}
+# 当前线程正在重放条目时为 True，此时 record_dead_letter 不写入
+_replay_state = threading.local()
+_retrier_thread = None
+_retrier_stop = threading.Event()
+
+
+def register_dead_letter_handler(kind: str, handler):
+    """注册条目的重放函数。handler(**params) 返回 True 表示成功，返回 False 或抛出异常表示失败。"""
+    _dead_letter_handlers[kind] = handler
+
+
+def retry_delay_seconds(attempt: int) -> int:
+    """第 attempt 次失败后到下次重试的等待秒数。"""
+    base = max(int(app_configs.get("DEAD_LETTER_RETRY_BASE_SECONDS", 60)), 1)
+    maximum = max(int(app_configs.get("DEAD_LETTER_RETRY_MAX_SECONDS", 3600)), base)
+    return min(base * 2 ** max(attempt - 1, 0), maximum)
+
+
+def record_dead_letter(kind: str, params: dict, error, description: str = "", attempt: int = 1,
+                       first_failed_at: float = None):
+    """
+    写入一个失败的单元，返回条目 ID；Redis 不可用或当前正在重放条目时不写入，返回 None。
+    params 必须可以 JSON 序列化，且不应包含访问令牌等敏感信息。
+    """
+    if getattr(_replay_state, "active", False) or not core_config.redis_client:
+        return None
+    now = time.time()
+    max_attempts = int(app_configs.get("DEAD_LETTER_MAX_ATTEMPTS", 5))
+    next_retry_at = now + retry_delay_seconds(attempt) if attempt < max_attempts else None
+    try:
+        entry_id = core_config.redis_client.xadd(REDIS_DEAD_LETTER_STREAM_KEY, {
+            "kind": kind,
+            "params": json.dumps(params, ensure_ascii=False),
+            "error": str(error)[:_MAX_ERROR_LENGTH],
+            "description": description,
+            "attempt": attempt,
+            "first_failed_at": first_failed_at or now,
+            "failed_at": now,
+            "next_retry_at": next_retry_at or "",
+        }, maxlen=int(app_configs.get("DEAD_LETTER_MAX_ENTRIES", 10000)), approximate=True)
+        if next_retry_at is not None:
+            core_config.redis_client.zadd(REDIS_DEAD_LETTER_SCHEDULE_KEY, {entry_id: next_retry_at})
+    except (redis.exceptions.RedisError, TypeError, ValueError) as e:
+        logger.error(f"写入死信队列失败 ({kind} {description}): {e}")
+        return None
+    entry_id = entry_id.decode('utf-8') if isinstance(entry_id, bytes) else entry_id
+    if next_retry_at is not None:
+        logger.warning(f"{description or kind} 第 {attempt} 次执行失败，已写入死信队列 ({entry_id})，"
+                       f"{next_retry_at - now:.0f} 秒后重试。错误: {error}")
+    else:
+        logger.error(f"{description or kind} 已失败 {attempt} 次，不再自动重试 (死信队列条目 {entry_id})。错误: {error}")
+    return entry_id
+
+
+def record_failed_file_review(vcs_type: str, identifier: str, pr_mr_id, head_sha: str, file_path: str, error):
+    """记录详细审查中审查失败 (LLM 调用失败或输出无法解析) 的文件。"""
+    if not head_sha:
+        return None
+    return record_dead_letter(
+        DEAD_LETTER_FILE_REVIEW,
+        {"vcs_type": vcs_type, "identifier": identifier, "pr_mr_id": str(pr_mr_id), "head_sha": head_sha,
+         "file_path": file_path},
+        error, description=f"{vcs_type} {identifier}#{pr_mr_id} @ {head_sha[:8]} 文件 {file_path} 的审查")
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _format_entry(entry_id, raw_fields: dict) -> dict:
+    fields = {_decode(k): _decode(v) for k, v in raw_fields.items()}
+    try:
+        params = json.loads(fields.get("params") or "{}")
+    except json.JSONDecodeError:
+        params = {}
+    next_retry_at = _to_float(fields.get("next_retry_at"))
+    return {
+        "id": _decode(entry_id),
+        "kind": fields.get("kind"),
+        "description": fields.get("description") or None,
+        "params": params,
+        "error": fields.get("error") or None,
+        "attempt": int(fields.get("attempt") or 1),
+        "first_failed_at": _to_float(fields.get("first_failed_at")),
+        "failed_at": _to_float(fields.get("failed_at")),
+        "next_retry_at": next_retry_at,
+        # 已达到最大失败次数，只能手动重放
+        "exhausted": next_retry_at is None,
+    }
+
+
+def _read_entry(entry_id: str):
+    entries = core_config.redis_client.xrange(REDIS_DEAD_LETTER_STREAM_KEY, entry_id, entry_id)
+    return _format_entry(*entries[0]) if entries else None
+
+
+def list_dead_letters(kind: str = None, limit: int = 100) -> dict:
+    """按失败时间倒序返回条目 (可按类型过滤)，以及所有条目按类型的计数。"""
+    result = {"entries": [], "counts": {}, "total": 0}
+    if not core_config.redis_client:
+        return result
+    for entry_id, raw_fields in core_config.redis_client.xrevrange(REDIS_DEAD_LETTER_STREAM_KEY):
+        entry = _format_entry(entry_id, raw_fields)
+        result["total"] += 1
+        result["counts"][entry["kind"]] = result["counts"].get(entry["kind"], 0) + 1
+        if (kind is None or entry["kind"] == kind) and len(result["entries"]) < limit:
+            result["entries"].append(entry)
+    return result
+
+
+def _select_entry_ids(ids=None, kind: str = None) -> list:
+    """ids 不为空时返回其中仍存在的条目，否则返回所有 (或指定类型的) 条目。"""
+    if ids:
+        return [entry_id for entry_id in ids if _read_entry(entry_id) is not None]
+    return [_decode(entry_id) for entry_id, raw_fields in core_config.redis_client.xrange(REDIS_DEAD_LETTER_STREAM_KEY)
+            if kind is None or _decode(raw_fields.get(b"kind", raw_fields.get("kind"))) == kind]
+
+
+def replay_dead_letters(ids=None, kind: str = None) -> int:
+    """
+    把条目 (包括已不再自动重试的) 标记为立即重试，由重试线程在下一次轮询时重放，返回标记的条目数。
+    重放再次失败时失败次数继续累加。
+    """
+    if not core_config.redis_client:
+        return 0
+    entry_ids = _select_entry_ids(ids, kind)
+    if entry_ids:
+        now = time.time()
+        core_config.redis_client.zadd(REDIS_DEAD_LETTER_SCHEDULE_KEY, {entry_id: now for entry_id in entry_ids})
+    logger.info(f"已将 {len(entry_ids)} 个死信队列条目标记为立即重放。")
+    return len(entry_ids)
+
+
+def purge_dead_letters(ids=None, kind: str = None) -> int:
+    """删除条目 (不再重试)，返回删除的条目数。"""
+    if not core_config.redis_client:
+        return 0
+    entry_ids = _select_entry_ids(ids, kind)
+    if entry_ids:
+        pipe = core_config.redis_client.pipeline()
+        pipe.xdel(REDIS_DEAD_LETTER_STREAM_KEY, *entry_ids)
+        pipe.zrem(REDIS_DEAD_LETTER_SCHEDULE_KEY, *entry_ids)
+        pipe.execute()
+    logger.info(f"已从死信队列删除 {len(entry_ids)} 个条目。")
+    return len(entry_ids)
+
+
+def _remove_entry(entry_id: str):
+    pipe = core_config.redis_client.pipeline()
+    pipe.xdel(REDIS_DEAD_LETTER_STREAM_KEY, entry_id)
+    pipe.zrem(REDIS_DEAD_LETTER_SCHEDULE_KEY, entry_id)
+    pipe.execute()
+
+
+def _replay_entry(entry: dict) -> bool:
+    """重放一个条目：成功时删除，失败时删除旧条目并以新的失败次数重新写入。"""
+    handler = _dead_letter_handlers.get(entry["kind"])
+    if handler is None:
+        logger.error(f"死信队列条目 {entry['id']} 的类型 {entry['kind']} 没有注册重放函数，暂不重试。")
+        core_config.redis_client.zrem(REDIS_DEAD_LETTER_SCHEDULE_KEY, entry["id"])
+        return False
+    label = entry["description"] or entry["kind"]
+    logger.info(f"重放死信队列条目 {entry['id']}: {label} (已失败 {entry['attempt']} 次)。")
+    error = "重放未成功 (详见日志)"
+    _replay_state.active = True
+    try:
+        succeeded = bool(handler(**entry["params"]))
+    except Exception as e:
+        logger.exception(f"重放死信队列条目 {entry['id']} ({label}) 时出错:")
+        succeeded, error = False, f"{type(e).__name__}: {e}"
+    finally:
+        _replay_state.active = False
+
+    _remove_entry(entry["id"])
+    if succeeded:
+        logger.info(f"死信队列条目 {entry['id']} ({label}) 重放成功。")
+        return True
+    record_dead_letter(entry["kind"], entry["params"], error, description=entry["description"] or "",
+                       attempt=entry["attempt"] + 1, first_failed_at=entry["first_failed_at"])
+    return False
+
+
+def retry_due_dead_letters(now: float = None) -> int:
+    """重放已到重试时间的条目 (每次最多 _RETRY_BATCH_SIZE 个)，返回重放的条目数。"""
+    if not core_config.redis_client:
+        return 0
+    now = time.time() if now is None else now
+    lease_until = now + int(app_configs.get("DEAD_LETTER_REPLAY_LEASE_SECONDS", 900))
+    replayed = 0
+    for entry_id in core_config.redis_client.zrangebyscore(REDIS_DEAD_LETTER_SCHEDULE_KEY, "-inf", now,
+                                                           start=0, num=_RETRY_BATCH_SIZE):
+        entry_id = _decode(entry_id)
+        if not core_config.redis_client.eval(_CLAIM_DUE_ENTRY_SCRIPT, 1, REDIS_DEAD_LETTER_SCHEDULE_KEY,
+                                             entry_id, now, lease_until):
+            continue  # 已被其他进程取出
+        entry = _read_entry(entry_id)
+        if entry is None:  # 条目已被清除或因超出 DEAD_LETTER_MAX_ENTRIES 被裁剪
+            core_config.redis_client.zrem(REDIS_DEAD_LETTER_SCHEDULE_KEY, entry_id)
+            continue
+        _replay_entry(entry)
+        replayed += 1
+    return replayed
+
+
+def _retrier_loop():
+    while not _retrier_stop.wait(_RETRY_POLL_INTERVAL_SECONDS):
+        try:
+            retry_due_dead_letters()
+        except redis.exceptions.RedisError as e:
+            logger.error(f"重试死信队列条目时 Redis 出错: {e}")
+        except Exception:
+            logger.exception("重试死信队列条目时出错:")
+
+
+def start_dead_letter_retrier():
+    """启动死信队列的重试线程 (可在多个进程中同时运行)。"""
+    global _retrier_thread
+    if _retrier_thread is not None and _retrier_thread.is_alive():
+        return
+    _retrier_stop.clear()
+    _retrier_thread = threading.Thread(target=_retrier_loop, name="dead-letter-retrier", daemon=True)
+    _retrier_thread.start()
+
+
+def stop_dead_letter_retrier():
+    _retrier_stop.set()
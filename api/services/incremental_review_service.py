@@ -0,0 +1,46 @@
+import logging
+from api.core_config import app_configs, get_last_reviewed_commit, get_review_results
+
+logger = logging.getLogger(__name__)
+
+
+def plan_incremental_review(vcs_type: str, identifier: str, pr_mr_id: str, head_sha: str,
+                            current_files: dict, fetch_changed_paths):
+    """
+    为 PR/MR 的新 head commit 规划增量审查。
+
+    :param current_files: 当前 PR/MR diff 中的文件，{new_path: old_path 或 None}。
+    :param fetch_changed_paths: callable(last_reviewed_sha, head_sha)，返回两个 commit 之间变更的路径集合，失败时返回 None。
+    :return: (paths_to_review, carried_forward_reviews)。
+             paths_to_review 为 None 表示需要完整审查；否则只需审查其中的文件，
+             carried_forward_reviews 是上次审查中未被本次推送触及的文件的审查意见，应原样保留。
+    """
+    if not app_configs.get("INCREMENTAL_REVIEW_ENABLED", True) or not head_sha:
+        return None, []
+
+    last_reviewed_sha = get_last_reviewed_commit(vcs_type, identifier, pr_mr_id)
+    if not last_reviewed_sha or last_reviewed_sha == head_sha:
+        return None, []
+
+    previous_reviews = get_review_results(vcs_type, identifier, pr_mr_id, last_reviewed_sha)
+    if not isinstance(previous_reviews, list):
+        logger.info(f"{vcs_type} {identifier}#{pr_mr_id}: 未找到 commit {last_reviewed_sha} 的审查结果，执行完整审查。")
+        return None, []
+
+    changed_paths = fetch_changed_paths(last_reviewed_sha, head_sha)
+    if changed_paths is None:
+        logger.info(f"{vcs_type} {identifier}#{pr_mr_id}: 无法获取 {last_reviewed_sha[:8]}...{head_sha[:8]} 的增量变更，执行完整审查。")
+        return None, []
+
+    paths_to_review = {
+        path for path, old_path in current_files.items()
+        if path in changed_paths or (old_path and old_path in changed_paths)
+    }
+    carried_forward_reviews = [
+        review for review in previous_reviews
+        if isinstance(review, dict) and review.get("file") in current_files and review.get("file") not in paths_to_review
+    ]
+    logger.info(
+        f"{vcs_type} {identifier}#{pr_mr_id}: 增量审查 (自 {last_reviewed_sha[:8]} 起)。"
+        f"{len(paths_to_review)}/{len(current_files)} 个文件需要重新审查，沿用 {len(carried_forward_reviews)} 条先前的审查意见。")
+    return paths_to_review, carried_forward_reviews
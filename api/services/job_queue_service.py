@@ -0,0 +1,601 @@
+"""
+审查任务队列。
+
+JOB_QUEUE_MODE=local (默认) 时任务由进程内的调度器 (按 PR 大小和仓库等级排序，见 review_scheduler) 在线程池中执行；
+JOB_QUEUE_MODE=redis_stream 时任务写入 Redis Stream，由独立的 `python -m api.worker` 进程通过消费组消费，
+进程重启或崩溃不会丢失排队中和执行中的任务，worker 也可以独立于 Web 服务横向扩展。
+任务只包含处理函数需要的精简参数，不包含访问令牌；执行时从仓库/项目配置中读取令牌。
+
+PUSH_DEBOUNCE_SECONDS > 0 时，任务先写入 Redis 延迟队列 (ZSET 记录到期时间 + HASH 记录每个 PR/MR 最新的任务)，
+静默期内的新推送覆盖旧任务并重新计时；由 start_job_poller 启动的轮询线程把到期任务取出后再正式提交。
+
+提交时通过 claim_commit_for_review 原子地认领 (vcs, 仓库, PR, SHA)，执行期间由后台线程续约，结束后释放；
+重复投递或并行投递的 webhook 无法再次认领，每个 commit 在多个副本之间也只会被审查一次。
+
+同一 PR/MR 推送了新的 head SHA 后，旧提交的任务即被取代：尚未开始的任务直接跳过，执行中的任务通过
+cancel_token 在文件之间和发布评论之前检查并提前结束，避免连续推送时多次完整审查同时运行。
+
+进程关闭时 (drain_local_jobs / worker 停止) 不再开始新任务，执行中的任务有 SHUTDOWN_DRAIN_SECONDS 秒的期限；
+超时后通过 cancel_token 中断 (处理函数已把逐文件进度写入审查检查点，见 review_checkpoint_service)，
+任务抛出 JobInterrupted 并交还给队列：local 模式写入 Redis 待恢复列表，由重启后的进程继续；
+redis_stream 模式下消息不确认，由其他 worker 立即接管。
+
+任务的状态、逐文件进度和各阶段时间记录在 job_status_service 中 (/config/jobs)；处理函数通过 cancel_token.job_id 上报进度。
+
+过载时 (见 admission_control_service) webhook 可以把任务延后 (defer_seconds) 写入延迟队列；通过 register_dispatch_gate
+注册的检查返回 False 时，轮询线程暂不提交延迟队列中已到期的任务，任务留在 Redis 中直到负载回落。
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+
+import redis
+
+import api.core_config as core_config
+from api.app_factory import EXECUTOR_MAX_WORKERS, executor, handle_async_task_exception
+from api.services.concurrency_limit_service import SCOPE_REPO, try_acquire_slot
+from api.services.job_status_service import (
+    JOB_STATE_CANCELLED, JOB_STATE_DONE, JOB_STATE_FAILED, JOB_STATE_FETCHING, JOB_STATE_INTERRUPTED, JOB_STATE_SKIPPED,
+    record_job_queued, set_job_state
+)
+from api.services.review_scheduler import ReviewScheduler
+from api.core_config import (
+    app_configs, claim_commit_for_review, renew_commit_claim, release_commit_claim, resolve_access_token,
+    REDIS_JOB_STREAM_KEY, REDIS_LATEST_HEAD_KEY_PREFIX,
+    REDIS_DEBOUNCE_SCHEDULE_KEY, REDIS_DEBOUNCE_PAYLOADS_KEY, REDIS_INTERRUPTED_JOBS_KEY
+)
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_MODE_LOCAL = "local"
+JOB_QUEUE_MODE_REDIS_STREAM = "redis_stream"
+
+# 最新 head SHA 记录的过期时间，与审查结果保持一致
+_LATEST_HEAD_TTL_SECONDS = 60 * 60 * 24 * 7
+
+# 延迟队列与待恢复任务的轮询间隔 (秒)
+_JOB_POLL_INTERVAL_SECONDS = 1.0
+# 中断执行中的任务后，等待其在文件边界保存检查点并退出的秒数
+_INTERRUPT_GRACE_SECONDS = 30
+
+# 原子地取出一个已到期的延迟任务 (多个进程同时轮询时每个任务只会被取出一次)
+# KEYS[1]: 到期时间 ZSET，KEYS[2]: 任务 HASH；ARGV[1]: PR/MR 成员，ARGV[2]: 当前时间
+_CLAIM_DUE_JOB_SCRIPT = """
+local due_at = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not due_at or tonumber(due_at) > tonumber(ARGV[2]) then
+    return false
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+local job = redis.call('HGET', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return job
+"""
+
+# 原子地写入 (覆盖) 延迟任务并重新计时，返回被覆盖的尚未取出的任务 (没有时返回 nil)；
+# 与 _CLAIM_DUE_JOB_SCRIPT 互斥，已被轮询取出并提交的任务不会被当作被覆盖的任务
+# KEYS[1]: 到期时间 ZSET，KEYS[2]: 任务 HASH；ARGV[1]: PR/MR 成员，ARGV[2]: 任务，ARGV[3]: 到期时间
+_REPLACE_DEBOUNCED_JOB_SCRIPT = """
+local previous = redis.call('HGET', KEYS[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return previous
+"""
+
+# 任务类型 -> 处理函数 (由各 webhook 路由模块在导入时注册)
+_job_handlers = {}
+# 是否允许提交延迟队列中到期的任务 (由 admission_control_service 在导入时注册)
+_dispatch_gate = None
+# Redis 不可用时在进程内记录每个 PR/MR 的最新 head SHA
+_latest_heads = {}
+_latest_heads_lock = threading.Lock()
+_job_poller_thread = None
+_local_scheduler = None
+# 当前进程中执行中任务的认领: job_id -> (vcs_type, identifier, pr_mr_id, head_sha, job_id)
+_active_claims = {}
+_active_claims_lock = threading.Lock()
+_claim_renewer_thread = None
+_local_scheduler_lock = threading.Lock()
+# 当前进程调度器中尚未结束的任务: job_id -> job；关闭时超过期限仍未结束的任务由 drain_local_jobs 写入待恢复列表，
+# 其 job_id 记录在 _saved_on_drain 中，任务之后结束时不再重复保存或重试
+_local_jobs = {}
+_saved_on_drain = set()
+_local_jobs_lock = threading.Lock()
+_job_poller_stop = threading.Event()
+# 进程正在关闭: 不再开始新任务 / 执行中的任务应在下一个文件边界中断
+_draining = threading.Event()
+_interrupt_event = threading.Event()
+
+
+class JobInterrupted(Exception):
+    """任务因进程关闭在完成前被中断 (进度已写入检查点)，应交还给队列由其他进程继续。"""
+
+
+def register_job_handler(kind: str, handler):
+    """注册任务处理函数。处理函数以关键字参数接收 access_token、cancel_token 和任务的 params。"""
+    _job_handlers[kind] = handler
+
+
+def register_dispatch_gate(gate):
+    """注册延迟队列的提交检查: gate() 返回 False 时到期的任务暂不提交，留在延迟队列中。"""
+    global _dispatch_gate
+    _dispatch_gate = gate
+
+
+def build_job(kind: str, platform: str, identifier: str, pr_mr_id, head_sha: str, params: dict, size_hint=None,
+              claim_vcs_type: str = None) -> dict:
+    return {
+        "job_id": uuid.uuid4().hex,
+        "kind": kind,
+        "platform": platform,  # github / gitlab，用于查找访问令牌
+        "identifier": str(identifier),
+        "pr_mr_id": str(pr_mr_id),
+        "head_sha": head_sha,
+        "params": params,
+        "size_hint": size_hint,  # PR/MR 变更行数 (未知时为 None)，用于调度
+        "claim_vcs_type": claim_vcs_type,  # 认领和已处理记录使用的 vcs_type (None 表示不认领)
+        "enqueued_at": time.time(),
+    }
+
+
+def _latest_head_key(kind: str, identifier: str, pr_mr_id) -> str:
+    return f"{REDIS_LATEST_HEAD_KEY_PREFIX}{kind}:{identifier}:{str(pr_mr_id)}"
+
+
+def record_latest_head(kind: str, identifier: str, pr_mr_id, head_sha: str):
+    """记录 PR/MR 最新的 head SHA，此前提交的同类任务随之被取代。"""
+    if not head_sha:
+        return
+    key = _latest_head_key(kind, identifier, pr_mr_id)
+    with _latest_heads_lock:
+        _latest_heads[key] = head_sha
+    if core_config.redis_client:
+        try:
+            core_config.redis_client.set(key, head_sha, ex=_LATEST_HEAD_TTL_SECONDS)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"记录 {kind} {identifier}#{pr_mr_id} 的最新 head SHA 时出错: {e}")
+
+
+def get_latest_head(kind: str, identifier: str, pr_mr_id):
+    """读取 PR/MR 最新的 head SHA；没有记录时返回 None。"""
+    key = _latest_head_key(kind, identifier, pr_mr_id)
+    if core_config.redis_client:
+        try:
+            latest = core_config.redis_client.get(key)
+            if latest is not None:
+                return latest.decode('utf-8') if isinstance(latest, bytes) else latest
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"读取 {kind} {identifier}#{pr_mr_id} 的最新 head SHA 时出错，使用进程内记录: {e}")
+    with _latest_heads_lock:
+        return _latest_heads.get(key)
+
+
+class CancellationToken:
+    """
+    审查任务的取消令牌：PR/MR 出现比任务更新的 head SHA 时视为已取消 (一旦取消不再恢复)。
+    进程关闭期间调用 interrupt_running_jobs() 后同样视为已取消，此时 interrupted 为 True。
+    job_id 用于处理函数上报任务进度 (见 job_status_service.report_job_state)。
+    """
+
+    def __init__(self, kind: str, identifier: str, pr_mr_id, head_sha: str, job_id: str = None):
+        self.kind = kind
+        self.identifier = identifier
+        self.pr_mr_id = str(pr_mr_id)
+        self.head_sha = head_sha
+        self.job_id = job_id
+        self._cancelled = False
+        self.interrupted = False
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已因更新的提交被取消 (不再查询最新 head SHA)。"""
+        return self._cancelled
+
+    def is_cancelled(self) -> bool:
+        if _interrupt_event.is_set() and not self._cancelled:
+            if not self.interrupted:
+                logger.info(f"进程正在关闭，中断 {self.kind} {self.identifier}#{self.pr_mr_id} @ "
+                            f"{(self.head_sha or '')[:8]} 的审查，已完成的进度保存在检查点中。")
+            self.interrupted = True
+            return True
+        if self._cancelled or not self.head_sha:
+            return self._cancelled
+        latest_head = get_latest_head(self.kind, self.identifier, self.pr_mr_id)
+        if latest_head and latest_head != self.head_sha:
+            logger.info(f"{self.kind} {self.identifier}#{self.pr_mr_id} 已推送新的提交 {latest_head[:8]}，"
+                        f"取消针对 {self.head_sha[:8]} 的审查。")
+            self._cancelled = True
+        return self._cancelled
+
+
+def _claim_args(job: dict) -> tuple:
+    return job["claim_vcs_type"], job["identifier"], job["pr_mr_id"], job.get("head_sha"), job["job_id"]
+
+
+def _claim_renewer_loop():
+    while True:
+        time.sleep(max(int(app_configs.get("REVIEW_CLAIM_LEASE_SECONDS", 900)) / 3, 1))
+        with _active_claims_lock:
+            claims = list(_active_claims.values())
+        for claim_args in claims:
+            if not renew_commit_claim(*claim_args):
+                logger.warning(f"任务 {claim_args[-1]} 对提交 {claim_args[3]} 的认领已被其他任务持有。")
+
+
+def _track_claim(job: dict):
+    global _claim_renewer_thread
+    with _active_claims_lock:
+        _active_claims[job["job_id"]] = _claim_args(job)
+        if _claim_renewer_thread is None or not _claim_renewer_thread.is_alive():
+            _claim_renewer_thread = threading.Thread(target=_claim_renewer_loop, name="review-claim-renewer", daemon=True)
+            _claim_renewer_thread.start()
+
+
+def _untrack_claim(job: dict):
+    with _active_claims_lock:
+        _active_claims.pop(job["job_id"], None)
+
+
+def _release_claim(job: dict):
+    if job.get("claim_vcs_type"):
+        release_commit_claim(*_claim_args(job))
+
+
+def _execute_review_job(job: dict, handler):
+    job_id = job["job_id"]
+    cancel_token = CancellationToken(job["kind"], job["identifier"], job["pr_mr_id"], job.get("head_sha"), job_id=job_id)
+    if cancel_token.is_cancelled():
+        if cancel_token.interrupted:
+            set_job_state(job_id, JOB_STATE_INTERRUPTED)
+            raise JobInterrupted(f"进程正在关闭，审查任务 {job_id} 未开始执行。")
+        logger.info(f"审查任务 {job_id} 已被更新的提交取代，跳过执行。")
+        set_job_state(job_id, JOB_STATE_SKIPPED, error="已被更新的提交取代")
+        return
+    access_token = resolve_access_token(job["platform"], job["identifier"])
+    if not access_token:
+        logger.error(f"{job['platform']} {job['identifier']} 未配置访问令牌，放弃任务 {job_id}。")
+        set_job_state(job_id, JOB_STATE_FAILED, error="未配置访问令牌")
+        return
+    wait_seconds = time.time() - job.get("enqueued_at", time.time())
+    logger.info(f"开始执行审查任务 {job_id} ({job['kind']} {job['identifier']}#{job['pr_mr_id']} @ "
+                f"{(job.get('head_sha') or '')[:8]})，排队等待 {wait_seconds:.1f} 秒。")
+    set_job_state(job_id, JOB_STATE_FETCHING)
+    try:
+        handler(access_token=access_token, cancel_token=cancel_token, **job["params"])
+    except Exception as e:
+        set_job_state(job_id, JOB_STATE_FAILED, error=f"{type(e).__name__}: {e}")
+        raise
+    if cancel_token.interrupted:
+        set_job_state(job_id, JOB_STATE_INTERRUPTED)
+        raise JobInterrupted(f"进程正在关闭，审查任务 {job_id} 在完成前被中断。")
+    set_job_state(job_id, JOB_STATE_CANCELLED if cancel_token.cancelled else JOB_STATE_DONE)
+
+
+def run_review_job(job: dict):
+    """
+    执行单个审查任务。令牌缺失或任务类型未知时记录错误并放弃 (重试也无法成功)；
+    任务已被同一 PR/MR 更新的提交取代，或提交已处理/正由其他任务审查时直接跳过。
+    进程关闭导致任务未完成时抛出 JobInterrupted (认领已释放，接手的进程可以重新认领)。
+    """
+    handler = _job_handlers.get(job.get("kind"))
+    if handler is None:
+        logger.error(f"未知的审查任务类型 '{job.get('kind')}' (任务 {job.get('job_id')})，已放弃。")
+        set_job_state(job.get("job_id"), JOB_STATE_FAILED, error=f"未知的任务类型: {job.get('kind')}")
+        return
+    if not job.get("claim_vcs_type"):
+        _execute_review_job(job, handler)
+        return
+
+    # 续约提交时的认领 (排队期间租约过期则重新认领)，失败说明已有其他任务在审查或已审查完毕
+    if not renew_commit_claim(*_claim_args(job)):
+        logger.info(f"提交 {job.get('head_sha')} ({job['identifier']}#{job['pr_mr_id']}) 已处理或正由其他任务审查，"
+                    f"跳过任务 {job['job_id']}。")
+        set_job_state(job["job_id"], JOB_STATE_SKIPPED, error="提交已处理或正由其他任务审查")
+        return
+    _track_claim(job)
+    try:
+        _execute_review_job(job, handler)
+    finally:
+        _untrack_claim(job)
+        _release_claim(job)
+
+
+def github_pr_size_hint(pr_data: dict):
+    """GitHub pull_request 负载中的变更行数 (additions + deletions)，缺失时返回 None。"""
+    additions, deletions = pr_data.get("additions"), pr_data.get("deletions")
+    if isinstance(additions, int) and isinstance(deletions, int):
+        return additions + deletions
+    return None
+
+
+def create_scheduler(pool, max_running: int) -> ReviewScheduler:
+    return ReviewScheduler(
+        pool, max_running,
+        reserved_small_slots=int(app_configs.get("SCHEDULER_RESERVED_SMALL_SLOTS", 2)),
+        small_job_max_lines=int(app_configs.get("SCHEDULER_SMALL_JOB_MAX_LINES", 300)),
+        # 仓库并发上限在开始任务之前获取，达到上限的仓库的任务留在队列中，不占用执行线程
+        slot_acquirer=lambda job: try_acquire_slot(SCOPE_REPO, str(job.get("identifier"))),
+    )
+
+
+def _get_local_scheduler() -> ReviewScheduler:
+    global _local_scheduler
+    with _local_scheduler_lock:
+        if _local_scheduler is None:
+            _local_scheduler = create_scheduler(executor, EXECUTOR_MAX_WORKERS)
+        return _local_scheduler
+
+
+def _dispatch_job(job: dict):
+    """
+    正式提交任务。redis_stream 模式下写入 Redis Stream 失败时回退到进程内执行，避免丢失任务。
+    """
+    record_job_queued(job)
+    if app_configs.get("JOB_QUEUE_MODE") == JOB_QUEUE_MODE_REDIS_STREAM:
+        if core_config.redis_client:
+            try:
+                core_config.redis_client.xadd(REDIS_JOB_STREAM_KEY, {"job": json.dumps(job, ensure_ascii=False)})
+                logger.info(f"审查任务 {job['job_id']} ({job['kind']} {job['identifier']}#{job['pr_mr_id']}) 已写入任务队列。")
+                return
+            except (redis.exceptions.RedisError, TypeError) as e:
+                logger.error(f"写入任务队列失败，改为在当前进程中执行任务 {job['job_id']}: {e}")
+        else:
+            logger.warning(f"Redis 客户端不可用，审查任务 {job['job_id']} 将在当前进程中执行。")
+
+    with _local_jobs_lock:
+        _local_jobs[job["job_id"]] = job
+    future = _get_local_scheduler().submit(run_review_job, job)
+    future.add_done_callback(lambda f: _on_local_job_done(job, f))
+
+
+def queue_depth() -> int:
+    """
+    当前未完成的审查任务数。redis_stream 模式为任务流中的消息数 (排队中和执行中，所有 worker 共享)；
+    local 模式为当前进程调度器中排队和执行中的任务数。
+    """
+    if app_configs.get("JOB_QUEUE_MODE") == JOB_QUEUE_MODE_REDIS_STREAM and core_config.redis_client:
+        try:
+            return int(core_config.redis_client.xlen(REDIS_JOB_STREAM_KEY))
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"读取任务队列长度时 Redis 出错，只统计当前进程中的任务: {e}")
+    with _local_scheduler_lock:
+        scheduler = _local_scheduler
+    if scheduler is None:
+        return 0
+    stats = scheduler.stats()
+    return stats["running"] + stats["queued_small"] + stats["queued_large"]
+
+
+def _on_local_job_done(job: dict, future):
+    """
+    进程内任务结束回调：因进程关闭被取消或中断的任务写入待恢复列表；
+    执行失败的任务在 JOB_MAX_DELIVERIES 次以内延迟重试，其他异常照常记录。
+    关闭时已由 drain_local_jobs 写入待恢复列表的任务不再保存或重试。
+    """
+    with _local_jobs_lock:
+        _local_jobs.pop(job["job_id"], None)
+        saved_on_drain = job["job_id"] in _saved_on_drain
+        _saved_on_drain.discard(job["job_id"])
+    if future.cancelled() or isinstance(future.exception(), JobInterrupted):
+        if future.cancelled():
+            set_job_state(job["job_id"], JOB_STATE_INTERRUPTED)
+        if not saved_on_drain:
+            _save_interrupted_job(job)
+        return
+    if future.exception() is not None and not saved_on_drain and _schedule_local_retry(job, future.exception()):
+        return
+    handle_async_task_exception(future)
+
+
+def _schedule_local_retry(job: dict, exception: BaseException) -> bool:
+    """延迟重新提交失败的任务 (已完成文件的审查结果保存在检查点中，重试时不再调用 LLM)。超过重试次数时返回 False。"""
+    attempt = int(job.get("attempt", 1))
+    max_attempts = int(app_configs.get("JOB_MAX_DELIVERIES", 3))
+    if attempt >= max_attempts:
+        logger.error(f"审查任务 {job['job_id']} 已执行 {attempt} 次仍失败，放弃该任务。")
+        return False
+    delay_seconds = int(app_configs.get("JOB_RETRY_DELAY_SECONDS", 30)) * attempt
+    logger.error(f"审查任务 {job['job_id']} 第 {attempt} 次执行失败，{delay_seconds} 秒后重试 (最多 {max_attempts} 次)。",
+                 exc_info=exception)
+    timer = threading.Timer(delay_seconds, _dispatch_job, args=(dict(job, attempt=attempt + 1),))
+    timer.daemon = True
+    timer.start()
+    return True
+
+
+def _save_interrupted_job(job: dict):
+    if not core_config.redis_client:
+        logger.warning(f"Redis 客户端不可用，进程关闭时未完成的审查任务 {job['job_id']} 无法保存，"
+                       f"需等待该 PR/MR 的下一次推送重新触发。")
+        return
+    try:
+        core_config.redis_client.rpush(REDIS_INTERRUPTED_JOBS_KEY, json.dumps(job, ensure_ascii=False))
+        logger.info(f"审查任务 {job['job_id']} ({job['kind']} {job['identifier']}#{job['pr_mr_id']}) 未完成，"
+                    f"已保存到待恢复列表，由重启后的进程继续。")
+    except (redis.exceptions.RedisError, TypeError) as e:
+        logger.error(f"保存未完成的审查任务 {job['job_id']} 时出错: {e}")
+
+
+def resume_interrupted_jobs() -> int:
+    """取出待恢复列表中的任务 (上次关闭时未完成) 重新提交，返回提交的任务数。多个进程同时调用时每个任务只取出一次。"""
+    if not core_config.redis_client or _draining.is_set():
+        return 0
+    resumed = 0
+    while True:
+        raw_job = core_config.redis_client.lpop(REDIS_INTERRUPTED_JOBS_KEY)
+        if raw_job is None:
+            return resumed
+        try:
+            job = json.loads(raw_job)
+        except (TypeError, ValueError):
+            logger.error(f"待恢复列表中的任务无法解析，已丢弃: {raw_job!r}")
+            continue
+        logger.info(f"恢复上次关闭时未完成的审查任务 {job['job_id']} ({job['kind']} {job['identifier']}#{job['pr_mr_id']})。")
+        _dispatch_job(job)
+        resumed += 1
+
+
+def is_draining() -> bool:
+    return _draining.is_set()
+
+
+def interrupt_running_jobs():
+    """要求当前进程中执行中的任务在下一个文件边界保存进度并中断。"""
+    _interrupt_event.set()
+
+
+def drain_local_jobs(drain_seconds: int = None) -> int:
+    """
+    关闭当前进程的任务执行 (Web 进程退出前调用)：不再开始新任务 (尚未开始和之后提交的任务直接写入待恢复列表)，
+    等待执行中的任务最多 drain_seconds 秒 (默认 SHUTDOWN_DRAIN_SECONDS)，超时后中断它们并再等待其保存检查点。
+    中断后仍未结束 (例如正在等待 LLM 响应) 的任务以原 job_id 写入待恢复列表，重启后的进程可以续约其认领并从检查点继续
+    (已完成的文件和已发布的评论不会重复处理)。返回仍未结束的任务数。
+    """
+    _draining.set()
+    stop_job_poller()
+    with _local_scheduler_lock:
+        scheduler = _local_scheduler
+    if scheduler is None:
+        return 0
+    scheduler.drain()
+    if drain_seconds is None:
+        drain_seconds = int(app_configs.get("SHUTDOWN_DRAIN_SECONDS", 60))
+    running = _wait_until_idle(scheduler, drain_seconds)
+    if running:
+        logger.warning(f"{running} 个审查任务未能在 {drain_seconds} 秒内完成，正在中断并保存进度...")
+        interrupt_running_jobs()
+        running = _wait_until_idle(scheduler, _INTERRUPT_GRACE_SECONDS)
+        if running:
+            logger.error(f"{running} 个审查任务在中断后 {_INTERRUPT_GRACE_SECONDS} 秒内仍未结束 (可能正在等待 LLM 响应)，"
+                         f"写入待恢复列表。")
+            _save_unfinished_local_jobs()
+    logger.info("审查任务已全部结束，可以安全退出。" if not running else "停止等待审查任务。")
+    return running
+
+
+def _save_unfinished_local_jobs():
+    with _local_jobs_lock:
+        jobs = list(_local_jobs.values())
+        _local_jobs.clear()
+        _saved_on_drain.update(job["job_id"] for job in jobs)
+    for job in jobs:
+        set_job_state(job["job_id"], JOB_STATE_INTERRUPTED)
+        _save_interrupted_job(job)
+
+
+def _wait_until_idle(scheduler: ReviewScheduler, timeout_seconds: float) -> int:
+    deadline = time.monotonic() + max(timeout_seconds, 0)
+    while True:
+        running = scheduler.stats()["running"]
+        if not running or time.monotonic() >= deadline:
+            return running
+        time.sleep(0.2)
+
+
+def _debounce_member(job: dict) -> str:
+    return f"{job['kind']}:{job['identifier']}:{job['pr_mr_id']}"
+
+
+def _schedule_debounced_job(job: dict, delay_seconds: int) -> bool:
+    """把任务写入延迟队列，覆盖同一 PR/MR 尚未到期的任务并重新计时。Redis 不可用时返回 False。"""
+    if not core_config.redis_client:
+        return False
+    member = _debounce_member(job)
+    try:
+        previous_raw = core_config.redis_client.eval(
+            _REPLACE_DEBOUNCED_JOB_SCRIPT, 2, REDIS_DEBOUNCE_SCHEDULE_KEY, REDIS_DEBOUNCE_PAYLOADS_KEY,
+            member, json.dumps(job, ensure_ascii=False), time.time() + delay_seconds)
+    except (redis.exceptions.RedisError, TypeError) as e:
+        logger.error(f"写入延迟队列失败，立即提交任务 {job['job_id']}: {e}")
+        return False
+    logger.info(f"审查任务 {job['job_id']} ({member}) 将在 {delay_seconds} 秒内无新推送后开始。")
+    if previous_raw:
+        try:
+            # 被覆盖的任务尚未被取出，不会再执行，释放其认领 (例如之后又推送回该提交时仍可审查)
+            previous_job = json.loads(previous_raw)
+            _release_claim(previous_job)
+            set_job_state(previous_job["job_id"], JOB_STATE_SKIPPED, error="防抖期间被更新的推送取代")
+        except (TypeError, ValueError, KeyError):
+            pass
+    return True
+
+
+def submit_review_job(kind: str, platform: str, identifier: str, pr_mr_id, head_sha: str, size_hint=None,
+                      claim_vcs_type: str = None, defer_seconds: int = 0, **params):
+    """
+    提交审查任务，返回 job_id。配置了 PUSH_DEBOUNCE_SECONDS 时先进入延迟队列。
+    :param size_hint: PR/MR 的变更行数，调度器据此决定执行顺序 (小 PR 优先)。
+    :param defer_seconds: 大于 0 时 (服务过载) 任务至少延后该秒数，期间同一 PR/MR 的新推送同样合并为一个任务。
+    :param claim_vcs_type: 指定时先原子地认领该提交 (与 mark_commit_as_processed 使用相同的 vcs_type)；
+                           提交已处理或已被认领时不提交任务并返回 None。
+    """
+    job = build_job(kind, platform, identifier, pr_mr_id, head_sha, params, size_hint=size_hint,
+                    claim_vcs_type=claim_vcs_type)
+    if claim_vcs_type and not claim_commit_for_review(*_claim_args(job)):
+        logger.info(f"{claim_vcs_type} {identifier}#{pr_mr_id} 的提交 {head_sha} 已处理或正在审查，不再提交任务。")
+        return None
+    record_latest_head(kind, identifier, pr_mr_id, head_sha)
+    delay_seconds = max(int(app_configs.get("PUSH_DEBOUNCE_SECONDS", 0) or 0), int(defer_seconds or 0))
+    if delay_seconds > 0 and _schedule_debounced_job(job, delay_seconds):
+        record_job_queued(job)
+        return job["job_id"]
+    _dispatch_job(job)
+    return job["job_id"]
+
+
+def dispatch_due_jobs(now: float = None) -> int:
+    """取出所有已到期的延迟任务并正式提交，返回提交的任务数。提交检查不通过 (服务过载) 时停止提交。"""
+    if not core_config.redis_client:
+        return 0
+    now = time.time() if now is None else now
+    dispatched = 0
+    for member in core_config.redis_client.zrangebyscore(REDIS_DEBOUNCE_SCHEDULE_KEY, "-inf", now):
+        if _dispatch_gate is not None and not _dispatch_gate():
+            break  # 剩余的到期任务留在延迟队列中，负载回落后再提交
+        raw_job = core_config.redis_client.eval(_CLAIM_DUE_JOB_SCRIPT, 2, REDIS_DEBOUNCE_SCHEDULE_KEY,
+                                                REDIS_DEBOUNCE_PAYLOADS_KEY, member, now)
+        if not raw_job:
+            continue  # 已被其他进程取出，或在此期间有新推送重新计时
+        try:
+            job = json.loads(raw_job)
+        except (TypeError, ValueError):
+            logger.error(f"延迟队列中的任务无法解析，已丢弃: {raw_job!r}")
+            continue
+        _dispatch_job(job)
+        dispatched += 1
+    return dispatched
+
+
+def _job_poller_loop():
+    while not _job_poller_stop.wait(_JOB_POLL_INTERVAL_SECONDS):
+        try:
+            dispatch_due_jobs()
+            resume_interrupted_jobs()
+        except redis.exceptions.RedisError as e:
+            logger.error(f"轮询延迟队列/待恢复任务时 Redis 出错: {e}")
+        except Exception:
+            logger.exception("轮询延迟队列/待恢复任务时出错:")
+
+
+def start_job_poller():
+    """
+    启动轮询线程：提交延迟队列中到期的任务 (推送防抖) 和其他进程关闭时留下的未完成任务。
+    可在多个进程中同时运行。启动前先恢复一次未完成的任务。
+    """
+    global _job_poller_thread
+    try:
+        resume_interrupted_jobs()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"恢复未完成的审查任务时 Redis 出错: {e}")
+    if _job_poller_thread is not None and _job_poller_thread.is_alive():
+        return
+    _job_poller_stop.clear()
+    _job_poller_thread = threading.Thread(target=_job_poller_loop, name="job-poller", daemon=True)
+    _job_poller_thread.start()
+    if int(app_configs.get("PUSH_DEBOUNCE_SECONDS", 0) or 0) > 0:
+        logger.info(f"推送防抖已启用 (静默期 {app_configs.get('PUSH_DEBOUNCE_SECONDS')} 秒)。")
+
+
+def stop_job_poller():
+    _job_poller_stop.set()
@@ -0,0 +1,230 @@
+"""
+审查任务状态：记录每个任务的当前状态、逐文件进度、各阶段的开始时间和最近一次错误，保存在 Redis 中，供 /config/jobs 查询。
+
+状态依次为 queued (排队) → fetching (获取变更) → reviewing (逐文件审查，记录已完成/总文件数) → posting (发布评论)
+→ done / failed；未执行的任务为 skipped (提交已处理或已被更新的推送取代)，执行中被更新的提交取代为 cancelled，
+进程关闭时未完成的为 interrupted (等待恢复)。失败重试或恢复时任务重新进入 queued，阶段时间记录最近一次的值。
+
+每个任务对应一个 HASH (JOB_STATUS_TTL_SECONDS 后过期)，另有按提交时间排序的 ZSET 索引，最多保留 JOB_STATUS_MAX_ENTRIES 个任务。
+写入失败只记录日志，不影响任务执行。
+"""
+import logging
+import os
+import socket
+import time
+
+import redis
+
+import api.core_config as core_config
+from api.core_config import app_configs, REDIS_JOB_STATUS_KEY_PREFIX, REDIS_JOB_STATUS_INDEX_KEY
+
+logger = logging.getLogger(__name__)
+
+JOB_STATE_QUEUED = "queued"
+JOB_STATE_FETCHING = "fetching"
+JOB_STATE_REVIEWING = "reviewing"
+JOB_STATE_POSTING = "posting"
+JOB_STATE_DONE = "done"
+JOB_STATE_FAILED = "failed"
+JOB_STATE_SKIPPED = "skipped"
+JOB_STATE_CANCELLED = "cancelled"
+JOB_STATE_INTERRUPTED = "interrupted"
+
+JOB_STATES = (
+    JOB_STATE_QUEUED, JOB_STATE_FETCHING, JOB_STATE_REVIEWING, JOB_STATE_POSTING, JOB_STATE_DONE,
+    JOB_STATE_FAILED, JOB_STATE_SKIPPED, JOB_STATE_CANCELLED, JOB_STATE_INTERRUPTED,
+)
+# 任务已结束 (不会再更新，除非重试/恢复后重新排队) 的状态
+TERMINAL_JOB_STATES = frozenset({
+    JOB_STATE_DONE, JOB_STATE_FAILED, JOB_STATE_SKIPPED, JOB_STATE_CANCELLED, JOB_STATE_INTERRUPTED,
+})
+
+_STAGE_FIELD_PREFIX = "stage:"
+# 错误信息的最大保存长度
+_MAX_ERROR_LENGTH = 2000
+# 执行任务的进程，便于定位卡住的任务
+_WORKER_NAME = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _job_key(job_id: str) -> str:
+    return f"{REDIS_JOB_STATUS_KEY_PREFIX}{job_id}"
+
+
+def _write(job_id: str, fields: dict, index_score: float = None):
+    if not core_config.redis_client or not job_id:
+        return
+    key = _job_key(job_id)
+    try:
+        pipe = core_config.redis_client.pipeline()
+        pipe.hset(key, mapping={field: "" if value is None else value for field, value in fields.items()})
+        pipe.expire(key, int(app_configs.get("JOB_STATUS_TTL_SECONDS", 259200)))
+        if index_score is not None:
+            pipe.zadd(REDIS_JOB_STATUS_INDEX_KEY, {job_id: index_score})
+            pipe.zremrangebyrank(REDIS_JOB_STATUS_INDEX_KEY, 0, -int(app_configs.get("JOB_STATUS_MAX_ENTRIES", 1000)) - 1)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"记录审查任务 {job_id} 的状态时 Redis 出错: {e}")
+
+
+def record_job_queued(job: dict):
+    """任务进入队列 (首次提交、失败重试或恢复) 时调用。"""
+    now = time.time()
+    _write(job["job_id"], {
+        "job_id": job["job_id"],
+        "kind": job.get("kind"),
+        "platform": job.get("platform"),
+        "identifier": job.get("identifier"),
+        "pr_mr_id": job.get("pr_mr_id"),
+        "head_sha": job.get("head_sha"),
+        "size_hint": job.get("size_hint"),
+        "attempt": int(job.get("attempt", 1)),
+        "enqueued_at": job.get("enqueued_at", now),
+        "state": JOB_STATE_QUEUED,
+        "updated_at": now,
+        f"{_STAGE_FIELD_PREFIX}{JOB_STATE_QUEUED}": now,
+    }, index_score=job.get("enqueued_at", now))
+
+
+def set_job_state(job_id: str, state: str, error: str = None, files_total: int = None):
+    """记录任务进入新的阶段。error 不为空时同时记录错误信息；files_total 为需要审查的文件数。"""
+    now = time.time()
+    fields = {"state": state, "updated_at": now, f"{_STAGE_FIELD_PREFIX}{state}": now}
+    if state == JOB_STATE_FETCHING:
+        fields["worker"] = _WORKER_NAME
+    if error:
+        fields["error"] = str(error)[:_MAX_ERROR_LENGTH]
+    if files_total is not None:
+        fields.update({"files_total": int(files_total), "files_done": 0})
+    _write(job_id, fields)
+
+
+def set_job_progress(job_id: str, files_done: int):
+    """记录已审查完成的文件数 (不改变阶段)。"""
+    _write(job_id, {"files_done": int(files_done), "updated_at": time.time()})
+
+
+def report_job_state(cancel_token, state: str, files_total: int = None):
+    """供任务处理函数调用：通过 cancel_token 关联的任务记录阶段。cancel_token 为空 (同步调用) 时不记录。"""
+    job_id = getattr(cancel_token, "job_id", None)
+    if job_id:
+        set_job_state(job_id, state, files_total=files_total)
+
+
+def report_job_progress(cancel_token, files_done: int):
+    """供任务处理函数调用：记录已审查完成的文件数。"""
+    job_id = getattr(cancel_token, "job_id", None)
+    if job_id:
+        set_job_progress(job_id, files_done)
+
+
+def _decode_fields(raw_fields: dict) -> dict:
+    return {(k.decode('utf-8') if isinstance(k, bytes) else k): (v.decode('utf-8') if isinstance(v, bytes) else v)
+            for k, v in raw_fields.items()}
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _format_job(fields: dict, now: float) -> dict:
+    """把 HASH 字段整理为 API 返回的任务信息，并计算各阶段耗时与排队等待时间。"""
+    state = fields.get("state")
+    stage_starts = sorted(
+        ((name[len(_STAGE_FIELD_PREFIX):], _to_float(value)) for name, value in fields.items()
+         if name.startswith(_STAGE_FIELD_PREFIX) and _to_float(value) is not None),
+        key=lambda item: item[1]
+    )
+    # 重试后 queued 的时间晚于上一次执行的阶段，只保留最近一次排队之后的阶段
+    queued_at = dict(stage_starts).get(JOB_STATE_QUEUED)
+    if queued_at is not None:
+        stage_starts = [(name, started_at) for name, started_at in stage_starts if started_at >= queued_at]
+    stages = []
+    for i, (name, started_at) in enumerate(stage_starts):
+        if i + 1 < len(stage_starts):
+            ended_at = stage_starts[i + 1][1]
+        else:
+            ended_at = None if name in TERMINAL_JOB_STATES else now
+        stages.append({
+            "state": name,
+            "started_at": started_at,
+            "duration_seconds": round(ended_at - started_at, 3) if ended_at is not None else None,
+        })
+
+    started_at = dict(stage_starts).get(JOB_STATE_FETCHING)
+    queue_wait_seconds = None
+    if queued_at is not None:
+        queue_wait_seconds = round((started_at if started_at is not None else now) - queued_at, 3)
+    updated_at = _to_float(fields.get("updated_at"))
+    finished_at = stage_starts[-1][1] if stage_starts and state in TERMINAL_JOB_STATES else None
+    stalled_after = int(app_configs.get("JOB_STALLED_SECONDS", 600))
+    return {
+        "job_id": fields.get("job_id"),
+        "kind": fields.get("kind"),
+        "platform": fields.get("platform"),
+        "identifier": fields.get("identifier"),
+        "pr_mr_id": fields.get("pr_mr_id"),
+        "head_sha": fields.get("head_sha") or None,
+        "size_hint": _to_int(fields.get("size_hint")),
+        "attempt": _to_int(fields.get("attempt")) or 1,
+        "state": state,
+        "files_done": _to_int(fields.get("files_done")),
+        "files_total": _to_int(fields.get("files_total")),
+        "error": fields.get("error") or None,
+        "worker": fields.get("worker") or None,
+        "enqueued_at": _to_float(fields.get("enqueued_at")),
+        "updated_at": updated_at,
+        "queue_wait_seconds": queue_wait_seconds,
+        "total_seconds": round((finished_at or now) - queued_at, 3) if queued_at is not None else None,
+        # 未结束且长时间没有任何进展的任务 (可能卡在 LLM/VCS 请求或执行进程已退出)
+        "stalled": (state not in TERMINAL_JOB_STATES and updated_at is not None
+                    and stalled_after > 0 and now - updated_at > stalled_after),
+        "stages": stages,
+    }
+
+
+def get_job(job_id: str):
+    """返回单个任务的状态；任务不存在或已过期时返回 None。"""
+    if not core_config.redis_client:
+        return None
+    fields = _decode_fields(core_config.redis_client.hgetall(_job_key(job_id)))
+    if not fields:
+        return None
+    return _format_job(fields, time.time())
+
+
+def list_jobs(limit: int = 50, state: str = None) -> dict:
+    """
+    按提交时间倒序返回最近的任务 (可按状态过滤)，以及索引中所有任务按状态的计数。
+    已过期的任务从索引中移除。
+    """
+    result = {"jobs": [], "counts": {}}
+    if not core_config.redis_client:
+        return result
+    job_ids = core_config.redis_client.zrevrange(REDIS_JOB_STATUS_INDEX_KEY, 0, -1)
+    pipe = core_config.redis_client.pipeline()
+    for job_id in job_ids:
+        pipe.hgetall(_job_key(job_id.decode('utf-8') if isinstance(job_id, bytes) else job_id))
+    now = time.time()
+    expired = []
+    for job_id, raw_fields in zip(job_ids, pipe.execute() if job_ids else []):
+        fields = _decode_fields(raw_fields)
+        if not fields:
+            expired.append(job_id)
+            continue
+        job_state = fields.get("state")
+        result["counts"][job_state] = result["counts"].get(job_state, 0) + 1
+        if (state is None or job_state == state) and len(result["jobs"]) < limit:
+            result["jobs"].append(_format_job(fields, now))
+    if expired:
+        core_config.redis_client.zrem(REDIS_JOB_STATUS_INDEX_KEY, *expired)
+    return result
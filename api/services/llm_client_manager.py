@@ -2,6 +2,7 @@ import logging
 import re
 from openai import OpenAI, APIError # 导入 APIError
 from api.core_config import app_configs
+from api.services.concurrency_limit_service import SCOPE_LLM_PROVIDER, concurrency_slot
 
 logger = logging.getLogger(__name__)
 
@@ -84,7 +85,8 @@ def execute_llm_chat_completion(client, model_name: str, system_prompt: str, use
         completion_params["response_format"] = {"type": response_format_type}
 
     try:
-        response = client.chat.completions.create(**completion_params)
+        with concurrency_slot(SCOPE_LLM_PROVIDER, "openai"):
+            response = client.chat.completions.create(**completion_params)
         if response and response.choices and len(response.choices) > 0:
             message = response.choices[0].message
             if message and message.content:
@@ -3,6 +3,7 @@ import logging
 from openai import OpenAI # Ensure OpenAI client is available for type hinting if needed
 from api.core_config import app_configs
 from .llm_client_manager import get_openai_client, execute_llm_chat_completion
+from .job_status_service import report_job_progress
 from api.prompt.prompt_loader import get_prompt
 
 logger = logging.getLogger(__name__)
@@ -146,8 +147,12 @@ DETAILED_REVIEW_SYSTEM_PROMPT = """
 """
 
 
-def get_openai_code_review(structured_file_changes):
-    """使用 OpenAI API 对结构化的代码变更进行 review (源自 GitHub 版本，通用性较好)"""
+def get_openai_code_review(structured_file_changes, cancel_token=None, checkpoint=None):
+    """使用 OpenAI API 对结构化的代码变更进行 review (源自 GitHub 版本，通用性较好)
+    cancel_token 已取消时 (PR/MR 推送了新的提交) 不再审查剩余文件；每个文件开始前通过 cancel_token 上报已完成的文件数。
+
+    checkpoint (ReviewCheckpoint) 不为空时，检查点中已完成的文件直接使用保存的结果，每个文件成功解析后立即写入检查点。
+    """
     client = get_openai_client()
     if not client:
         logger.warning("OpenAI 客户端不可用 (未初始化或初始化失败)。跳过审查。")
@@ -159,7 +164,17 @@ def get_openai_code_review(structured_file_changes):
     all_reviews = []
     current_model = app_configs.get("OPENAI_MODEL", "gpt-4o")
 
-    for file_path, file_data in structured_file_changes.items():
+    for files_done, (file_path, file_data) in enumerate(structured_file_changes.items()):
+        report_job_progress(cancel_token, files_done)
+        if cancel_token is not None and cancel_token.is_cancelled():
+            logger.info("审查任务已取消 (有更新的提交或进程正在关闭)，停止审查剩余文件。")
+            break
+        if checkpoint is not None:
+            checkpointed_reviews = checkpoint.get_file_reviews(file_path)
+            if checkpointed_reviews is not None:
+                logger.info(f"文件 {file_path} 已在检查点中完成审查，跳过。")
+                all_reviews.extend(checkpointed_reviews)
+                continue
         input_data = {
             "file_meta": {
                 "path": file_data["path"],
@@ -240,12 +255,20 @@ def get_openai_code_review(structured_file_changes):
                     else:
                         logger.warning(f"警告: 跳过文件 {file_path} 的无效审查项结构: {review}")
                 all_reviews.extend(valid_reviews_for_file)
+                if checkpoint is not None:
+                    checkpoint.save_file_reviews(file_path, valid_reviews_for_file)
 
             except json.JSONDecodeError as json_e:
                 logger.error(f"错误: 解析来自 OpenAI 的文件 {file_path} 的 JSON 响应失败: {json_e}")
                 logger.error(f"LLM 原始输出为: {review_json_str}")
+                if checkpoint is not None:  # 审查完成时仍失败的文件写入死信队列，稍后单独重新审查
+                    checkpoint.mark_file_failed(file_path, f"JSONDecodeError: {json_e}")
         except Exception as e:
             logger.exception(f"从 OpenAI 获取文件 {file_path} 的代码审查时出错:")
+            if checkpoint is not None:
+                checkpoint.mark_file_failed(file_path, f"{type(e).__name__}: {e}")
+
+    report_job_progress(cancel_token, len(structured_file_changes))
 
     try:
         final_json_output = json.dumps(all_reviews, ensure_ascii=False, indent=2)
@@ -260,12 +283,12 @@ def get_openai_code_review(structured_file_changes):
 def get_openai_detailed_review_for_file(file_path: str, file_data: dict, client: OpenAI, model_name: str):
     """
     使用 OpenAI API 对单个文件的结构化代码变更进行详细审查。
-    返回一个 Python 列表，其中包含该文件的审查意见字典。
-    如果文件没有问题或发生错误，则返回空列表。
+    返回一个 Python 列表，其中包含该文件的审查意见字典；文件没有问题时返回空列表。
+    客户端不可用、调用失败或输出无法解析时返回 None，调用方据此区分失败与无问题 (失败的文件不写入检查点，重试时重新审查)。
     """
     if not client:
         logger.warning(f"OpenAI 客户端不可用 (传递给 get_openai_detailed_review_for_file 时)。跳过文件 {file_path} 的审查。")
-        return []
+        return None
     if not file_data:
         logger.info(f"未提供文件 {file_path} 的数据以供详细审查。")
         return []
@@ -284,7 +307,7 @@ def get_openai_detailed_review_for_file(file_path: str, file_data: dict, client:
     except TypeError as te:
         logger.error(f"序列化文件 {file_path} 的输入数据时出错: {te}")
         logger.error(f"有问题的输入结构: {input_data}")
-        return []
+        return None
 
     user_prompt_for_llm = f"\n\n```json\n{input_json_string}\n```\n"
 
@@ -294,7 +317,7 @@ def get_openai_detailed_review_for_file(file_path: str, file_data: dict, client:
         detailed_review_system_prompt = get_prompt('detailed_review')
         if "Error: Prompt" in detailed_review_system_prompt: # Check if prompt loading failed
             logger.error(f"无法加载详细审查的 System Prompt。跳过文件 {file_path}。错误: {detailed_review_system_prompt}")
-            return []
+            return None
 
         review_json_str = execute_llm_chat_completion(
             client,
@@ -329,7 +352,7 @@ def get_openai_detailed_review_for_file(file_path: str, file_data: dict, client:
             else:
                 logger.warning(
                     f"警告: 文件 {file_path} 的 LLM 输出不是 JSON 列表或预期的字典。输出: {review_json_str}")
-                return [] # Not a valid format
+                return None # Not a valid format
 
             valid_reviews = []
             for review in reviews_for_this_file:
@@ -346,7 +369,7 @@ def get_openai_detailed_review_for_file(file_path: str, file_data: dict, client:
         except json.JSONDecodeError as json_e:
             logger.error(f"错误: 解析来自 OpenAI 的文件 {file_path} 的 JSON 响应失败: {json_e}")
             logger.error(f"LLM 原始输出为: {review_json_str}")
-            return []
+            return None
     except Exception as e:
         logger.exception(f"从 OpenAI 获取文件 {file_path} 的详细代码审查时出错:")
-        return []
+        return None
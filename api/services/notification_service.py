@@ -1,34 +1,65 @@
 import requests
 from api.core_config import app_configs
+from api.services.dead_letter_service import DEAD_LETTER_NOTIFICATION, record_dead_letter, register_dead_letter_handler
 import logging
 
 logger = logging.getLogger(__name__)
 
+WECOM_BOT_SERVICE_NAME = "企业微信机器人"
+CUSTOM_WEBHOOK_SERVICE_NAME = "自定义 Webhook"
+# 通知渠道 -> URL 所在的配置项 (死信队列中不保存 URL，重放时读取当前配置)
+_NOTIFICATION_URL_CONFIG_KEYS = {
+    WECOM_BOT_SERVICE_NAME: "WECOM_BOT_WEBHOOK_URL",
+    CUSTOM_WEBHOOK_SERVICE_NAME: "CUSTOM_WEBHOOK_URL",
+}
 
-def _send_notification(url: str, payload: dict, service_name: str):
-    """通用函数，用于发送 POST 请求到指定的 URL"""
+
+def _send_notification(url: str, payload: dict, service_name: str) -> bool:
+    """通用函数，用于发送 POST 请求到指定的 URL。发送失败时写入死信队列稍后重试，返回是否发送成功。"""
     if not url:
         logger.info(f"{service_name} URL 未配置。跳过发送消息。")
-        return
+        return True
 
     headers = {'Content-Type': 'application/json'}
     try:
         response = requests.post(url, json=payload, headers=headers, timeout=15)
         response.raise_for_status()
         # 检查企业微信特定的错误码
-        if service_name == "企业微信机器人" and response.json().get("errcode") != 0:
+        if service_name == WECOM_BOT_SERVICE_NAME and response.json().get("errcode") != 0:
             logger.error(f"发送摘要到 {service_name} 时出错: {response.text}")
+            error = f"errcode: {response.text[:500]}"
         # 对于自定义 webhook，我们假设 2xx 状态码表示成功
-        elif service_name == "自定义 Webhook":
+        elif service_name == CUSTOM_WEBHOOK_SERVICE_NAME:
             logger.info(f"成功发送摘要到 {service_name}。状态码: {response.status_code}")
+            return True
         # 其他情况或企业微信成功
         else:
             logger.info(f"成功发送摘要到 {service_name}。")
+            return True
 
     except requests.exceptions.RequestException as e:
         logger.error(f"发送摘要消息到 {service_name} 时出错: {e}")
+        error = f"{type(e).__name__}: {e}"
     except Exception as e:
         logger.error(f"发送摘要到 {service_name} 时发生意外错误: {e}")
+        error = f"{type(e).__name__}: {e}"
+
+    if service_name in _NOTIFICATION_URL_CONFIG_KEYS:
+        record_dead_letter(DEAD_LETTER_NOTIFICATION, {"service_name": service_name, "payload": payload}, error,
+                           description=f"发送到{service_name}的摘要通知")
+    return False
+
+
+def _replay_notification(service_name: str, payload: dict) -> bool:
+    """死信队列的重放函数：使用当前配置的 URL 重新发送通知，渠道已不再配置时直接丢弃。"""
+    url = app_configs.get(_NOTIFICATION_URL_CONFIG_KEYS.get(service_name, ""))
+    if not url:
+        logger.info(f"{service_name} URL 已不再配置，丢弃待重发的通知。")
+        return True
+    return _send_notification(url, payload, service_name)
+
+
+register_dead_letter_handler(DEAD_LETTER_NOTIFICATION, _replay_notification)
 
 
 def send_notifications(summary_content):
@@ -43,7 +74,7 @@ def send_notifications(summary_content):
                 "content": summary_content
             }
         }
-        _send_notification(wecom_url, wecom_payload, "企业微信机器人")
+        _send_notification(wecom_url, wecom_payload, WECOM_BOT_SERVICE_NAME)
     else:
         logger.info("WECOM_BOT_WEBHOOK_URL 未配置。跳过发送到企业微信。")
 
@@ -53,7 +84,7 @@ def send_notifications(summary_content):
         custom_payload = {
             "content": summary_content  # 将通知内容放在 'content' 参数中
         }
-        _send_notification(custom_webhook_url, custom_payload, "自定义 Webhook")
+        _send_notification(custom_webhook_url, custom_payload, CUSTOM_WEBHOOK_SERVICE_NAME)
     else:
         logger.info("CUSTOM_WEBHOOK_URL 未配置。跳过发送到自定义 Webhook。")
 
@@ -0,0 +1,179 @@
+import fnmatch
+import logging
+import re
+from functools import lru_cache
+
+from api.core_config import github_repo_configs, gitlab_project_configs
+
+logger = logging.getLogger(__name__)
+
+# 默认排除的路径 (锁文件、第三方代码、压缩产物、快照、生成的 protobuf 等)，仓库可通过 use_default_excludes=false 关闭
+DEFAULT_EXCLUDE_PATTERNS = (
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "npm-shrinkwrap.json",
+    "poetry.lock", "Pipfile.lock", "uv.lock", "Cargo.lock", "go.sum", "composer.lock", "Gemfile.lock",
+    "vendor/**", "third_party/**", "node_modules/**",
+    "*.min.js", "*.min.css", "*.map",
+    "__snapshots__/**", "*.snap",
+    "*_pb2.py", "*_pb2_grpc.py", "*.pb.go", "*.pb.cc", "*.pb.h",
+)
+
+# 生成文件标记 (不区分大小写)，只匹配从新文件第 1 行开始的 hunk 中文件头部的注释行
+GENERATED_FILE_MARKER_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"@generated\b",
+    r"\bcode generated\b.*\bdo not edit\b",  # Go: // Code generated ... DO NOT EDIT.
+    r"^<auto-generated",  # C#: // <auto-generated>
+    r"^(?:this|the) (?:file|code) (?:is|was|has been) (?:auto-?|automatically )?generated\b",
+    r"\b(?:auto-?|automatically )generated\b.*\b(?:do not|don't) (?:edit|modify)\b",
+))
+_GENERATED_MARKER_SCAN_LINES = 20
+# 注释行的前缀，去掉后再匹配标记
+_COMMENT_PREFIX_RE = re.compile(r"^\s*(?:#+|//+|/\*+|\*+|--|<!--|;+|%+|\"{3}|'{3})\s*")
+_HUNK_HEADER_RE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+# 超过该长度的行视为压缩/打包产物的行；diff 中新文件一侧超过半数的行都是这样的行时跳过
+_MINIFIED_LINE_LENGTH = 1000
+_MINIFIED_LINE_RATIO = 0.5
+
+
+def _generated_marker_in(line: str):
+    """line 为注释行且包含生成文件标记时返回标记文本。"""
+    prefix = _COMMENT_PREFIX_RE.match(line)
+    if not prefix or not prefix.group(0).strip():
+        return None
+    comment = line[prefix.end():].strip()
+    for pattern in GENERATED_FILE_MARKER_PATTERNS:
+        match = pattern.search(comment)
+        if match:
+            return match.group(0)
+    return None
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """
+    将一个 glob 转换为正则。不含 '/' 的模式 (以及 '**/' 开头的模式) 匹配任意目录下的路径 (类似 .gitignore)，
+    以 '/' 或 '/**' 结尾的模式匹配该目录下的所有文件。
+    """
+    pattern = pattern.strip()
+    if pattern.endswith("/"):
+        pattern += "**"
+    while pattern.startswith("**/"):
+        pattern = pattern[3:]
+    anchored = "/" in pattern.rstrip("*").rstrip("/")
+    pattern = pattern.lstrip("/")
+    regex = fnmatch.translate(pattern)
+    if anchored:
+        return regex
+    return r"(?s:(?:.*/)?)" + regex
+
+
+@lru_cache(maxsize=256)
+def compile_path_matcher(patterns: tuple):
+    """将一组 glob 编译为单个正则；patterns 为空时返回 None。"""
+    regexes = [_glob_to_regex(p) for p in patterns if p and p.strip()]
+    if not regexes:
+        return None
+    return re.compile("|".join(f"(?:{r})" for r in regexes))
+
+
+def detect_generated_content(diff_text: str):
+    """
+    根据 diff 判断文件是否为生成/压缩产物:
+    - 从新文件第 1 行开始的 hunk 中，前若干行里有包含生成文件标记的注释行 (文件头部的 "@generated"、"Code generated ... DO NOT EDIT" 等)；
+    - 新文件一侧 (新增行和上下文行) 超过半数的行长度超过 _MINIFIED_LINE_LENGTH。单个超长行 (如 base64 常量) 不会导致跳过。
+    :return: 跳过原因字符串，不是生成文件时返回 None。
+    """
+    if not diff_text:
+        return None
+    new_lines = long_lines = 0
+    header_lines_left = 0
+    for line in diff_text.splitlines():
+        if line.startswith("@@"):
+            hunk = _HUNK_HEADER_RE.match(line)
+            header_lines_left = _GENERATED_MARKER_SCAN_LINES if hunk and int(hunk.group(1)) <= 1 else 0
+            continue
+        if line.startswith("+++") or line.startswith("---") or line[:1] not in ("+", " "):
+            continue
+        new_lines += 1
+        if len(line) > _MINIFIED_LINE_LENGTH:
+            long_lines += 1
+        if header_lines_left > 0:
+            header_lines_left -= 1
+            marker = _generated_marker_in(line[1:])
+            if marker:
+                return f"文件头部包含生成文件标记 '{marker}'"
+    if long_lines and long_lines > new_lines * _MINIFIED_LINE_RATIO:
+        return f"{long_lines}/{new_lines} 行超过 {_MINIFIED_LINE_LENGTH} 字符 (疑似压缩产物)"
+    return None
+
+
+class PathFilter:
+    """单个仓库/项目的路径过滤规则。"""
+
+    def __init__(self, include_patterns=(), exclude_patterns=(), use_default_excludes: bool = True):
+        self.include_matcher = compile_path_matcher(tuple(include_patterns))
+        excludes = tuple(exclude_patterns)
+        if use_default_excludes:
+            excludes = DEFAULT_EXCLUDE_PATTERNS + excludes
+        self.exclude_matcher = compile_path_matcher(excludes)
+
+    def skip_reason_for_path(self, path: str):
+        """仅根据路径判断是否跳过，返回原因或 None。"""
+        if not path:
+            return None
+        if self.include_matcher is not None and not self.include_matcher.match(path):
+            return "不匹配 include 规则"
+        if self.exclude_matcher is not None and self.exclude_matcher.match(path):
+            return "匹配 exclude 规则"
+        return None
+
+    def skip_reason(self, path: str, diff_text: str = None, old_path: str = None):
+        """
+        判断文件是否应在获取内容和 LLM 审查之前跳过。
+        重命名文件的新旧路径任一被排除即跳过。
+        """
+        reason = self.skip_reason_for_path(path)
+        if reason is None and old_path and old_path != path and self.exclude_matcher is not None \
+                and self.exclude_matcher.match(old_path):
+            reason = "旧路径匹配 exclude 规则"
+        if reason is None:
+            reason = detect_generated_content(diff_text)
+        return reason
+
+
+def _normalize_patterns(value) -> tuple:
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = value.replace("\n", ",").split(",")
+    return tuple(p.strip() for p in value if isinstance(p, str) and p.strip())
+
+
+@lru_cache(maxsize=256)
+def _build_path_filter(include_patterns: tuple, exclude_patterns: tuple, use_default_excludes: bool) -> PathFilter:
+    return PathFilter(include_patterns, exclude_patterns, use_default_excludes)
+
+
+def get_path_filter(vcs_type: str, identifier: str) -> PathFilter:
+    """
+    获取仓库/项目的路径过滤器。规则保存在 github_repo_configs / gitlab_project_configs 条目的
+    include_paths、exclude_paths、use_default_excludes 字段中。
+    """
+    configs = github_repo_configs if vcs_type.startswith("github") else gitlab_project_configs
+    config = configs.get(str(identifier)) or {}
+    return _build_path_filter(
+        _normalize_patterns(config.get("include_paths")),
+        _normalize_patterns(config.get("exclude_paths")),
+        bool(config.get("use_default_excludes", True)),
+    )
+
+
+def normalize_path_filter_config(data: dict) -> dict:
+    """从配置 API 请求体中提取路径过滤字段，只返回请求中出现的字段。"""
+    result = {}
+    if "include_paths" in data:
+        result["include_paths"] = list(_normalize_patterns(data.get("include_paths")))
+    if "exclude_paths" in data:
+        result["exclude_paths"] = list(_normalize_patterns(data.get("exclude_paths")))
+    if "use_default_excludes" in data:
+        value = data.get("use_default_excludes")
+        result["use_default_excludes"] = value if isinstance(value, bool) else str(value).lower() == "true"
+    return result
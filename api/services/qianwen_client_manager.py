@@ -1,6 +1,7 @@
 import logging
 import openai
 from api.core_config import app_configs
+from api.services.concurrency_limit_service import SCOPE_LLM_PROVIDER, concurrency_slot
 
 logger = logging.getLogger(__name__)
 
@@ -99,7 +100,8 @@ def execute_qianwen_chat_completion(client, model_name: str, system_prompt: str,
         completion_params["response_format"] = {"type": "json_object"}
 
     try:
-        response = client.chat.completions.create(**completion_params)
+        with concurrency_slot(SCOPE_LLM_PROVIDER, "qianwen"):
+            response = client.chat.completions.create(**completion_params)
         
         if response and response.choices:
             content = response.choices[0].message.content
@@ -2,12 +2,17 @@ import json
 import logging
 from api.core_config import app_configs
 from .qianwen_client_manager import get_qianwen_client, execute_qianwen_chat_completion
+from .job_status_service import report_job_progress
 from api.prompt.prompt_loader import get_prompt
 
 logger = logging.getLogger(__name__)
 
-def get_qianwen_code_review(structured_file_changes):
-    """使用通义千问 API 对结构化的代码变更进行 review"""
+def get_qianwen_code_review(structured_file_changes, cancel_token=None, checkpoint=None):
+    """使用通义千问 API 对结构化的代码变更进行 review
+    cancel_token 已取消时 (PR/MR 推送了新的提交) 不再审查剩余文件；每个文件开始前通过 cancel_token 上报已完成的文件数。
+
+    checkpoint (ReviewCheckpoint) 不为空时，检查点中已完成的文件直接使用保存的结果，每个文件成功解析后立即写入检查点。
+    """
     client = get_qianwen_client()
     if not client:
         logger.warning("通义千问客户端不可用 (未初始化或初始化失败)。跳过审查。")
@@ -19,7 +24,17 @@ def get_qianwen_code_review(structured_file_changes):
     all_reviews = []
     current_model = app_configs.get("QIANWEN_MODEL", "qwen-turbo")
 
-    for file_path, file_data in structured_file_changes.items():
+    for files_done, (file_path, file_data) in enumerate(structured_file_changes.items()):
+        report_job_progress(cancel_token, files_done)
+        if cancel_token is not None and cancel_token.is_cancelled():
+            logger.info("审查任务已取消 (有更新的提交或进程正在关闭)，停止审查剩余文件。")
+            break
+        if checkpoint is not None:
+            checkpointed_reviews = checkpoint.get_file_reviews(file_path)
+            if checkpointed_reviews is not None:
+                logger.info(f"文件 {file_path} 已在检查点中完成审查，跳过。")
+                all_reviews.extend(checkpointed_reviews)
+                continue
         input_data = {
             "file_meta": {
                 "path": file_data["path"],
@@ -96,12 +111,20 @@ def get_qianwen_code_review(structured_file_changes):
                     else:
                         logger.warning(f"警告: 跳过文件 {file_path} 的无效审查项结构: {review}")
                 all_reviews.extend(valid_reviews_for_file)
+                if checkpoint is not None:
+                    checkpoint.save_file_reviews(file_path, valid_reviews_for_file)
 
             except json.JSONDecodeError as json_e:
                 logger.error(f"错误: 解析来自通义千问的文件 {file_path} 的 JSON 响应失败: {json_e}")
                 logger.error(f"通义千问原始输出为: {review_json_str}")
+                if checkpoint is not None:  # 审查完成时仍失败的文件写入死信队列，稍后单独重新审查
+                    checkpoint.mark_file_failed(file_path, f"JSONDecodeError: {json_e}")
         except Exception as e:
             logger.exception(f"从通义千问获取文件 {file_path} 的代码审查时出错:")
+            if checkpoint is not None:
+                checkpoint.mark_file_failed(file_path, f"{type(e).__name__}: {e}")
+
+    report_job_progress(cancel_token, len(structured_file_changes))
 
     try:
         final_json_output = json.dumps(all_reviews, ensure_ascii=False, indent=2)
@@ -116,12 +139,12 @@ def get_qianwen_code_review(structured_file_changes):
 def get_qianwen_detailed_review_for_file(file_path: str, file_data: dict, client, model_name: str):
     """
     使用通义千问 API 对单个文件的结构化代码变更进行详细审查。
-    返回一个 Python 列表，其中包含该文件的审查意见字典。
-    如果文件没有问题或发生错误，则返回空列表。
+    返回一个 Python 列表，其中包含该文件的审查意见字典；文件没有问题时返回空列表。
+    客户端不可用、调用失败或输出无法解析时返回 None，调用方据此区分失败与无问题 (失败的文件不写入检查点，重试时重新审查)。
     """
     if not client:
         logger.warning(f"通义千问客户端不可用 (传递给 get_qianwen_detailed_review_for_file 时)。跳过文件 {file_path} 的审查。")
-        return []
+        return None
     if not file_data:
         logger.info(f"未提供文件 {file_path} 的数据以供详细审查。")
         return []
@@ -140,7 +163,7 @@ def get_qianwen_detailed_review_for_file(file_path: str, file_data: dict, client
     except TypeError as te:
         logger.error(f"序列化文件 {file_path} 的输入数据时出错: {te}")
         logger.error(f"有问题的输入结构: {input_data}")
-        return []
+        return None
 
     user_prompt_for_llm = f"\n\n```json\n{input_json_string}\n```\n"
 
@@ -150,7 +173,7 @@ def get_qianwen_detailed_review_for_file(file_path: str, file_data: dict, client
         detailed_review_system_prompt = get_prompt('detailed_review')
         if "Error: Prompt" in detailed_review_system_prompt:
             logger.error(f"无法加载详细审查的 System Prompt。跳过文件 {file_path}。错误: {detailed_review_system_prompt}")
-            return []
+            return None
 
         review_json_str = execute_qianwen_chat_completion(
             client,
@@ -185,7 +208,7 @@ def get_qianwen_detailed_review_for_file(file_path: str, file_data: dict, client
             else:
                 logger.warning(
                     f"警告: 文件 {file_path} 的通义千问输出不是 JSON 列表或预期的字典。输出: {review_json_str}")
-                return []
+                return None
 
             valid_reviews = []
             for review in reviews_for_this_file:
@@ -202,7 +225,7 @@ def get_qianwen_detailed_review_for_file(file_path: str, file_data: dict, client
         except json.JSONDecodeError as json_e:
             logger.error(f"错误: 解析来自通义千问的文件 {file_path} 的 JSON 响应失败: {json_e}")
             logger.error(f"通义千问原始输出为: {review_json_str}")
-            return []
+            return None
     except Exception as e:
         logger.exception(f"从通义千问获取文件 {file_path} 的详细代码审查时出错:")
-        return []
\ No newline at end of file
+        return None
\ No newline at end of file
@@ -1,8 +1,8 @@
-import json
 import logging
 from api.core_config import app_configs
 from .qianwen_client_manager import get_qianwen_client, execute_qianwen_chat_completion
 from api.prompt.prompt_loader import get_prompt
+from api.services.review_context_service import build_general_review_prompt
 
 logger = logging.getLogger(__name__)
 
@@ -10,7 +10,7 @@ logger = logging.getLogger(__name__)
 def get_qianwen_code_review_general(file_data: dict):
     """
     使用通义千问 API 对单个文件的代码变更进行粗粒度的审查。
-    接收一个文件数据字典，包含路径、diff、旧内容和新内容。
+    接收一个文件数据字典，包含路径、diff、旧内容和新内容 (可以是 LazyFileContent 惰性句柄)。
     返回一个针对该文件的 Markdown 格式审查意见文本字符串。
     如果文件无问题，则返回空字符串或特定无问题指示。
     """
@@ -23,7 +23,7 @@ def get_qianwen_code_review_general(file_data: dict):
         return ""
 
     try:
-        user_prompt_content_for_llm = json.dumps(file_data, ensure_ascii=False, indent=2)
+        user_prompt_content_for_llm = build_general_review_prompt(file_data)
     except TypeError as te:
         logger.error(f"序列化文件 {file_data.get('file_path', 'N/A')} 的粗粒度审查输入数据时出错: {te}")
         return f"序列化文件 {file_data.get('file_path', 'N/A')} 的粗粒度审查输入数据时出错。"
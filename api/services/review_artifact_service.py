@@ -0,0 +1,164 @@
+"""
+审查素材共享：同一 PR/MR 的同一提交同时配置了详细审查和通用审查 (或任务重试、被其他 worker 接管) 时，
+VCS 的原始响应 (PR diff、文件列表、GitLab MR 版本与版本详情、文件内容) 只获取一次。
+
+素材按 (平台, 仓库, PR/MR, 提交 SHA, 名称) 缓存：先查进程内的 LRU (总大小受 REVIEW_ARTIFACT_MEMORY_MAX_MB 限制)，
+再查 Redis (REVIEW_ARTIFACT_TTL_SECONDS 后过期)，都未命中时才请求 VCS。同一进程内对同一素材的并发请求只有一个会真正获取，
+其余等待其结果。素材以 JSON 保存，每次读取都返回新的副本，调用方可以原地修改。
+解析 (structured_changes / 行位置索引) 在本地进行，不缓存解析结果。
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+import api.core_config as core_config
+from api.core_config import app_configs, REDIS_REVIEW_ARTIFACT_KEY_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# 缓存键 -> (过期时间, 序列化后的素材, 素材的 UTF-8 字节数)，按最近使用排序
+_memory_cache = OrderedDict()
+_memory_cache_bytes = 0
+_memory_cache_lock = threading.Lock()
+
+# 缓存键 -> [锁, 等待者数量]，保证同一进程内同一素材只获取一次
+_fetch_locks = {}
+_fetch_locks_guard = threading.Lock()
+
+
+def _artifact_key(platform: str, identifier: str, pr_mr_id, commit_sha: str, name: str) -> str:
+    return f"{REDIS_REVIEW_ARTIFACT_KEY_PREFIX}{platform}:{identifier}:{str(pr_mr_id)}:{commit_sha}:{name}"
+
+
+def _ttl_seconds() -> int:
+    return int(app_configs.get("REVIEW_ARTIFACT_TTL_SECONDS", 600))
+
+
+def _memory_get(key: str):
+    with _memory_cache_lock:
+        entry = _memory_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, serialized, _ = entry
+        if expires_at <= time.time():
+            _memory_pop(key)
+            return None
+        _memory_cache.move_to_end(key)
+        return serialized
+
+
+def _memory_pop(key: str):
+    """调用方持有 _memory_cache_lock。"""
+    global _memory_cache_bytes
+    entry = _memory_cache.pop(key, None)
+    if entry is not None:
+        _memory_cache_bytes -= entry[2]
+
+
+def _memory_put(key: str, serialized: str, ttl: int):
+    global _memory_cache_bytes
+    max_bytes = int(app_configs.get("REVIEW_ARTIFACT_MEMORY_MAX_MB", 64)) * 1024 * 1024
+    size_bytes = len(serialized.encode('utf-8'))
+    if size_bytes > max_bytes:
+        return
+    with _memory_cache_lock:
+        _memory_pop(key)
+        _memory_cache[key] = (time.time() + ttl, serialized, size_bytes)
+        _memory_cache_bytes += size_bytes
+        while _memory_cache_bytes > max_bytes and _memory_cache:
+            _memory_pop(next(iter(_memory_cache)))
+
+
+def _redis_get(key: str):
+    if not core_config.redis_client:
+        return None
+    try:
+        raw_value = core_config.redis_client.get(key)
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"从 Redis 读取审查素材 {key} 时出错: {e}")
+        return None
+    if raw_value is None:
+        return None
+    return raw_value.decode('utf-8') if isinstance(raw_value, bytes) else raw_value
+
+
+def _redis_put(key: str, serialized: str, ttl: int):
+    if not core_config.redis_client:
+        return
+    try:
+        core_config.redis_client.setex(key, ttl, serialized)
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"将审查素材 {key} 写入 Redis 时出错: {e}")
+
+
+def _acquire_fetch_lock(key: str):
+    with _fetch_locks_guard:
+        entry = _fetch_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    entry[0].acquire()
+    return entry
+
+
+def _release_fetch_lock(key: str, entry):
+    entry[0].release()
+    with _fetch_locks_guard:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _fetch_locks.pop(key, None)
+
+
+def _lookup(key: str):
+    """返回缓存中的序列化素材，Redis 命中时同时写入进程内缓存。"""
+    serialized = _memory_get(key)
+    if serialized is not None:
+        return serialized
+    serialized = _redis_get(key)
+    if serialized is not None:
+        _memory_put(key, serialized, _ttl_seconds())
+    return serialized
+
+
+def get_or_fetch_review_artifact(platform: str, identifier: str, pr_mr_id, commit_sha: str, name: str, fetch,
+                                 cacheable=None):
+    """
+    返回 (platform, identifier, pr_mr_id, commit_sha) 下名为 name 的素材，未缓存时调用 fetch() 获取并缓存。
+    fetch 返回可 JSON 序列化的值，抛出的异常直接传给调用方 (不缓存失败)。
+    cacheable(value) 返回 False 时不缓存 (默认不缓存 None)。commit_sha 为空或 REVIEW_ARTIFACT_TTL_SECONDS 为 0 时不缓存。
+    """
+    ttl = _ttl_seconds()
+    if not commit_sha or ttl <= 0:
+        return fetch()
+    key = _artifact_key(platform, identifier, pr_mr_id, commit_sha, name)
+
+    serialized = _lookup(key)
+    if serialized is None:
+        lock_entry = _acquire_fetch_lock(key)
+        try:
+            serialized = _lookup(key)  # 等待期间可能已由其他线程获取
+            if serialized is None:
+                value = fetch()
+                if not (cacheable(value) if cacheable is not None else value is not None):
+                    return value
+                serialized = json.dumps(value, ensure_ascii=False)
+                _memory_put(key, serialized, ttl)
+                _redis_put(key, serialized, ttl)
+                logger.info(f"已缓存审查素材 {platform} {identifier}#{pr_mr_id} @ {commit_sha[:8]}: {name} "
+                            f"({len(serialized.encode('utf-8'))} 字节)。")
+                return json.loads(serialized)
+        finally:
+            _release_fetch_lock(key, lock_entry)
+
+    logger.info(f"复用已缓存的审查素材 {platform} {identifier}#{pr_mr_id} @ {commit_sha[:8]}: {name}。")
+    return json.loads(serialized)
+
+
+def clear_memory_cache():
+    """清空进程内缓存 (用于测试)。"""
+    global _memory_cache_bytes
+    with _memory_cache_lock:
+        _memory_cache.clear()
+        _memory_cache_bytes = 0
@@ -0,0 +1,95 @@
+"""
+审查检查点：逐文件记录一次审查 (vcs, 仓库, PR/MR, SHA) 的进度，保存在 Redis 中。
+
+每个文件审查完成 (通用审查还包括该文件的评论已发布) 后立即写入该文件解析后的审查意见列表，批量评论发布后写入发布标记；
+审查失败的文件只记录失败原因。任务执行失败重试、或因进程关闭被中断后由其他进程继续时读取检查点：
+已完成的文件不再调用 LLM，只审查剩余的 (包括此前失败的) 文件，已发布的评论不再重复发布。
+审查完成时 (flush_failed_files) 才把最终仍未成功的文件写入死信队列，避免中断或重试后已成功审查的文件再被重放。
+审查完成后删除检查点；未完成的检查点在 REVIEW_CHECKPOINT_TTL_SECONDS 后过期。
+"""
+import json
+import logging
+
+from api.core_config import delete_review_checkpoint, get_review_checkpoint, save_review_checkpoint_field
+from api.services.dead_letter_service import record_failed_file_review
+
+logger = logging.getLogger(__name__)
+
+_FILE_FIELD_PREFIX = "file:"
+_FAILED_FIELD_PREFIX = "failed:"
+_POSTED_FIELD = "posted"
+
+
+class ReviewCheckpoint:
+    """单次审查的检查点。首次访问时从 Redis 读取一次，之后的写入同时更新内存副本。"""
+
+    def __init__(self, vcs_type: str, identifier: str, pr_mr_id, commit_sha: str):
+        self.vcs_type = vcs_type
+        self.identifier = identifier
+        self.pr_mr_id = str(pr_mr_id)
+        self.commit_sha = commit_sha
+        self._fields = None
+
+    def _load(self) -> dict:
+        if self._fields is None:
+            self._fields = get_review_checkpoint(self.vcs_type, self.identifier, self.pr_mr_id, self.commit_sha)
+            completed = sum(1 for field in self._fields if field.startswith(_FILE_FIELD_PREFIX))
+            if completed:
+                logger.info(f"{self.vcs_type} {self.identifier}#{self.pr_mr_id} @ {(self.commit_sha or '')[:8]}: "
+                            f"从检查点恢复，已完成 {completed} 个文件。")
+        return self._fields
+
+    def _save(self, field: str, value):
+        serialized = json.dumps(value, ensure_ascii=False)
+        self._load()[field] = serialized
+        save_review_checkpoint_field(self.vcs_type, self.identifier, self.pr_mr_id, self.commit_sha, field, serialized)
+
+    def get_file_reviews(self, file_path: str):
+        """返回已完成文件的审查结果列表；文件尚未完成时返回 None。"""
+        raw_value = self._load().get(f"{_FILE_FIELD_PREFIX}{file_path}")
+        if raw_value is None:
+            return None
+        try:
+            reviews = json.loads(raw_value)
+        except json.JSONDecodeError:
+            logger.warning(f"检查点中文件 {file_path} 的审查结果无法解析，将重新审查该文件。")
+            return None
+        return reviews if isinstance(reviews, list) else None
+
+    def save_file_reviews(self, file_path: str, reviews: list):
+        self._save(f"{_FILE_FIELD_PREFIX}{file_path}", reviews or [])
+
+    def mark_file_failed(self, file_path: str, error):
+        """记录审查失败 (LLM 调用出错或输出无法解析) 的文件，重新执行时会再次审查该文件。"""
+        self._save(f"{_FAILED_FIELD_PREFIX}{file_path}", str(error))
+
+    def failed_files(self) -> dict:
+        """返回 {文件路径: 失败原因}，不包括之后已审查成功的文件。"""
+        failed = {}
+        for field, raw_value in self._load().items():
+            if not field.startswith(_FAILED_FIELD_PREFIX):
+                continue
+            file_path = field[len(_FAILED_FIELD_PREFIX):]
+            if f"{_FILE_FIELD_PREFIX}{file_path}" in self._fields:
+                continue
+            try:
+                failed[file_path] = json.loads(raw_value)
+            except json.JSONDecodeError:
+                failed[file_path] = raw_value
+        return failed
+
+    def flush_failed_files(self):
+        """审查完成时调用 (在 clear 之前)：把仍未审查成功的文件写入死信队列，由后台单独重新审查。"""
+        for file_path, error in self.failed_files().items():
+            record_failed_file_review(self.vcs_type, self.identifier, self.pr_mr_id, self.commit_sha, file_path, error)
+
+    def is_posted(self) -> bool:
+        """批量评论是否已经发布。"""
+        return _POSTED_FIELD in self._load()
+
+    def mark_posted(self):
+        self._save(_POSTED_FIELD, True)
+
+    def clear(self):
+        self._fields = {}
+        delete_review_checkpoint(self.vcs_type, self.identifier, self.pr_mr_id, self.commit_sha)
@@ -0,0 +1,288 @@
+import json
+import logging
+import re
+import threading
+
+from api.core_config import app_configs
+
+logger = logging.getLogger(__name__)
+
+_HUNK_HEADER_PATTERN = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+# 找不到合适的代码块 (或代码块超出预算) 时，hunk 前后附带的上下文行数
+_FALLBACK_CONTEXT_LINES = 10
+# _fetch_file_content_from_url 在文件过大时返回的占位文本前缀
+_NOT_FETCHED_PREFIX = "[Content not fetched"
+
+
+class LazyFileContent:
+    """
+    文件内容的惰性句柄。创建时不发起任何请求，只有 prompt 构建器真正需要某些行时才通过 fetcher 获取一次。
+    获取时可以指定需要的行窗口 (见 materialize)，之后只保留这些窗口内的行，其余内容随即丢弃。
+    """
+
+    def __init__(self, fetcher, description: str = ""):
+        self._fetcher = fetcher
+        self.description = description
+        self._windows = None  # [(start_line, [行, ...])]，按 start_line 升序且互不重叠
+        self._line_count = None
+        self._fetched = False
+        self.unavailable_reason = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_materialized(self) -> bool:
+        return self._fetched
+
+    def materialize(self, window_selector=None):
+        """
+        获取文件内容 (只获取一次)。window_selector(lines) 返回需要保留的 [(start_line, end_line)] (从 1 开始，含两端)，
+        只在第一次获取时调用，未指定时保留整个文件。
+        :return: 保留的行窗口 (合并后)；内容不可用时返回 None。
+        """
+        with self._lock:
+            if not self._fetched:
+                self._fetched = True
+                content = self._fetcher()
+                self._fetcher = None
+                if content is None:
+                    self.unavailable_reason = "内容获取失败或为二进制文件"
+                elif content.startswith(_NOT_FETCHED_PREFIX):
+                    self.unavailable_reason = content
+                else:
+                    lines = content.splitlines()
+                    ranges = window_selector(lines) if window_selector is not None else [(1, len(lines))]
+                    self._line_count = len(lines)
+                    self._windows = [(start, lines[start - 1:end])
+                                     for start, end in merge_line_ranges(ranges) if start <= end]
+                    logger.debug(f"已获取文件内容 {self.description} ({len(lines)} 行)，保留 "
+                                 f"{sum(len(window) for _, window in self._windows)} 行。")
+            if self._windows is None:
+                return None
+            return [(start, start + len(window) - 1) for start, window in self._windows]
+
+    def line_count(self):
+        """整个文件的行数 (包括未保留的行)，内容不可用时返回 None。"""
+        self.materialize()
+        return self._line_count
+
+    def get_lines(self, start_line: int, end_line: int):
+        """
+        返回 [start_line, end_line] (从 1 开始，含两端) 范围内的行列表，内容不可用时返回 None。
+        只能读取保留的窗口：返回 start_line 所在窗口中不超过 end_line 的部分，start_line 不在任何窗口中时返回空列表。
+        """
+        if self.materialize() is None:
+            return None
+        start_line = max(start_line, 1)
+        for window_start, window in self._windows:
+            if window_start <= start_line < window_start + len(window):
+                return window[start_line - window_start:max(end_line - window_start + 1, 0)]
+        return []
+
+    def __repr__(self):
+        return f"LazyFileContent({self.description!r}, materialized={self._fetched})"
+
+
+def parse_hunk_ranges(diff_text: str) -> list:
+    """从 diff 文本中解析每个 hunk 的 (old_start, old_count, new_start, new_count)。"""
+    ranges = []
+    for line in (diff_text or "").splitlines():
+        match = _HUNK_HEADER_PATTERN.match(line)
+        if match:
+            old_start, old_count, new_start, new_count = match.groups()
+            ranges.append((int(old_start), int(old_count) if old_count is not None else 1,
+                           int(new_start), int(new_count) if new_count is not None else 1))
+    return ranges
+
+
+def merge_line_ranges(ranges: list) -> list:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _indent_of(line: str) -> int:
+    return len(line.expandtabs(4)) - len(line.expandtabs(4).lstrip())
+
+
+def _brace_block_end(lines: list, header_line: int):
+    """从 header_line 开始按花括号配对查找代码块结束行；header 行没有未闭合的 '{' 时返回 None。"""
+    depth = 0
+    opened = False
+    for line_number in range(header_line, len(lines) + 1):
+        line = lines[line_number - 1]
+        depth += line.count("{") - line.count("}")
+        opened = opened or "{" in line
+        if line_number == header_line and depth <= 0:
+            return None
+        if opened and depth <= 0:
+            return line_number
+    return len(lines)
+
+
+def _indent_block_end(lines: list, header_line: int, body_end: int) -> int:
+    """按缩进查找代码块结束行：header 之后缩进大于 header 的连续行 (空行除外) 都属于该块。"""
+    header_indent = _indent_of(lines[header_line - 1])
+    block_end = max(body_end, header_line)
+    for line_number in range(block_end + 1, len(lines) + 1):
+        line = lines[line_number - 1]
+        if not line.strip():
+            continue
+        if _indent_of(line) <= header_indent:
+            break
+        block_end = line_number
+    return block_end
+
+
+def find_enclosing_block(lines: list, start_line: int, end_line: int):
+    """
+    使用缩进和花括号查找包含 [start_line, end_line] 的最内层代码块 (例如函数、类或条件分支)。
+    :return: (block_start, block_end)；变更位于顶层代码时返回 None。
+    """
+    start_line = min(max(start_line, 1), len(lines))
+    end_line = min(max(end_line, start_line), len(lines))
+    body_indents = [_indent_of(line) for line in lines[start_line - 1:end_line] if line.strip()]
+    min_indent = min(body_indents) if body_indents else 0
+    if min_indent == 0:
+        return None
+
+    for header_line in range(start_line - 1, 0, -1):
+        header = lines[header_line - 1]
+        if header.strip() and _indent_of(header) < min_indent:
+            block_end = _brace_block_end(lines, header_line)
+            if block_end is None or block_end < end_line:
+                block_end = _indent_block_end(lines, header_line, end_line)
+            return header_line, block_end
+    return None
+
+
+def _context_range_for_hunk(lines: list, start_line: int, end_line: int, max_lines: int):
+    """
+    为一个 hunk 选取上下文范围：由内向外扩展到不超过 max_lines 行的最外层代码块；
+    连最内层代码块都过大时，退化为 hunk 前后 _FALLBACK_CONTEXT_LINES 行的窗口。
+    """
+    best = None
+    block = find_enclosing_block(lines, start_line, end_line)
+    while block is not None and block[1] - block[0] + 1 <= max_lines:
+        best = block
+        if block[0] <= 1:
+            break
+        block = find_enclosing_block(lines, block[0], block[1])
+    if best is not None:
+        return best
+    return (max(start_line - _FALLBACK_CONTEXT_LINES, 1),
+            min(end_line + _FALLBACK_CONTEXT_LINES, len(lines)))
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数 (约 4 个字符 1 个 token)。"""
+    return (len(text or "") + 3) // 4
+
+
+def _context_windows(lines: list, hunk_ranges: list, token_budget: int) -> list:
+    """为每个 hunk 选取上下文范围 (见 _context_range_for_hunk)，返回合并后的 [[start_line, end_line]]。"""
+    total_lines = len(lines)
+    if not total_lines:
+        return []
+    # 单个代码块最多占用预算对应的行数 (按平均行长估算)
+    average_line_tokens = max(estimate_tokens("\n".join(lines)) // total_lines, 1)
+    max_block_lines = max(token_budget // average_line_tokens, 1)
+    return merge_line_ranges([_context_range_for_hunk(lines, start, start + max(count, 1) - 1, max_block_lines)
+                              for start, count in hunk_ranges if start <= total_lines])
+
+
+def build_context_blocks(content: LazyFileContent, hunk_ranges: list, token_budget: int):
+    """
+    从文件内容中取出包含每个 hunk 的代码块，总量不超过 token_budget。
+    获取内容时只保留这些代码块所在的行，整个文件的内容不会在句柄中保留。
+    :param hunk_ranges: [(start_line, line_count)]，为该文件版本一侧的 hunk 行范围。
+    :return: ([{"start_line", "end_line", "content"}], 使用的 token 数)；内容不可用时返回 (None, 0)。
+    """
+    if token_budget <= 0 or not hunk_ranges:
+        return [], 0
+    windows = content.materialize(lambda lines: _context_windows(lines, hunk_ranges, token_budget))
+    if windows is None:
+        return None, 0
+
+    blocks = []
+    used_tokens = 0
+    for start, end in windows:
+        block_lines = content.get_lines(start, end)
+        block_text = "\n".join(block_lines)
+        block_tokens = estimate_tokens(block_text)
+        if used_tokens + block_tokens > token_budget:
+            # 预算不足以容纳整个块时，只保留块开头能放下的部分，然后停止
+            remaining_chars = (token_budget - used_tokens) * 4
+            kept = []
+            for line in block_lines:
+                remaining_chars -= len(line) + 1
+                if remaining_chars < 0:
+                    break
+                kept.append(line)
+            if kept:
+                block_text = "\n".join(kept)
+                blocks.append({"start_line": start, "end_line": start + len(kept) - 1, "content": block_text})
+                used_tokens += estimate_tokens(block_text)
+            break
+        blocks.append({"start_line": start, "end_line": end, "content": block_text})
+        used_tokens += block_tokens
+    return blocks, used_tokens
+
+
+def _needs_context(file_data: dict) -> bool:
+    """只有修改/重命名且 diff 中存在 hunk 的文件才需要上下文；新增和删除文件的 diff 本身已包含全部内容。"""
+    return file_data.get("status") in ("modified", "renamed") and bool(parse_hunk_ranges(file_data.get("diff_text")))
+
+
+def _as_lazy(content, description: str):
+    if content is None or isinstance(content, LazyFileContent):
+        return content
+    return LazyFileContent(lambda: content, description)
+
+
+def build_general_review_input(file_data: dict) -> dict:
+    """
+    构建粗粒度审查的 LLM 输入。不再放入完整文件内容，而是只放入包含每个 hunk 的代码块：
+    优先使用变更后 (head) 文件中的代码块，剩余预算再用于变更前 (base) 文件。
+    old_content / new_content 可以是字符串或 LazyFileContent，只有需要时才会获取。
+    每个文件的 diff 与上下文总量受 GENERAL_REVIEW_CONTEXT_TOKEN_BUDGET 限制。
+    """
+    file_path = file_data.get("file_path")
+    diff_text = file_data.get("diff_text") or ""
+    review_input = {
+        "file_path": file_path,
+        "status": file_data.get("status"),
+        "diff_text": diff_text,
+        "new_context": None,
+        "old_context": None,
+    }
+    if not _needs_context(file_data):
+        return review_input
+
+    token_budget = int(app_configs.get("GENERAL_REVIEW_CONTEXT_TOKEN_BUDGET", 6000)) - estimate_tokens(diff_text)
+    if token_budget <= 0:
+        logger.info(f"文件 {file_path} 的 diff 已占满 token 预算，不附带上下文。")
+        return review_input
+
+    hunks = parse_hunk_ranges(diff_text)
+    for key, content_key, side_ranges in (
+            ("new_context", "new_content", [(new_start, new_count) for _, _, new_start, new_count in hunks]),
+            ("old_context", "old_content", [(old_start, old_count) for old_start, old_count, _, _ in hunks])):
+        content = _as_lazy(file_data.get(content_key), f"{file_path} ({content_key})")
+        if content is None or token_budget <= 0:
+            continue
+        blocks, used_tokens = build_context_blocks(content, side_ranges, token_budget)
+        if blocks is None:
+            logger.info(f"文件 {file_path} 的 {content_key} 不可用 ({content.unavailable_reason})，跳过该侧上下文。")
+            continue
+        review_input[key] = blocks
+        token_budget -= used_tokens
+    return review_input
+
+
+def build_general_review_prompt(file_data: dict) -> str:
+    """将单个文件的粗粒度审查输入序列化为 LLM 的 user prompt (JSON 字符串)。"""
+    return json.dumps(build_general_review_input(file_data), ensure_ascii=False, indent=2)
@@ -0,0 +1,272 @@
+"""
+审查任务调度器：按 PR 大小和仓库等级安排执行顺序，替代线程池的先进先出。
+
+- 加权公平排队 (WFQ)：每个仓库/项目是一个流，任务的虚拟完成时间 = max(当前虚拟时间, 该仓库上一任务的虚拟完成时间)
+  + 任务成本 / 仓库权重，总是先执行虚拟完成时间最小的任务。单个仓库的大量任务不会阻塞其他仓库。
+- 短作业优先：任务成本为 PR 的变更行数，小 PR 的虚拟完成时间小，即使晚到也会排在大 PR 之前；
+  同一仓库的大任务和小任务分属不同的流，小 PR 不会排在本仓库的大 PR 之后。
+- 预留小任务并发：大任务 (变更行数超过 SCHEDULER_SMALL_JOB_MAX_LINES) 最多占用 max_running - 预留数 个执行槽位，
+  大 PR 运行期间小 PR 仍能立即开始。
+- 仓库并发上限：提供 slot_acquirer 时，开始任务之前先获取该仓库的槽位 (见 concurrency_limit_service.try_acquire_slot)，
+  槽位已满的仓库的任务留在队列中，由其他仓库的任务先使用执行槽位；槽位可能由其他进程释放，
+  因此有任务因此被跳过时每隔 slot_retry_seconds 秒重新尝试调度。获取槽位 (Redis 调用) 在调度锁之外进行，
+  每轮调度中每个仓库最多尝试一次。等待过久的任务可以通过 withdraw_held_back 撤回 (worker 将其交还给其他 worker)。
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from api.core_config import app_configs, github_repo_configs, gitlab_project_configs
+
+logger = logging.getLogger(__name__)
+
+# 仓库等级 -> WFQ 权重 (仓库/项目配置中的 priority_tier 字段，未配置时为 normal)
+TIER_WEIGHTS = {"high": 4.0, "normal": 2.0, "low": 1.0}
+DEFAULT_TIER = "normal"
+
+
+def get_repo_tier(platform: str, identifier: str) -> str:
+    configs = github_repo_configs if platform == "github" else gitlab_project_configs
+    tier = (configs.get(str(identifier)) or {}).get("priority_tier")
+    return tier if tier in TIER_WEIGHTS else DEFAULT_TIER
+
+
+def estimate_job_cost(job: dict) -> int:
+    """任务成本 (变更行数)。webhook 未提供大小时使用 SCHEDULER_DEFAULT_JOB_LINES。"""
+    size_hint = job.get("size_hint")
+    if isinstance(size_hint, int) and size_hint >= 0:
+        return max(size_hint, 1)
+    return max(int(app_configs.get("SCHEDULER_DEFAULT_JOB_LINES", 200)), 1)
+
+
+class _ScheduledJob:
+    __slots__ = ("job", "run", "future", "flow", "cost", "is_large", "start_tag", "finish_tag", "release", "held_since")
+
+    def __init__(self, job, run, future, flow, cost, is_large):
+        self.job = job
+        self.run = run
+        self.future = future
+        self.flow = flow
+        self.cost = cost
+        self.is_large = is_large
+        self.start_tag = 0.0
+        self.finish_tag = 0.0
+        self.release = None  # 仓库槽位的释放函数
+        self.held_since = None  # 首次因仓库并发上限未能开始的时间 (time.monotonic)
+
+    @property
+    def repo(self) -> tuple:
+        return self.job.get("platform"), self.job.get("identifier")
+
+
+class ReviewScheduler:
+    """在给定线程池上按 WFQ + 短作业优先执行任务，同时运行的任务数不超过 max_running。"""
+
+    def __init__(self, pool, max_running: int, reserved_small_slots: int = 0, small_job_max_lines: int = 300,
+                 slot_acquirer=None, slot_retry_seconds: float = 1.0):
+        self.pool = pool
+        self.max_running = max(max_running, 1)
+        # 至少保留一个槽位给大任务，避免大任务永远无法执行
+        self.max_running_large = max(self.max_running - max(reserved_small_slots, 0), 1)
+        self.small_job_max_lines = small_job_max_lines
+        # slot_acquirer(job) 返回仓库槽位的释放函数，槽位已满时返回 None
+        self.slot_acquirer = slot_acquirer
+        self.slot_retry_seconds = slot_retry_seconds
+        self._retry_timer = None
+        self._lock = threading.Lock()
+        self._small_queue = []  # [(finish_tag, seq, _ScheduledJob)]
+        self._large_queue = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._flow_finish_tags = {}  # flow -> 该流最后一个任务的虚拟完成时间 (流的数量受已配置仓库数限制)
+        self._running = 0
+        self._running_large = 0
+        self._closed = False
+
+    def submit(self, run, job: dict) -> Future:
+        """
+        将任务加入调度队列 (与线程池的 submit 用法一致)，返回任务执行结束时完成的 Future。
+        调度器已关闭 (drain) 时不再接收任务，返回的 Future 立即处于已取消状态。
+        """
+        cost = estimate_job_cost(job)
+        is_large = cost > self.small_job_max_lines
+        flow = f"{job.get('platform')}:{job.get('identifier')}:{'large' if is_large else 'small'}"
+        weight = TIER_WEIGHTS[get_repo_tier(job.get("platform"), job.get("identifier"))]
+        entry = _ScheduledJob(job, run, Future(), flow, cost, is_large)
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                entry.start_tag = max(self._virtual_time, self._flow_finish_tags.get(flow, 0.0))
+                entry.finish_tag = entry.start_tag + cost / weight
+                self._flow_finish_tags[flow] = entry.finish_tag
+                self._push_locked(entry)
+            queued = len(self._small_queue) + len(self._large_queue)
+        if closed:
+            entry.future.cancel()
+            return entry.future
+        logger.info(f"审查任务 {job.get('job_id')} ({flow}，约 {cost} 行) 已加入调度队列，当前排队 {queued} 个。")
+        self._pump()
+        return entry.future
+
+    def _mark_held_back_locked(self, entry):
+        if entry.held_since is None:
+            entry.held_since = time.monotonic()
+            logger.info(f"仓库 {entry.job.get('identifier')} 的审查任务已达到并发上限，任务 {entry.job.get('job_id')} "
+                        f"留在队列中等待。")
+
+    def _push_locked(self, entry):
+        heapq.heappush(self._large_queue if entry.is_large else self._small_queue,
+                       (entry.finish_tag, next(self._sequence), entry))
+
+    def _pop_next_locked(self, blocked_repos: set):
+        """按虚拟完成时间取出下一个任务，跳过本轮调度中仓库槽位已满 (blocked_repos) 的任务 (放回队列)。"""
+        large_allowed = self._running_large < self.max_running_large
+        queues = [self._small_queue] + ([self._large_queue] if large_allowed else [])
+        skipped = []
+        entry = None
+        try:
+            while True:
+                candidates = [queue for queue in queues if queue]
+                if not candidates:
+                    break
+                queue = min(candidates, key=lambda q: q[0][0])
+                item = heapq.heappop(queue)
+                if item[2].repo not in blocked_repos:
+                    entry = item[2]
+                    break
+                self._mark_held_back_locked(item[2])
+                skipped.append((queue, item))
+        finally:
+            for queue, item in skipped:
+                heapq.heappush(queue, item)
+        return entry
+
+    def _schedule_retry_locked(self):
+        if self._closed or (self._retry_timer is not None and self._retry_timer.is_alive()):
+            return
+        self._retry_timer = threading.Timer(self.slot_retry_seconds, self._retry_pump)
+        self._retry_timer.daemon = True
+        self._retry_timer.start()
+
+    def _retry_pump(self):
+        with self._lock:
+            self._retry_timer = None
+        self._pump()
+
+    def _pump(self):
+        blocked_repos = set()
+        while True:
+            with self._lock:
+                if self._closed or self._running >= self.max_running:
+                    return
+                entry = self._pop_next_locked(blocked_repos)
+                if entry is None:
+                    return
+                # 先占用执行槽位，再在锁外获取仓库槽位，避免 submit / stats 等待 Redis
+                self._running += 1
+                if entry.is_large:
+                    self._running_large += 1
+            if self.slot_acquirer is not None:
+                entry.release = self.slot_acquirer(entry.job)
+                if entry.release is None:
+                    blocked_repos.add(entry.repo)
+                    self._requeue(entry)
+                    continue
+            with self._lock:
+                closed = self._closed
+                if not closed:
+                    self._virtual_time = max(self._virtual_time, entry.start_tag)
+            if closed:  # 获取槽位期间调度器已关闭
+                self._finish(entry)
+                entry.future.cancel()
+                return
+            self.pool.submit(self._execute, entry)
+
+    def _requeue(self, entry):
+        """仓库槽位已满：归还执行槽位，任务放回队列等待重试。"""
+        with self._lock:
+            self._running -= 1
+            if entry.is_large:
+                self._running_large -= 1
+            closed = self._closed
+            if not closed:
+                self._mark_held_back_locked(entry)
+                self._push_locked(entry)
+                self._schedule_retry_locked()
+        if closed:
+            entry.future.cancel()
+
+    def _finish(self, entry):
+        if entry.release is not None:
+            entry.release()
+        with self._lock:
+            self._running -= 1
+            if entry.is_large:
+                self._running_large -= 1
+
+    def _execute(self, entry):
+        try:
+            if entry.future.set_running_or_notify_cancel():
+                try:
+                    entry.future.set_result(entry.run(entry.job))
+                except BaseException as e:
+                    entry.future.set_exception(e)
+        finally:
+            self._finish(entry)
+            self._pump()
+
+    def drain(self) -> int:
+        """
+        关闭调度器：不再开始新的任务，取消所有尚未开始的任务 (其 Future 变为已取消)，返回取消的任务数。
+        执行中的任务不受影响。
+        """
+        with self._lock:
+            self._closed = True
+            if self._retry_timer is not None:
+                self._retry_timer.cancel()
+                self._retry_timer = None
+            entries = [item[2] for item in sorted(self._small_queue + self._large_queue, key=lambda item: item[:2])]
+            self._small_queue, self._large_queue = [], []
+        for entry in entries:
+            entry.future.cancel()
+        if entries:
+            logger.info(f"调度器已关闭，取消了 {len(entries)} 个尚未开始的任务。")
+        return len(entries)
+
+    def withdraw_held_back(self, max_wait_seconds: float) -> int:
+        """
+        撤回因仓库并发上限等待超过 max_wait_seconds 秒的排队任务 (其 Future 变为已取消)，返回撤回的任务数。
+        worker 将撤回的任务交还给消费组，避免其长期占用预取名额。
+        """
+        deadline = time.monotonic() - max_wait_seconds
+        withdrawn = []
+        with self._lock:
+            for queue in (self._small_queue, self._large_queue):
+                kept = []
+                for item in queue:
+                    if item[2].held_since is not None and item[2].held_since <= deadline:
+                        withdrawn.append(item[2])
+                    else:
+                        kept.append(item)
+                if len(kept) != len(queue):
+                    queue[:] = kept
+                    heapq.heapify(queue)
+        for entry in withdrawn:
+            entry.future.cancel()
+        if withdrawn:
+            logger.info(f"撤回了 {len(withdrawn)} 个因仓库并发上限等待超过 {max_wait_seconds} 秒的任务。")
+        return len(withdrawn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._running,
+                "running_large": self._running_large,
+                "queued_small": len(self._small_queue),
+                "queued_large": len(self._large_queue),
+                "held_back": sum(1 for queue in (self._small_queue, self._large_queue)
+                                 for item in queue if item[2].held_since is not None),
+            }
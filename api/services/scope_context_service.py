@@ -0,0 +1,200 @@
+import ast
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+from api.core_config import app_configs
+from api.services.review_context_service import estimate_tokens, find_enclosing_block, merge_line_ranges
+
+logger = logging.getLogger(__name__)
+
+# 按 blob SHA 缓存的作用域索引条数上限 (相同内容的文件在不同 PR/commit 之间复用解析结果)
+_SCOPE_CACHE_MAX_ENTRIES = 256
+# 找不到包含变更的作用域 (或作用域超出预算) 时，变更前后附带的行数
+_FALLBACK_CONTEXT_LINES = 10
+# 相距不超过该行数的变更视为同一处变更
+_CHANGE_GROUP_GAP_LINES = 3
+
+_DEFINITION_KEYWORD_PATTERN = re.compile(
+    r"^\s*(?:@\w+\s+)*(?:(?:export|default|public|private|protected|internal|static|final|abstract|async|override|"
+    r"virtual|inline|pub(?:\([\w:]+\))?|unsafe|extern)\s+)*"
+    r"(?:def|fn|func|function|class|struct|interface|impl|enum|trait|module|object|namespace)\b")
+_SIGNATURE_PATTERN = re.compile(r"^\s*[\w$<>\[\],.:*&\s]*?([\w$]+)\s*\([^;]*\)[^;]*\{\s*$")
+_CONTROL_KEYWORDS = frozenset({"if", "for", "while", "switch", "catch", "with", "else", "do", "try", "return", "foreach"})
+
+
+class _ScopeIndex:
+    """单个 blob 的解析结果：按行拆分的内容，以及 (Python 文件) 通过 ast 得到的函数/类作用域。"""
+
+    __slots__ = ("lines", "python_scopes")
+
+    def __init__(self, lines: list, python_scopes):
+        self.lines = lines
+        self.python_scopes = python_scopes  # [(start_line, end_line)]，非 Python 或解析失败时为 None
+
+
+_scope_cache = OrderedDict()
+_scope_cache_lock = threading.Lock()
+
+
+def _parse_python_scopes(source: str):
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    scopes = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            end_line = getattr(node, "end_lineno", None)
+            if end_line:
+                scopes.append((start_line, end_line))
+    return scopes
+
+
+def _build_scope_index(path: str, content: str) -> _ScopeIndex:
+    python_scopes = _parse_python_scopes(content) if path.endswith((".py", ".pyi")) else None
+    return _ScopeIndex(content.splitlines(), python_scopes)
+
+
+def get_scope_index(blob_sha: str, path: str, fetch_content):
+    """
+    获取 blob 的作用域索引。命中缓存时不会调用 fetch_content；内容获取失败时返回 None (不缓存失败结果)。
+    """
+    if blob_sha:
+        with _scope_cache_lock:
+            index = _scope_cache.get(blob_sha)
+            if index is not None:
+                _scope_cache.move_to_end(blob_sha)
+                return index
+
+    content = fetch_content()
+    if content is None or content.startswith("[Content not fetched"):
+        return None
+    index = _build_scope_index(path, content)
+    if blob_sha:
+        with _scope_cache_lock:
+            _scope_cache[blob_sha] = index
+            while len(_scope_cache) > _SCOPE_CACHE_MAX_ENTRIES:
+                _scope_cache.popitem(last=False)
+    return index
+
+
+def _is_definition_header(line: str) -> bool:
+    if _DEFINITION_KEYWORD_PATTERN.match(line):
+        return True
+    match = _SIGNATURE_PATTERN.match(line)
+    return bool(match) and match.group(1) not in _CONTROL_KEYWORDS
+
+
+def _resolve_python_scope(index: _ScopeIndex, start_line: int, end_line: int):
+    containing = [scope for scope in index.python_scopes if scope[0] <= start_line and end_line <= scope[1]]
+    if not containing:
+        return None
+    return min(containing, key=lambda scope: scope[1] - scope[0])
+
+
+def _resolve_heuristic_scope(index: _ScopeIndex, start_line: int, end_line: int):
+    """由内向外查找代码块，直到遇到类似函数/类定义的块头；没有定义块时返回最外层代码块。"""
+    outermost = None
+    block = find_enclosing_block(index.lines, start_line, end_line)
+    while block is not None:
+        if _is_definition_header(index.lines[block[0] - 1]):
+            return block
+        outermost = block
+        if block[0] <= 1:
+            break
+        block = find_enclosing_block(index.lines, block[0], block[1])
+    return outermost
+
+
+def resolve_enclosing_scope(index: _ScopeIndex, start_line: int, end_line: int, max_lines: int):
+    """
+    返回包含 [start_line, end_line] 的函数/类作用域 (start, end)。
+    Python 使用 ast，其他语言使用缩进/花括号启发式；找不到或超过 max_lines 时退化为变更前后的固定窗口。
+    """
+    total_lines = len(index.lines)
+    start_line = min(max(start_line, 1), total_lines)
+    end_line = min(max(end_line, start_line), total_lines)
+    if index.python_scopes is not None:
+        scope = _resolve_python_scope(index, start_line, end_line)
+    else:
+        scope = _resolve_heuristic_scope(index, start_line, end_line)
+    if scope is not None and scope[1] - scope[0] + 1 <= max_lines:
+        return scope
+    return max(start_line - _FALLBACK_CONTEXT_LINES, 1), min(end_line + _FALLBACK_CONTEXT_LINES, total_lines)
+
+
+def _changed_new_line_ranges(changes: list) -> list:
+    """
+    根据变更列表计算新文件中受影响的行范围。
+    删除行在新文件中的位置按此前累计的增删行数推算。
+    """
+    positions = []
+    added = deleted = 0
+    for change in changes:
+        if change.get("type") == "add" and change.get("new_line") is not None:
+            positions.append(change["new_line"])
+            added += 1
+        elif change.get("type") == "delete" and change.get("old_line") is not None:
+            positions.append(max(change["old_line"] + added - deleted, 1))
+            deleted += 1
+    ranges = []
+    for position in sorted(positions):
+        if ranges and position <= ranges[-1][1] + _CHANGE_GROUP_GAP_LINES:
+            ranges[-1][1] = max(ranges[-1][1], position)
+        else:
+            ranges.append([position, position])
+    return ranges
+
+
+def build_scope_context(index: _ScopeIndex, changes: list, token_budget: int) -> str:
+    """将包含各处变更的作用域 (带行号) 拼接为上下文文本，总量不超过 token_budget。"""
+    if not index.lines:
+        return ""
+    average_line_tokens = max(estimate_tokens("\n".join(index.lines)) // len(index.lines), 1)
+    max_scope_lines = max(token_budget // average_line_tokens, 1)
+    scopes = [resolve_enclosing_scope(index, start, end, max_scope_lines) for start, end in _changed_new_line_ranges(changes)]
+
+    sections = []
+    used_tokens = 0
+    for start, end in merge_line_ranges(scopes):
+        numbered = [f"{line_number}: {index.lines[line_number - 1]}" for line_number in range(start, end + 1)]
+        section = "\n".join(numbered)
+        section_tokens = estimate_tokens(section)
+        if used_tokens + section_tokens > token_budget:
+            break
+        sections.append(section)
+        used_tokens += section_tokens
+    return "\n...\n".join(sections)
+
+
+def attach_scope_context(structured_changes: dict, head_blob_resolver):
+    """
+    为详细审查的每个文件解析变更所在的函数/类作用域，并用它替换 context["new"]。
+    :param head_blob_resolver: callable(path, file_data)，返回 (blob_sha, fetch_content) 或 None。
+    获取或解析失败的文件保留原有的 diff 上下文。
+    """
+    token_budget = int(app_configs.get("DETAILED_REVIEW_CONTEXT_TOKEN_BUDGET", 4000))
+    for path, file_data in (structured_changes or {}).items():
+        changes = file_data.get("changes") or []
+        if not any(change.get("type") in ("add", "delete") for change in changes):
+            continue
+        try:
+            blob = head_blob_resolver(path, file_data)
+            if not blob:
+                continue
+            blob_sha, fetch_content = blob
+            index = get_scope_index(blob_sha, path, fetch_content)
+            if index is None:
+                continue
+            scope_context = build_scope_context(index, changes, token_budget)
+        except Exception:
+            logger.exception(f"解析文件 {path} 的作用域上下文时出错，保留原有上下文:")
+            continue
+        if scope_context:
+            context = file_data.get("context")
+            if not isinstance(context, dict):
+                context = file_data["context"] = {"old": "", "new": ""}
+            context["new"] = scope_context
@@ -0,0 +1,187 @@
+import hashlib
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from api.core_config import app_configs
+from api.services.concurrency_limit_service import SCOPE_VCS_HOST, concurrency_slot
+
+logger = logging.getLogger(__name__)
+
+# 请求优先级 (数值越小越优先)。预算紧张时，低优先级请求让位于高优先级请求。
+PRIORITY_COMMENT = 0   # 发布评论 / 评审
+PRIORITY_FETCH = 1     # 审查必需的数据获取 (文件列表、diff)
+PRIORITY_OPTIONAL = 2  # 可选的内容获取 (完整文件内容)
+
+# 剩余预算低于 limit 的该比例时，对应优先级的请求开始排队等待重置
+_PRIORITY_RESERVE_RATIO = {
+    PRIORITY_COMMENT: 0.0,
+    PRIORITY_FETCH: 0.02,
+    PRIORITY_OPTIONAL: 0.1,
+}
+# 剩余预算低于 limit 的该比例时，开始将请求均匀分布到重置时间之前
+_PACING_THRESHOLD_RATIO = 0.2
+# 没有 Retry-After 的二级限流 (secondary rate limit) 至少等待的秒数
+_SECONDARY_RATE_LIMIT_BACKOFF_SECONDS = 60
+
+
+class _TokenBudget:
+    """单个访问令牌的速率预算状态，由响应头更新。"""
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+        self.blocked_until = 0.0
+        self.last_request_at = 0.0
+        self.waiting = {PRIORITY_COMMENT: 0, PRIORITY_FETCH: 0, PRIORITY_OPTIONAL: 0}
+
+
+def _parse_int_header(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class VCSRequestScheduler:
+    """
+    所有 VCS (GitHub / GitLab) 出站请求的中央调度器。
+    根据 X-RateLimit-* / RateLimit-* / Retry-After 响应头跟踪每个令牌的剩余预算，
+    在预算紧张时按优先级排队并平滑请求速率，被限流 (403/429) 时等待后重试而不是直接失败。
+    """
+
+    def __init__(self, max_retries: int = 3):
+        self.max_retries = max_retries
+        self._budgets = {}
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+
+    @staticmethod
+    def _budget_key(url: str, headers: dict) -> str:
+        """以 (主机, 令牌指纹) 作为预算键，避免在内存中保存明文令牌。"""
+        headers = headers or {}
+        token = headers.get("Authorization") or headers.get("PRIVATE-TOKEN") or ""
+        token_fingerprint = hashlib.sha256(token.encode("utf-8")).hexdigest()[:12] if token else "anonymous"
+        return f"{urlparse(url).netloc}:{token_fingerprint}"
+
+    def _get_budget(self, key: str) -> _TokenBudget:
+        budget = self._budgets.get(key)
+        if budget is None:
+            budget = _TokenBudget()
+            self._budgets[key] = budget
+        return budget
+
+    def _delay_before_request(self, budget: _TokenBudget, priority: int, now: float) -> float:
+        """计算当前请求还需等待的秒数，返回 0 表示可以立即发送。调用方需持有锁。"""
+        if budget.blocked_until > now:
+            return budget.blocked_until - now
+        if any(budget.waiting[p] for p in budget.waiting if p < priority) and budget.remaining is not None \
+                and budget.limit and budget.remaining <= budget.limit * _PACING_THRESHOLD_RATIO:
+            # 预算紧张且有更高优先级的请求在排队，让其先行
+            return 0.5
+        if budget.remaining is None or not budget.limit or budget.reset_at <= now:
+            return 0.0
+
+        reserve = budget.limit * _PRIORITY_RESERVE_RATIO.get(priority, 0.0)
+        if budget.remaining <= reserve:
+            return budget.reset_at - now
+        if priority != PRIORITY_COMMENT and budget.remaining <= budget.limit * _PACING_THRESHOLD_RATIO:
+            min_interval = (budget.reset_at - now) / max(budget.remaining, 1)
+            next_allowed_at = budget.last_request_at + min_interval
+            if next_allowed_at > now:
+                return next_allowed_at - now
+        return 0.0
+
+    def _acquire(self, key: str, priority: int):
+        max_wait_seconds = float(app_configs.get("VCS_RATE_LIMIT_MAX_WAIT_SECONDS", 900))
+        deadline = time.time() + max_wait_seconds
+        with self._condition:
+            budget = self._get_budget(key)
+            budget.waiting[priority] += 1
+            try:
+                while True:
+                    now = time.time()
+                    delay = self._delay_before_request(budget, priority, now)
+                    if delay <= 0:
+                        break
+                    if now + delay > deadline:
+                        logger.warning(f"VCS 请求 ({key}) 等待速率预算已超过 {max_wait_seconds} 秒上限，将直接发送。")
+                        break
+                    logger.info(f"VCS 速率预算不足 ({key}, 剩余: {budget.remaining}, 优先级: {priority})，排队等待 {delay:.1f} 秒。")
+                    self._condition.wait(timeout=min(delay, 30))
+                budget.last_request_at = time.time()
+                if budget.remaining is not None and budget.remaining > 0:
+                    budget.remaining -= 1
+            finally:
+                budget.waiting[priority] -= 1
+
+    def _update_from_response(self, key: str, response):
+        """根据响应头更新预算。如果请求被限流，返回建议等待的秒数，否则返回 None。"""
+        headers = response.headers or {}
+        now = time.time()
+        limit = _parse_int_header(headers, "X-RateLimit-Limit", "RateLimit-Limit")
+        remaining = _parse_int_header(headers, "X-RateLimit-Remaining", "RateLimit-Remaining")
+        reset_at = _parse_int_header(headers, "X-RateLimit-Reset", "RateLimit-Reset")
+        retry_after = _parse_int_header(headers, "Retry-After")
+
+        rate_limited = response.status_code == 429 or (
+            response.status_code == 403 and (
+                retry_after is not None or remaining == 0 or "rate limit" in (response.text or "").lower()))
+
+        wait_seconds = None
+        with self._condition:
+            budget = self._get_budget(key)
+            if limit is not None:
+                budget.limit = limit
+            if remaining is not None:
+                budget.remaining = remaining
+            if reset_at is not None:
+                budget.reset_at = float(reset_at)
+            if rate_limited:
+                if retry_after is not None:
+                    wait_seconds = float(retry_after)
+                elif remaining == 0 and budget.reset_at > now:
+                    wait_seconds = budget.reset_at - now
+                else:
+                    wait_seconds = float(_SECONDARY_RATE_LIMIT_BACKOFF_SECONDS)
+                budget.blocked_until = max(budget.blocked_until, now + wait_seconds)
+            self._condition.notify_all()
+        return wait_seconds
+
+    def request(self, method: str, url: str, priority: int = PRIORITY_FETCH, **kwargs):
+        """
+        发送一个 VCS 请求 (参数与 requests.request 相同)。
+        被限流时在预算恢复后重试，最多 max_retries 次；返回最后一次的 Response，由调用方决定如何处理状态码。
+        """
+        key = self._budget_key(url, kwargs.get("headers"))
+        attempt = 0
+        while True:
+            self._acquire(key, priority)
+            with concurrency_slot(SCOPE_VCS_HOST, urlparse(url).hostname or ""):
+                response = requests.request(method, url, **kwargs)
+            wait_seconds = self._update_from_response(key, response)
+            if wait_seconds is None:
+                return response
+            attempt += 1
+            if attempt > self.max_retries:
+                logger.error(f"VCS 请求 {method} {url} 在重试 {self.max_retries} 次后仍被限流 (状态: {response.status_code})。")
+                return response
+            logger.warning(f"VCS 请求 {method} {url} 被限流 (状态: {response.status_code})，"
+                           f"{wait_seconds:.0f} 秒后重试 (第 {attempt}/{self.max_retries} 次)。")
+
+
+vcs_scheduler = VCSRequestScheduler()
+
+
+def vcs_request(method: str, url: str, priority: int = PRIORITY_FETCH, **kwargs):
+    """通过全局调度器发送 VCS 请求。"""
+    return vcs_scheduler.request(method, url, priority=priority, **kwargs)
@@ -3,32 +3,45 @@ import json
 import traceback
 import logging
 import base64
-from api.core_config import app_configs, gitlab_project_configs
+from functools import partial
+from api.core_config import app_configs, gitlab_project_configs, resolve_access_token
 from api.utils import parse_single_file_diff
+from api.diff_parser import as_line_number, parse_unified_diff
+from api.services.vcs_request_scheduler import vcs_request, PRIORITY_COMMENT, PRIORITY_OPTIONAL
+from api.services.path_filter_service import get_path_filter
+from api.services.comment_dedup_service import CommentFingerprintIndex, format_fingerprint_marker
+from api.services.review_context_service import LazyFileContent
+from api.services.review_artifact_service import get_or_fetch_review_artifact
+from api.services.dead_letter_service import (
+    DEAD_LETTER_GITHUB_COMMENT, DEAD_LETTER_GITHUB_GENERAL_COMMENT, DEAD_LETTER_GITHUB_REVIEW_BATCH,
+    DEAD_LETTER_GITLAB_COMMENT, DEAD_LETTER_GITLAB_DRAFT_PUBLISH, DEAD_LETTER_GITLAB_GENERAL_COMMENT,
+    record_dead_letter, register_dead_letter_handler
+)
 
 logger = logging.getLogger(__name__)
 
 
-def get_github_pr_changes(owner, repo_name, pull_number, access_token):
-    """从 GitHub API 获取 Pull Request 的变更，并为每个文件解析成结构化数据"""
+def get_github_pr_changes(owner, repo_name, pull_number, access_token, head_sha=None):
+    """
+    从 GitHub API 获取 Pull Request 的变更，并为每个文件解析成结构化数据。
+    提供 head_sha 时，PR diff / 文件列表按该提交与通用审查共享，只请求一次。
+    """
     if not access_token:
         logger.error(f"错误: 仓库 {owner}/{repo_name} 未配置访问令牌。")
         return None
 
-    current_github_api_url = app_configs.get("GITHUB_API_URL", "https://api.github.com")
-    files_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/pulls/{pull_number}/files"
-    headers = {
-        "Authorization": f"token {access_token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    path_filter = get_path_filter("github", f"{owner}/{repo_name}")
+    if app_configs.get("GITHUB_PR_DIFF_MEDIA_TYPE_ENABLED", True):
+        structured_changes = _get_github_pr_changes_from_diff(owner, repo_name, pull_number, access_token, path_filter,
+                                                              head_sha)
+        if structured_changes is not None:
+            return structured_changes
+        logger.info(f"回退到 PR 文件 API 获取 {owner}/{repo_name}#{pull_number} 的变更。")
 
     structured_changes = {}
 
     try:
-        logger.info(f"从以下地址获取 PR 文件: {files_url}")
-        response = requests.get(files_url, headers=headers, timeout=60)
-        response.raise_for_status()
-        files_data = response.json()
+        files_data = _fetch_github_pr_files(owner, repo_name, pull_number, access_token, head_sha)
 
         if not files_data:
             logger.info(f"在 {owner}/{repo_name} 的 Pull Request {pull_number} 中未找到文件。")
@@ -42,6 +55,11 @@ def get_github_pr_changes(owner, repo_name, pull_number, access_token):
             old_path = file_item.get('previous_filename')
             status = file_item.get('status')
 
+            skip_reason = path_filter.skip_reason(new_path, file_patch_text, old_path)
+            if skip_reason:
+                logger.info(f"跳过文件 {new_path}: {skip_reason}。")
+                continue
+
             if not file_patch_text and status != 'removed':
                 logger.warning(
                     f"警告: 因非删除文件缺少补丁文本而跳过文件项。文件: {new_path}, 状态: {status}")
@@ -49,23 +67,17 @@ def get_github_pr_changes(owner, repo_name, pull_number, access_token):
 
             if status == 'removed':
                 if not file_patch_text:  # Usually removed files might not have a patch, or it's empty
-                    file_changes_data = {
-                        "path": new_path,  # new_path is the path of the removed file
-                        "old_path": None,
-                        # No old_path if it's just a removal, unless it was renamed then removed (complex case)
-                        "changes": [{"type": "delete", "old_line": 0, "new_line": None, "content": "文件已删除"}],
-                        "context": {"old": "", "new": ""},  # No context for a fully removed file via this path
-                        "lines_changed": 0  # Or count lines if available from another source
-                    }
-                    structured_changes[new_path] = file_changes_data
+                    structured_changes[new_path] = _removed_file_changes(new_path)
                     logger.info(f"为 {new_path} 合成了 'removed' 状态。")
                     continue
 
             logger.info(f"解析文件 diff: {new_path} (旧路径: {old_path if old_path else 'N/A'}, 状态: {status})")
             try:
                 # 使用通用的 parse_single_file_diff
-                file_parsed_changes = parse_single_file_diff(file_patch_text, new_path, old_path)
+                file_parsed_changes = parse_single_file_diff(file_patch_text, new_path, old_path, include_anchors=True)
                 if file_parsed_changes and file_parsed_changes.get("changes"):
+                    if status != 'removed' and file_item.get('sha'):
+                        file_parsed_changes["head_blob_sha"] = file_item['sha']  # 用于按 blob 缓存作用域解析结果
                     structured_changes[new_path] = file_parsed_changes
                     logger.info(f"成功解析 {new_path} 的 {len(file_parsed_changes['changes'])} 处变更。")
                 elif status == 'added' and not file_parsed_changes.get("changes"):  # Empty new file
@@ -84,13 +96,11 @@ def get_github_pr_changes(owner, repo_name, pull_number, access_token):
             logger.info(f"在 {owner}/{repo_name} 的 PR {pull_number} 的所有文件中均未找到可解析的变更。")
 
     except requests.exceptions.RequestException as e:
-        logger.error(f"从 GitHub API ({files_url}) 获取数据时出错: {e}")
-        if 'response' in locals() and response is not None:
-            logger.error(f"响应状态: {response.status_code}, 响应体: {response.text[:500]}...")
+        logger.error(f"从 GitHub PR 文件 API 获取 {owner}/{repo_name}#{pull_number} 的数据时出错: {e}")
+        if e.response is not None:
+            logger.error(f"响应状态: {e.response.status_code}, 响应体: {e.response.text[:500]}...")
     except json.JSONDecodeError as json_e:
-        logger.error(f"解码来自 GitHub API ({files_url}) 的 JSON 响应时出错: {json_e}")
-        if 'response' in locals() and response is not None:
-            logger.error(f"响应文本: {response.text[:500]}...")
+        logger.error(f"解码 GitHub PR 文件 API ({owner}/{repo_name}#{pull_number}) 的 JSON 响应时出错: {json_e}")
     except Exception as e:
         logger.exception(
             f"获取/解析 {owner}/{repo_name} 中 PR {pull_number} 的 diff 时发生意外错误:")
@@ -98,8 +108,155 @@ def get_github_pr_changes(owner, repo_name, pull_number, access_token):
     return structured_changes
 
 
-def get_gitlab_mr_changes(project_id, mr_iid, access_token):
-    """从 GitLab API 获取 Merge Request 的变更，并为每个文件解析成结构化数据"""
+def _removed_file_changes(path):
+    """没有补丁文本 (空文件或二进制文件) 的删除文件的合成变更数据。"""
+    return {
+        "path": path,
+        "old_path": None,
+        "changes": [{"type": "delete", "old_line": 0, "new_line": None, "content": "文件已删除"}],
+        "context": {"old": "", "new": ""},
+        "lines_changed": 0
+    }
+
+
+def _is_full_blob_sha(blob_sha) -> bool:
+    return bool(blob_sha) and len(blob_sha) in (40, 64)
+
+
+def build_structured_changes_from_diff(diff_source, path_filter=None):
+    """
+    将完整的多文件 unified diff (git diff 输出或 GitHub 的 .diff 媒体类型) 解析为与逐文件 API 相同的
+    structured_changes 映射。path_filter 为 PathFilter (可选)，被过滤的文件不会出现在结果中。
+    """
+    structured_changes = {}
+    for file_diff in parse_unified_diff(diff_source, build_anchors=True):
+        path = file_diff.path
+        if not path:
+            continue
+        if path_filter is not None:
+            skip_reason = path_filter.skip_reason(path, file_diff.patch, file_diff.old_path)
+            if skip_reason:
+                logger.info(f"跳过文件 {path}: {skip_reason}。")
+                continue
+        if file_diff.is_binary or not file_diff.patch:
+            if file_diff.status == "removed":
+                structured_changes[path] = _removed_file_changes(path)
+                logger.info(f"为 {path} 合成了 'removed' 状态。")
+            else:
+                logger.info(f"跳过没有文本 hunk 的文件 {path} (状态: {file_diff.status}, 二进制: {file_diff.is_binary}, "
+                            f"模式: {file_diff.old_mode} -> {file_diff.new_mode})。")
+            continue
+        if not file_diff.changes:
+            logger.info(f"未从 {path} 的 diff 中解析出变更。状态: {file_diff.status}")
+            continue
+        file_parsed_changes = file_diff.as_dict(include_anchors=True)
+        if file_diff.status != "removed" and _is_full_blob_sha(file_diff.new_blob):
+            file_parsed_changes["head_blob_sha"] = file_diff.new_blob
+        structured_changes[path] = file_parsed_changes
+    return structured_changes
+
+
+def _fetch_github_pr_files(owner, repo_name, pull_number, access_token, head_sha=None):
+    """获取 PR 文件 API 的响应 (文件列表及各文件的补丁)，按 head_sha 在详细审查与通用审查之间共享。"""
+    current_github_api_url = app_configs.get("GITHUB_API_URL", "https://api.github.com")
+    files_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/pulls/{pull_number}/files"
+    headers = {
+        "Authorization": f"token {access_token}",
+        "Accept": "application/vnd.github.v3+json"
+    }
+
+    def fetch():
+        logger.info(f"从以下地址获取 PR 文件: {files_url}")
+        response = vcs_request("GET", files_url, headers=headers, timeout=60)
+        response.raise_for_status()
+        return response.json()
+
+    return get_or_fetch_review_artifact("github", f"{owner}/{repo_name}", pull_number, head_sha, "pr_files", fetch)
+
+
+def _fetch_github_pr_diff(owner, repo_name, pull_number, access_token, head_sha=None):
+    """
+    通过 application/vnd.github.v3.diff 媒体类型获取整个 PR 的 diff 文本，按 head_sha 共享。
+    diff 过大 (GitHub 返回 406) 时返回 None (同一提交的结果不会改变，同样缓存)；其他请求错误抛出异常。
+    """
+    current_github_api_url = app_configs.get("GITHUB_API_URL", "https://api.github.com")
+    pr_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/pulls/{pull_number}"
+    headers = {
+        "Authorization": f"token {access_token}",
+        "Accept": "application/vnd.github.v3.diff"
+    }
+
+    def fetch():
+        logger.info(f"以 diff 媒体类型获取 PR 变更: {pr_url}")
+        response = vcs_request("GET", pr_url, headers=headers, timeout=60)
+        if response.status_code == 406:
+            return {"diff": None}
+        response.raise_for_status()
+        return {"diff": response.text}
+
+    return get_or_fetch_review_artifact("github", f"{owner}/{repo_name}", pull_number, head_sha, "pr_diff", fetch)["diff"]
+
+
+def _get_github_pr_changes_from_diff(owner, repo_name, pull_number, access_token, path_filter, head_sha=None):
+    """
+    通过 application/vnd.github.v3.diff 媒体类型一次请求获取整个 PR 的 diff 并解析。
+    diff 过大 (GitHub 返回 406) 或请求失败时返回 None，由调用方回退到文件 API。
+    """
+    try:
+        diff_text = _fetch_github_pr_diff(owner, repo_name, pull_number, access_token, head_sha)
+        if diff_text is None:
+            logger.warning(f"{owner}/{repo_name}#{pull_number} 的 diff 过大 (406)，无法以 diff 媒体类型获取。")
+            return None
+        structured_changes = build_structured_changes_from_diff(diff_text, path_filter)
+    except requests.exceptions.RequestException as e:
+        error_message = f"以 diff 媒体类型获取 {owner}/{repo_name}#{pull_number} 失败: {e}"
+        if e.response is not None:
+            error_message += f" - 状态: {e.response.status_code}"
+        logger.warning(error_message)
+        return None
+    except Exception:
+        logger.exception(f"解析 {owner}/{repo_name}#{pull_number} 的完整 diff 时出错:")
+        return None
+    logger.info(f"从完整 diff 中解析出 PR {pull_number} 的 {len(structured_changes)} 个文件的变更。")
+    return structured_changes
+
+
+def _fetch_gitlab_mr_versions(instance_url, project_id, mr_iid, headers, head_sha=None):
+    """
+    获取 MR 的版本列表 (最新版本在前)，按 head_sha 在详细审查与通用审查之间共享。
+    最新版本还不是 head_sha (webhook 先于 GitLab 生成新版本到达) 时不缓存。
+    """
+    versions_url = f"{instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/versions"
+
+    def fetch():
+        logger.info(f"从以下地址获取 MR 版本: {versions_url}")
+        response = vcs_request("GET", versions_url, headers=headers, timeout=60)
+        response.raise_for_status()
+        return response.json()
+
+    return get_or_fetch_review_artifact(
+        "gitlab", str(project_id), mr_iid, head_sha, "mr_versions", fetch,
+        cacheable=lambda versions: bool(versions) and versions[0].get("head_commit_sha") == head_sha)
+
+
+def _fetch_gitlab_mr_version_detail(instance_url, project_id, mr_iid, headers, version_id, head_sha=None):
+    """获取 MR 指定版本的详情 (包含各文件的 diff)，按 head_sha 共享。"""
+    version_detail_url = f"{instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/versions/{version_id}"
+
+    def fetch():
+        logger.info(f"从以下地址获取版本 ID {version_id} 的详细信息: {version_detail_url}")
+        response = vcs_request("GET", version_detail_url, headers=headers, timeout=60)
+        response.raise_for_status()
+        return response.json()
+
+    return get_or_fetch_review_artifact("gitlab", str(project_id), mr_iid, head_sha, f"mr_version:{version_id}", fetch)
+
+
+def get_gitlab_mr_changes(project_id, mr_iid, access_token, head_sha=None):
+    """
+    从 GitLab API 获取 Merge Request 的变更，并为每个文件解析成结构化数据。
+    提供 head_sha (webhook 中的最新提交) 时，MR 版本与版本详情按该提交与通用审查共享，只请求一次。
+    """
     if not access_token:
         logger.error(f"错误: 项目 {project_id} 未配置访问令牌。")
         return None, None
@@ -114,16 +271,12 @@ def get_gitlab_mr_changes(project_id, mr_iid, access_token):
     else:
         logger.info(f"项目 {project_id} 使用全局 GitLab 实例 URL: {current_gitlab_instance_url}")
 
-    versions_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/versions"
     headers = {"PRIVATE-TOKEN": access_token}
     structured_changes = {}
     position_info = None
 
     try:
-        logger.info(f"从以下地址获取 MR 版本: {versions_url}")
-        response = requests.get(versions_url, headers=headers, timeout=60)
-        response.raise_for_status()
-        versions_data = response.json()
+        versions_data = _fetch_gitlab_mr_versions(current_gitlab_instance_url, project_id, mr_iid, headers, head_sha)
 
         if versions_data:
             latest_version = versions_data[0]
@@ -135,15 +288,12 @@ def get_gitlab_mr_changes(project_id, mr_iid, access_token):
             latest_version_id = latest_version.get("id")
             logger.info(f"从最新版本 (ID: {latest_version_id}) 提取的位置信息: {position_info}")
 
-            # current_gitlab_instance_url is already defined above using project-specific or global config
-            version_detail_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/versions/{latest_version_id}"
-            logger.info(f"从以下地址获取版本 ID {latest_version_id} 的详细信息: {version_detail_url}")
-            version_detail_response = requests.get(version_detail_url, headers=headers, timeout=60)
-            version_detail_response.raise_for_status()
-            version_detail_data = version_detail_response.json()
+            version_detail_data = _fetch_gitlab_mr_version_detail(current_gitlab_instance_url, project_id, mr_iid,
+                                                                  headers, latest_version_id, head_sha)
 
             api_diffs = version_detail_data.get('diffs', [])
             logger.info(f"从 API 收到版本 ID {latest_version_id} 的 {len(api_diffs)} 个文件 diff。")
+            path_filter = get_path_filter("gitlab", project_id)
 
             for diff_item in api_diffs:
                 file_diff_text = diff_item.get('diff')
@@ -151,6 +301,11 @@ def get_gitlab_mr_changes(project_id, mr_iid, access_token):
                 old_path = diff_item.get('old_path')
                 is_renamed = diff_item.get('renamed_file', False)
 
+                skip_reason = path_filter.skip_reason(new_path, file_diff_text, old_path if is_renamed else None)
+                if skip_reason:
+                    logger.info(f"跳过文件 {new_path}: {skip_reason}。")
+                    continue
+
                 if not file_diff_text or not new_path:
                     logger.warning(
                         f"警告: 因缺少 diff 文本或 new_path 而跳过 diff 项。项: {diff_item.get('new_path', 'N/A')}")
@@ -160,7 +315,7 @@ def get_gitlab_mr_changes(project_id, mr_iid, access_token):
                 try:
                     # 使用通用的 parse_single_file_diff
                     file_parsed_changes = parse_single_file_diff(file_diff_text, new_path,
-                                                                 old_path if is_renamed else None)
+                                                                 old_path if is_renamed else None, include_anchors=True)
                     if file_parsed_changes and file_parsed_changes.get("changes"):
                         structured_changes[new_path] = file_parsed_changes
                         logger.info(f"成功解析 {new_path} 的 {len(file_parsed_changes['changes'])} 处变更。")
@@ -175,23 +330,171 @@ def get_gitlab_mr_changes(project_id, mr_iid, access_token):
             logger.info(f"GitLab 对项目 {project_id} 的 MR {mr_iid} 的初始响应中未找到版本。")
 
     except requests.exceptions.RequestException as e:
-        request_url = locals().get('version_detail_url') or locals().get('versions_url', 'GitLab API')
-        error_response = locals().get('version_detail_response') or locals().get('response')
-        logger.error(f"从 {request_url} 获取数据时出错: {e}")
-        if error_response is not None:
-            logger.error(f"响应状态: {error_response.status_code}, 响应体: {error_response.text[:500]}...")
+        logger.error(f"从 GitLab API 获取项目 {project_id} 的 MR {mr_iid} 的版本数据时出错: {e}")
+        if e.response is not None:
+            logger.error(f"响应状态: {e.response.status_code}, 响应体: {e.response.text[:500]}...")
     except json.JSONDecodeError as json_e:
-        request_url = locals().get('version_detail_url') or locals().get('versions_url', 'GitLab API')
-        error_response = locals().get('version_detail_response') or locals().get('response')
-        logger.error(f"解码来自 {request_url} 的 JSON 响应时出错: {json_e}")
-        if error_response is not None:
-            logger.error(f"响应文本: {error_response.text[:500]}...")
+        logger.error(f"解码 GitLab API (项目 {project_id} 的 MR {mr_iid} 版本数据) 的 JSON 响应时出错: {json_e}")
     except Exception as e:
         logger.exception(f"获取/解析项目 {project_id} 中 MR {mr_iid} 的 diff 时发生意外错误:")
 
     return structured_changes, position_info
 
 
+def make_github_head_blob_resolver(owner, repo_name, access_token, head_sha=None, pull_number=None):
+    """
+    返回用于作用域上下文的 head blob 解析函数: (path, file_data) -> (blob_sha, fetch_content)。
+    blob SHA 来自 PR 文件列表或完整 diff 的 index 行 (file_data["head_blob_sha"])，内容通过 git/blobs API 按需获取。
+    GitHub 的 diff 媒体类型的 index 行只有缩写 SHA，此时从 (与通用审查共享、按 head_sha 缓存的) PR 文件列表中
+    取完整 blob SHA，使未修改的文件在后续推送中仍能命中按 blob 缓存的作用域解析结果；
+    仍没有完整 blob SHA 时，退化为以 head_sha:path 为缓存键、通过 contents API 获取。
+    """
+    current_github_api_url = app_configs.get("GITHUB_API_URL", "https://api.github.com")
+    headers = {
+        "Authorization": f"token {access_token}",
+        "Accept": "application/vnd.github.v3+json"
+    }
+    pr_file_blob_shas = None  # 文件路径 -> 完整 blob SHA，第一次需要时获取
+
+    def pr_file_blob_sha(path):
+        nonlocal pr_file_blob_shas
+        if pull_number is None or not head_sha:
+            return None
+        if pr_file_blob_shas is None:
+            try:
+                files_data = _fetch_github_pr_files(owner, repo_name, pull_number, access_token, head_sha) or []
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.warning(f"获取 {owner}/{repo_name}#{pull_number} 的 PR 文件列表失败，按 head_sha:path 获取文件内容: {e}")
+                files_data = []
+            pr_file_blob_shas = {item.get("filename"): item.get("sha") for item in files_data
+                                 if item.get("status") != "removed" and _is_full_blob_sha(item.get("sha"))}
+        return pr_file_blob_shas.get(path)
+
+    def resolve(path, file_data):
+        blob_sha = file_data.get("head_blob_sha") or pr_file_blob_sha(path)
+        if not blob_sha:
+            if not head_sha:
+                return None
+            contents_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/contents/{requests.utils.quote(path)}?ref={head_sha}"
+            return f"{head_sha}:{path}", partial(_fetch_file_content_from_url, contents_url, headers, max_size_bytes=1024*1024)
+        blob_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/git/blobs/{blob_sha}"
+        return blob_sha, partial(_fetch_file_content_from_url, blob_url, headers, max_size_bytes=1024*1024)
+
+    return resolve
+
+
+def make_gitlab_head_blob_resolver(project_id, access_token, head_sha):
+    """
+    返回用于作用域上下文的 head blob 解析函数: (path, file_data) -> (blob_id, fetch_content)。
+    GitLab 的 diff 中没有 blob ID，这里通过 HEAD 请求文件 API 的 X-Gitlab-Blob-Id 响应头获取，
+    缓存未命中时再通过 repository/blobs API 获取内容。
+    """
+    project_config = gitlab_project_configs.get(str(project_id), {})
+    current_gitlab_instance_url = project_config.get("instance_url") or app_configs.get("GITLAB_INSTANCE_URL", "https://gitlab.com")
+    project_api_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}"
+    headers = {"PRIVATE-TOKEN": access_token}
+
+    def resolve(path, file_data):
+        if not head_sha:
+            return None
+        encoded_path = requests.utils.quote(path, safe='')
+        try:
+            response = vcs_request("HEAD", f"{project_api_url}/repository/files/{encoded_path}", priority=PRIORITY_OPTIONAL,
+                                   headers=headers, params={"ref": head_sha}, timeout=30)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"获取 GitLab 文件 {path}@{head_sha[:8]} 的 blob ID 时出错: {e}")
+            return None
+        blob_id = (response.headers or {}).get("X-Gitlab-Blob-Id")
+        if not blob_id:
+            return None
+        blob_url = f"{project_api_url}/repository/blobs/{blob_id}"
+        return blob_id, partial(_fetch_file_content_from_url, blob_url, headers, max_size_bytes=1024*1024)
+
+    return resolve
+
+
+def get_github_changed_files_between_commits(owner, repo_name, base_sha, head_sha, access_token):
+    """
+    使用 GitHub compare API 获取两个 commit 之间变更的文件路径集合 (包含重命名前的旧路径)。
+    获取失败或结果可能被截断时返回 None，调用方应回退到完整审查。
+    """
+    if not access_token or not base_sha or not head_sha:
+        return None
+
+    current_github_api_url = app_configs.get("GITHUB_API_URL", "https://api.github.com")
+    compare_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/compare/{base_sha}...{head_sha}"
+    headers = {
+        "Authorization": f"token {access_token}",
+        "Accept": "application/vnd.github.v3+json"
+    }
+    response = None
+    try:
+        logger.info(f"从 {compare_url} 获取增量变更文件列表。")
+        response = vcs_request("GET", compare_url, headers=headers, timeout=60)
+        response.raise_for_status()
+        compare_data = response.json()
+        files = compare_data.get("files", [])
+        if len(files) >= 300:  # compare API 最多返回 300 个文件，结果可能被截断
+            logger.warning(f"{owner}/{repo_name} {base_sha[:8]}...{head_sha[:8]} 的变更文件数达到 compare API 上限，回退到完整审查。")
+            return None
+        changed_paths = set()
+        for file_item in files:
+            if file_item.get("filename"):
+                changed_paths.add(file_item["filename"])
+            if file_item.get("previous_filename"):
+                changed_paths.add(file_item["previous_filename"])
+        return changed_paths
+    except requests.exceptions.RequestException as e:
+        error_message = f"从 GitHub compare API ({compare_url}) 获取数据时出错: {e}"
+        if response is not None:
+            error_message += f" - 状态: {response.status_code}"
+        logger.warning(error_message)
+        return None
+    except (json.JSONDecodeError, AttributeError) as e:
+        logger.warning(f"解析 GitHub compare API ({compare_url}) 的响应时出错: {e}")
+        return None
+
+
+def get_gitlab_changed_files_between_commits(project_id, from_sha, to_sha, access_token):
+    """
+    使用 GitLab repository compare API 获取两个 commit 之间变更的文件路径集合 (包含重命名前的旧路径)。
+    获取失败时返回 None，调用方应回退到完整审查。
+    """
+    if not access_token or not from_sha or not to_sha:
+        return None
+
+    project_config = gitlab_project_configs.get(str(project_id), {})
+    current_gitlab_instance_url = project_config.get("instance_url") or app_configs.get("GITLAB_INSTANCE_URL", "https://gitlab.com")
+    compare_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/repository/compare"
+    headers = {"PRIVATE-TOKEN": access_token}
+    response = None
+    try:
+        logger.info(f"从 {compare_url} 获取增量变更文件列表 ({from_sha[:8]}...{to_sha[:8]})。")
+        response = vcs_request("GET", compare_url, headers=headers, params={"from": from_sha, "to": to_sha}, timeout=60)
+        response.raise_for_status()
+        compare_data = response.json()
+        if compare_data.get("compare_timeout"):
+            logger.warning(f"GitLab 项目 {project_id} 的 compare 请求超时，结果不完整，回退到完整审查。")
+            return None
+        changed_paths = set()
+        for diff_item in compare_data.get("diffs", []):
+            if diff_item.get("new_path"):
+                changed_paths.add(diff_item["new_path"])
+            if diff_item.get("old_path"):
+                changed_paths.add(diff_item["old_path"])
+        return changed_paths
+    except requests.exceptions.RequestException as e:
+        error_message = f"从 GitLab compare API ({compare_url}) 获取数据时出错: {e}"
+        if response is not None:
+            error_message += f" - 状态: {response.status_code}"
+        logger.warning(error_message)
+        return None
+    except (json.JSONDecodeError, AttributeError) as e:
+        logger.warning(f"解析 GitLab compare API ({compare_url}) 的响应时出错: {e}")
+        return None
+
+
 def _fetch_file_content_from_url(url: str, headers: dict, is_github: bool = False, max_size_bytes: int = None):
     """
     通用辅助函数，用于从给定 URL 获取文件内容。
@@ -199,7 +502,7 @@ def _fetch_file_content_from_url(url: str, headers: dict, is_github: bool = Fals
     增加了 max_size_bytes 参数用于限制通过 API 获取的文件大小。
     """
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = vcs_request("GET", url, priority=PRIORITY_OPTIONAL, headers=headers, timeout=30)
         response.raise_for_status()
 
         if is_github and "application/vnd.github.v3.raw" in headers.get("Accept", ""): # GitHub raw URL
@@ -245,24 +548,47 @@ def _fetch_file_content_from_url(url: str, headers: dict, is_github: bool = Fals
         return None
 
 
+def _cached_file_content(platform: str, identifier: str, pr_mr_id, ref: str, file_path: str, fetcher):
+    """LazyFileContent 的 fetcher：文件在 ref 处的内容按 (仓库, PR/MR, ref) 共享，任务重试时不再重复下载。"""
+    return get_or_fetch_review_artifact(platform, identifier, pr_mr_id, ref, f"content:{file_path}", fetcher)
+
+
+def _github_general_review_file_items(owner, repo_name, pull_number, access_token, head_sha):
+    """
+    返回粗粒度审查的文件条目 (PR 文件 API 的格式)。已知 head_sha 且启用了 diff 媒体类型时，由与详细审查共享的
+    完整 PR diff 生成；diff 过大或获取失败时使用 (同样共享的) PR 文件 API。
+    """
+    if head_sha and app_configs.get("GITHUB_PR_DIFF_MEDIA_TYPE_ENABLED", True):
+        try:
+            diff_text = _fetch_github_pr_diff(owner, repo_name, pull_number, access_token, head_sha)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"以 diff 媒体类型获取 {owner}/{repo_name}#{pull_number} 失败，回退到 PR 文件 API: {e}")
+            diff_text = None
+        if diff_text is not None:
+            return [{
+                "filename": file_diff.path,
+                "previous_filename": file_diff.old_path,
+                "status": file_diff.status,
+                "patch": file_diff.patch or '',
+            } for file_diff in parse_unified_diff(diff_text, build_anchors=False) if file_diff.path]
+    return _fetch_github_pr_files(owner, repo_name, pull_number, access_token, head_sha)
+
+
 def get_github_pr_data_for_general_review(owner: str, repo_name: str, pull_number: int, access_token: str, pr_data: dict):
     """
     为 GitHub PR 获取粗粒度审查所需的数据：文件列表、每个文件的 diff、旧内容和新内容。
-    pr_data 是 GitHub PR webhook 负载中的 'pull_request' 对象。
+    旧内容和新内容是 LazyFileContent 惰性句柄，此处不会下载文件内容。
+    pr_data 是 GitHub PR webhook 负载中的 'pull_request' 对象，其中的 head SHA 用于与详细审查共享 PR diff。
     """
     if not access_token:
         logger.error(f"错误: 仓库 {owner}/{repo_name} 未配置访问令牌。")
         return None
 
     current_github_api_url = app_configs.get("GITHUB_API_URL", "https://api.github.com")
-    files_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/pulls/{pull_number}/files"
+    repo_full_name = f"{owner}/{repo_name}"
     base_sha = pr_data.get('base', {}).get('sha')
-    # head_sha = pr_data.get('head', {}).get('sha') # raw_url is already at head
+    head_sha = pr_data.get('head', {}).get('sha')
 
-    headers_files_api = {
-        "Authorization": f"token {access_token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
     headers_content_api = { # For fetching specific file content (potentially base_sha)
         "Authorization": f"token {access_token}",
         "Accept": "application/vnd.github.v3+json" # Gets JSON with base64 content
@@ -275,15 +601,14 @@ def get_github_pr_data_for_general_review(owner: str, repo_name: str, pull_numbe
     general_review_data = []
 
     try:
-        logger.info(f"从 {files_url} 获取 PR 文件列表 (用于粗粒度审查)。")
-        response = requests.get(files_url, headers=headers_files_api, timeout=60)
-        response.raise_for_status()
-        files_api_data = response.json()
+        logger.info(f"获取 {repo_full_name}#{pull_number} 的 PR 文件列表 (用于粗粒度审查)。")
+        files_api_data = _github_general_review_file_items(owner, repo_name, pull_number, access_token, head_sha)
 
         if not files_api_data:
             logger.info(f"在 {owner}/{repo_name} 的 PR {pull_number} 中未找到文件。")
             return []
 
+        path_filter = get_path_filter("github", repo_full_name)
         for file_item in files_api_data:
             file_path = file_item.get('filename')
             status = file_item.get('status') # 'added', 'modified', 'removed', 'renamed'
@@ -291,26 +616,48 @@ def get_github_pr_data_for_general_review(owner: str, repo_name: str, pull_numbe
             raw_url = file_item.get('raw_url') # Content at HEAD
             previous_filename = file_item.get('previous_filename')
 
+            skip_reason = path_filter.skip_reason(file_path, diff_text, previous_filename)
+            if skip_reason: # 在获取文件内容之前跳过
+                logger.info(f"跳过文件 {file_path}: {skip_reason}。")
+                continue
+
             file_data_entry = {
                 "file_path": file_path,
                 "status": status,
                 "diff_text": diff_text,
-                "old_content": None
+                "old_content": None,
+                "new_content": None
             }
 
+            # 新内容 (HEAD) 同样是惰性句柄，用于提取变更所在的代码块
+            if status != 'removed' and file_path:
+                if head_sha:
+                    new_content_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/contents/{requests.utils.quote(file_path)}?ref={head_sha}"
+                    file_data_entry["new_content"] = LazyFileContent(
+                        partial(_cached_file_content, "github", repo_full_name, pull_number, head_sha, file_path,
+                                partial(_fetch_file_content_from_url, new_content_url, headers_content_api, is_github=False, max_size_bytes=1024*1024)),
+                        f"{file_path}@{head_sha[:8]}")
+                elif raw_url:
+                    file_data_entry["new_content"] = LazyFileContent(
+                        partial(_fetch_file_content_from_url, raw_url, headers_raw_content_api, is_github=True),
+                        f"{file_path}@head")
+
             # 获取旧内容 (适用于 'modified', 'removed', 'renamed')
             path_for_old_content = previous_filename if status == 'renamed' and previous_filename else file_path
             if status in ['modified', 'removed', 'renamed'] and base_sha and path_for_old_content:
                 # Check size if available (GitHub files API doesn't give old size directly)
                 # We'll attempt to fetch and let _fetch_file_content_from_url handle large/binary via its internal JSON parsing if not raw
-                old_content_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/contents/{path_for_old_content}?ref={base_sha}"
-                logger.info(f"获取旧内容: {path_for_old_content} (ref: {base_sha}) 从 {old_content_url}")
-                file_data_entry["old_content"] = _fetch_file_content_from_url(old_content_url, headers_content_api, is_github=False, max_size_bytes=1024*1024) # Not raw, expect JSON, add size limit
+                old_content_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/contents/{requests.utils.quote(path_for_old_content)}?ref={base_sha}"
+                # 惰性句柄: 只有 prompt 构建器需要 hunk 周围的上下文时才会真正请求
+                file_data_entry["old_content"] = LazyFileContent(
+                    partial(_cached_file_content, "github", repo_full_name, pull_number, base_sha, path_for_old_content,
+                            partial(_fetch_file_content_from_url, old_content_url, headers_content_api, is_github=False, max_size_bytes=1024*1024)), # Not raw, expect JSON, add size limit
+                    f"{path_for_old_content}@{base_sha[:8]}")
 
             general_review_data.append(file_data_entry)
 
     except requests.exceptions.RequestException as e:
-        logger.error(f"从 GitHub API ({files_url}) 获取粗粒度审查数据时出错: {e}")
+        logger.error(f"从 GitHub API 获取 {repo_full_name}#{pull_number} 的粗粒度审查数据时出错: {e}")
         return None # Indicate error
     except Exception as e:
         logger.exception(f"为 {owner}/{repo_name} PR {pull_number} 准备粗粒度审查数据时发生意外错误:")
@@ -321,9 +668,11 @@ def get_github_pr_data_for_general_review(owner: str, repo_name: str, pull_numbe
 
 def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_token: str, mr_attrs: dict, position_info: dict):
     """
-    为 GitLab MR 获取粗粒度审查所需的数据：文件列表、每个文件的 diff、旧内容和新内容。
+    为 GitLab MR 获取粗粒度审查所需的数据：文件列表、每个文件的 diff、旧内容和新内容 (LazyFileContent 惰性句柄)。
     mr_attrs 是 GitLab MR webhook 负载中的 'object_attributes'。
-    position_info 包含 'base_commit_sha', 'start_commit_sha', 'head_commit_sha'。
+    position_info 包含 'base_commit_sha', 'start_commit_sha', 'head_commit_sha' (来自 webhook 负载，可能不完整)。
+    如果未提供 'latest_version_id'，会获取一次 MR 版本列表，并用最新版本的 SHA 原地更新 position_info，
+    以便调用方无需再单独请求版本信息。
     """
     if not access_token:
         logger.error(f"错误: 项目 {project_id} 未配置访问令牌。")
@@ -333,44 +682,50 @@ def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_t
     project_specific_instance_url = project_config.get("instance_url")
     current_gitlab_instance_url = project_specific_instance_url or app_configs.get("GITLAB_INSTANCE_URL", "https://gitlab.com")
 
-    base_sha = position_info.get("base_commit_sha")
-    head_sha = position_info.get("head_commit_sha")
-    if not head_sha: # Fallback to last_commit from webhook payload if not in position_info
-        head_sha = mr_attrs.get('last_commit', {}).get('id')
-
-    if not base_sha or not head_sha:
-        logger.error(f"GitLab MR {project_id}#{mr_iid}: 缺少 base_sha 或 head_sha，无法获取文件内容。Base: {base_sha}, Head: {head_sha}")
-        return None
-
     headers = {"PRIVATE-TOKEN": access_token}
     general_review_data = []
 
     # GitLab MR changes are typically fetched via versions API then details of latest version
     # This gives us the diffs. We then fetch content for each file.
-    latest_version_id = position_info.get("latest_version_id") # Assuming this is passed in position_info
-    if not latest_version_id: # Fallback: try to get versions if not pre-fetched
-        versions_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/versions"
+    # 版本列表和版本详情按 webhook 中的最新提交与详细审查共享
+    payload_head_sha = position_info.get("head_commit_sha") or mr_attrs.get('last_commit', {}).get('id')
+    latest_version_id = position_info.get("latest_version_id")
+    if not latest_version_id: # 未预先获取版本信息时，在此获取一次并更新 position_info
         try:
-            logger.info(f"从 {versions_url} 获取 MR 版本 (用于粗粒度审查)。")
-            versions_response = requests.get(versions_url, headers=headers, timeout=30)
-            versions_response.raise_for_status()
-            versions_data = versions_response.json()
+            logger.info(f"获取 GitLab MR {project_id}#{mr_iid} 的版本 (用于粗粒度审查)。")
+            versions_data = _fetch_gitlab_mr_versions(current_gitlab_instance_url, project_id, mr_iid, headers,
+                                                      payload_head_sha)
             if versions_data:
-                latest_version_id = versions_data[0].get("id")
+                latest_version = versions_data[0]
+                latest_version_id = latest_version.get("id")
+                position_info["base_commit_sha"] = latest_version.get("base_commit_sha") or position_info.get("base_commit_sha")
+                position_info["start_commit_sha"] = latest_version.get("start_commit_sha") or position_info.get("start_commit_sha")
+                position_info["head_commit_sha"] = latest_version.get("head_commit_sha") or position_info.get("head_commit_sha")
+                position_info["latest_version_id"] = latest_version_id
+                logger.info(f"从最新版本 (ID: {latest_version_id}) 提取的位置信息: {position_info}")
             else:
                 logger.warning(f"GitLab MR {project_id}#{mr_iid}: 未找到 MR 版本。")
                 return []
         except requests.exceptions.RequestException as e:
-            logger.error(f"从 GitLab API ({versions_url}) 获取 MR 版本时出错: {e}")
+            logger.error(f"从 GitLab API 获取 MR {project_id}#{mr_iid} 的版本时出错: {e}")
             return None
-    
-    version_detail_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/versions/{latest_version_id}"
+
+    base_sha = position_info.get("base_commit_sha")
+    head_sha = position_info.get("head_commit_sha")
+    if not head_sha: # Fallback to last_commit from webhook payload if not in position_info
+        head_sha = mr_attrs.get('last_commit', {}).get('id')
+        position_info["head_commit_sha"] = head_sha
+
+    if not base_sha or not head_sha:
+        logger.error(f"GitLab MR {project_id}#{mr_iid}: 缺少 base_sha 或 head_sha，无法获取文件内容。Base: {base_sha}, Head: {head_sha}")
+        return None
+
     try:
-        logger.info(f"从 {version_detail_url} 获取 MR 版本详情 (用于粗粒度审查)。")
-        detail_response = requests.get(version_detail_url, headers=headers, timeout=60)
-        detail_response.raise_for_status()
-        version_detail_data = detail_response.json()
+        logger.info(f"获取 GitLab MR {project_id}#{mr_iid} 的版本 {latest_version_id} 详情 (用于粗粒度审查)。")
+        version_detail_data = _fetch_gitlab_mr_version_detail(current_gitlab_instance_url, project_id, mr_iid, headers,
+                                                              latest_version_id, payload_head_sha)
         api_diffs = version_detail_data.get('diffs', [])
+        path_filter = get_path_filter("gitlab", project_id)
 
         for diff_item in api_diffs:
             new_path = diff_item.get('new_path')
@@ -380,6 +735,11 @@ def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_t
             is_deleted = diff_item.get('deleted_file', False)
             is_new = diff_item.get('new_file', False)
 
+            skip_reason = path_filter.skip_reason(new_path, diff_text, old_path if is_renamed else None)
+            if skip_reason: # 在获取文件内容之前跳过
+                logger.info(f"跳过文件 {new_path}: {skip_reason}。")
+                continue
+
             status = "modified"
             if is_new: status = "added"
             if is_deleted: status = "deleted"
@@ -389,24 +749,37 @@ def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_t
                 "file_path": new_path, # For deleted files, new_path is the path of the deleted file
                 "status": status,
                 "diff_text": diff_text,
-                "old_content": None
+                "old_content": None,
+                "new_content": None
             }
 
             # GitLab file content API: /projects/:id/repository/files/:file_path?ref=:sha
             # File path needs to be URL-encoded.
 
+            # 新内容 (HEAD) 的惰性句柄，用于提取变更所在的代码块
+            if not is_deleted and new_path:
+                encoded_new_path = requests.utils.quote(new_path, safe='')
+                new_content_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/repository/files/{encoded_new_path}?ref={head_sha}"
+                file_data_entry["new_content"] = LazyFileContent(
+                    partial(_cached_file_content, "gitlab", str(project_id), mr_iid, head_sha, new_path,
+                            partial(_fetch_file_content_from_url, new_content_url, headers, max_size_bytes=1024*1024)),
+                    f"{new_path}@{head_sha[:8]}")
+
             # Get old content (if not new file)
             path_for_old_content = old_path if old_path else new_path # If renamed, old_path is correct. If modified, old_path is same as new_path.
             if not is_new and path_for_old_content:
                 encoded_old_path = requests.utils.quote(path_for_old_content, safe='')
                 old_content_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/repository/files/{encoded_old_path}?ref={base_sha}"
-                logger.info(f"获取旧内容 (GitLab): {path_for_old_content} (ref: {base_sha})")
-                file_data_entry["old_content"] = _fetch_file_content_from_url(old_content_url, headers, max_size_bytes=1024*1024)
+                # 惰性句柄: 只有 prompt 构建器需要 hunk 周围的上下文时才会真正请求
+                file_data_entry["old_content"] = LazyFileContent(
+                    partial(_cached_file_content, "gitlab", str(project_id), mr_iid, base_sha, path_for_old_content,
+                            partial(_fetch_file_content_from_url, old_content_url, headers, max_size_bytes=1024*1024)),
+                    f"{path_for_old_content}@{base_sha[:8]}")
             
             general_review_data.append(file_data_entry)
 
     except requests.exceptions.RequestException as e:
-        logger.error(f"从 GitLab API ({version_detail_url}) 获取粗粒度审查数据时出错: {e}")
+        logger.error(f"从 GitLab API 获取 MR {project_id}#{mr_iid} 的粗粒度审查数据时出错: {e}")
         return None
     except Exception as e:
         logger.exception(f"为 GitLab MR {project_id}#{mr_iid} 准备粗粒度审查数据时发生意外错误:")
@@ -415,8 +788,150 @@ def get_gitlab_mr_data_for_general_review(project_id: str, mr_iid: int, access_t
     return general_review_data
 
 
-def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, head_sha):
-    """向 GitHub Pull Request 的特定行添加评论"""
+def _format_review_comment_body(review: dict, fingerprint: str = None) -> str:
+    """将单条审查意见格式化为评论正文 (Markdown)。提供 fingerprint 时在末尾附加隐藏的指纹标记。"""
+    body = f"""**AI Review [{review.get('severity', 'N/A').upper()}]**: {review.get('category', 'General')}
+
+**分析**: {review.get('analysis', 'N/A')}
+
+**建议**:
+```suggestion
+{review.get('suggestion', 'N/A')}
+```
+"""
+    if fingerprint:
+        body += f"\n{format_fingerprint_marker(fingerprint)}\n"
+    return body
+
+
+def _format_folded_comments_section(folded_items: list, fingerprints: dict = None) -> str:
+    """将无法定位到具体行的审查意见合并为评审正文中的一个段落。"""
+    if not folded_items:
+        return ""
+    fingerprints = fingerprints or {}
+    sections = ["---", f"**以下 {len(folded_items)} 条审查意见无法定位到具体代码行:**"]
+    for target_desc, review in folded_items:
+        sections.append(f"#### {target_desc}\n\n{_format_review_comment_body(review, fingerprints.get(id(review)))}")
+    return "\n\n".join(sections)
+
+
+def list_github_pr_review_comment_bodies(owner, repo_name, pull_number, access_token):
+    """
+    分页列出 GitHub PR 上已有的行评论和评审正文，用于初始化评论指纹索引。
+    失败时返回 None。
+    """
+    current_github_api_url = app_configs.get("GITHUB_API_URL", "https://api.github.com")
+    headers = {
+        "Authorization": f"token {access_token}",
+        "Accept": "application/vnd.github.v3+json"
+    }
+    bodies = []
+    for list_url in (f"{current_github_api_url}/repos/{owner}/{repo_name}/pulls/{pull_number}/comments?per_page=100",
+                     f"{current_github_api_url}/repos/{owner}/{repo_name}/pulls/{pull_number}/reviews?per_page=100"):
+        next_url = list_url
+        try:
+            while next_url:
+                response = vcs_request("GET", next_url, headers=headers, timeout=30)
+                response.raise_for_status()
+                bodies.extend(item.get("body") or "" for item in response.json())
+                next_url = (getattr(response, "links", None) or {}).get("next", {}).get("url")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"列出 GitHub PR #{pull_number} 的已有评论时出错 ({next_url}): {e}")
+            return None
+    return bodies
+
+
+def list_gitlab_mr_note_bodies(project_id, mr_iid, access_token):
+    """
+    分页列出 GitLab MR 上已有的评论 (notes)，用于初始化评论指纹索引。
+    失败时返回 None。
+    """
+    project_config = gitlab_project_configs.get(str(project_id), {})
+    current_gitlab_instance_url = project_config.get("instance_url") or app_configs.get("GITLAB_INSTANCE_URL", "https://gitlab.com")
+    notes_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/notes"
+    headers = {"PRIVATE-TOKEN": access_token}
+    bodies = []
+    page = "1"
+    try:
+        while page:
+            response = vcs_request("GET", notes_url, headers=headers, params={"per_page": 100, "page": page}, timeout=30)
+            response.raise_for_status()
+            bodies.extend(note.get("body") or "" for note in response.json())
+            page = (response.headers or {}).get("X-Next-Page")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error(f"列出 GitLab MR {mr_iid} 的已有评论时出错: {e}")
+        return None
+    return bodies
+
+
+def _skip_posted_reviews(reviews, fingerprint_index, line_content_map):
+    """使用评论指纹索引过滤已发布过的审查意见。返回 (待发布的意见, {id(review): fingerprint}, 重复数量)。"""
+    if fingerprint_index is None:
+        return reviews, {}, 0
+    try:
+        return fingerprint_index.filter_new(reviews, line_content_map)
+    except Exception:
+        logger.exception("查询评论指纹索引时出错，将发布全部审查意见:")
+        return reviews, {}, 0
+
+
+def collect_line_anchors(structured_changes: dict) -> dict:
+    """从 structured_changes 中收集每个文件的 LineAnchorIndex: {path: LineAnchorIndex}。"""
+    return {path: file_data["line_anchors"] for path, file_data in (structured_changes or {}).items()
+            if file_data.get("line_anchors")}
+
+
+def _anchor_reviews(reviews, line_anchors):
+    """
+    发布前在本地校验审查意见的行号：不在 diff 中的行号吸附到同一文件最近的变更行，
+    文件不在 diff 中或没有可评论行的意见去掉行号 (合并到正文)，避免行评论请求被 VCS 以 422 拒绝。
+    校验后的 lines 为规范位置：上下文行同时包含 old/new，新增行只有 new，删除行只有 old。
+    未提供 line_anchors 时原样返回。
+    """
+    if not line_anchors:
+        return reviews
+    anchored = []
+    snapped_count = folded_count = 0
+    for review in reviews:
+        if not isinstance(review, dict) or not review.get("file"):
+            anchored.append(review)
+            continue
+        lines_info = review.get("lines") or {}
+        if lines_info.get("new") is None and lines_info.get("old") is None:
+            anchored.append(review)
+            continue
+        index = line_anchors.get(review["file"])
+        position = index.resolve(lines_info.get("new"), lines_info.get("old")) if index else None
+        if position is None:
+            folded_count += 1
+            anchored.append(dict(review, lines={"old": None, "new": None}))
+            continue
+        new_line, old_line = position
+        requested = (lines_info.get("new"), lines_info.get("old"))
+        if (new_line is None or new_line != as_line_number(requested[0])) and (old_line is None or old_line != as_line_number(requested[1])):
+            snapped_count += 1
+            logger.info(f"审查意见的行号 {review['file']} new={requested[0]} old={requested[1]} 不在 diff 中，"
+                        f"已吸附到 new={new_line} old={old_line}。")
+        anchored.append(dict(review, lines={"old": old_line, "new": new_line}))
+    if snapped_count or folded_count:
+        logger.info(f"行号校验: {snapped_count} 条意见吸附到最近的变更行，{folded_count} 条无法定位的意见将合并到正文。")
+    return anchored
+
+
+def _record_posted_fingerprints(fingerprint_index, fingerprints, posted_reviews):
+    if fingerprint_index is None or not fingerprints:
+        return
+    try:
+        fingerprint_index.add(fingerprints.get(id(review)) for review in posted_reviews)
+    except Exception:
+        logger.exception("记录已发布评论指纹时出错:")
+
+
+def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, head_sha, line_anchors=None):
+    """
+    向 GitHub Pull Request 的特定行添加评论。提供 line_anchors 时先在本地校验/吸附行号。
+    请求失败 (包括回退为通用评论后仍失败) 时写入死信队列稍后重试。
+    """
     if not access_token:
         logger.error("错误: 无法添加评论，缺少访问令牌。")
         return False
@@ -432,15 +947,8 @@ def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, h
         "Content-Type": "application/json"
     }
 
-    body = f"""**AI Review [{review.get('severity', 'N/A').upper()}]**: {review.get('category', 'General')}
-
-**分析**: {review.get('analysis', 'N/A')}
-
-**建议**:
-```suggestion
-{review.get('suggestion', 'N/A')}
-```
-"""
+    review = _anchor_reviews([review], line_anchors)[0]
+    body = _format_review_comment_body(review)
 
     lines_info = review.get("lines", {})
     file_path = review.get("file")
@@ -460,6 +968,11 @@ def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, h
         payload["line"] = lines_info["new"]
         line_comment_possible = True
         target_desc = f"file {file_path} line {lines_info['new']}"
+    elif line_anchors and lines_info and lines_info.get("old") is not None:
+        payload["line"] = lines_info["old"]
+        payload["side"] = "LEFT"
+        line_comment_possible = True
+        target_desc = f"文件 {file_path} 旧行号 {lines_info['old']}"
 
     if not line_comment_possible:
         current_github_api_url = app_configs.get("GITHUB_API_URL", "https://api.github.com")
@@ -475,7 +988,7 @@ def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, h
         logger.info(f"尝试向 {target_desc} 添加行评论")
 
     try:
-        response = requests.post(current_url_to_use, headers=headers, json=current_payload_to_use, timeout=30)
+        response = vcs_request("POST", current_url_to_use, priority=PRIORITY_COMMENT, headers=headers, json=current_payload_to_use, timeout=30)
         response.raise_for_status()
         logger.info(f"成功向 GitHub PR #{pull_number} ({target_desc}) 添加评论")
         return True
@@ -491,7 +1004,7 @@ def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, h
             general_comment_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/issues/{pull_number}/comments"
             fallback_payload = {"body": f"**(评论原针对 {target_desc})**\n\n{body}"}
             try:
-                fallback_response = requests.post(general_comment_url, headers=headers, json=fallback_payload,
+                fallback_response = vcs_request("POST", general_comment_url, priority=PRIORITY_COMMENT, headers=headers, json=fallback_payload,
                                                   timeout=30)
                 fallback_response.raise_for_status()
                 logger.info(f"行评论失败后，成功作为通用 PR 讨论添加评论。")
@@ -501,15 +1014,35 @@ def add_github_pr_comment(owner, repo_name, pull_number, access_token, review, h
                 if 'fallback_response' in locals() and fallback_response is not None:
                     fb_error_message += f" - 状态: {fallback_response.status_code} - 响应体: {fallback_response.text[:500]}"
                 logger.error(fb_error_message)
+                _dead_letter_github_comment(owner, repo_name, pull_number, review, head_sha, fallback_e)
                 return False
+        _dead_letter_github_comment(owner, repo_name, pull_number, review, head_sha, e)
         return False
     except Exception as e:
         logger.exception(f"添加 GitHub 评论 ({target_desc}) 时发生意外错误:")
+        _dead_letter_github_comment(owner, repo_name, pull_number, review, head_sha, e)
         return False
 
 
-def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_info):
-    """向 GitLab Merge Request 的特定行添加评论"""
+def _dead_letter_github_comment(owner, repo_name, pull_number, review, head_sha, error):
+    record_dead_letter(
+        DEAD_LETTER_GITHUB_COMMENT,
+        {"owner": owner, "repo_name": repo_name, "pull_number": pull_number, "review": review, "head_sha": head_sha},
+        f"{type(error).__name__}: {error}",
+        description=f"GitHub PR {owner}/{repo_name}#{pull_number} 文件 {review.get('file')} 的行评论")
+
+
+def _replay_github_comment(owner, repo_name, pull_number, review, head_sha):
+    """死信队列的重放函数 (review 已在首次发布时完成行号校验)。"""
+    access_token = resolve_access_token("github", f"{owner}/{repo_name}")
+    return add_github_pr_comment(owner, repo_name, pull_number, access_token, review, head_sha)
+
+
+def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_info, line_anchors=None):
+    """
+    向 GitLab Merge Request 的特定行添加评论。提供 line_anchors 时先在本地校验/吸附行号。
+    请求失败 (包括回退为通用讨论后仍失败) 时写入死信队列稍后重试。
+    """
     if not access_token:
         logger.error("错误: 无法添加评论，缺少访问令牌。")
         return False
@@ -531,15 +1064,8 @@ def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_inf
     comment_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/discussions"
     headers = {"PRIVATE-TOKEN": access_token, "Content-Type": "application/json"}
 
-    body = f"""**AI Review [{review.get('severity', 'N/A').upper()}]**: {review.get('category', 'General')}
-
-**分析**: {review.get('analysis', 'N/A')}
-
-**建议**:
-```suggestion
-{review.get('suggestion', 'N/A')}
-```
-"""
+    review = _anchor_reviews([review], line_anchors)[0]
+    body = _format_review_comment_body(review)
     position_data = {
         "base_sha": position_info.get("base_sha"),
         "start_sha": position_info.get("start_sha"),
@@ -560,6 +1086,8 @@ def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_inf
         position_data["new_path"] = file_path
         position_data["new_line"] = lines_info["new"]
         position_data["old_path"] = old_file_path if old_file_path else file_path
+        if line_anchors and lines_info.get("old") is not None:  # 上下文行需要同时提供新旧行号
+            position_data["old_line"] = lines_info["old"]
         line_comment_possible = True
         target_desc = f"file {file_path} line {lines_info['new']}"
     elif lines_info and lines_info.get("old") is not None:
@@ -581,7 +1109,7 @@ def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_inf
 
     response_obj = None  # Define response_obj to ensure it's available in except block
     try:
-        response_obj = requests.post(comment_url, headers=headers, json=payload, timeout=30)
+        response_obj = vcs_request("POST", comment_url, priority=PRIORITY_COMMENT, headers=headers, json=payload, timeout=30)
         response_obj.raise_for_status()
         logger.info(f"成功向 GitLab MR {mr_iid} ({target_desc}) 添加评论")
         return True
@@ -596,7 +1124,7 @@ def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_inf
             fallback_payload = {"body": f"**(评论原针对 {target_desc})**\n\n{body}"}
             fallback_response_obj = None
             try:
-                fallback_response_obj = requests.post(comment_url, headers=headers, json=fallback_payload, timeout=30)
+                fallback_response_obj = vcs_request("POST", comment_url, priority=PRIORITY_COMMENT, headers=headers, json=fallback_payload, timeout=30)
                 fallback_response_obj.raise_for_status()
                 logger.info(f"位置评论失败后，成功作为通用讨论添加评论。")
                 return True
@@ -605,15 +1133,326 @@ def add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_inf
                 if fallback_response_obj is not None:
                     fb_error_message += f" - 状态: {fallback_response_obj.status_code} - 响应体: {fallback_response_obj.text[:500]}"
                 logger.error(fb_error_message)
+                _dead_letter_gitlab_comment(project_id, mr_iid, review, position_info, fallback_e)
                 return False
+        _dead_letter_gitlab_comment(project_id, mr_iid, review, position_info, e)
         return False
     except Exception as e:
         logger.exception(f"添加 GitLab 评论 ({target_desc}) 时发生意外错误:")
+        _dead_letter_gitlab_comment(project_id, mr_iid, review, position_info, e)
+        return False
+
+
+def _dead_letter_gitlab_comment(project_id, mr_iid, review, position_info, error):
+    record_dead_letter(
+        DEAD_LETTER_GITLAB_COMMENT,
+        {"project_id": str(project_id), "mr_iid": mr_iid, "review": review,
+         "position_info": {key: position_info.get(key) for key in ("base_sha", "start_sha", "head_sha")}},
+        f"{type(error).__name__}: {error}",
+        description=f"GitLab MR {project_id}#{mr_iid} 文件 {review.get('file')} 的行评论")
+
+
+def _replay_gitlab_comment(project_id, mr_iid, review, position_info):
+    """死信队列的重放函数 (review 已在首次发布时完成行号校验)。"""
+    access_token = resolve_access_token("gitlab", str(project_id))
+    return add_gitlab_mr_comment(project_id, mr_iid, access_token, review, position_info)
+
+
+def post_github_pr_review_batch(owner, repo_name, pull_number, access_token, reviews, head_sha, summary_text="",
+                                fingerprint_index=None, line_content_map=None, line_anchors=None):
+    """
+    将所有审查意见作为一个 GitHub Pull Request Review 一次性发布。
+    可定位到行的意见作为 review 的行评论，其余意见合并进 review 正文。
+    提供 line_anchors ({path: LineAnchorIndex}) 时先在本地校验并吸附行号；
+    如果 GitHub 仍拒绝行评论 (例如 422 行号不在 diff 中)，则将全部意见合并到正文后只重试一次。
+    提供 fingerprint_index (CommentFingerprintIndex) 时跳过已发布过的相同意见，并在发布成功后记录新指纹。
+    发布失败时整批意见写入死信队列稍后重试。
+    返回 (成功发布的意见数, 失败的意见数)。
+    """
+    if not access_token:
+        logger.error("错误: 无法发布批量评审，缺少访问令牌。")
+        return 0, len(reviews)
+    if not head_sha:
+        logger.error("错误: 无法发布批量评审，缺少 head_sha。")
+        return 0, len(reviews)
+    reviews = _anchor_reviews(reviews, line_anchors)
+    reviews, fingerprints, duplicate_count = _skip_posted_reviews(reviews, fingerprint_index, line_content_map)
+    if not reviews:
+        return 0, 0
+    if duplicate_count:
+        summary_text = f"{summary_text}\n\n(其中 {duplicate_count} 条此前已发布过，本次省略。)" if summary_text else summary_text
+
+    current_github_api_url = app_configs.get("GITHUB_API_URL", "https://api.github.com")
+    review_url = f"{current_github_api_url}/repos/{owner}/{repo_name}/pulls/{pull_number}/reviews"
+    headers = {
+        "Authorization": f"token {access_token}",
+        "Accept": "application/vnd.github.v3+json",
+        "Content-Type": "application/json"
+    }
+
+    inline_comments = []
+    inline_items = []
+    folded_items = []
+    skipped_count = 0
+    for review in reviews:
+        file_path = review.get("file") if isinstance(review, dict) else None
+        if not file_path:
+            logger.warning(f"警告: 跳过无效或缺少 'file' 路径的审查项: {review}")
+            skipped_count += 1
+            continue
+        lines_info = review.get("lines") or {}
+        if lines_info.get("new") is not None:
+            inline_comments.append({"path": file_path, "line": lines_info["new"], "side": "RIGHT",
+                                    "body": _format_review_comment_body(review, fingerprints.get(id(review)))})
+            inline_items.append((f"文件 {file_path} 第 {lines_info['new']} 行", review))
+        elif lines_info.get("old") is not None:
+            inline_comments.append({"path": file_path, "line": lines_info["old"], "side": "LEFT",
+                                    "body": _format_review_comment_body(review, fingerprints.get(id(review)))})
+            inline_items.append((f"文件 {file_path} 旧行号 {lines_info['old']}", review))
+        else:
+            folded_items.append((f"文件 {file_path}", review))
+
+    def _build_body(items_to_fold):
+        parts = [summary_text or f"**AI Code Review**: 共 {len(inline_items) + len(folded_items)} 条审查意见。"]
+        folded_section = _format_folded_comments_section(items_to_fold, fingerprints)
+        if folded_section:
+            parts.append(folded_section)
+        return "\n\n".join(parts)
+
+    payload = {
+        "commit_id": head_sha,
+        "event": "COMMENT",
+        "body": _build_body(folded_items),
+        "comments": inline_comments
+    }
+
+    response = None
+    try:
+        logger.info(f"尝试向 GitHub PR #{pull_number} 发布批量评审: {len(inline_comments)} 条行评论, {len(folded_items)} 条合并到正文。")
+        response = vcs_request("POST", review_url, priority=PRIORITY_COMMENT, headers=headers, json=payload, timeout=60)
+        response.raise_for_status()
+        logger.info(f"成功向 GitHub PR #{pull_number} 发布批量评审。")
+        _record_posted_fingerprints(fingerprint_index, fingerprints, reviews)
+        return len(inline_items) + len(folded_items), skipped_count
+    except requests.exceptions.RequestException as e:
+        error_message = f"发布 GitHub 批量评审时出错: {e}"
+        if response is not None:
+            error_message += f" - 状态: {response.status_code} - 响应体: {response.text[:500]}"
+        logger.error(error_message)
+        if response is None or response.status_code != 422 or not inline_comments:
+            _dead_letter_github_review_batch(owner, repo_name, pull_number, reviews, head_sha, summary_text,
+                                             line_content_map, e)
+            return 0, len(reviews)
+    except Exception as e:
+        logger.exception("发布 GitHub 批量评审时发生意外错误:")
+        _dead_letter_github_review_batch(owner, repo_name, pull_number, reviews, head_sha, summary_text,
+                                         line_content_map, e)
+        return 0, len(reviews)
+
+    # 422: 至少有一条行评论无法定位。将所有意见合并到正文，仅重试一次。
+    logger.warning("由于行评论定位失败，将所有审查意见合并到评审正文后重试一次。")
+    fallback_payload = {
+        "commit_id": head_sha,
+        "event": "COMMENT",
+        "body": _build_body(inline_items + folded_items)
+    }
+    fallback_response = None
+    try:
+        fallback_response = vcs_request("POST", review_url, priority=PRIORITY_COMMENT, headers=headers, json=fallback_payload, timeout=60)
+        fallback_response.raise_for_status()
+        logger.info(f"行评论定位失败后，成功以单条评审正文的形式向 GitHub PR #{pull_number} 发布全部审查意见。")
+        _record_posted_fingerprints(fingerprint_index, fingerprints, reviews)
+        return len(inline_items) + len(folded_items), skipped_count
+    except Exception as fallback_e:
+        fb_error_message = f"发布回退的 GitHub 批量评审时出错: {fallback_e}"
+        if fallback_response is not None:
+            fb_error_message += f" - 状态: {fallback_response.status_code} - 响应体: {fallback_response.text[:500]}"
+        logger.error(fb_error_message)
+        _dead_letter_github_review_batch(owner, repo_name, pull_number, reviews, head_sha, summary_text,
+                                         line_content_map, fallback_e)
+        return 0, len(reviews)
+
+
+def _anchored_line_contents(reviews, line_content_map) -> list:
+    """审查意见所锚定的行内容 [[path, side, 行号, 内容], ...]，使重放时计算出与首次发布相同的 (按行内容锚定的) 指纹。"""
+    line_contents = []
+    for review in reviews:
+        if not isinstance(review, dict) or not line_content_map:
+            continue
+        lines_info = review.get("lines") or {}
+        for side in ("new", "old"):
+            key = (review.get("file"), side, lines_info.get(side))
+            if key in line_content_map:
+                line_contents.append([*key, line_content_map[key]])
+    return line_contents
+
+
+def _dead_letter_github_review_batch(owner, repo_name, pull_number, reviews, head_sha, summary_text, line_content_map,
+                                     error):
+    record_dead_letter(
+        DEAD_LETTER_GITHUB_REVIEW_BATCH,
+        {"owner": owner, "repo_name": repo_name, "pull_number": pull_number, "reviews": reviews, "head_sha": head_sha,
+         "summary_text": summary_text, "line_contents": _anchored_line_contents(reviews, line_content_map)},
+        f"{type(error).__name__}: {error}",
+        description=f"GitHub PR {owner}/{repo_name}#{pull_number} 的批量评审 ({len(reviews)} 条意见)")
+
+
+def _replay_github_review_batch(owner, repo_name, pull_number, reviews, head_sha, summary_text, line_contents=()):
+    """死信队列的重放函数：重新发布整批意见，期间已发布过的相同意见通过指纹跳过。"""
+    access_token = resolve_access_token("github", f"{owner}/{repo_name}")
+    fingerprint_index = CommentFingerprintIndex(
+        'github', f"{owner}/{repo_name}", str(pull_number),
+        seed_loader=lambda: list_github_pr_review_comment_bodies(owner, repo_name, pull_number, access_token)
+    )
+    line_content_map = {(path, side, line): content for path, side, line, content in line_contents}
+    _, comments_failed = post_github_pr_review_batch(owner, repo_name, pull_number, access_token, reviews, head_sha,
+                                                     summary_text=summary_text, fingerprint_index=fingerprint_index,
+                                                     line_content_map=line_content_map)
+    return comments_failed == 0
+
+
+def post_gitlab_mr_review_batch(project_id, mr_iid, access_token, reviews, position_info, summary_text="",
+                                fingerprint_index=None, line_content_map=None, line_anchors=None):
+    """
+    使用 GitLab 草稿评论 (draft notes) 批量发布审查意见，最后通过 bulk_publish 一次性发布。
+    提供 line_anchors ({path: LineAnchorIndex}) 时先在本地校验并吸附行号；
+    仍无法创建带位置草稿的意见会合并到一条汇总草稿中，而不是逐条回退重试。
+    提供 fingerprint_index (CommentFingerprintIndex) 时跳过已发布过的相同意见，并在发布成功后记录新指纹。
+    bulk_publish 失败时 (草稿已保存在 GitLab 上) 写入死信队列，稍后重新发布。
+    返回 (成功发布的意见数, 失败的意见数)。
+    """
+    if not access_token:
+        logger.error("错误: 无法发布批量评审，缺少访问令牌。")
+        return 0, len(reviews)
+    reviews = _anchor_reviews(reviews, line_anchors)
+    reviews, fingerprints, duplicate_count = _skip_posted_reviews(reviews, fingerprint_index, line_content_map)
+    if not reviews:
+        return 0, 0
+    if duplicate_count:
+        summary_text = f"{summary_text}\n\n(其中 {duplicate_count} 条此前已发布过，本次省略。)" if summary_text else summary_text
+
+    project_config = gitlab_project_configs.get(str(project_id), {})
+    current_gitlab_instance_url = project_config.get("instance_url") or app_configs.get("GITLAB_INSTANCE_URL", "https://gitlab.com")
+    mr_api_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}"
+    draft_notes_url = f"{mr_api_url}/draft_notes"
+    headers = {"PRIVATE-TOKEN": access_token, "Content-Type": "application/json"}
+
+    has_position = bool(position_info and position_info.get("head_sha") and position_info.get("base_sha")
+                        and position_info.get("start_sha"))
+    if not has_position:
+        logger.warning(f"GitLab MR {mr_iid}: 缺少位置信息 (head_sha/base_sha/start_sha)，所有意见将合并为一条汇总评论。")
+
+    drafted_reviews = []
+    folded_items = []
+    skipped_count = 0
+    for review in reviews:
+        file_path = review.get("file") if isinstance(review, dict) else None
+        if not file_path:
+            logger.warning(f"警告: 跳过无效或缺少 'file' 路径的审查项: {review}")
+            skipped_count += 1
+            continue
+        lines_info = review.get("lines") or {}
+        old_file_path = review.get("old_path") or file_path
+
+        if not has_position or (lines_info.get("new") is None and lines_info.get("old") is None):
+            folded_items.append((f"文件 {file_path}", review))
+            continue
+
+        position_data = {
+            "base_sha": position_info.get("base_sha"),
+            "start_sha": position_info.get("start_sha"),
+            "head_sha": position_info.get("head_sha"),
+            "position_type": "text",
+            "old_path": old_file_path,
+            "new_path": file_path,
+        }
+        if lines_info.get("new") is not None:
+            position_data["new_line"] = lines_info["new"]
+            if line_anchors and lines_info.get("old") is not None:  # 上下文行需要同时提供新旧行号
+                position_data["old_line"] = lines_info["old"]
+            target_desc = f"文件 {file_path} 第 {lines_info['new']} 行"
+        else:
+            position_data["old_line"] = lines_info["old"]
+            target_desc = f"文件 {old_file_path} 旧行号 {lines_info['old']}"
+
+        draft_response = None
+        try:
+            draft_response = vcs_request("POST", draft_notes_url, priority=PRIORITY_COMMENT, headers=headers, timeout=30,
+                                           json={"note": _format_review_comment_body(review, fingerprints.get(id(review))),
+                                                 "position": position_data})
+            draft_response.raise_for_status()
+            drafted_reviews.append(review)
+        except requests.exceptions.RequestException as e:
+            error_message = f"创建 GitLab 草稿评论 ({target_desc}) 时出错: {e}"
+            if draft_response is not None:
+                error_message += f" - 状态: {draft_response.status_code} - 响应体: {draft_response.text[:500]}"
+            logger.warning(error_message + "。将合并到汇总评论中。")
+            folded_items.append((target_desc, review))
+
+    summary_parts = [summary_text] if summary_text else []
+    folded_section = _format_folded_comments_section(folded_items, fingerprints)
+    if folded_section:
+        summary_parts.append(folded_section)
+    summary_body = "\n\n".join(summary_parts)
+
+    if summary_body:
+        summary_response = None
+        try:
+            summary_response = vcs_request("POST", draft_notes_url, priority=PRIORITY_COMMENT, headers=headers, json={"note": summary_body}, timeout=30)
+            summary_response.raise_for_status()
+            drafted_reviews.extend(review for _, review in folded_items)
+            folded_items = []
+        except requests.exceptions.RequestException as e:
+            error_message = f"创建 GitLab 汇总草稿评论时出错: {e}"
+            if summary_response is not None:
+                error_message += f" - 状态: {summary_response.status_code} - 响应体: {summary_response.text[:500]}"
+            logger.error(error_message)
+
+    published_count = 0
+    if drafted_reviews:
+        publish_response = None
+        try:
+            publish_response = vcs_request("POST", f"{draft_notes_url}/bulk_publish", priority=PRIORITY_COMMENT, headers=headers, timeout=60)
+            publish_response.raise_for_status()
+            published_count = len(drafted_reviews)
+            _record_posted_fingerprints(fingerprint_index, fingerprints, drafted_reviews)
+            logger.info(f"成功向 GitLab MR {mr_iid} 批量发布 {published_count} 条审查意见。")
+        except requests.exceptions.RequestException as e:
+            error_message = f"批量发布 GitLab 草稿评论时出错: {e}"
+            if publish_response is not None:
+                error_message += f" - 状态: {publish_response.status_code} - 响应体: {publish_response.text[:500]}"
+            logger.error(error_message)
+            record_dead_letter(DEAD_LETTER_GITLAB_DRAFT_PUBLISH, {"project_id": str(project_id), "mr_iid": mr_iid},
+                               f"{type(e).__name__}: {e}",
+                               description=f"GitLab MR {project_id}#{mr_iid} 的草稿评论发布 ({len(drafted_reviews)} 条意见)")
+
+    # 汇总草稿创建失败时，将合并的意见作为一条普通讨论发布
+    if folded_items:
+        fallback_body = "\n\n".join(filter(None, [summary_text, _format_folded_comments_section(folded_items, fingerprints)]))
+        if add_gitlab_mr_general_comment(project_id, mr_iid, access_token, fallback_body):
+            published_count += len(folded_items)
+            _record_posted_fingerprints(fingerprint_index, fingerprints, [review for _, review in folded_items])
+
+    return published_count, len(reviews) - published_count
+
+
+def _replay_gitlab_draft_publish(project_id, mr_iid):
+    """死信队列的重放函数：重新发布 MR 上已创建的草稿评论。"""
+    access_token = resolve_access_token("gitlab", str(project_id))
+    if not access_token:
+        logger.error(f"错误: 无法发布 GitLab MR {project_id}#{mr_iid} 的草稿评论，缺少访问令牌。")
         return False
+    project_config = gitlab_project_configs.get(str(project_id), {})
+    current_gitlab_instance_url = project_config.get("instance_url") or app_configs.get("GITLAB_INSTANCE_URL", "https://gitlab.com")
+    publish_url = f"{current_gitlab_instance_url}/api/v4/projects/{project_id}/merge_requests/{mr_iid}/draft_notes/bulk_publish"
+    response = vcs_request("POST", publish_url, priority=PRIORITY_COMMENT, headers={"PRIVATE-TOKEN": access_token}, timeout=60)
+    response.raise_for_status()
+    logger.info(f"成功重新发布 GitLab MR {project_id}#{mr_iid} 的草稿评论。")
+    return True
 
 
 def add_github_pr_general_comment(owner: str, repo_name: str, pull_number: int, access_token: str, review_text: str):
-    """向 GitHub Pull Request 添加一个通用的粗粒度审查评论。"""
+    """向 GitHub Pull Request 添加一个通用的粗粒度审查评论。请求失败时写入死信队列稍后重试。"""
     if not access_token:
         logger.error("错误: 无法添加粗粒度评论，缺少访问令牌。")
         return False
@@ -632,7 +1471,7 @@ def add_github_pr_general_comment(owner: str, repo_name: str, pull_number: int,
     payload = {"body": review_text}
 
     try:
-        response = requests.post(comment_url, headers=headers, json=payload, timeout=30)
+        response = vcs_request("POST", comment_url, priority=PRIORITY_COMMENT, headers=headers, json=payload, timeout=30)
         response.raise_for_status()
         logger.info(f"成功向 GitHub PR #{pull_number} 添加粗粒度审查评论。")
         return True
@@ -641,14 +1480,28 @@ def add_github_pr_general_comment(owner: str, repo_name: str, pull_number: int,
         if 'response' in locals() and response is not None:
             error_message += f" - 状态: {response.status_code} - 响应体: {response.text[:500]}"
         logger.error(error_message)
+        _dead_letter_github_general_comment(owner, repo_name, pull_number, review_text, e)
         return False
     except Exception as e:
         logger.exception(f"添加 GitHub 粗粒度审查评论时发生意外错误:")
+        _dead_letter_github_general_comment(owner, repo_name, pull_number, review_text, e)
         return False
 
 
+def _dead_letter_github_general_comment(owner, repo_name, pull_number, review_text, error):
+    record_dead_letter(
+        DEAD_LETTER_GITHUB_GENERAL_COMMENT,
+        {"owner": owner, "repo_name": repo_name, "pull_number": pull_number, "review_text": review_text},
+        f"{type(error).__name__}: {error}", description=f"GitHub PR {owner}/{repo_name}#{pull_number} 的通用评论")
+
+
+def _replay_github_general_comment(owner, repo_name, pull_number, review_text):
+    access_token = resolve_access_token("github", f"{owner}/{repo_name}")
+    return add_github_pr_general_comment(owner, repo_name, pull_number, access_token, review_text)
+
+
 def add_gitlab_mr_general_comment(project_id: str, mr_iid: int, access_token: str, review_text: str):
-    """向 GitLab Merge Request 添加一个通用的粗粒度审查讨论/评论。"""
+    """向 GitLab Merge Request 添加一个通用的粗粒度审查讨论/评论。请求失败时写入死信队列稍后重试。"""
     if not access_token:
         logger.error("错误: 无法添加粗粒度评论，缺少访问令牌。")
         return False
@@ -667,7 +1520,7 @@ def add_gitlab_mr_general_comment(project_id: str, mr_iid: int, access_token: st
     
     response_obj = None
     try:
-        response_obj = requests.post(comment_url, headers=headers, json=payload, timeout=30)
+        response_obj = vcs_request("POST", comment_url, priority=PRIORITY_COMMENT, headers=headers, json=payload, timeout=30)
         response_obj.raise_for_status()
         logger.info(f"成功向 GitLab MR {mr_iid} 添加粗粒度审查评论。")
         return True
@@ -676,7 +1529,29 @@ def add_gitlab_mr_general_comment(project_id: str, mr_iid: int, access_token: st
         if response_obj is not None:
             error_message += f" - 状态: {response_obj.status_code} - 响应体: {response_obj.text[:500]}"
         logger.error(error_message)
+        _dead_letter_gitlab_general_comment(project_id, mr_iid, review_text, e)
         return False
     except Exception as e:
         logger.exception(f"添加 GitLab 粗粒度审查评论时发生意外错误:")
+        _dead_letter_gitlab_general_comment(project_id, mr_iid, review_text, e)
         return False
+
+
+def _dead_letter_gitlab_general_comment(project_id, mr_iid, review_text, error):
+    record_dead_letter(
+        DEAD_LETTER_GITLAB_GENERAL_COMMENT,
+        {"project_id": str(project_id), "mr_iid": mr_iid, "review_text": review_text},
+        f"{type(error).__name__}: {error}", description=f"GitLab MR {project_id}#{mr_iid} 的通用评论")
+
+
+def _replay_gitlab_general_comment(project_id, mr_iid, review_text):
+    access_token = resolve_access_token("gitlab", str(project_id))
+    return add_gitlab_mr_general_comment(project_id, mr_iid, access_token, review_text)
+
+
+register_dead_letter_handler(DEAD_LETTER_GITHUB_COMMENT, _replay_github_comment)
+register_dead_letter_handler(DEAD_LETTER_GITLAB_COMMENT, _replay_gitlab_comment)
+register_dead_letter_handler(DEAD_LETTER_GITHUB_REVIEW_BATCH, _replay_github_review_batch)
+register_dead_letter_handler(DEAD_LETTER_GITLAB_DRAFT_PUBLISH, _replay_gitlab_draft_publish)
+register_dead_letter_handler(DEAD_LETTER_GITHUB_GENERAL_COMMENT, _replay_github_general_comment)
+register_dead_letter_handler(DEAD_LETTER_GITLAB_GENERAL_COMMENT, _replay_gitlab_general_comment)
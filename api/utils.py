@@ -1,89 +1,21 @@
-import re
 import hmac
 import hashlib
 from functools import wraps
 from flask import request, abort
 from api.core_config import ADMIN_API_KEY
+from api.diff_parser import parse_file_diff
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def parse_single_file_diff(diff_text, file_path, old_file_path=None):
+def parse_single_file_diff(diff_text, file_path, old_file_path=None, include_anchors=False):
     """
     解析单个文件的 unified diff 格式文本，提取变更信息。
-    返回包含该文件变更详情和上下文的字典。
+    返回包含该文件变更详情和上下文的字典 (api.diff_parser.FileDiff 的字典视图)。
+    include_anchors=True 时额外包含 "line_anchors" (可评论行位置的 LineAnchorIndex)。
     """
-    file_changes = {
-        "path": file_path,
-        "old_path": old_file_path,
-        "changes": [],
-        "context": {"old": [], "new": []},
-        "lines_changed": 0
-    }
-
-    old_line_num_start = 0
-    new_line_num_start = 0
-    old_line_num_current = 0
-    new_line_num_current = 0
-    hunk_context_lines = []
-
-    lines = diff_text.splitlines()
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if line.startswith('--- ') or line.startswith('+++ '):
-            i += 1
-            continue
-        elif line.startswith('@@ '):
-            match = re.match(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@', line)
-            if match:
-                old_line_num_start = int(match.group(1))
-                new_line_num_start = int(match.group(3))
-                old_line_num_current = old_line_num_start
-                new_line_num_current = new_line_num_start
-                if hunk_context_lines:  # 将上一个 hunk 的上下文添加到 file_changes
-                    file_changes["context"]["old"].extend(hunk_context_lines)
-                    file_changes["context"]["new"].extend(hunk_context_lines)
-                    hunk_context_lines = []  # 为新的 hunk 重置
-            else:
-                logger.warning(f"警告: 无法解析 {file_path} 中的 hunk 标头: {line}")
-                old_line_num_start = 0  # 重置行号计数器
-                new_line_num_start = 0
-                old_line_num_current = 0
-                new_line_num_current = 0
-        elif line.startswith('+'):
-            file_changes["changes"].append({
-                "type": "add",
-                "old_line": None,
-                "new_line": new_line_num_current,
-                "content": line[1:]
-            })
-            new_line_num_current += 1
-        elif line.startswith('-'):
-            file_changes["changes"].append({
-                "type": "delete",
-                "old_line": old_line_num_current,
-                "new_line": None,
-                "content": line[1:]
-            })
-            old_line_num_current += 1
-        elif line.startswith(' '):  # Context line
-            hunk_context_lines.append(f"{old_line_num_current} -> {new_line_num_current}: {line[1:]}")
-            old_line_num_current += 1
-            new_line_num_current += 1
-        i += 1
-
-    if hunk_context_lines:  # 添加最后一个 hunk 的上下文
-        file_changes["context"]["old"].extend(hunk_context_lines)
-        file_changes["context"]["new"].extend(hunk_context_lines)
-
-    limit = 20  # 限制上下文行数
-    file_changes["context"]["old"] = "\n".join(file_changes["context"]["old"][-limit:])
-    file_changes["context"]["new"] = "\n".join(file_changes["context"]["new"][-limit:])
-    file_changes["lines_changed"] = len([c for c in file_changes["changes"] if c['type'] in ['add', 'delete']])
-
-    return file_changes
+    return parse_file_diff(diff_text, file_path, old_file_path, build_anchors=include_anchors).as_dict(include_anchors)
 
 
 def require_admin_key(f):
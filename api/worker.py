@@ -0,0 +1,291 @@
+"""
+审查任务 worker 进程 (JOB_QUEUE_MODE=redis_stream 时使用)。
+
+用法:
+    python -m api.worker [--consumer NAME] [--concurrency N]
+
+通过 Redis Streams 消费组 (XREADGROUP) 获取任务，执行完成后 XACK 并删除；执行失败 (抛出异常) 的任务不确认，
+空闲 JOB_RECLAIM_IDLE_SECONDS 秒后重新投递，最多 JOB_MAX_DELIVERIES 次，已完成文件的审查结果从检查点读取。
+执行中的任务定期以 XCLAIM 刷新空闲时间作为心跳；某个 worker 退出后，其未确认的任务在空闲
+JOB_RECLAIM_IDLE_SECONDS 秒后由其他 worker 通过 XAUTOCLAIM 接管。可以在多台机器上启动任意数量的 worker。
+每个 worker 在执行槽位之外预取 WORKER_PREFETCH 个任务，由调度器 (review_scheduler) 按 PR 大小和仓库等级决定执行顺序。
+因仓库并发上限留在调度队列中的任务 (最多与执行槽位 + 预取数相同) 不占用预取名额，其他仓库的任务照常读取；
+等待超过 WORKER_HELD_JOB_HANDBACK_SECONDS 秒的任务交还给消费组，不再持续心跳，由有空闲的 worker 接管。
+
+收到 SIGTERM/SIGINT 后排空: 不再读取新任务，预取但尚未开始的任务立即交还；执行中的任务最多再执行
+SHUTDOWN_DRAIN_SECONDS 秒，超时后在文件边界保存检查点并中断，同样交还。交还的任务不确认，并把空闲时间
+设为接管阈值，其他 worker 下一轮即可接管，从检查点继续 (交还不计入投递次数)。
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+
+import api.core_config as core_config
+from api.core_config import (
+    app_configs, init_redis_client, load_configs_from_redis,
+    REDIS_JOB_STREAM_KEY, REDIS_JOB_CONSUMER_GROUP
+)
+from api.services.job_queue_service import (
+    JobInterrupted, create_scheduler, interrupt_running_jobs, run_review_job, start_job_poller, stop_job_poller
+)
+from api.services.job_status_service import record_job_queued
+from api.services.review_scheduler import ReviewScheduler
+from api.services.dead_letter_service import start_dead_letter_retrier, stop_dead_letter_retrier
+
+logger = logging.getLogger(__name__)
+
+
+class ReviewWorker:
+    """单个 worker 进程内的任务消费循环。"""
+
+    def __init__(self, redis_client, consumer_name: str, concurrency: int, reclaim_idle_seconds: int,
+                 max_deliveries: int, block_ms: int = 5000, prefetch: int = 0, drain_seconds: int = 60,
+                 held_back_handback_seconds: int = 60):
+        self.redis_client = redis_client
+        self.consumer_name = consumer_name
+        self.concurrency = max(concurrency, 1)
+        # 同时持有的任务上限 (执行中 + 预取等待调度)
+        self.capacity = self.concurrency + max(prefetch, 0)
+        self.reclaim_idle_ms = max(reclaim_idle_seconds, 1) * 1000
+        self.max_deliveries = max_deliveries
+        self.block_ms = block_ms
+        self.drain_seconds = max(drain_seconds, 0)
+        self.held_back_handback_seconds = max(held_back_handback_seconds, 0)
+        self._in_flight = {}  # message_id -> Future
+        self._stop_event = threading.Event()
+        self._last_maintenance = 0.0
+
+    def stop(self):
+        logger.info(f"Worker {self.consumer_name} 收到停止信号，不再获取新任务。")
+        self._stop_event.set()
+
+    def ensure_group(self):
+        try:
+            # 从 "0" 开始，使消费组创建之前已写入的任务也能被消费
+            self.redis_client.xgroup_create(REDIS_JOB_STREAM_KEY, REDIS_JOB_CONSUMER_GROUP, id="0", mkstream=True)
+            logger.info(f"已创建任务消费组 {REDIS_JOB_CONSUMER_GROUP}。")
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _ack(self, message_id):
+        pipe = self.redis_client.pipeline()
+        pipe.xack(REDIS_JOB_STREAM_KEY, REDIS_JOB_CONSUMER_GROUP, message_id)
+        pipe.xdel(REDIS_JOB_STREAM_KEY, message_id)
+        pipe.execute()
+
+    def _dispatch(self, pool, message_id, fields, deliveries: int = None):
+        raw_job = (fields or {}).get(b"job") or (fields or {}).get("job")
+        try:
+            job = json.loads(raw_job)
+        except (TypeError, ValueError):
+            logger.error(f"任务消息 {message_id} 无法解析，已丢弃: {fields}")
+            self._ack(message_id)
+            return
+        if deliveries is not None:
+            # 重试或接管其他 worker 的任务: 在任务状态中记录重新排队和执行次数
+            job["attempt"] = deliveries
+            record_job_queued(job)
+        self._in_flight[message_id] = pool.submit(run_review_job, job)
+
+    def _reap_finished(self):
+        for message_id, future in list(self._in_flight.items()):
+            if not future.done():
+                continue
+            del self._in_flight[message_id]
+            if future.cancelled() or isinstance(future.exception(), JobInterrupted):
+                self._hand_back(message_id)
+                continue
+            exception = future.exception()
+            if exception is not None:
+                deliveries = self._delivery_count(message_id)
+                if deliveries < self.max_deliveries:
+                    # 不确认: 空闲 JOB_RECLAIM_IDLE_SECONDS 秒后由 worker 重新接管，已完成的文件从检查点读取
+                    logger.error(f"任务 {message_id} 第 {deliveries} 次执行失败，将在 {self.reclaim_idle_ms // 1000} 秒后重试。",
+                                 exc_info=exception)
+                    continue
+                logger.error(f"任务 {message_id} 已执行 {deliveries} 次仍失败，放弃该任务。", exc_info=exception)
+            self._ack(message_id)
+
+    def _hand_back(self, message_id):
+        """
+        交还未完成的任务: 不确认消息，并把其空闲时间设为接管阈值，使其他 worker 立即可以接管；
+        同时回退投递计数，关闭导致的中断不消耗 JOB_MAX_DELIVERIES。
+        """
+        try:
+            deliveries = self._delivery_count(message_id)
+            self.redis_client.xclaim(REDIS_JOB_STREAM_KEY, REDIS_JOB_CONSUMER_GROUP, self.consumer_name,
+                                     min_idle_time=0, message_ids=[message_id], idle=self.reclaim_idle_ms,
+                                     retrycount=max(deliveries - 1, 0), justid=True)
+            logger.info(f"任务 {message_id} 未完成，已交还给其他 worker 继续。")
+        except redis.exceptions.RedisError as e:
+            logger.error(f"交还任务 {message_id} 时 Redis 出错 (空闲 {self.reclaim_idle_ms // 1000} 秒后仍会被接管): {e}")
+
+    def _heartbeat(self):
+        """对执行中的任务执行 XCLAIM (归属不变) 以重置空闲时间，防止被其他 worker 误接管。"""
+        if not self._in_flight:
+            return
+        self.redis_client.xclaim(REDIS_JOB_STREAM_KEY, REDIS_JOB_CONSUMER_GROUP, self.consumer_name,
+                                 min_idle_time=0, message_ids=list(self._in_flight), justid=True)
+
+    def _delivery_count(self, message_id) -> int:
+        pending = self.redis_client.xpending_range(REDIS_JOB_STREAM_KEY, REDIS_JOB_CONSUMER_GROUP,
+                                                   min=message_id, max=message_id, count=1)
+        return pending[0]["times_delivered"] if pending else 1
+
+    def _free_slots(self, pool) -> int:
+        """
+        还可以持有的任务数。因仓库并发上限留在调度队列中的任务不计入 (最多 capacity 个)，
+        以免单个仓库的积压占满预取名额，使其他仓库的任务无法被读取。
+        """
+        held_back = pool.stats()["held_back"] if isinstance(pool, ReviewScheduler) else 0
+        return self.capacity - len(self._in_flight) + min(held_back, self.capacity)
+
+    def _reclaim(self, pool):
+        """接管空闲过久 (所属 worker 已退出) 的未确认任务。"""
+        free_slots = self._free_slots(pool)
+        if free_slots <= 0:
+            return
+        result = self.redis_client.xautoclaim(REDIS_JOB_STREAM_KEY, REDIS_JOB_CONSUMER_GROUP, self.consumer_name,
+                                              min_idle_time=self.reclaim_idle_ms, start_id="0-0", count=free_slots)
+        messages = result[1] if len(result) > 1 else []
+        for message_id, fields in messages:
+            if message_id in self._in_flight:
+                continue
+            deliveries = self._delivery_count(message_id)
+            if deliveries > self.max_deliveries:
+                logger.error(f"任务 {message_id} 已投递 {deliveries} 次仍未完成，放弃该任务: {fields}")
+                self._ack(message_id)
+                continue
+            logger.warning(f"接管空闲任务 {message_id} (第 {deliveries} 次投递)。")
+            self._dispatch(pool, message_id, fields, deliveries=deliveries)
+
+    def _maintenance(self, pool):
+        now = time.monotonic()
+        if now - self._last_maintenance < self.reclaim_idle_ms / 3000:
+            return
+        self._last_maintenance = now
+        try:
+            self._heartbeat()
+            self._reclaim(pool)
+        except redis.exceptions.RedisError as e:
+            logger.error(f"任务心跳/接管时 Redis 出错: {e}")
+
+    def run_once(self, pool):
+        """
+        执行一轮: 交还等待仓库槽位过久的任务、回收已完成任务、心跳与接管、读取新任务。
+        pool 为 ReviewScheduler (或任何 submit(fn, job) 返回 Future 的执行器)。
+        """
+        if isinstance(pool, ReviewScheduler):
+            pool.withdraw_held_back(self.held_back_handback_seconds)  # 撤回的任务在 _reap_finished 中交还
+        self._reap_finished()
+        self._maintenance(pool)
+        free_slots = self._free_slots(pool)
+        if free_slots <= 0:
+            self._stop_event.wait(0.5)
+            return
+        entries = self.redis_client.xreadgroup(REDIS_JOB_CONSUMER_GROUP, self.consumer_name,
+                                               {REDIS_JOB_STREAM_KEY: ">"}, count=free_slots, block=self.block_ms)
+        for _, messages in entries or []:
+            for message_id, fields in messages:
+                self._dispatch(pool, message_id, fields)
+
+    def run(self):
+        self.ensure_group()
+        logger.info(f"Worker {self.consumer_name} 开始消费任务 (并发 {self.concurrency}，最多持有 {self.capacity} 个任务)。")
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="review-worker") as pool:
+            scheduler = create_scheduler(pool, self.concurrency)
+            while not self._stop_event.is_set():
+                try:
+                    self.run_once(scheduler)
+                except redis.exceptions.RedisError as e:
+                    logger.error(f"读取任务队列时 Redis 出错: {e}，5 秒后重试。")
+                    self._stop_event.wait(5)
+            self.drain(scheduler)
+        logger.info(f"Worker {self.consumer_name} 已退出。")
+
+    def drain(self, scheduler):
+        """停止开始新任务，等待执行中的任务至多 drain_seconds 秒，超时后中断并交还未完成的任务。"""
+        scheduler.drain()
+        self._reap_finished()
+        logger.info(f"Worker {self.consumer_name} 正在等待 {len(self._in_flight)} 个执行中的任务完成 "
+                    f"(最多 {self.drain_seconds} 秒)...")
+        if not self._wait_in_flight(self.drain_seconds):
+            logger.warning(f"Worker {self.consumer_name}: {len(self._in_flight)} 个任务未能在期限内完成，正在中断并保存进度...")
+            interrupt_running_jobs()
+            # 中断后仍需等待当前文件的 LLM 调用返回；线程池退出时也会等待这些线程
+            self._wait_in_flight(None)
+
+    def _wait_in_flight(self, timeout_seconds) -> bool:
+        deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+        last_heartbeat = time.monotonic()
+        while True:
+            try:
+                self._reap_finished()
+                if time.monotonic() - last_heartbeat >= self.reclaim_idle_ms / 3000:
+                    # 排空期间继续心跳 (但不再接管其他任务)，避免执行中的任务被其他 worker 接管
+                    self._heartbeat()
+                    last_heartbeat = time.monotonic()
+            except redis.exceptions.RedisError as e:
+                logger.error(f"排空任务时 Redis 出错: {e}")
+            if not self._in_flight:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.5)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AI Code Review Helper 审查任务 worker")
+    parser.add_argument("--consumer", default=f"{socket.gethostname()}-{os.getpid()}", help="消费者名称 (同一消费组内唯一)")
+    parser.add_argument("--concurrency", type=int, default=app_configs.get("WORKER_CONCURRENCY", 4), help="同时执行的任务数")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        handlers=[logging.StreamHandler()])
+
+    try:
+        init_redis_client()
+    except (ValueError, redis.exceptions.ConnectionError) as e:
+        logger.critical(f"关键错误: Redis 初始化失败 - {e}。Worker 无法启动。")
+        sys.exit(1)
+    load_configs_from_redis()
+
+    from api.services.unified_review_service import initialize_llm_client
+    initialize_llm_client()
+    # 导入路由模块以注册各类审查任务的处理函数
+    import api.routes.webhook_routes_detailed
+    import api.routes.webhook_routes_general
+
+    worker = ReviewWorker(
+        core_config.redis_client, args.consumer, args.concurrency,
+        reclaim_idle_seconds=app_configs.get("JOB_RECLAIM_IDLE_SECONDS", 120),
+        max_deliveries=app_configs.get("JOB_MAX_DELIVERIES", 3),
+        prefetch=app_configs.get("WORKER_PREFETCH", 4),
+        drain_seconds=app_configs.get("SHUTDOWN_DRAIN_SECONDS", 60),
+        held_back_handback_seconds=app_configs.get("WORKER_HELD_JOB_HANDBACK_SECONDS", 60),
+    )
+    # worker 同样轮询推送防抖的延迟队列，Web 进程与 worker 同时轮询时每个任务只会被取出一次
+    start_job_poller()
+    start_dead_letter_retrier()
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    try:
+        worker.run()
+    finally:
+        stop_job_poller()
+        stop_dead_letter_retrier()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+"""
+生产环境 WSGI 入口: gunicorn -c gunicorn.conf.py api.wsgi:app
+
+导入本模块只加载应用代码和路由，不建立连接；配合 preload_app 在 gunicorn 主进程中加载一次，
+各 worker 进程在 post_fork 钩子中分别初始化 Redis 与 LLM 客户端 (见 gunicorn.conf.py)。
+"""
+import logging
+
+from api.ai_code_review_helper import create_app
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s',
+                    handlers=[logging.StreamHandler()])
+
+app = create_app()
@@ -0,0 +1,119 @@
+"""
+diff 解析吞吐量基准测试。
+
+用法 (在仓库根目录运行):
+    python -m benchmarks.diff_parser_benchmark [--size-mb 8] [--repeat 3]
+
+生成指定大小的合成单文件 unified diff，对比逐行 splitlines + 未编译正则的旧实现与
+api.diff_parser 的流式解析器 (仅解析 / 解析并生成字典视图) 的吞吐量。
+"""
+import argparse
+import re
+import time
+import tracemalloc
+
+from api.diff_parser import parse_file_diff
+
+
+def build_synthetic_diff(target_bytes: int) -> str:
+    """生成由多个 hunk 组成的 diff，每个 hunk 包含上下文、删除和新增行。"""
+    parts = ["--- a/big_module.py\n", "+++ b/big_module.py\n"]
+    size = sum(len(part) for part in parts)
+    old_start = new_start = 1
+    hunk_index = 0
+    while size < target_bytes:
+        body = []
+        for i in range(3):
+            body.append(f"     value_{hunk_index}_{i} = compute(value_{hunk_index}_{i - 1})\n")
+        for i in range(4):
+            body.append(f"-    result_{hunk_index}_{i} = legacy_call(arg_{i}, option=True)\n")
+        for i in range(6):
+            body.append(f"+    result_{hunk_index}_{i} = new_call(arg_{i}, option=False, retries=3)\n")
+        for i in range(3):
+            body.append(f"     return_value_{hunk_index}_{i}\n")
+        header = f"@@ -{old_start},10 +{new_start},12 @@ def function_{hunk_index}():\n"
+        parts.append(header)
+        parts.extend(body)
+        size += len(header) + sum(len(line) for line in body)
+        old_start += 40
+        new_start += 42
+        hunk_index += 1
+    return "".join(parts)
+
+
+def legacy_parse_single_file_diff(diff_text, file_path, old_file_path=None):
+    """重构前的 parse_single_file_diff 实现，仅用于对比。"""
+    file_changes = {"path": file_path, "old_path": old_file_path, "changes": [],
+                    "context": {"old": [], "new": []}, "lines_changed": 0}
+    old_line_num_current = new_line_num_current = 0
+    hunk_context_lines = []
+    for line in diff_text.splitlines():
+        if line.startswith('--- ') or line.startswith('+++ '):
+            continue
+        elif line.startswith('@@ '):
+            match = re.match(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@', line)
+            if match:
+                old_line_num_current = int(match.group(1))
+                new_line_num_current = int(match.group(3))
+                if hunk_context_lines:
+                    file_changes["context"]["old"].extend(hunk_context_lines)
+                    file_changes["context"]["new"].extend(hunk_context_lines)
+                    hunk_context_lines = []
+            else:
+                old_line_num_current = new_line_num_current = 0
+        elif line.startswith('+'):
+            file_changes["changes"].append({"type": "add", "old_line": None,
+                                            "new_line": new_line_num_current, "content": line[1:]})
+            new_line_num_current += 1
+        elif line.startswith('-'):
+            file_changes["changes"].append({"type": "delete", "old_line": old_line_num_current,
+                                            "new_line": None, "content": line[1:]})
+            old_line_num_current += 1
+        elif line.startswith(' '):
+            hunk_context_lines.append(f"{old_line_num_current} -> {new_line_num_current}: {line[1:]}")
+            old_line_num_current += 1
+            new_line_num_current += 1
+    if hunk_context_lines:
+        file_changes["context"]["old"].extend(hunk_context_lines)
+        file_changes["context"]["new"].extend(hunk_context_lines)
+    file_changes["context"]["old"] = "\n".join(file_changes["context"]["old"][-20:])
+    file_changes["context"]["new"] = "\n".join(file_changes["context"]["new"][-20:])
+    file_changes["lines_changed"] = len([c for c in file_changes["changes"] if c['type'] in ['add', 'delete']])
+    return file_changes
+
+
+def _measure(label, func, diff_text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size_mb = len(diff_text.encode("utf-8")) / (1024 * 1024)
+    print(f"{label:<34} {best * 1000:9.1f} ms  {size_mb / best:8.1f} MB/s  峰值内存 {peak / (1024 * 1024):7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="diff 解析吞吐量基准测试")
+    parser.add_argument("--size-mb", type=float, nargs="+", default=[1, 4, 16], help="合成 diff 的大小 (MB)")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测量的重复次数 (取最快一次)")
+    args = parser.parse_args()
+
+    for size_mb in args.size_mb:
+        diff_text = build_synthetic_diff(int(size_mb * 1024 * 1024))
+        expected = legacy_parse_single_file_diff(diff_text, "big_module.py")
+        assert parse_file_diff(diff_text, "big_module.py").as_dict() == expected, "新旧解析结果不一致"
+        print(f"== {size_mb} MB diff ({diff_text.count(chr(10))} 行) ==")
+        _measure("旧实现 (splitlines + dict)", lambda: legacy_parse_single_file_diff(diff_text, "big_module.py"),
+                 diff_text, args.repeat)
+        _measure("流式解析 (FileDiff)", lambda: parse_file_diff(diff_text, "big_module.py"), diff_text, args.repeat)
+        _measure("流式解析 + as_dict() 视图", lambda: parse_file_diff(diff_text, "big_module.py").as_dict(),
+                 diff_text, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+gunicorn 配置: gunicorn -c gunicorn.conf.py api.wsgi:app
+
+主进程预加载应用 (preload_app)，fork 出的 worker 以写时复制共享已导入的代码；
+Redis 连接、LLM 客户端和后台线程不能跨 fork 共享，在 post_fork 钩子中由每个 worker 各自初始化。
+worker 退出时 (重新部署/收到 SIGTERM) 在 worker_exit 钩子中排空进程内的审查任务，graceful_timeout 需覆盖排空期限。
+
+JOB_QUEUE_MODE=local (默认) 时审查任务在 Web 进程内执行，线程池、调度器 (review_scheduler)、VCS 令牌的速率预算和
+准入控制的队列深度都按进程统计，多个 worker 会使这些上限成倍放大，因此默认只启动 1 个 worker，
+显式设置 WEB_CONCURRENCY > 1 时拒绝启动；多 worker 需使用 JOB_QUEUE_MODE=redis_stream 并另外运行 python -m api.worker。
+"""
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('SERVER_HOST', '0.0.0.0')}:{os.environ.get('SERVER_PORT', '8088')}"
+_job_queue_mode = os.environ.get("JOB_QUEUE_MODE", "local").lower()
+# redis_stream 模式下 Webhook 接收只做校验和入队，gthread worker 的线程足以覆盖等待 Redis/VCS 的 I/O；
+# local 模式下审查在 Web 进程内执行，默认单 worker (见模块说明)
+workers = int(os.environ.get(
+    "WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1 if _job_queue_mode == "redis_stream" else 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+# 默认: 排空期限 (SHUTDOWN_DRAIN_SECONDS) + 中断后保存进度的时间
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", int(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "60")) + 45))
+keepalive = 5
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    if server.cfg.workers > 1 and _job_queue_mode != "redis_stream":
+        raise RuntimeError(
+            f"JOB_QUEUE_MODE={_job_queue_mode} 时审查任务在每个 Web worker 内各自执行，线程池、调度器、速率预算和准入控制"
+            f"不在 worker 之间共享，{server.cfg.workers} 个 worker 会使所有上限放大 {server.cfg.workers} 倍。"
+            "请设置 JOB_QUEUE_MODE=redis_stream 并另外运行 python -m api.worker，或将 WEB_CONCURRENCY 设为 1。")
+
+
+def post_fork(server, worker):
+    import redis
+    from api.ai_code_review_helper import ensure_process_initialized
+
+    try:
+        ensure_process_initialized()
+    except (ValueError, redis.exceptions.ConnectionError) as e:
+        server.log.critical(f"Worker {worker.pid} 初始化失败 (Redis 不可用或配置错误): {e}")
+        raise
+    server.log.info(f"Worker {worker.pid} 已完成 Redis 与 LLM 客户端初始化。")
+    if worker.age == 1:
+        # 只由第一个 worker 输出一次配置摘要 (主进程未初始化 LLM 客户端，无法判断其状态)
+        from api.ai_code_review_helper import log_startup_summary
+
+        log_startup_summary()
+
+
+def worker_exit(server, worker):
+    from api.services.job_queue_service import drain_local_jobs
+
+    unfinished = drain_local_jobs()
+    if unfinished:
+        server.log.warning(f"Worker {worker.pid} 退出时仍有 {unfinished} 个审查任务未结束。")
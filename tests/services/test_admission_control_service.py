@@ -0,0 +1,54 @@
+import unittest
+from unittest.mock import patch
+from api.services import admission_control_service
+from api.services.admission_control_service import (
+    ADMISSION_ACCEPT, ADMISSION_DEFER, ADMISSION_REJECT, evaluate_admission, is_overloaded
+)
+
+
+class TestAdmissionControlService(unittest.TestCase):
+
+    def setUp(self):
+        admission_control_service._overloaded = False
+
+    def tearDown(self):
+        admission_control_service._overloaded = False
+
+    @patch('api.services.admission_control_service.queue_depth')
+    def test_queue_watermarks_use_hysteresis(self, mock_depth):
+        configs = {"ADMISSION_QUEUE_HIGH_WATERMARK": 10, "ADMISSION_QUEUE_LOW_WATERMARK": 4, "ADMISSION_MEMORY_HIGH_MB": 0}
+        with patch.dict('api.services.admission_control_service.app_configs', configs):
+            states = []
+            for depth in (9, 10, 7, 5, 4, 9):
+                mock_depth.return_value = depth
+                states.append(is_overloaded())
+        # 达到高水位后保持过载，直到回落到低水位
+        self.assertEqual(states, [False, True, True, True, False, False])
+
+    @patch('api.services.admission_control_service.current_rss_mb', return_value=900.0)
+    @patch('api.services.admission_control_service.queue_depth', return_value=0)
+    def test_memory_high_watermark_triggers_overload(self, mock_depth, mock_rss):
+        configs = {"ADMISSION_QUEUE_HIGH_WATERMARK": 10, "ADMISSION_MEMORY_HIGH_MB": 800, "ADMISSION_MEMORY_LOW_MB": 0}
+        with patch.dict('api.services.admission_control_service.app_configs', configs):
+            self.assertTrue(is_overloaded())
+            mock_rss.return_value = 700.0  # 低水位默认为高水位的 80% (640 MB)
+            self.assertTrue(is_overloaded())
+            mock_rss.return_value = 600.0
+            self.assertFalse(is_overloaded())
+
+    @patch('api.services.admission_control_service.core_config')
+    @patch('api.services.admission_control_service.is_overloaded')
+    def test_overload_action_defers_or_rejects(self, mock_overloaded, mock_core_config):
+        mock_overloaded.return_value = False
+        self.assertEqual(evaluate_admission(), ADMISSION_ACCEPT)
+        mock_overloaded.return_value = True
+        with patch.dict('api.services.admission_control_service.app_configs', {"ADMISSION_OVERLOAD_ACTION": "defer"}):
+            self.assertEqual(evaluate_admission(), ADMISSION_DEFER)
+            mock_core_config.redis_client = None  # 无法延后时改为拒绝
+            self.assertEqual(evaluate_admission(), ADMISSION_REJECT)
+        with patch.dict('api.services.admission_control_service.app_configs', {"ADMISSION_OVERLOAD_ACTION": "reject"}):
+            self.assertEqual(evaluate_admission(), ADMISSION_REJECT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.comment_dedup_service import (
+    CommentFingerprintIndex, build_line_content_map, compute_review_fingerprint,
+    extract_fingerprints, format_fingerprint_marker
+)
+
+
+class TestCommentFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.structured_changes = {
+            "a.py": {"changes": [
+                {"type": "add", "old_line": None, "new_line": 10, "content": "x = eval(user_input)"},
+                {"type": "context", "old_line": 8, "new_line": 11, "content": "return x"},
+            ]}
+        }
+        self.review = {"file": "a.py", "lines": {"old": None, "new": 10}, "category": "安全",
+                       "analysis": "使用 eval  处理用户输入。", "suggestion": "..."}
+
+    def test_fingerprint_is_anchored_on_line_content(self):
+        line_map = build_line_content_map(self.structured_changes)
+        fingerprint = compute_review_fingerprint(self.review, line_map)
+        # 同一行内容在新推送中移动到其他行号后，指纹保持不变
+        moved_map = build_line_content_map({"a.py": {"changes": [
+            {"type": "add", "old_line": None, "new_line": 25, "content": "x = eval(user_input)"}]}})
+        moved_review = dict(self.review, lines={"old": None, "new": 25}, analysis="使用 eval 处理用户输入。")
+        self.assertEqual(fingerprint, compute_review_fingerprint(moved_review, moved_map))
+        self.assertNotEqual(fingerprint, compute_review_fingerprint(dict(self.review, category="性能"), line_map))
+
+    def test_marker_round_trip(self):
+        body = f"正文\n{format_fingerprint_marker('abcdef0123456789abcd')}\n"
+        self.assertEqual(extract_fingerprints(body), {"abcdef0123456789abcd"})
+        self.assertEqual(extract_fingerprints("没有标记"), set())
+
+
+class TestCommentFingerprintIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.review = {"file": "a.py", "lines": {"new": 3}, "category": "正确性", "analysis": "问题"}
+        self.fingerprint = compute_review_fingerprint(self.review)
+
+    @patch('api.services.comment_dedup_service.add_comment_fingerprints')
+    @patch('api.services.comment_dedup_service.get_comment_fingerprints', return_value=None)
+    def test_seeds_once_from_existing_comments(self, _mock_get, mock_add):
+        seed_loader = MagicMock(return_value=[f"旧评论 {format_fingerprint_marker(self.fingerprint)}", "人工评论"])
+        index = CommentFingerprintIndex("github", "o/r", "1", seed_loader=seed_loader)
+        other = {"file": "b.py", "lines": {"new": 1}, "category": "设计", "analysis": "新问题"}
+        new_reviews, fingerprints, duplicates = index.filter_new([self.review, other, dict(other)])
+        self.assertEqual(new_reviews, [other])
+        self.assertEqual(duplicates, 2)  # 一条已发布，一条为同批次重复
+        self.assertIn(id(other), fingerprints)
+        seed_loader.assert_called_once()
+        mock_add.assert_called_once_with("github", "o/r", "1", {self.fingerprint}, mark_seeded=True)
+
+    @patch('api.services.comment_dedup_service.add_comment_fingerprints')
+    @patch('api.services.comment_dedup_service.get_comment_fingerprints', return_value=set())
+    def test_uses_redis_index_without_seeding(self, _mock_get, mock_add):
+        seed_loader = MagicMock()
+        index = CommentFingerprintIndex("gitlab", "1", "2", seed_loader=seed_loader)
+        self.assertNotIn(self.fingerprint, index)
+        index.add([self.fingerprint])
+        self.assertIn(self.fingerprint, index)
+        seed_loader.assert_not_called()
+        mock_add.assert_called_once_with("gitlab", "1", "2", [self.fingerprint])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services import concurrency_limit_service
+from api.services.concurrency_limit_service import (
+    SCOPE_LLM_PROVIDER, SCOPE_REPO, SCOPE_VCS_HOST, concurrency_slot, get_limit, try_acquire_slot
+)
+
+
+class TestConcurrencyLimitService(unittest.TestCase):
+
+    def setUp(self):
+        concurrency_limit_service._limits_cache.update({"loaded_at": 0.0, "overrides": {}})
+        concurrency_limit_service._local_counts.clear()
+        concurrency_limit_service._held_slots.clear()
+
+    @patch('api.services.concurrency_limit_service.core_config')
+    def test_overrides_take_precedence_over_defaults(self, mock_core_config):
+        mock_core_config.redis_client.hgetall.return_value = {b"repo:team/mono": b"1", b"llm_provider:*": b"5"}
+        with patch.dict('api.services.concurrency_limit_service.app_configs',
+                        {"REPO_CONCURRENCY_LIMIT": 3, "VCS_HOST_CONCURRENCY_LIMIT": 0}):
+            self.assertEqual(get_limit(SCOPE_REPO, "team/mono"), 1)
+            self.assertEqual(get_limit(SCOPE_REPO, "team/other"), 3)
+            self.assertEqual(get_limit(SCOPE_LLM_PROVIDER, "openai"), 5)
+            self.assertEqual(get_limit(SCOPE_VCS_HOST, "api.github.com"), 0)
+
+    @patch('api.services.concurrency_limit_service.core_config')
+    def test_local_fallback_caps_concurrent_holders(self, mock_core_config):
+        mock_core_config.redis_client = None
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def work():
+            with concurrency_slot(SCOPE_REPO, "team/mono"):
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.02)
+                with lock:
+                    active[0] -= 1
+
+        with patch.dict('api.services.concurrency_limit_service.app_configs', {"REPO_CONCURRENCY_LIMIT": 2}):
+            threads = [threading.Thread(target=work) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(concurrency_limit_service._local_counts[(SCOPE_REPO, "team/mono")], 0)
+
+    @patch('api.services.concurrency_limit_service._ensure_renewer')
+    @patch('api.services.concurrency_limit_service.time.sleep')
+    @patch('api.services.concurrency_limit_service.core_config')
+    def test_redis_slot_waits_then_releases(self, mock_core_config, mock_sleep, mock_renewer):
+        mock_core_config.redis_client.hgetall.return_value = {}
+        mock_core_config.redis_client.eval.side_effect = [0, 0, 1]
+        with patch.dict('api.services.concurrency_limit_service.app_configs', {"VCS_HOST_CONCURRENCY_LIMIT": 4}):
+            with concurrency_slot(SCOPE_VCS_HOST, "api.github.com"):
+                key, token = next(iter(concurrency_limit_service._held_slots))
+        self.assertEqual(mock_core_config.redis_client.eval.call_count, 3)
+        self.assertEqual(mock_core_config.redis_client.eval.call_args.args[2:5],
+                         (key, concurrency_limit_service._LEASE_SECONDS, 4))
+        self.assertTrue(key.endswith("concurrency_slots:vcs_host:api.github.com"))
+        mock_core_config.redis_client.zrem.assert_called_once_with(key, token)
+        self.assertEqual(concurrency_limit_service._held_slots, set())
+
+    @patch('api.services.concurrency_limit_service.core_config')
+    def test_try_acquire_slot_does_not_wait(self, mock_core_config):
+        mock_core_config.redis_client = None
+        with patch.dict('api.services.concurrency_limit_service.app_configs', {"REPO_CONCURRENCY_LIMIT": 1}):
+            release = try_acquire_slot(SCOPE_REPO, "team/mono")
+            self.assertIsNone(try_acquire_slot(SCOPE_REPO, "team/mono"))
+            release()
+            self.assertIsNotNone(try_acquire_slot(SCOPE_REPO, "team/mono"))
+
+    @patch('api.services.concurrency_limit_service.core_config')
+    def test_times_out_open_instead_of_blocking_forever(self, mock_core_config):
+        mock_core_config.redis_client.hgetall.return_value = {}
+        mock_core_config.redis_client.eval.return_value = 0
+        ran = MagicMock()
+        with patch.dict('api.services.concurrency_limit_service.app_configs',
+                        {"LLM_PROVIDER_CONCURRENCY_LIMIT": 1, "CONCURRENCY_ACQUIRE_TIMEOUT_SECONDS": 0}):
+            with concurrency_slot(SCOPE_LLM_PROVIDER, "openai"):
+                ran()
+        ran.assert_called_once()
+        mock_core_config.redis_client.zrem.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services import dead_letter_service
+from api.services.dead_letter_service import (
+    DEAD_LETTER_NOTIFICATION, record_dead_letter, register_dead_letter_handler, retry_delay_seconds,
+    retry_due_dead_letters
+)
+
+
+def _stream_entry(entry_id, attempt=1, kind="test_kind", params=None):
+    return (entry_id.encode(), {
+        b"kind": kind.encode(), b"params": json.dumps(params or {"value": 1}).encode(), b"error": b"boom",
+        b"description": b"", b"attempt": str(attempt).encode(), b"first_failed_at": b"100.0",
+        b"failed_at": b"100.0", b"next_retry_at": b"160.0",
+    })
+
+
+class TestDeadLetterService(unittest.TestCase):
+
+    def tearDown(self):
+        dead_letter_service._dead_letter_handlers.pop("test_kind", None)
+
+    def test_retry_delay_grows_exponentially_up_to_max(self):
+        configs = {"DEAD_LETTER_RETRY_BASE_SECONDS": 60, "DEAD_LETTER_RETRY_MAX_SECONDS": 600}
+        with patch.dict('api.services.dead_letter_service.app_configs', configs):
+            self.assertEqual([retry_delay_seconds(attempt) for attempt in range(1, 6)], [60, 120, 240, 480, 600])
+
+    @patch('api.services.dead_letter_service.time.time', return_value=1000.0)
+    @patch('api.services.dead_letter_service.core_config')
+    def test_record_schedules_retry_until_attempts_exhausted(self, mock_core_config, mock_time):
+        redis_client = mock_core_config.redis_client
+        redis_client.xadd.return_value = b"1-0"
+        with patch.dict('api.services.dead_letter_service.app_configs', {"DEAD_LETTER_MAX_ATTEMPTS": 3}):
+            self.assertEqual(record_dead_letter("test_kind", {"value": 1}, "boom", attempt=2), "1-0")
+            redis_client.zadd.assert_called_once_with("ai_code_review_helper:dead_letters:schedule", {b"1-0": 1120.0})
+            fields = redis_client.xadd.call_args.args[1]
+            self.assertEqual((fields["attempt"], json.loads(fields["params"])), (2, {"value": 1}))
+
+            redis_client.zadd.reset_mock()
+            record_dead_letter("test_kind", {"value": 1}, "boom", attempt=3)
+            redis_client.zadd.assert_not_called()  # 已达到最大失败次数，不再自动重试
+            self.assertEqual(redis_client.xadd.call_args.args[1]["next_retry_at"], "")
+
+    @patch('api.services.dead_letter_service.core_config')
+    def test_failed_replay_is_rerecorded_once_with_next_attempt(self, mock_core_config):
+        redis_client = mock_core_config.redis_client
+        redis_client.zrangebyscore.return_value = [b"1-0"]
+        redis_client.eval.return_value = 1
+        redis_client.xrange.return_value = [_stream_entry("1-0", attempt=2)]
+        redis_client.xadd.return_value = b"2-0"
+
+        def failing_handler(value):
+            # 重放期间被调用的函数自行写入的失败记录会被忽略
+            self.assertIsNone(record_dead_letter("test_kind", {"value": value}, "nested"))
+            raise RuntimeError("still down")
+
+        register_dead_letter_handler("test_kind", failing_handler)
+        self.assertEqual(retry_due_dead_letters(now=200.0), 1)
+        redis_client.pipeline.return_value.xdel.assert_called_once_with("ai_code_review_helper:dead_letters", "1-0")
+        redis_client.xadd.assert_called_once()
+        fields = redis_client.xadd.call_args.args[1]
+        self.assertEqual((fields["attempt"], fields["first_failed_at"]), (3, 100.0))
+        self.assertEqual(fields["error"], "RuntimeError: still down")
+
+    @patch('api.services.dead_letter_service.core_config')
+    def test_successful_replay_removes_entry_and_claimed_entries_are_skipped(self, mock_core_config):
+        redis_client = mock_core_config.redis_client
+        redis_client.zrangebyscore.return_value = [b"1-0", b"2-0"]
+        redis_client.eval.side_effect = [1, 0]  # 2-0 已被其他进程取出
+        redis_client.xrange.return_value = [_stream_entry("1-0")]
+        handler = MagicMock(return_value=True)
+        register_dead_letter_handler("test_kind", handler)
+
+        self.assertEqual(retry_due_dead_letters(now=200.0), 1)
+        handler.assert_called_once_with(value=1)
+        redis_client.pipeline.return_value.zrem.assert_called_once_with("ai_code_review_helper:dead_letters:schedule", "1-0")
+        redis_client.xadd.assert_not_called()
+
+    @patch('api.services.dead_letter_service.core_config')
+    @patch('api.services.notification_service.requests.post')
+    def test_failed_notification_is_dead_lettered_without_url(self, mock_post, mock_core_config):
+        from api.services.notification_service import send_notifications
+        mock_core_config.redis_client.xadd.return_value = b"1-0"
+        mock_post.return_value.json.return_value = {"errcode": 93000, "errmsg": "invalid webhook url"}
+        configs = {"WECOM_BOT_WEBHOOK_URL": "https://qyapi.example.com/secret-key", "CUSTOM_WEBHOOK_URL": ""}
+        with patch.dict('api.services.notification_service.app_configs', configs):
+            send_notifications("**done**")
+        fields = mock_core_config.redis_client.xadd.call_args.args[1]
+        self.assertEqual(fields["kind"], DEAD_LETTER_NOTIFICATION)
+        self.assertNotIn("secret-key", fields["params"])
+
+
+if __name__ == '__main__':
+    unittest.main()
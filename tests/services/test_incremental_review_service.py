@@ -0,0 +1,45 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.incremental_review_service import plan_incremental_review
+
+
+class TestPlanIncrementalReview(unittest.TestCase):
+
+    def setUp(self):
+        self.current_files = {"a.py": None, "b.py": None, "renamed.py": "original.py"}
+        self.previous_reviews = [
+            {"file": "a.py", "analysis": "旧问题 a"},
+            {"file": "b.py", "analysis": "旧问题 b"},
+            {"file": "removed_from_pr.py", "analysis": "已不在 PR 中"},
+        ]
+
+    @patch('api.services.incremental_review_service.get_review_results')
+    @patch('api.services.incremental_review_service.get_last_reviewed_commit', return_value="old_sha")
+    def test_only_changed_files_are_reviewed(self, _mock_last, mock_results):
+        mock_results.return_value = self.previous_reviews
+        fetch = MagicMock(return_value={"a.py", "original.py"})
+        paths, carried = plan_incremental_review("github", "o/r", "1", "new_sha", self.current_files, fetch)
+        fetch.assert_called_once_with("old_sha", "new_sha")
+        self.assertEqual(paths, {"a.py", "renamed.py"})
+        self.assertEqual(carried, [{"file": "b.py", "analysis": "旧问题 b"}])
+
+    @patch('api.services.incremental_review_service.get_last_reviewed_commit', return_value=None)
+    def test_full_review_without_previous_commit(self, _mock_last):
+        fetch = MagicMock()
+        self.assertEqual(plan_incremental_review("github", "o/r", "1", "sha", self.current_files, fetch), (None, []))
+        fetch.assert_not_called()
+
+    @patch('api.services.incremental_review_service.get_review_results', return_value=[])
+    @patch('api.services.incremental_review_service.get_last_reviewed_commit', return_value="old_sha")
+    def test_full_review_when_compare_fails(self, _mock_last, _mock_results):
+        fetch = MagicMock(return_value=None)
+        self.assertEqual(plan_incremental_review("gitlab", "1", "2", "sha", self.current_files, fetch), (None, []))
+
+    @patch.dict('api.services.incremental_review_service.app_configs', {"INCREMENTAL_REVIEW_ENABLED": False})
+    def test_disabled_by_config(self):
+        fetch = MagicMock()
+        self.assertEqual(plan_incremental_review("github", "o/r", "1", "sha", self.current_files, fetch), (None, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,320 @@
+import json
+import threading
+import time
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+from api.services import job_queue_service
+from api.services.job_queue_service import (
+    CancellationToken, JobInterrupted, dispatch_due_jobs, drain_local_jobs, record_latest_head, register_job_handler,
+    resume_interrupted_jobs, run_review_job, submit_review_job
+)
+
+
+class TestJobQueueService(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = MagicMock()
+        register_job_handler("test_kind", self.handler)
+        job_queue_service._latest_heads.clear()
+        job_queue_service._interrupt_event.clear()
+        job_queue_service._draining.clear()
+        job_queue_service._local_jobs.clear()
+        job_queue_service._saved_on_drain.clear()
+
+    def tearDown(self):
+        job_queue_service._interrupt_event.clear()
+        job_queue_service._draining.clear()
+        job_queue_service._local_jobs.clear()
+        job_queue_service._saved_on_drain.clear()
+
+    @patch('api.services.job_queue_service._get_local_scheduler')
+    def test_local_mode_runs_in_process(self, mock_scheduler):
+        with patch.dict('api.services.job_queue_service.app_configs', {"JOB_QUEUE_MODE": "local"}):
+            submit_review_job("test_kind", "github", "owner/repo", 5, "sha1", owner="owner")
+        func, job = mock_scheduler.return_value.submit.call_args.args
+        self.assertIs(func, run_review_job)
+        self.assertEqual((job["kind"], job["pr_mr_id"], job["params"]), ("test_kind", "5", {"owner": "owner"}))
+
+    @patch('api.services.job_queue_service._get_local_scheduler')
+    @patch('api.services.job_queue_service.core_config')
+    def test_redis_stream_mode_enqueues_compact_job_without_token(self, mock_core_config, mock_scheduler):
+        with patch.dict('api.services.job_queue_service.app_configs', {"JOB_QUEUE_MODE": "redis_stream"}):
+            job_id = submit_review_job("test_kind", "gitlab", "42", 7, "sha2", mr_iid=7)
+        mock_scheduler.return_value.submit.assert_not_called()
+        stream_key, fields = mock_core_config.redis_client.xadd.call_args.args
+        job = json.loads(fields["job"])
+        self.assertEqual(job["job_id"], job_id)
+        self.assertNotIn("access_token", json.dumps(job))
+
+    @patch('api.core_config.redis_client')
+    @patch('api.services.job_queue_service.core_config')
+    def test_run_reads_latest_token_from_redis(self, mock_core_config, mock_config_redis):
+        mock_config_redis.hget.return_value = json.dumps({"token": "fresh-token"}).encode()
+        mock_core_config.redis_client.get.return_value = b"sha"
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 1, "sha", {"owner": "owner"})
+        run_review_job(job)
+        self.handler.assert_called_once()
+        kwargs = self.handler.call_args.kwargs
+        self.assertEqual((kwargs["access_token"], kwargs["owner"]), ("fresh-token", "owner"))
+        self.assertFalse(kwargs["cancel_token"].is_cancelled())
+
+    @patch('api.services.job_queue_service.core_config')
+    def test_run_without_token_is_dropped(self, mock_core_config):
+        mock_core_config.redis_client.hget.return_value = None
+        run_review_job(job_queue_service.build_job("test_kind", "gitlab", "no-such-project", 1, "sha", {}))
+        self.handler.assert_not_called()
+
+    @patch('api.services.job_queue_service.core_config')
+    def test_superseded_job_is_skipped(self, mock_core_config):
+        mock_core_config.redis_client = None
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 3, "old-sha", {})
+        record_latest_head("test_kind", "owner/repo", 3, "new-sha")
+        run_review_job(job)
+        self.handler.assert_not_called()
+
+    @patch('api.services.job_queue_service.core_config')
+    def test_token_cancels_when_newer_head_is_pushed(self, mock_core_config):
+        mock_core_config.redis_client.get.side_effect = [b"sha1", b"sha2", b"sha1"]
+        token = CancellationToken("test_kind", "owner/repo", 4, "sha1")
+        self.assertFalse(token.is_cancelled())
+        self.assertTrue(token.is_cancelled())
+        # 一旦取消不再恢复，也不再查询 Redis
+        self.assertTrue(token.is_cancelled())
+        self.assertEqual(mock_core_config.redis_client.get.call_count, 2)
+
+    @patch('api.services.job_queue_service._get_local_scheduler')
+    @patch('api.services.job_queue_service.core_config')
+    def test_submit_records_latest_head(self, mock_core_config, mock_scheduler):
+        with patch.dict('api.services.job_queue_service.app_configs', {"JOB_QUEUE_MODE": "local"}):
+            submit_review_job("test_kind", "gitlab", "42", 9, "head-sha")
+        key, value = mock_core_config.redis_client.set.call_args.args
+        self.assertTrue(key.endswith("latest_head:test_kind:42:9"))
+        self.assertEqual(value, "head-sha")
+
+    @patch('api.services.job_queue_service._get_local_scheduler')
+    @patch('api.services.job_queue_service.core_config')
+    def test_debounce_keeps_only_latest_push(self, mock_core_config, mock_scheduler):
+        redis_client = mock_core_config.redis_client
+        redis_client.eval.return_value = None
+        with patch.dict('api.services.job_queue_service.app_configs',
+                        {"JOB_QUEUE_MODE": "local", "PUSH_DEBOUNCE_SECONDS": 30}):
+            submit_review_job("test_kind", "github", "owner/repo", 8, "sha-a")
+            latest_job_id = submit_review_job("test_kind", "github", "owner/repo", 8, "sha-b")
+        mock_scheduler.return_value.submit.assert_not_called()
+        # 两次推送写入同一个成员，后一次覆盖前一次的任务并重新计时 (读取与覆盖在同一个脚本中完成)
+        members = [call.args[4] for call in redis_client.eval.call_args_list]
+        self.assertEqual(members, ["test_kind:owner/repo:8"] * 2)
+        self.assertEqual(json.loads(redis_client.eval.call_args.args[5])["job_id"], latest_job_id)
+        redis_client.hget.assert_not_called()
+
+    @patch('api.services.job_queue_service.set_job_state')
+    @patch('api.services.job_queue_service.release_commit_claim')
+    @patch('api.services.job_queue_service.core_config')
+    def test_debounce_releases_claim_only_of_replaced_pending_job(self, mock_core_config, mock_release, mock_set_state):
+        previous = job_queue_service.build_job("test_kind", "github", "owner/repo", 8, "sha-a", {},
+                                               claim_vcs_type="github")
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 8, "sha-b", {}, claim_vcs_type="github")
+        # 前一个任务已被轮询取出并提交 (脚本未覆盖任何待执行的任务)：不释放其认领
+        mock_core_config.redis_client.eval.return_value = None
+        self.assertTrue(job_queue_service._schedule_debounced_job(job, 30))
+        mock_release.assert_not_called()
+        mock_set_state.assert_not_called()
+
+        mock_core_config.redis_client.eval.return_value = json.dumps(previous).encode()
+        self.assertTrue(job_queue_service._schedule_debounced_job(job, 30))
+        mock_release.assert_called_once_with("github", "owner/repo", "8", "sha-a", previous["job_id"])
+        self.assertEqual(mock_set_state.call_args.args[:2], (previous["job_id"], job_queue_service.JOB_STATE_SKIPPED))
+
+    @patch('api.services.job_queue_service._get_local_scheduler')
+    @patch('api.services.job_queue_service.core_config')
+    def test_dispatch_due_jobs_submits_claimed_jobs(self, mock_core_config, mock_scheduler):
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 8, "sha-b", {})
+        mock_core_config.redis_client.zrangebyscore.return_value = [b"test_kind:owner/repo:8", b"test_kind:other:1"]
+        # 第二个成员已被其他进程取出
+        mock_core_config.redis_client.eval.side_effect = [json.dumps(job).encode(), None]
+        with patch.dict('api.services.job_queue_service.app_configs', {"JOB_QUEUE_MODE": "local"}):
+            self.assertEqual(dispatch_due_jobs(now=1000.0), 1)
+        func, submitted = mock_scheduler.return_value.submit.call_args.args
+        self.assertEqual(submitted["job_id"], job["job_id"])
+
+    @patch('api.services.job_queue_service._get_local_scheduler')
+    @patch('api.services.job_queue_service.core_config')
+    def test_overloaded_gate_holds_due_jobs_and_defer_delays_submission(self, mock_core_config, mock_scheduler):
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 8, "sha-b", {})
+        mock_core_config.redis_client.zrangebyscore.return_value = [b"test_kind:owner/repo:8"]
+        mock_core_config.redis_client.eval.return_value = json.dumps(job).encode()
+        with patch.object(job_queue_service, '_dispatch_gate', lambda: False), \
+                patch.dict('api.services.job_queue_service.app_configs', {"JOB_QUEUE_MODE": "local", "PUSH_DEBOUNCE_SECONDS": 0}):
+            self.assertEqual(dispatch_due_jobs(now=1000.0), 0)
+            mock_core_config.redis_client.eval.assert_not_called()
+            submit_review_job("test_kind", "github", "owner/repo", 9, "sha-c", defer_seconds=60)
+        mock_scheduler.return_value.submit.assert_not_called()
+        due_at = mock_core_config.redis_client.eval.call_args.args[6]
+        self.assertGreater(due_at, time.time() + 50)
+
+    @patch('api.services.job_queue_service._get_local_scheduler')
+    @patch('api.services.job_queue_service.claim_commit_for_review', return_value=False)
+    def test_duplicate_delivery_is_not_submitted(self, mock_claim, mock_scheduler):
+        with patch.dict('api.services.job_queue_service.app_configs', {"JOB_QUEUE_MODE": "local"}):
+            job_id = submit_review_job("test_kind", "github", "owner/repo", 5, "sha1", claim_vcs_type="github")
+        self.assertIsNone(job_id)
+        self.assertEqual(mock_claim.call_args.args[:4], ("github", "owner/repo", "5", "sha1"))
+        mock_scheduler.return_value.submit.assert_not_called()
+
+    @patch('api.services.job_queue_service.release_commit_claim')
+    @patch('api.services.job_queue_service.renew_commit_claim', return_value=True)
+    @patch('api.services.job_queue_service.resolve_access_token', return_value="token")
+    def test_claim_is_released_even_when_handler_fails(self, mock_token, mock_renew, mock_release):
+        self.handler.side_effect = RuntimeError("boom")
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 1, "sha", {}, claim_vcs_type="github")
+        with self.assertRaises(RuntimeError):
+            run_review_job(job)
+        mock_release.assert_called_once_with("github", "owner/repo", "1", "sha", job["job_id"])
+        self.assertEqual(job_queue_service._active_claims, {})
+
+    @patch('api.services.job_queue_service.set_job_state')
+    @patch('api.services.job_queue_service.resolve_access_token', return_value="token")
+    @patch('api.services.job_queue_service.core_config')
+    def test_job_states_are_recorded_around_handler(self, mock_core_config, mock_token, mock_set_state):
+        mock_core_config.redis_client = None
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 1, "sha", {})
+        run_review_job(job)
+        self.assertEqual(self.handler.call_args.kwargs["cancel_token"].job_id, job["job_id"])
+        self.assertEqual([c.args for c in mock_set_state.call_args_list],
+                         [(job["job_id"], "fetching"), (job["job_id"], "done")])
+
+        mock_set_state.reset_mock()
+        self.handler.side_effect = RuntimeError("LLM timeout")
+        with self.assertRaises(RuntimeError):
+            run_review_job(job)
+        self.assertEqual(mock_set_state.call_args.args, (job["job_id"], "failed"))
+        self.assertEqual(mock_set_state.call_args.kwargs["error"], "RuntimeError: LLM timeout")
+
+    @patch('api.services.job_queue_service.release_commit_claim')
+    @patch('api.services.job_queue_service.renew_commit_claim', return_value=False)
+    def test_job_claimed_elsewhere_is_skipped(self, mock_renew, mock_release):
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 1, "sha", {}, claim_vcs_type="github")
+        run_review_job(job)
+        self.handler.assert_not_called()
+        mock_release.assert_not_called()
+
+    @patch('api.core_config.redis_client')
+    def test_claim_script_checks_processed_set_and_claim_key(self, mock_redis):
+        from api.core_config import claim_commit_for_review
+        mock_redis.eval.return_value = 1
+        self.assertTrue(claim_commit_for_review("gitlab", "42", "7", "abc", "job-1"))
+        _, num_keys, processed_set, claim_key, member, owner, lease = mock_redis.eval.call_args.args
+        self.assertEqual((num_keys, member, owner), (2, "gitlab:42:7:abc", "job-1"))
+        self.assertTrue(processed_set.endswith("processed_commits_set"))
+        self.assertTrue(claim_key.endswith("review_claims:gitlab:42:7:abc"))
+        mock_redis.eval.return_value = 0
+        self.assertFalse(claim_commit_for_review("gitlab", "42", "7", "abc", "job-2"))
+
+
+    @patch('api.services.job_queue_service.release_commit_claim')
+    @patch('api.services.job_queue_service.renew_commit_claim', return_value=True)
+    @patch('api.services.job_queue_service.resolve_access_token', return_value="token")
+    @patch('api.services.job_queue_service.core_config')
+    def test_interrupted_job_raises_and_releases_claim(self, mock_core_config, mock_token, mock_renew, mock_release):
+        mock_core_config.redis_client = None
+
+        def handler(cancel_token, **kwargs):
+            job_queue_service.interrupt_running_jobs()
+            self.assertTrue(cancel_token.is_cancelled())  # 处理函数在文件边界检查到中断后提前返回
+
+        register_job_handler("test_kind", handler)
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 1, "sha", {}, claim_vcs_type="github")
+        with self.assertRaises(JobInterrupted):
+            run_review_job(job)
+        mock_release.assert_called_once()
+
+    @patch('api.services.job_queue_service.core_config')
+    def test_cancelled_or_interrupted_local_job_is_saved_for_resume(self, mock_core_config):
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 1, "sha", {})
+        cancelled, interrupted = Future(), Future()
+        cancelled.cancel()
+        interrupted.set_exception(JobInterrupted("shutdown"))
+        job_queue_service._on_local_job_done(job, cancelled)
+        job_queue_service._on_local_job_done(job, interrupted)
+        self.assertEqual(mock_core_config.redis_client.rpush.call_count, 2)
+        key, raw_job = mock_core_config.redis_client.rpush.call_args.args
+        self.assertTrue(key.endswith("interrupted_jobs"))
+        self.assertEqual(json.loads(raw_job)["job_id"], job["job_id"])
+
+    @patch('api.services.job_queue_service._dispatch_job')
+    @patch('api.services.job_queue_service.core_config')
+    def test_resume_dispatches_saved_jobs(self, mock_core_config, mock_dispatch):
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 1, "sha", {})
+        mock_core_config.redis_client.lpop.side_effect = [json.dumps(job).encode(), b"not json", None]
+        self.assertEqual(resume_interrupted_jobs(), 1)
+        mock_dispatch.assert_called_once_with(job)
+
+    @patch('api.services.job_queue_service._INTERRUPT_GRACE_SECONDS', 1)
+    @patch('api.services.job_queue_service.core_config')
+    def test_drain_interrupts_jobs_past_deadline(self, mock_core_config):
+        mock_core_config.redis_client.get.return_value = None
+        pool = ThreadPoolExecutor(max_workers=1)
+        scheduler = job_queue_service.create_scheduler(pool, 1)
+
+        def slow_job(job):
+            token = CancellationToken("test_kind", "owner/repo", 1, "sha")
+            while not token.is_cancelled():
+                time.sleep(0.01)
+            raise JobInterrupted("shutdown")
+
+        running = scheduler.submit(slow_job, {"job_id": "running"})
+        queued = scheduler.submit(slow_job, {"job_id": "queued"})
+        with patch('api.services.job_queue_service._local_scheduler', scheduler):
+            self.assertEqual(drain_local_jobs(drain_seconds=0.05), 0)
+        self.assertTrue(queued.cancelled())
+        self.assertIsInstance(running.exception(), JobInterrupted)
+        self.assertTrue(scheduler.submit(slow_job, {"job_id": "late"}).cancelled())
+        pool.shutdown()
+
+    @patch('api.services.job_queue_service._INTERRUPT_GRACE_SECONDS', 0.05)
+    @patch('api.services.job_queue_service.set_job_state')
+    @patch('api.services.job_queue_service.core_config')
+    def test_drain_saves_jobs_still_running_after_grace_period(self, mock_core_config, mock_set_state):
+        rpush = mock_core_config.redis_client.rpush
+        release = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=1)
+        scheduler = job_queue_service.create_scheduler(pool, 1)
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 1, "sha", {})
+
+        def stuck_job(job):  # 正在等待 LLM 响应，无法在文件边界中断
+            release.wait(5)
+            raise JobInterrupted("shutdown")
+
+        job_queue_service._local_jobs[job["job_id"]] = job
+        future = scheduler.submit(stuck_job, job)
+        future.add_done_callback(lambda f: job_queue_service._on_local_job_done(job, f))
+        with patch('api.services.job_queue_service._local_scheduler', scheduler):
+            self.assertEqual(drain_local_jobs(drain_seconds=0), 1)
+        rpush.assert_called_once()
+        self.assertEqual(json.loads(rpush.call_args.args[1])["job_id"], job["job_id"])  # 原 job_id，恢复时可续约认领
+
+        release.set()
+        pool.shutdown()
+        rpush.assert_called_once()  # 任务之后结束时不再重复保存
+        self.assertNotIn(job["job_id"], job_queue_service._saved_on_drain)
+
+
+    @patch('api.services.job_queue_service.threading.Timer')
+    def test_failed_local_job_is_retried_with_next_attempt(self, mock_timer):
+        job = job_queue_service.build_job("test_kind", "github", "owner/repo", 1, "sha", {})
+        failed = Future()
+        failed.set_exception(RuntimeError("comment POST failed"))
+        with patch.dict('api.services.job_queue_service.app_configs',
+                        {"JOB_MAX_DELIVERIES": 2, "JOB_RETRY_DELAY_SECONDS": 10}), \
+                patch('api.services.job_queue_service.logger'):
+            job_queue_service._on_local_job_done(job, failed)
+            delay, dispatch = mock_timer.call_args.args[:2]
+            retried_job = mock_timer.call_args.kwargs["args"][0]
+            self.assertEqual((delay, dispatch, retried_job["attempt"]), (10, job_queue_service._dispatch_job, 2))
+            job_queue_service._on_local_job_done(retried_job, failed)  # 已达重试上限，不再重试
+        self.assertEqual(mock_timer.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
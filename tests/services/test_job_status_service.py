@@ -0,0 +1,72 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services import job_status_service
+from api.services.job_status_service import get_job, list_jobs, record_job_queued, report_job_state, set_job_state
+
+
+def _fields(**fields):
+    return {k.encode(): str(v).encode() for k, v in fields.items()}
+
+
+class TestJobStatusService(unittest.TestCase):
+
+    @patch('api.services.job_status_service.time.time', return_value=1000.0)
+    @patch('api.services.job_status_service.core_config')
+    def test_queued_job_is_written_and_indexed(self, mock_core_config, mock_time):
+        pipe = mock_core_config.redis_client.pipeline.return_value
+        job = {"job_id": "j1", "kind": "github_detailed", "platform": "github", "identifier": "owner/repo",
+               "pr_mr_id": "3", "head_sha": "abc", "size_hint": None, "enqueued_at": 990.0}
+        with patch.dict('api.services.job_status_service.app_configs', {"JOB_STATUS_MAX_ENTRIES": 100}):
+            record_job_queued(job)
+        key, = pipe.hset.call_args.args
+        mapping = pipe.hset.call_args.kwargs["mapping"]
+        self.assertTrue(key.endswith("job_status:j1"))
+        self.assertEqual((mapping["state"], mapping["stage:queued"], mapping["attempt"], mapping["size_hint"]),
+                         ("queued", 1000.0, 1, ""))
+        self.assertEqual(pipe.zadd.call_args.args[1], {"j1": 990.0})
+        self.assertEqual(pipe.zremrangebyrank.call_args.args[1:], (0, -101))
+        pipe.execute.assert_called_once()
+
+    @patch('api.services.job_status_service.core_config')
+    def test_report_without_job_does_nothing(self, mock_core_config):
+        report_job_state(None, "reviewing", files_total=3)
+        set_job_state(None, "done")
+        mock_core_config.redis_client.pipeline.assert_not_called()
+
+    @patch('api.services.job_status_service.time.time', return_value=1100.0)
+    @patch('api.services.job_status_service.core_config')
+    def test_stage_timings_follow_latest_attempt(self, mock_core_config, mock_time):
+        mock_core_config.redis_client.hgetall.return_value = _fields(**{
+            "job_id": "j1", "state": "reviewing", "attempt": 2, "files_done": 2, "files_total": 5,
+            "error": "RuntimeError: boom", "updated_at": 1090,
+            # 第一次执行的 fetching/failed 早于重新排队的时间，不计入本次的阶段
+            "stage:failed": 1010, "stage:queued": 1040, "stage:fetching": 1050, "stage:reviewing": 1060,
+        })
+        job = get_job("j1")
+        self.assertEqual([(s["state"], s["duration_seconds"]) for s in job["stages"]],
+                         [("queued", 10.0), ("fetching", 10.0), ("reviewing", 40.0)])
+        self.assertEqual((job["queue_wait_seconds"], job["total_seconds"]), (10.0, 60.0))
+        self.assertEqual((job["files_done"], job["files_total"], job["attempt"]), (2, 5, 2))
+        self.assertFalse(job["stalled"])
+
+    @patch('api.services.job_status_service.time.time', return_value=5000.0)
+    @patch('api.services.job_status_service.core_config')
+    def test_list_filters_counts_and_prunes_expired_jobs(self, mock_core_config, mock_time):
+        mock_core_config.redis_client.zrevrange.return_value = [b"j3", b"j2", b"j1"]
+        pipe = MagicMock()
+        pipe.execute.return_value = [
+            _fields(job_id="j3", state="reviewing", updated_at=1000, **{"stage:queued": 900}),
+            {},
+            _fields(job_id="j1", state="done", updated_at=800, **{"stage:queued": 700, "stage:done": 800}),
+        ]
+        mock_core_config.redis_client.pipeline.return_value = pipe
+        with patch.dict('api.services.job_status_service.app_configs', {"JOB_STALLED_SECONDS": 600}):
+            result = list_jobs(limit=10, state="reviewing")
+        self.assertEqual(result["counts"], {"reviewing": 1, "done": 1})
+        self.assertEqual([job["job_id"] for job in result["jobs"]], ["j3"])
+        self.assertTrue(result["jobs"][0]["stalled"])
+        mock_core_config.redis_client.zrem.assert_called_once_with(job_status_service.REDIS_JOB_STATUS_INDEX_KEY, b"j2")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.llm_review_detailed_service import get_openai_code_review, get_openai_detailed_review_for_file
+
+
+def _file(path):
+    return {"path": path, "old_path": None, "changes": [{"type": "add", "new_line": 1, "content": "x = 1"}], "context": {}}
+
+
+def _review(path):
+    return {"file": path, "lines": {"new": 1}, "category": "Bug", "severity": "HIGH", "analysis": "a", "suggestion": "s"}
+
+
+@patch('api.services.llm_review_detailed_service.get_prompt', return_value="system prompt")
+@patch('api.services.llm_review_detailed_service.get_openai_client', return_value=MagicMock())
+class TestDetailedReviewCheckpoint(unittest.TestCase):
+
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion')
+    def test_checkpointed_files_skip_llm_and_new_results_are_saved(self, mock_completion, mock_client, mock_prompt):
+        checkpoint = MagicMock()
+        checkpoint.get_file_reviews.side_effect = lambda path: [_review("a.py")] if path == "a.py" else None
+        mock_completion.side_effect = [json.dumps([_review("b.py")]), RuntimeError("LLM timeout")]
+        with patch('api.services.llm_review_detailed_service.logger'):
+            result = json.loads(get_openai_code_review({"a.py": _file("a.py"), "b.py": _file("b.py"), "c.py": _file("c.py")},
+                                                       checkpoint=checkpoint))
+        self.assertEqual([review["file"] for review in result], ["a.py", "b.py"])
+        self.assertEqual(mock_completion.call_count, 2)  # a.py 从检查点读取
+        # 失败的 c.py 不写入检查点，重试时重新审查
+        checkpoint.save_file_reviews.assert_called_once_with("b.py", [_review("b.py")])
+
+    @patch('api.services.llm_review_detailed_service.execute_llm_chat_completion')
+    def test_single_file_review_distinguishes_failure_from_no_issues(self, mock_completion, mock_client, mock_prompt):
+        mock_completion.side_effect = ["[]", "not json"]
+        with patch('api.services.llm_review_detailed_service.logger'):
+            self.assertEqual(get_openai_detailed_review_for_file("a.py", _file("a.py"), MagicMock(), "gpt-4o"), [])
+            self.assertIsNone(get_openai_detailed_review_for_file("a.py", _file("a.py"), MagicMock(), "gpt-4o"))
+
+
+if __name__ == '__main__':
+    unittest.main()
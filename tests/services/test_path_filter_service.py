@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import patch
+from api.services.path_filter_service import (
+    PathFilter, detect_generated_content, get_path_filter, normalize_path_filter_config
+)
+
+
+class TestPathFilter(unittest.TestCase):
+
+    def test_default_excludes(self):
+        path_filter = PathFilter()
+        for path in ["yarn.lock", "web/package-lock.json", "vendor/lib.go", "svc/a/vendor/x.go",
+                     "static/app.min.js", "src/__snapshots__/view.snap", "proto/user_pb2.py", "api/user.pb.go"]:
+            self.assertIsNotNone(path_filter.skip_reason_for_path(path), path)
+        for path in ["src/main.py", "app.js", "vendored.py"]:
+            self.assertIsNone(path_filter.skip_reason_for_path(path), path)
+
+    def test_include_and_exclude_rules(self):
+        path_filter = PathFilter(include_patterns=["src/**", "**/*.go"], exclude_patterns=["src/gen/"],
+                                 use_default_excludes=False)
+        self.assertIsNone(path_filter.skip_reason_for_path("src/app/main.py"))
+        self.assertIsNone(path_filter.skip_reason_for_path("cmd/main.go"))
+        self.assertIsNone(path_filter.skip_reason_for_path("main.go"))
+        self.assertIsNotNone(path_filter.skip_reason_for_path("docs/readme.md"))
+        self.assertIsNotNone(path_filter.skip_reason_for_path("src/gen/models.py"))
+
+    def test_renamed_from_excluded_path(self):
+        path_filter = PathFilter()
+        self.assertIsNotNone(path_filter.skip_reason("lib/x.go", "+a", old_path="vendor/x.go"))
+
+    def test_generated_content_heuristics(self):
+        self.assertIsNotNone(detect_generated_content("@@ -0,0 +1,2 @@\n+// Code generated by protoc-gen-go. DO NOT EDIT.\n+package x"))
+        self.assertIsNotNone(detect_generated_content("@@ -0,0 +1 @@\n+" + "a" * 2000))
+        self.assertIsNotNone(detect_generated_content("@@ -1,3 +1,3 @@\n # This file is autogenerated by pip-compile\n-a==1\n+a==2"))
+        # 删除行中的标记不影响判断
+        self.assertIsNone(detect_generated_content("@@ -1 +1 @@\n-// @generated\n+def f(): pass"))
+        self.assertIsNone(detect_generated_content(""))
+
+    def test_generated_heuristics_ignore_ordinary_code(self):
+        # 代码中的标识符、非文件头部的注释以及与生成无关的 "do not edit" 都不是生成文件标记
+        self.assertIsNone(detect_generated_content("@@ -1,2 +1,3 @@\n import x\n+    user.id = make_autogenerated_id()\n x.run()"))
+        self.assertIsNone(detect_generated_content("@@ -1,2 +1,3 @@\n+# Do not edit this list without updating docs\n A = 1\n B = 2"))
+        self.assertIsNone(detect_generated_content("@@ -40,2 +40,3 @@\n def f():\n+    # @generated ids below are stable\n     pass"))
+        # 单个超长行 (如 base64 常量) 不代表整个文件是压缩产物
+        self.assertIsNone(detect_generated_content(
+            "@@ -10,6 +10,7 @@\n a = 1\n b = 2\n c = 3\n+LOGO = '" + "QUFB" * 500 + "'\n d = 4\n e = 5\n f = 6"))
+
+    def test_get_path_filter_reads_repo_config(self):
+        configs = {"o/r": {"secret": "s", "token": "t", "exclude_paths": ["docs/**"], "use_default_excludes": False}}
+        with patch.dict('api.services.path_filter_service.github_repo_configs', configs, clear=True):
+            path_filter = get_path_filter("github", "o/r")
+        self.assertIsNotNone(path_filter.skip_reason_for_path("docs/a.md"))
+        self.assertIsNone(path_filter.skip_reason_for_path("yarn.lock"))
+
+    def test_normalize_path_filter_config(self):
+        self.assertEqual(normalize_path_filter_config({"include_paths": "src/**, *.py\nlib/"}),
+                         {"include_paths": ["src/**", "*.py", "lib/"]})
+        self.assertEqual(normalize_path_filter_config({"use_default_excludes": "false"}),
+                         {"use_default_excludes": False})
+        self.assertEqual(normalize_path_filter_config({"secret": "s"}), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
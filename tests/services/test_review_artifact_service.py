@@ -0,0 +1,89 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services import review_artifact_service
+from api.services.review_artifact_service import clear_memory_cache, get_or_fetch_review_artifact
+
+
+class TestReviewArtifactService(unittest.TestCase):
+
+    def setUp(self):
+        clear_memory_cache()
+
+    def tearDown(self):
+        clear_memory_cache()
+
+    @patch('api.services.review_artifact_service.core_config')
+    def test_fetches_once_and_returns_copies(self, mock_core_config):
+        mock_core_config.redis_client.get.return_value = None
+        fetch = MagicMock(return_value={"files": [{"path": "a.py"}]})
+        first = get_or_fetch_review_artifact("github", "owner/repo", 7, "abc123", "pr_files", fetch)
+        first["files"].append({"path": "mutated.py"})
+        second = get_or_fetch_review_artifact("github", "owner/repo", 7, "abc123", "pr_files", fetch)
+        fetch.assert_called_once()
+        self.assertEqual(second, {"files": [{"path": "a.py"}]})
+        key, ttl, _ = mock_core_config.redis_client.setex.call_args.args
+        self.assertTrue(key.endswith("review_artifacts:github:owner/repo:7:abc123:pr_files"))
+        self.assertEqual(ttl, 600)
+
+    @patch('api.services.review_artifact_service.core_config')
+    def test_reads_artifact_written_by_other_process(self, mock_core_config):
+        mock_core_config.redis_client.get.return_value = b'{"diff": "@@ -1 +1 @@"}'
+        fetch = MagicMock()
+        value = get_or_fetch_review_artifact("github", "owner/repo", 7, "abc123", "pr_diff", fetch)
+        self.assertEqual(value, {"diff": "@@ -1 +1 @@"})
+        fetch.assert_not_called()
+
+    @patch('api.services.review_artifact_service.core_config')
+    def test_uncacheable_values_and_missing_sha_are_not_cached(self, mock_core_config):
+        mock_core_config.redis_client.get.return_value = None
+        fetch = MagicMock(return_value=[{"head_commit_sha": "old"}])
+        for _ in range(2):
+            get_or_fetch_review_artifact("gitlab", "42", 3, "new", "mr_versions", fetch,
+                                         cacheable=lambda versions: versions[0]["head_commit_sha"] == "new")
+            get_or_fetch_review_artifact("gitlab", "42", 3, None, "mr_versions", fetch)
+        self.assertEqual(fetch.call_count, 4)
+        mock_core_config.redis_client.setex.assert_not_called()
+
+    @patch('api.services.review_artifact_service.core_config')
+    def test_concurrent_requests_share_one_fetch(self, mock_core_config):
+        mock_core_config.redis_client = None
+        calls = []
+
+        def slow_fetch():
+            calls.append(1)
+            time.sleep(0.05)
+            return "content"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_or_fetch_review_artifact(
+            "gitlab", "42", 3, "abc", "content:a.py", slow_fetch))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(calls), results), (1, ["content"] * 4))
+        self.assertEqual(review_artifact_service._fetch_locks, {})
+
+    @patch('api.services.review_artifact_service.core_config')
+    def test_memory_cache_evicts_least_recently_used(self, mock_core_config):
+        mock_core_config.redis_client = None
+        with patch.dict('api.services.review_artifact_service.app_configs', {"REVIEW_ARTIFACT_MEMORY_MAX_MB": 1}):
+            for name in ("a", "b", "c"):
+                get_or_fetch_review_artifact("github", "owner/repo", 7, "abc", name, lambda: "x" * 400 * 1024)
+        self.assertEqual([key.rsplit(":", 1)[1] for key in review_artifact_service._memory_cache], ["b", "c"])
+
+    @patch('api.services.review_artifact_service.core_config')
+    def test_memory_cache_counts_utf8_bytes(self, mock_core_config):
+        mock_core_config.redis_client = None
+        with patch.dict('api.services.review_artifact_service.app_configs', {"REVIEW_ARTIFACT_MEMORY_MAX_MB": 1}):
+            # 每个素材约 20 万个字符，但 UTF-8 编码后约 600 KB，1 MB 内只能容纳一个
+            for name in ("a", "b"):
+                get_or_fetch_review_artifact("github", "owner/repo", 7, "abc", name, lambda: "中" * 200 * 1024)
+        self.assertEqual([key.rsplit(":", 1)[1] for key in review_artifact_service._memory_cache], ["b"])
+        self.assertLessEqual(review_artifact_service._memory_cache_bytes, 1024 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
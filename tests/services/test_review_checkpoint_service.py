@@ -0,0 +1,51 @@
+import json
+import unittest
+from unittest.mock import patch
+from api.services.review_checkpoint_service import ReviewCheckpoint
+
+
+class TestReviewCheckpoint(unittest.TestCase):
+
+    @patch('api.services.review_checkpoint_service.save_review_checkpoint_field')
+    @patch('api.services.review_checkpoint_service.get_review_checkpoint')
+    def test_reads_completed_files_once_and_saves_new_ones(self, mock_get, mock_save):
+        mock_get.return_value = {"file:a.py": json.dumps([{"file": "a.py", "severity": "HIGH"}]), "file:b.py": "[]"}
+        checkpoint = ReviewCheckpoint("github", "owner/repo", 3, "sha")
+        self.assertEqual(checkpoint.get_file_reviews("a.py"), [{"file": "a.py", "severity": "HIGH"}])
+        self.assertEqual(checkpoint.get_file_reviews("b.py"), [])  # 已审查但无问题，与未审查区分
+        self.assertIsNone(checkpoint.get_file_reviews("c.py"))
+        checkpoint.save_file_reviews("c.py", None)
+        self.assertEqual(checkpoint.get_file_reviews("c.py"), [])
+        mock_get.assert_called_once_with("github", "owner/repo", "3", "sha")
+        mock_save.assert_called_once_with("github", "owner/repo", "3", "sha", "file:c.py", "[]")
+
+    @patch('api.services.review_checkpoint_service.delete_review_checkpoint')
+    @patch('api.services.review_checkpoint_service.save_review_checkpoint_field')
+    @patch('api.services.review_checkpoint_service.get_review_checkpoint', return_value={"file:a.py": "not json"})
+    def test_posted_marker_and_clear(self, mock_get, mock_save, mock_delete):
+        checkpoint = ReviewCheckpoint("gitlab", "42", 7, "sha")
+        self.assertIsNone(checkpoint.get_file_reviews("a.py"))  # 无法解析时重新审查
+        self.assertFalse(checkpoint.is_posted())
+        checkpoint.mark_posted()
+        self.assertTrue(checkpoint.is_posted())
+        checkpoint.clear()
+        self.assertFalse(checkpoint.is_posted())
+        mock_delete.assert_called_once_with("gitlab", "42", "7", "sha")
+
+    @patch('api.services.review_checkpoint_service.record_failed_file_review')
+    @patch('api.services.review_checkpoint_service.save_review_checkpoint_field')
+    @patch('api.services.review_checkpoint_service.get_review_checkpoint')
+    def test_only_files_still_failed_at_completion_are_dead_lettered(self, mock_get, mock_save, mock_record):
+        # 上一次执行中 a.py、b.py 审查失败，本次 (重试/中断后继续) 执行中 a.py 已审查成功
+        mock_get.return_value = {"failed:a.py": json.dumps("timeout"), "failed:b.py": json.dumps("timeout")}
+        checkpoint = ReviewCheckpoint("github", "owner/repo", 3, "sha")
+        checkpoint.save_file_reviews("a.py", [])
+        checkpoint.mark_file_failed("b.py", "JSONDecodeError: bad")
+        mock_record.assert_not_called()  # 审查过程中不写入死信队列
+
+        checkpoint.flush_failed_files()
+        mock_record.assert_called_once_with("github", "owner/repo", "3", "sha", "b.py", "JSONDecodeError: bad")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.review_context_service import (
+    LazyFileContent, build_general_review_input, build_general_review_prompt, estimate_tokens,
+    find_enclosing_block, parse_hunk_ranges
+)
+
+
+def _numbered_content(line_count):
+    return "\n".join(f"line {i}" for i in range(1, line_count + 1))
+
+
+class TestLazyFileContent(unittest.TestCase):
+
+    def test_fetches_only_once_on_demand(self):
+        fetcher = MagicMock(return_value=_numbered_content(10))
+        content = LazyFileContent(fetcher, "a.py@base")
+        fetcher.assert_not_called()
+        self.assertEqual(content.get_lines(2, 3), ["line 2", "line 3"])
+        self.assertEqual(content.line_count(), 10)
+        fetcher.assert_called_once()
+
+    def test_keeps_only_selected_windows(self):
+        content = LazyFileContent(lambda: _numbered_content(100), "a.py@base")
+        self.assertEqual(content.materialize(lambda lines: [(50, 52), (10, 11), (51, 55)]), [(10, 11), (50, 55)])
+        self.assertEqual(content.line_count(), 100)
+        self.assertEqual(content.get_lines(50, 51), ["line 50", "line 51"])
+        self.assertEqual(content.get_lines(54, 80), ["line 54", "line 55"])  # 只返回所在窗口内的部分
+        self.assertEqual(content.get_lines(30, 31), [])
+        self.assertEqual(sum(len(window) for _, window in content._windows), 8)
+
+    def test_unavailable_content(self):
+        content = LazyFileContent(lambda: "[Content not fetched: File size (2 bytes) exceeds limit 1 bytes]")
+        self.assertIsNone(content.get_lines(1, 5))
+        self.assertIn("Content not fetched", content.unavailable_reason)
+
+
+PYTHON_SOURCE = """import os
+
+
+def helper(x):
+    return x + 1
+
+
+class Service:
+    def run(self, items):
+        total = 0
+        for item in items:
+            total += helper(item)
+        return total
+
+    def stop(self):
+        pass
+"""
+
+JS_SOURCE = """const a = 1;
+
+function handler(req) {
+  if (req.ok) {
+    return 1;
+  }
+  return 0;
+}
+"""
+
+
+class TestFindEnclosingBlock(unittest.TestCase):
+
+    def test_indentation_block(self):
+        lines = PYTHON_SOURCE.splitlines()
+        # 第 12 行位于 for 循环内，最内层代码块是 for 循环
+        self.assertEqual(find_enclosing_block(lines, 12, 12), (11, 12))
+        self.assertEqual(find_enclosing_block(lines, 11, 12), (9, 13))
+        self.assertIsNone(find_enclosing_block(lines, 1, 1))
+
+    def test_brace_block(self):
+        lines = JS_SOURCE.splitlines()
+        self.assertEqual(find_enclosing_block(lines, 5, 5), (4, 6))
+        self.assertEqual(find_enclosing_block(lines, 4, 6), (3, 8))
+
+
+class TestBuildGeneralReviewInput(unittest.TestCase):
+
+    def setUp(self):
+        self.diff_text = "@@ -50,2 +50,3 @@\n context\n+added\n context\n@@ -60 +61 @@\n-old\n+new"
+
+    def test_parse_hunk_ranges(self):
+        self.assertEqual(parse_hunk_ranges(self.diff_text), [(50, 2, 50, 3), (60, 1, 61, 1)])
+
+    def test_context_is_the_enclosing_function(self):
+        new_fetcher = MagicMock(return_value=PYTHON_SOURCE)
+        file_data = {"file_path": "svc.py", "status": "modified", "diff_text": "@@ -12 +12 @@\n-x\n+            total += helper(item)",
+                     "old_content": None, "new_content": LazyFileContent(new_fetcher)}
+        review_input = build_general_review_input(file_data)
+        self.assertEqual(len(review_input["new_context"]), 1)
+        block = review_input["new_context"][0]
+        # 由内向外扩展到最外层的类定义 (仍在预算内)
+        self.assertEqual((block["start_line"], block["end_line"]), (8, 16))
+        self.assertTrue(block["content"].startswith("class Service:"))
+        self.assertIsNone(review_input["old_context"])
+        self.assertNotIn("old_content", review_input)
+
+    def test_token_budget_limits_context(self):
+        file_data = {"file_path": "a.py", "status": "modified", "diff_text": self.diff_text,
+                     "old_content": LazyFileContent(lambda: _numbered_content(500)),
+                     "new_content": LazyFileContent(lambda: _numbered_content(500))}
+        with patch.dict('api.services.review_context_service.app_configs', {"GENERAL_REVIEW_CONTEXT_TOKEN_BUDGET": 100}):
+            review_input = build_general_review_input(file_data)
+        context_text = "".join(block["content"] for key in ("new_context", "old_context")
+                               for block in (review_input[key] or []))
+        self.assertLessEqual(estimate_tokens(context_text) + estimate_tokens(self.diff_text), 100 + 2)
+        self.assertTrue(review_input["new_context"])
+
+    def test_added_file_does_not_fetch_content(self):
+        fetcher = MagicMock()
+        file_data = {"file_path": "a.py", "status": "added", "diff_text": "@@ -0,0 +1 @@\n+x",
+                     "old_content": None, "new_content": LazyFileContent(fetcher)}
+        prompt = json.loads(build_general_review_prompt(file_data))
+        self.assertIsNone(prompt["new_context"])
+        fetcher.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
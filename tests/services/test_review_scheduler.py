@@ -0,0 +1,148 @@
+import unittest
+from unittest.mock import patch
+from api.services.review_scheduler import ReviewScheduler, estimate_job_cost
+
+
+class _ManualPool:
+    """记录提交的任务，由测试决定何时执行。"""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, fn, *args):
+        self.pending.append((fn, args))
+
+    def run_next(self):
+        fn, args = self.pending.pop(0)
+        fn(*args)
+
+
+def _job(job_id, identifier, size_hint, platform="github"):
+    return {"job_id": job_id, "platform": platform, "identifier": identifier, "size_hint": size_hint}
+
+
+class TestReviewScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = _ManualPool()
+        self.order = []
+        self.run = lambda job: self.order.append(job["job_id"])
+
+    def _drain(self):
+        while self.pool.pending:
+            self.pool.run_next()
+
+    def test_small_jobs_run_before_large_backlog(self):
+        scheduler = ReviewScheduler(self.pool, max_running=1, small_job_max_lines=300)
+        scheduler.submit(self.run, _job("big-1", "team/monorepo", 5000))  # 立即占用唯一的槽位
+        scheduler.submit(self.run, _job("big-2", "team/monorepo", 8000))
+        scheduler.submit(self.run, _job("small-a", "team/service", 12))
+        scheduler.submit(self.run, _job("small-b", "team/monorepo", 3))
+        self._drain()
+        self.assertEqual(self.order, ["big-1", "small-b", "small-a", "big-2"])
+
+    def test_fair_share_across_repositories(self):
+        scheduler = ReviewScheduler(self.pool, max_running=1, small_job_max_lines=1000)
+        scheduler.submit(self.run, _job("blocker", "other/repo", 10))
+        for i in range(3):
+            scheduler.submit(self.run, _job(f"a{i}", "team/a", 100))
+        scheduler.submit(self.run, _job("b0", "team/b", 100))
+        self._drain()
+        # team/b 的任务不必等待 team/a 的全部积压
+        self.assertEqual(self.order, ["blocker", "a0", "b0", "a1", "a2"])
+
+    def test_high_tier_repository_gets_larger_share(self):
+        configs = {"vip/repo": {"priority_tier": "high"}}
+        with patch.dict('api.services.review_scheduler.github_repo_configs', configs):
+            scheduler = ReviewScheduler(self.pool, max_running=1, small_job_max_lines=1000)
+            scheduler.submit(self.run, _job("blocker", "other/repo", 10))
+            for i in range(2):
+                scheduler.submit(self.run, _job(f"low{i}", "plain/repo", 100))
+                scheduler.submit(self.run, _job(f"vip{i}", "vip/repo", 100))
+            self._drain()
+        self.assertEqual(self.order, ["blocker", "vip0", "low0", "vip1", "low1"])
+
+    def test_reserved_slots_keep_room_for_small_jobs(self):
+        scheduler = ReviewScheduler(self.pool, max_running=2, reserved_small_slots=1, small_job_max_lines=300)
+        scheduler.submit(self.run, _job("big-1", "a", 5000))
+        scheduler.submit(self.run, _job("big-2", "b", 5000))
+        self.assertEqual(scheduler.stats()["running"], 1)  # 第二个大任务不能占用预留槽位
+        scheduler.submit(self.run, _job("small", "c", 10))
+        self.assertEqual(scheduler.stats(), {"running": 2, "running_large": 1, "queued_small": 0, "queued_large": 1,
+                                             "held_back": 0})
+        self._drain()
+        self.assertEqual(sorted(self.order), ["big-1", "big-2", "small"])
+
+    def test_repo_at_concurrency_limit_does_not_take_running_slots(self):
+        held = {}
+
+        def acquire(job):
+            if held.get(job["identifier"], 0) >= 1:  # 每个仓库最多 1 个
+                return None
+            held[job["identifier"]] = held.get(job["identifier"], 0) + 1
+            return lambda: held.update({job["identifier"]: held[job["identifier"]] - 1})
+
+        scheduler = ReviewScheduler(self.pool, max_running=3, small_job_max_lines=1000,
+                                    slot_acquirer=acquire, slot_retry_seconds=60)
+        for i in range(3):
+            scheduler.submit(self.run, _job(f"busy{i}", "team/busy", 10))
+        scheduler.submit(self.run, _job("other", "team/other", 500))
+        # 繁忙仓库只占用 1 个执行槽位，其余任务留在队列中，不阻塞其他仓库
+        self.assertEqual(scheduler.stats(), {"running": 2, "running_large": 0, "queued_small": 2, "queued_large": 0,
+                                             "held_back": 2})
+        self._drain()
+        self.assertEqual(self.order, ["busy0", "other", "busy1", "busy2"])
+        self.assertEqual(held, {"team/busy": 0, "team/other": 0})
+        scheduler.drain()
+
+    def test_slot_is_tried_once_per_repo_per_pump_and_long_waits_are_withdrawn(self):
+        acquire_calls = []
+
+        def acquire(job):
+            acquire_calls.append(job["job_id"])
+            return None if job["identifier"] == "team/busy" else (lambda: None)
+
+        scheduler = ReviewScheduler(self.pool, max_running=2, small_job_max_lines=1000,
+                                    slot_acquirer=acquire, slot_retry_seconds=60)
+        busy = [scheduler.submit(self.run, _job(f"busy{i}", "team/busy", 10)) for i in range(3)]
+        acquire_calls.clear()
+        scheduler.submit(self.run, _job("other", "team/other", 500))
+        # 同一轮调度中繁忙仓库只尝试一次，其余任务直接跳过
+        self.assertEqual(acquire_calls, ["busy0", "other"])
+        self.assertEqual(scheduler.stats()["held_back"], 3)
+        self.assertEqual(scheduler.withdraw_held_back(0), 3)
+        self.assertTrue(all(future.cancelled() for future in busy))
+        self.assertEqual(scheduler.stats()["queued_small"], 0)
+        self._drain()
+        self.assertEqual(self.order, ["other"])
+        scheduler.drain()
+
+    def test_future_reports_result_and_exception(self):
+        scheduler = ReviewScheduler(self.pool, max_running=1)
+        ok = scheduler.submit(lambda job: "done", _job("ok", "a", 1))
+        failed = scheduler.submit(lambda job: 1 / 0, _job("failed", "a", 1))
+        self._drain()
+        self.assertEqual(ok.result(), "done")
+        self.assertIsInstance(failed.exception(), ZeroDivisionError)
+        self.assertEqual(scheduler.stats()["running"], 0)
+
+    def test_drain_cancels_queued_jobs_and_rejects_new_ones(self):
+        scheduler = ReviewScheduler(self.pool, max_running=1)
+        running = scheduler.submit(self.run, _job("running", "a", 10))
+        queued = scheduler.submit(self.run, _job("queued", "b", 10))
+        self.assertEqual(scheduler.drain(), 1)
+        self.assertTrue(queued.cancelled())
+        self.assertTrue(scheduler.submit(self.run, _job("late", "c", 10)).cancelled())
+        self._drain()
+        self.assertEqual(self.order, ["running"])
+        self.assertTrue(running.done())
+        self.assertEqual(scheduler.stats()["running"], 0)
+
+    def test_unknown_size_uses_default_cost(self):
+        with patch.dict('api.services.review_scheduler.app_configs', {"SCHEDULER_DEFAULT_JOB_LINES": 150}):
+            self.assertEqual(estimate_job_cost({"size_hint": None}), 150)
+        self.assertEqual(estimate_job_cost({"size_hint": 0}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
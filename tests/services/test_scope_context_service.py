@@ -0,0 +1,76 @@
+import unittest
+from unittest.mock import MagicMock
+from api.services import scope_context_service
+from api.services.scope_context_service import attach_scope_context, get_scope_index, resolve_enclosing_scope
+
+PYTHON_SOURCE = """import os
+
+
+@decorator
+def helper(x):
+    if x:
+        return x + 1
+    return 0
+
+
+class Service:
+    def run(self, items):
+        total = 0
+        for item in items:
+            total += helper(item)
+        return total
+"""
+
+GO_SOURCE = """package main
+
+func handler(w http.ResponseWriter, r *http.Request) {
+	if r.Method == "GET" {
+		w.Write(nil)
+	}
+	return
+}
+"""
+
+
+class TestScopeContext(unittest.TestCase):
+
+    def setUp(self):
+        scope_context_service._scope_cache.clear()
+
+    def test_python_scope_uses_ast(self):
+        index = get_scope_index("blob1", "svc.py", lambda: PYTHON_SOURCE)
+        # 第 7 行位于 if 块中，作用域是包含装饰器的 helper 函数
+        self.assertEqual(resolve_enclosing_scope(index, 7, 7, 100), (4, 8))
+        self.assertEqual(resolve_enclosing_scope(index, 15, 15, 100), (12, 16))
+
+    def test_heuristic_scope_for_other_languages(self):
+        index = get_scope_index("blob2", "main.go", lambda: GO_SOURCE)
+        self.assertEqual(resolve_enclosing_scope(index, 5, 5, 100), (3, 8))
+        # 作用域超过上限时退化为固定窗口
+        self.assertEqual(resolve_enclosing_scope(index, 5, 5, 2), (1, 8))
+
+    def test_cache_is_keyed_by_blob_sha(self):
+        fetch = MagicMock(return_value=PYTHON_SOURCE)
+        first = get_scope_index("same-blob", "a.py", fetch)
+        second = get_scope_index("same-blob", "b/a_copy.py", fetch)
+        self.assertIs(first, second)
+        fetch.assert_called_once()
+
+    def test_attach_replaces_new_context(self):
+        structured_changes = {
+            "svc.py": {"changes": [{"type": "add", "old_line": None, "new_line": 15, "content": "total += helper(item)"}],
+                       "context": {"old": "diff 上下文", "new": "diff 上下文"}},
+            "missing.py": {"changes": [{"type": "add", "old_line": None, "new_line": 1, "content": "x"}],
+                           "context": {"old": "原上下文", "new": "原上下文"}},
+        }
+        resolver = MagicMock(side_effect=lambda path, data: ("blob3", lambda: PYTHON_SOURCE) if path == "svc.py" else None)
+        attach_scope_context(structured_changes, resolver)
+        new_context = structured_changes["svc.py"]["context"]["new"]
+        self.assertTrue(new_context.startswith("12:     def run(self, items):"))
+        self.assertIn("16:         return total", new_context)
+        self.assertEqual(structured_changes["svc.py"]["context"]["old"], "diff 上下文")
+        self.assertEqual(structured_changes["missing.py"]["context"]["new"], "原上下文")
+
+
+if __name__ == '__main__':
+    unittest.main()
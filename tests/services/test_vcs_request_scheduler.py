@@ -0,0 +1,68 @@
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from api.services.vcs_request_scheduler import (
+    VCSRequestScheduler, PRIORITY_COMMENT, PRIORITY_OPTIONAL
+)
+
+
+def _mock_response(status_code=200, headers=None, text=""):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.text = text
+    return response
+
+
+class TestVCSRequestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = VCSRequestScheduler(max_retries=2)
+        self.url = "https://api.github.com/repos/o/r/pulls/1/files"
+        self.headers = {"Authorization": "token abc"}
+
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_tracks_budget_from_github_headers(self, mock_request):
+        reset_at = int(time.time()) + 3600
+        mock_request.return_value = _mock_response(headers={
+            "X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": str(reset_at)})
+        self.scheduler.request("GET", self.url, headers=self.headers)
+        budget = self.scheduler._budgets[self.scheduler._budget_key(self.url, self.headers)]
+        self.assertEqual(budget.limit, 5000)
+        self.assertEqual(budget.remaining, 4000)
+        self.assertEqual(budget.reset_at, reset_at)
+
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_retries_after_429_with_retry_after(self, mock_request):
+        mock_request.side_effect = [
+            _mock_response(429, headers={"Retry-After": "0"}),
+            _mock_response(200),
+        ]
+        # Retry-After 为 0 时不需要等待，直接重试
+        response = self.scheduler.request("POST", self.url, priority=PRIORITY_COMMENT, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_optional_requests_wait_when_budget_is_reserved(self):
+        key = self.scheduler._budget_key(self.url, self.headers)
+        budget = self.scheduler._get_budget(key)
+        now = time.time()
+        budget.limit, budget.remaining, budget.reset_at = 5000, 100, now + 600
+        self.assertGreater(self.scheduler._delay_before_request(budget, PRIORITY_OPTIONAL, now), 0)
+        self.assertEqual(self.scheduler._delay_before_request(budget, PRIORITY_COMMENT, now), 0)
+
+    def test_rate_limited_403_blocks_budget(self):
+        key = self.scheduler._budget_key(self.url, self.headers)
+        wait_seconds = self.scheduler._update_from_response(
+            key, _mock_response(403, headers={"X-RateLimit-Remaining": "0",
+                                              "X-RateLimit-Reset": str(int(time.time()) + 120)}))
+        self.assertGreater(wait_seconds, 0)
+        self.assertGreater(self.scheduler._budgets[key].blocked_until, time.time())
+
+    def test_budget_key_does_not_contain_token(self):
+        key = self.scheduler._budget_key(self.url, {"PRIVATE-TOKEN": "secret-token"})
+        self.assertNotIn("secret-token", key)
+        self.assertTrue(key.startswith("api.github.com:"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import requests
+from api.services.vcs_service import (
+    build_structured_changes_from_diff, make_github_head_blob_resolver, get_github_pr_changes, get_github_pr_data_for_general_review,
+    post_github_pr_review_batch, post_gitlab_mr_review_batch, _replay_github_review_batch
+)
+from api.services.review_artifact_service import clear_memory_cache
+from api.services.path_filter_service import PathFilter
+from api.utils import parse_single_file_diff
+from api.services.comment_dedup_service import CommentFingerprintIndex, compute_review_fingerprint, extract_fingerprints
+
+
+def _mock_response(status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.text = ""
+    response.headers = {}
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(f"{status_code} Error")
+    return response
+
+
+class TestPostReviewBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.reviews = [
+            {"file": "a.py", "lines": {"old": None, "new": 3}, "category": "正确性", "severity": "high",
+             "analysis": "问题一", "suggestion": "修复一"},
+            {"file": "b.py", "lines": {"old": None, "new": None}, "category": "设计", "severity": "medium",
+             "analysis": "问题二", "suggestion": "修复二"},
+        ]
+
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_github_batch_posts_single_review(self, mock_post):
+        mock_post.return_value = _mock_response(200)
+        added, failed = post_github_pr_review_batch("owner", "repo", 1, "token", self.reviews, "sha")
+        self.assertEqual((added, failed), (2, 0))
+        self.assertEqual(mock_post.call_count, 1)
+        payload = mock_post.call_args.kwargs["json"]
+        self.assertTrue(mock_post.call_args.args[1].endswith("/pulls/1/reviews"))
+        self.assertEqual(len(payload["comments"]), 1)
+        self.assertEqual(payload["comments"][0]["line"], 3)
+        self.assertIn("问题二", payload["body"])  # 无行号的意见合并到正文
+
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_github_batch_folds_all_comments_after_422(self, mock_post):
+        mock_post.side_effect = [_mock_response(422), _mock_response(200)]
+        added, failed = post_github_pr_review_batch("owner", "repo", 1, "token", self.reviews, "sha")
+        self.assertEqual((added, failed), (2, 0))
+        self.assertEqual(mock_post.call_count, 2)
+        fallback_payload = mock_post.call_args.kwargs["json"]
+        self.assertNotIn("comments", fallback_payload)
+        self.assertIn("问题一", fallback_payload["body"])
+
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_gitlab_batch_uses_draft_notes_and_bulk_publish(self, mock_post):
+        mock_post.return_value = _mock_response(200)
+        position_info = {"base_sha": "b", "start_sha": "s", "head_sha": "h"}
+        added, failed = post_gitlab_mr_review_batch("1", 2, "token", self.reviews, position_info)
+        self.assertEqual((added, failed), (2, 0))
+        urls = [call.args[1] for call in mock_post.call_args_list]
+        self.assertTrue(all("/draft_notes" in url for url in urls))
+        self.assertTrue(urls[-1].endswith("/draft_notes/bulk_publish"))
+
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_gitlab_batch_folds_unanchored_draft(self, mock_post):
+        mock_post.side_effect = [_mock_response(400), _mock_response(200), _mock_response(200)]
+        position_info = {"base_sha": "b", "start_sha": "s", "head_sha": "h"}
+        added, failed = post_gitlab_mr_review_batch("1", 2, "token", self.reviews, position_info)
+        self.assertEqual((added, failed), (2, 0))
+        summary_note = mock_post.call_args_list[1].kwargs["json"]["note"]
+        self.assertIn("问题一", summary_note)
+        self.assertIn("问题二", summary_note)
+
+    @patch('api.services.comment_dedup_service.add_comment_fingerprints')
+    @patch('api.services.comment_dedup_service.get_comment_fingerprints')
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_github_batch_skips_already_posted_findings(self, mock_post, mock_get_fps, mock_add_fps):
+        mock_post.return_value = _mock_response(200)
+        mock_get_fps.return_value = {compute_review_fingerprint(self.reviews[0])}
+        index = CommentFingerprintIndex("github", "owner/repo", "1")
+        added, failed = post_github_pr_review_batch("owner", "repo", 1, "token", self.reviews, "sha",
+                                                    fingerprint_index=index)
+        self.assertEqual((added, failed), (1, 0))
+        payload = mock_post.call_args.kwargs["json"]
+        self.assertEqual(payload["comments"], [])
+        self.assertNotIn("问题一", payload["body"])
+        self.assertEqual(extract_fingerprints(payload["body"]), {compute_review_fingerprint(self.reviews[1])})
+        mock_add_fps.assert_called_once()
+
+    @patch('api.services.comment_dedup_service.add_comment_fingerprints')
+    @patch('api.services.comment_dedup_service.get_comment_fingerprints', return_value=set())
+    @patch('api.services.vcs_service.resolve_access_token', return_value="token")
+    @patch('api.services.vcs_service.record_dead_letter')
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_replayed_batch_keeps_content_anchored_fingerprints(self, mock_post, mock_record, mock_token, mock_get_fps,
+                                                                mock_add_fps):
+        line_content_map = {("a.py", "new", 3): "value = compute()"}
+        expected = compute_review_fingerprint(self.reviews[0], line_content_map)
+        mock_post.return_value = _mock_response(500)
+        post_github_pr_review_batch("owner", "repo", 1, "token", self.reviews, "sha",
+                                    fingerprint_index=CommentFingerprintIndex("github", "owner/repo", "1"),
+                                    line_content_map=line_content_map)
+        params = mock_record.call_args.args[1]
+        self.assertEqual(params["line_contents"], [["a.py", "new", 3, "value = compute()"]])
+
+        mock_post.return_value = _mock_response(200)
+        self.assertTrue(_replay_github_review_batch(**params))
+        comment_body = mock_post.call_args.kwargs["json"]["comments"][0]["body"]
+        self.assertEqual(extract_fingerprints(comment_body), {expected})
+
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_invalid_lines_are_snapped_before_posting(self, mock_post):
+        mock_post.return_value = _mock_response(200)
+        line_anchors = {"a.py": parse_single_file_diff("@@ -1,2 +1,3 @@\n x\n+y\n+z\n w", "a.py",
+                                                      include_anchors=True)["line_anchors"]}
+        reviews = [dict(self.reviews[0], lines={"old": None, "new": 40}),
+                   dict(self.reviews[0], file="unknown.py", analysis="问题三")]
+        added, failed = post_github_pr_review_batch("owner", "repo", 1, "token", reviews, "sha", line_anchors=line_anchors)
+        self.assertEqual((added, failed), (2, 0))
+        self.assertEqual(mock_post.call_count, 1)
+        payload = mock_post.call_args.kwargs["json"]
+        self.assertEqual([(c["path"], c["line"], c["side"]) for c in payload["comments"]], [("a.py", 3, "RIGHT")])
+        self.assertIn("问题三", payload["body"])  # 文件不在 diff 中的意见合并到正文
+
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_gitlab_context_line_position_has_both_lines(self, mock_post):
+        mock_post.return_value = _mock_response(200)
+        line_anchors = {"a.py": parse_single_file_diff("@@ -5,2 +5,2 @@\n x\n-y\n+z", "a.py",
+                                                      include_anchors=True)["line_anchors"]}
+        position_info = {"base_sha": "b", "start_sha": "s", "head_sha": "h"}
+        post_gitlab_mr_review_batch(1, 2, "token", [dict(self.reviews[0], lines={"old": None, "new": 5})],
+                                    position_info, line_anchors=line_anchors)
+        position = mock_post.call_args_list[0].kwargs["json"]["position"]
+        self.assertEqual((position["old_line"], position["new_line"]), (5, 5))
+
+
+FULL_PR_DIFF = """diff --git a/app.py b/app.py
+index 1111111..2222222222222222222222222222222222222222 100644
+--- a/app.py
++++ b/app.py
+@@ -1 +1 @@
+-a
++b
+diff --git a/package-lock.json b/package-lock.json
+index 3333333..4444444 100644
+--- a/package-lock.json
++++ b/package-lock.json
+@@ -1 +1 @@
+-{}
++{"a": 1}
+diff --git a/icon.png b/icon.png
+deleted file mode 100644
+index 5555555..0000000
+Binary files a/icon.png and /dev/null differ
+"""
+
+
+class TestGithubPrChangesFromDiff(unittest.TestCase):
+
+    def test_builds_structured_changes_from_full_diff(self):
+        structured_changes = build_structured_changes_from_diff(FULL_PR_DIFF, PathFilter())
+        self.assertEqual(sorted(structured_changes), ["app.py", "icon.png"])
+        self.assertEqual(structured_changes["app.py"]["lines_changed"], 2)
+        self.assertEqual(structured_changes["app.py"]["head_blob_sha"], "2" * 40)
+        self.assertEqual(structured_changes["icon.png"]["changes"][0]["content"], "文件已删除")
+
+    @patch('api.services.vcs_service.get_path_filter', return_value=PathFilter())
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_single_request_with_diff_media_type(self, mock_request, _):
+        response = _mock_response(200)
+        response.text = FULL_PR_DIFF
+        mock_request.return_value = response
+        structured_changes = get_github_pr_changes("owner", "repo", 7, "token")
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(mock_request.call_args.kwargs["headers"]["Accept"], "application/vnd.github.v3.diff")
+        self.assertIn("app.py", structured_changes)
+
+    @patch('api.services.vcs_service.get_path_filter', return_value=PathFilter())
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_falls_back_to_files_api_when_diff_too_large(self, mock_request, _):
+        files_response = _mock_response(200)
+        files_response.json.return_value = [
+            {"filename": "app.py", "status": "modified", "sha": "f" * 40, "patch": "@@ -1 +1 @@\n-a\n+b"}]
+        mock_request.side_effect = [_mock_response(406), files_response]
+        structured_changes = get_github_pr_changes("owner", "repo", 7, "token")
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertTrue(mock_request.call_args.args[1].endswith("/pulls/7/files"))
+        self.assertEqual(structured_changes["app.py"]["head_blob_sha"], "f" * 40)
+
+    @patch('api.services.review_artifact_service.core_config')
+    @patch('api.services.vcs_service.get_path_filter', return_value=PathFilter())
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_detailed_and_general_review_share_pr_diff(self, mock_request, _, mock_core_config):
+        mock_core_config.redis_client = None
+        clear_memory_cache()
+        self.addCleanup(clear_memory_cache)
+        response = _mock_response(200)
+        response.text = FULL_PR_DIFF
+        mock_request.return_value = response
+        structured_changes = get_github_pr_changes("owner", "repo", 7, "token", head_sha="c" * 40)
+        file_data_list = get_github_pr_data_for_general_review(
+            "owner", "repo", 7, "token", {"base": {"sha": "b" * 40}, "head": {"sha": "c" * 40}})
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(sorted(structured_changes), ["app.py", "icon.png"])
+        self.assertEqual([(f["file_path"], f["status"]) for f in file_data_list],
+                         [("app.py", "modified"), ("icon.png", "removed")])
+        self.assertIsNone(file_data_list[1]["new_content"])
+
+    @patch('api.services.vcs_service._fetch_github_pr_files')
+    def test_head_blob_resolver_uses_full_sha_from_pr_files(self, mock_fetch_files):
+        # diff 媒体类型的 index 行只有缩写 SHA，structured_changes 中没有 head_blob_sha
+        mock_fetch_files.return_value = [
+            {"filename": "app.py", "status": "modified", "sha": "a" * 40},
+            {"filename": "lib.py", "status": "added", "sha": "b" * 40},
+        ]
+        resolve = make_github_head_blob_resolver("owner", "repo", "token", "c" * 40, 7)
+        self.assertEqual(resolve("app.py", {})[0], "a" * 40)
+        self.assertEqual(resolve("lib.py", {})[0], "b" * 40)
+        self.assertEqual(resolve("other.py", {})[0], f"{'c' * 40}:other.py")  # 文件列表中没有时按 head_sha:path
+        mock_fetch_files.assert_called_once_with("owner", "repo", 7, "token", "c" * 40)
+
+    @patch('api.services.review_artifact_service.core_config')
+    @patch('api.services.vcs_service.get_path_filter', return_value=PathFilter())
+    @patch('api.services.vcs_request_scheduler.requests.request')
+    def test_general_review_content_urls_quote_file_path(self, mock_request, _, mock_core_config):
+        mock_core_config.redis_client = None
+        clear_memory_cache()
+        self.addCleanup(clear_memory_cache)
+        response = _mock_response(200)
+        response.text = FULL_PR_DIFF.replace("app.py", "docs/a b#1.py")
+        mock_request.return_value = response
+        file_data_list = get_github_pr_data_for_general_review(
+            "owner", "repo", 7, "token", {"base": {"sha": "b" * 40}, "head": {"sha": "c" * 40}})
+        response.json.return_value = {"encoding": "base64", "content": "", "size": 0}
+        for content_key, sha in (("new_content", "c"), ("old_content", "b")):
+            file_data_list[0][content_key].line_count()
+            self.assertTrue(mock_request.call_args.args[1].endswith(f"/contents/docs/a%20b%231.py?ref={sha * 40}"))
+
+
+if __name__ == '__main__':
+    unittest.main()
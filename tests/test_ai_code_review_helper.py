@@ -0,0 +1,39 @@
+import unittest
+from unittest.mock import patch
+from api import ai_code_review_helper
+
+
+class TestProcessInitialization(unittest.TestCase):
+
+    def setUp(self):
+        ai_code_review_helper._initialized_pid = None
+
+    def tearDown(self):
+        ai_code_review_helper._initialized_pid = None
+
+    @patch('api.ai_code_review_helper.init_process_resources')
+    def test_initializes_once_per_process(self, mock_init):
+        with patch('api.ai_code_review_helper.os.getpid', return_value=100):
+            ai_code_review_helper.ensure_process_initialized()
+            ai_code_review_helper.ensure_process_initialized()
+        mock_init.assert_called_once()
+        # fork 出的子进程 PID 不同，需要重新初始化自己的连接
+        with patch('api.ai_code_review_helper.os.getpid', return_value=101):
+            ai_code_review_helper.ensure_process_initialized()
+        self.assertEqual(mock_init.call_count, 2)
+
+    @patch('api.ai_code_review_helper.init_process_resources')
+    def test_failed_initialization_is_retried(self, mock_init):
+        mock_init.side_effect = [ValueError("no redis"), None]
+        with self.assertRaises(ValueError):
+            ai_code_review_helper.ensure_process_initialized()
+        ai_code_review_helper.ensure_process_initialized()
+        self.assertEqual(mock_init.call_count, 2)
+
+    def test_create_app_has_all_routes(self):
+        rules = {rule.rule for rule in ai_code_review_helper.create_app().url_map.iter_rules()}
+        self.assertTrue({"/admin", "/github_webhook", "/gitlab_webhook_general", "/config/global_settings"} <= rules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import io
+import unittest
+from api.diff_parser import (
+    CHANGE_ADD, CHANGE_DELETE, LineAnchorIndex, iter_file_diff_events, iter_patch_lines, parse_file_diff, parse_unified_diff, unquote_git_path
+)
+from api.utils import parse_single_file_diff
+
+
+class TestDiffParser(unittest.TestCase):
+
+    def test_counts_are_built_in_single_pass(self):
+        diff_text = "@@ -1,3 +1,3 @@\n a\n-b\n+B\n+C\n c"
+        file_diff = parse_file_diff(diff_text, "f.txt")
+        self.assertEqual((file_diff.additions, file_diff.deletions, file_diff.lines_changed), (2, 1, 3))
+        self.assertEqual(file_diff.changes[0], (CHANGE_DELETE, 2, None, "b"))
+        self.assertEqual(file_diff.changes[2], (CHANGE_ADD, None, 3, "C"))
+
+    def test_content_resembling_file_headers_is_kept(self):
+        diff_text = "--- a/q.sql\n+++ b/q.sql\n@@ -1,2 +1,2 @@\n--- old comment\n+++ new counter\n select 1;"
+        changes = parse_single_file_diff(diff_text, "q.sql")["changes"]
+        self.assertEqual([(c["type"], c["content"]) for c in changes],
+                         [("delete", "-- old comment"), ("add", "++ new counter")])
+
+    def test_reads_file_like_objects_incrementally(self):
+        stream = io.StringIO("@@ -1 +1 @@\r\n-x\r\n+y\r\n\\ No newline at end of file\r\n")
+        events = list(iter_file_diff_events(iter_patch_lines(stream), "f.txt"))
+        self.assertEqual(events, [(CHANGE_DELETE, 1, None, "x"), (CHANGE_ADD, None, 1, "y")])
+
+    def test_only_last_context_lines_are_kept(self):
+        body = "".join(f" line{i}\n" for i in range(1, 31))
+        file_diff = parse_file_diff(f"@@ -1,30 +1,30 @@\n{body}", "f.txt")
+        context_lines = file_diff.as_dict()["context"]["new"].split("\n")
+        self.assertEqual(len(context_lines), 20)
+        self.assertEqual(context_lines[0], "11 -> 11: line11")
+
+
+MULTI_FILE_DIFF = """diff --git a/src/app.py b/src/app.py
+index 1111111..2222222 100644
+--- a/src/app.py
++++ b/src/app.py
+@@ -1,2 +1,2 @@
+ import os
+-x = 1
++x = 2
+diff --git a/old name.py b/new name.py
+similarity index 90%
+rename from old name.py
+rename to new name.py
+index 3333333..4444444 100644
+--- a/old name.py
++++ b/new name.py
+@@ -3 +3 @@
+-a
++b
+diff --git a/logo.png b/logo.png
+new file mode 100644
+index 0000000..5555555
+Binary files /dev/null and b/logo.png differ
+diff --git a/run.sh b/run.sh
+old mode 100644
+new mode 100755
+diff --git a/gone.txt b/gone.txt
+deleted file mode 100644
+index 6666666..0000000
+--- a/gone.txt
++++ /dev/null
+@@ -1 +0,0 @@
+-bye
+diff --git "a/\\346\\226\\207.txt" "b/\\346\\226\\207.txt"
+new file mode 100644
+index 0000000..7777777
+--- /dev/null
++++ "b/\\346\\226\\207.txt"
+@@ -0,0 +1 @@
++hello
+"""
+
+
+class TestParseUnifiedDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.files = {file_diff.path: file_diff for file_diff in parse_unified_diff(MULTI_FILE_DIFF)}
+
+    def test_statuses_and_paths(self):
+        self.assertEqual(list(self.files), ["src/app.py", "new name.py", "logo.png", "run.sh", "gone.txt", "文.txt"])
+        self.assertEqual(self.files["src/app.py"].status, "modified")
+        self.assertEqual(self.files["src/app.py"].as_dict(), parse_single_file_diff(
+            "@@ -1,2 +1,2 @@\n import os\n-x = 1\n+x = 2", "src/app.py"))
+        renamed = self.files["new name.py"]
+        self.assertEqual((renamed.status, renamed.old_path, renamed.new_blob), ("renamed", "old name.py", "4444444"))
+        self.assertEqual(self.files["gone.txt"].status, "removed")
+        self.assertEqual(self.files["gone.txt"].changes, [(CHANGE_DELETE, 1, None, "bye")])
+        self.assertEqual(self.files["文.txt"].changes, [(CHANGE_ADD, None, 1, "hello")])
+
+    def test_binary_and_mode_only_files_have_no_hunks(self):
+        logo = self.files["logo.png"]
+        self.assertTrue(logo.is_binary)
+        self.assertEqual(logo.status, "added")
+        self.assertIsNone(logo.patch)
+        run_script = self.files["run.sh"]
+        self.assertEqual((run_script.old_mode, run_script.new_mode, run_script.changes), ("100644", "100755", []))
+
+    def test_unquote_git_path(self):
+        self.assertEqual(unquote_git_path('"a/tab\\there"'), "a/tab\there")
+        self.assertEqual(unquote_git_path("plain/path"), "plain/path")
+
+
+class TestLineAnchorIndex(unittest.TestCase):
+
+    def setUp(self):
+        # 旧文件 10-13 行，新文件 10-13 行: 10 上下文, 11 删除, 11/12 新增, 12 -> 13 上下文
+        diff_text = "@@ -10,3 +10,4 @@\n ctx\n-old\n+new1\n+new2\n ctx2\n@@ -40 +41 @@\n-gone\n+here"
+        self.index = parse_file_diff(diff_text, "f.py", build_anchors=True).anchors
+
+    def test_valid_positions(self):
+        self.assertEqual(self.index.resolve(new_line=10), (10, 10))  # 上下文行带有对应旧行号
+        self.assertEqual(self.index.resolve(new_line=12), (12, None))
+        self.assertEqual(self.index.resolve(old_line=11), (None, 11))
+        self.assertEqual(self.index.resolve(new_line="13"), (13, 12))
+
+    def test_invalid_positions_snap_to_nearest_changed_line(self):
+        self.assertEqual(self.index.resolve(new_line=30), (41, None))
+        self.assertEqual(self.index.resolve(new_line=20), (12, None))
+        self.assertEqual(self.index.resolve(old_line=35), (None, 40))
+        self.assertIsNone(self.index.resolve())
+        self.assertIsNone(LineAnchorIndex().resolve(new_line=3))
+
+    def test_plain_view_has_no_anchors(self):
+        self.assertNotIn("line_anchors", parse_single_file_diff("@@ -1 +1 @@\n-a\n+b", "f.py"))
+        with_anchors = parse_single_file_diff("@@ -1 +1 @@\n-a\n+b", "f.py", include_anchors=True)
+        self.assertEqual(with_anchors["line_anchors"].resolve(new_line=1), (1, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import json
+import unittest
+from concurrent.futures import Future
+from unittest.mock import MagicMock, patch
+from api.services.job_queue_service import JobInterrupted
+from api.services.review_scheduler import ReviewScheduler
+from api.worker import ReviewWorker
+
+
+def _job_fields(job_id, identifier):
+    return {b"job": json.dumps({"job_id": job_id, "kind": "k", "platform": "github", "identifier": identifier,
+                                "size_hint": 10}).encode()}
+
+
+class _ManualPool:
+    """记录调度器提交的任务，由测试决定何时执行。"""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, fn, *args):
+        self.pending.append((fn, args))
+
+
+def _done_future(exception=None):
+    future = Future()
+    if exception:
+        future.set_exception(exception)
+    else:
+        future.set_result(None)
+    return future
+
+
+class TestReviewWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.redis_client = MagicMock()
+        self.worker = ReviewWorker(self.redis_client, "worker-1", concurrency=2, reclaim_idle_seconds=60, max_deliveries=3)
+        self.pool = MagicMock()
+        self.pool.submit.return_value = _done_future()
+        self.job_fields = {b"job": json.dumps({"job_id": "j1", "kind": "k"}).encode()}
+
+    def test_reads_new_jobs_and_acks_after_completion(self):
+        self.redis_client.xreadgroup.return_value = [[b"stream", [(b"1-0", self.job_fields)]]]
+        self.redis_client.xautoclaim.return_value = [b"0-0", [], []]
+        self.worker.run_once(self.pool)
+        self.assertEqual(self.redis_client.xreadgroup.call_args.kwargs["count"], 2)
+        self.assertEqual(self.pool.submit.call_args.args[1]["job_id"], "j1")
+        self.worker._reap_finished()
+        self.redis_client.pipeline.return_value.xack.assert_called_once()
+        self.redis_client.pipeline.return_value.xdel.assert_called_once()
+
+    def test_reclaims_idle_jobs_and_gives_up_after_max_deliveries(self):
+        self.redis_client.xautoclaim.return_value = [b"0-0", [(b"1-0", self.job_fields), (b"2-0", self.job_fields)], []]
+        self.redis_client.xpending_range.side_effect = [[{"times_delivered": 2}], [{"times_delivered": 4}]]
+        self.worker._reclaim(self.pool)
+        self.assertEqual(self.pool.submit.call_count, 1)
+        self.assertEqual(self.redis_client.xautoclaim.call_args.kwargs["min_idle_time"], 60000)
+        self.redis_client.pipeline.return_value.xack.assert_called_once()  # 超过投递上限的任务被确认丢弃
+
+    def test_heartbeat_refreshes_in_flight_jobs(self):
+        self.worker._in_flight = {b"1-0": Future()}
+        self.worker._heartbeat()
+        kwargs = self.redis_client.xclaim.call_args.kwargs
+        self.assertEqual((kwargs["message_ids"], kwargs["min_idle_time"], kwargs["justid"]), ([b"1-0"], 0, True))
+
+    def test_failed_job_is_retried_until_max_deliveries(self):
+        self.redis_client.xpending_range.side_effect = [[{"times_delivered": 1}], [{"times_delivered": 3}]]
+        with patch('api.worker.logger'):
+            self.worker._in_flight = {b"1-0": _done_future(RuntimeError("boom"))}
+            self.worker._reap_finished()
+            # 未确认: 空闲后重新投递，已完成的文件从检查点读取
+            self.redis_client.pipeline.return_value.xack.assert_not_called()
+            self.worker._in_flight = {b"1-0": _done_future(RuntimeError("boom"))}
+            self.worker._reap_finished()
+        self.assertEqual(self.worker._in_flight, {})
+        self.redis_client.pipeline.return_value.xack.assert_called_once()
+
+    def test_interrupted_and_unstarted_jobs_are_handed_back(self):
+        cancelled = Future()
+        cancelled.cancel()
+        self.worker._in_flight = {b"1-0": _done_future(JobInterrupted("shutdown")), b"2-0": cancelled}
+        self.redis_client.xpending_range.return_value = [{"times_delivered": 1}]
+        self.worker._reap_finished()
+        self.assertEqual(self.worker._in_flight, {})
+        self.redis_client.pipeline.return_value.xack.assert_not_called()
+        kwargs = self.redis_client.xclaim.call_args.kwargs
+        # 空闲时间直接设为接管阈值，且不计入投递次数
+        self.assertEqual((kwargs["idle"], kwargs["retrycount"]), (60000, 0))
+        self.assertEqual(self.redis_client.xclaim.call_count, 2)
+
+    @patch('api.worker.interrupt_running_jobs')
+    def test_drain_interrupts_jobs_still_running_at_deadline(self, mock_interrupt):
+        running = Future()
+        self.worker.drain_seconds = 0
+        self.worker._in_flight = {b"1-0": running}
+        mock_interrupt.side_effect = lambda: running.set_exception(JobInterrupted("shutdown"))
+        self.redis_client.xpending_range.return_value = [{"times_delivered": 2}]
+        scheduler = MagicMock()
+        self.worker.drain(scheduler)
+        scheduler.drain.assert_called_once()
+        mock_interrupt.assert_called_once()
+        self.assertEqual(self.worker._in_flight, {})
+        self.redis_client.pipeline.return_value.xack.assert_not_called()
+
+
+    @patch('api.worker.run_review_job')
+    def test_capped_repo_does_not_block_other_repos(self, mock_run):
+        held = set()
+
+        def acquire(job):  # 每个仓库最多同时执行 1 个任务
+            if job["identifier"] in held:
+                return None
+            held.add(job["identifier"])
+            return lambda: held.discard(job["identifier"])
+
+        pool = _ManualPool()
+        scheduler = ReviewScheduler(pool, 2, small_job_max_lines=1000, slot_acquirer=acquire, slot_retry_seconds=60)
+        worker = ReviewWorker(self.redis_client, "worker-1", concurrency=2, reclaim_idle_seconds=60,
+                              max_deliveries=3, held_back_handback_seconds=3600)
+        self.redis_client.xautoclaim.return_value = [b"0-0", [], []]
+        self.redis_client.xreadgroup.side_effect = [
+            [[b"stream", [(b"1-0", _job_fields("busy0", "team/busy")), (b"2-0", _job_fields("busy1", "team/busy"))]]],
+            [[b"stream", [(b"3-0", _job_fields("other", "team/other"))]]],
+        ]
+        worker.run_once(scheduler)
+        self.assertEqual(scheduler.stats()["held_back"], 1)
+        worker.run_once(scheduler)
+        # 被仓库上限挡住的 busy1 不占用名额，仍会读取并执行其他仓库的任务
+        self.assertEqual(self.redis_client.xreadgroup.call_args.kwargs["count"], 1)
+        self.assertEqual(len(pool.pending), 2)
+        fn, args = pool.pending[1]
+        fn(*args)
+        self.assertEqual(mock_run.call_args.args[0]["job_id"], "other")
+
+        # busy1 等待过久后交还给消费组，不再由本 worker 心跳
+        worker.held_back_handback_seconds = 0
+        self.redis_client.xreadgroup.side_effect = None
+        self.redis_client.xreadgroup.return_value = []
+        self.redis_client.xpending_range.return_value = [{"times_delivered": 1}]
+        worker.run_once(scheduler)
+        worker._reap_finished()
+        self.assertNotIn(b"2-0", worker._in_flight)
+        handed_back = [call.kwargs for call in self.redis_client.xclaim.call_args_list if "idle" in call.kwargs]
+        self.assertEqual([kwargs["message_ids"] for kwargs in handed_back], [[b"2-0"]])
+        scheduler.drain()
+
+
+if __name__ == '__main__':
+    unittest.main()